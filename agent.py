@@ -0,0 +1,314 @@
+"""
+Lightweight remote agent for cbt.
+
+The agent is a single stdlib-only python process started on a node over
+stdio (ssh or a local pipe). It reads one JSON request per line on stdin and
+answers with one JSON response per line on stdout, so structured operations
+(mkdir, kill by name, append to a file, ...) cost an in-process call on the
+node instead of a pdsh round trip and a remote shell.
+
+Request:  {"id": 1, "op": "mkdir", "args": {"path": "/tmp/cbt"}}
+Response: {"id": 1, "ok": true, "result": {}}
+          {"id": 1, "ok": false, "error": "..."}
+
+This file is both the agent (executed remotely, see bootstrap_command()) and
+the client side used by common.py.
+"""
+import base64
+import fnmatch
+import json
+import os
+import re
+import select
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+
+PROTOCOL_VERSION = 1
+
+
+class AgentError(Exception):
+    pass
+
+
+# ---------------------------------------------------------------------------
+# Agent side: the operations run on the node
+# ---------------------------------------------------------------------------
+
+def _signum(sig):
+    if isinstance(sig, int) or str(sig).isdigit():
+        return int(sig)
+    name = str(sig).upper()
+    if not name.startswith('SIG'):
+        name = 'SIG' + name
+    return int(getattr(signal, name))
+
+
+def _proc_matches(pid, name, full):
+    try:
+        if full:
+            with open('/proc/%d/cmdline' % pid, 'rb') as f:
+                cmdline = f.read().replace(b'\0', b' ').decode(errors='ignore').strip()
+            return re.search(name, cmdline) is not None
+        with open('/proc/%d/comm' % pid) as f:
+            comm = f.read().strip()
+        with open('/proc/%d/cmdline' % pid, 'rb') as f:
+            argv0 = f.read().split(b'\0')[0].decode(errors='ignore')
+    except (IOError, OSError):
+        return False
+    # like killall: the kernel truncates comm to 15 characters, a name given
+    # as a path matches the executable
+    return comm == os.path.basename(name)[:15] or argv0 == name or os.path.basename(argv0) == name
+
+
+def op_run(cmd, shell=True, timeout=None):
+    proc = subprocess.run(cmd, shell=shell, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          stdin=subprocess.DEVNULL, timeout=timeout)
+    return {'rc': proc.returncode,
+            'stdout': proc.stdout.decode(errors='ignore'),
+            'stderr': proc.stderr.decode(errors='ignore')}
+
+
+def op_kill(name, signal='KILL', full=False, sudo=False):
+    signum = _signum(signal)
+    me = os.getpid()
+    pids = [int(p) for p in os.listdir('/proc') if p.isdigit() and int(p) != me]
+    pids = [p for p in pids if _proc_matches(p, name, full)]
+    denied = []
+    for pid in pids:
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+        except PermissionError:
+            denied.append(pid)
+    if denied and sudo:
+        subprocess.call(['sudo', '-n', 'kill', '-%d' % signum] + [str(p) for p in denied],
+                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        denied = []
+    return {'killed': [p for p in pids if p not in denied], 'denied': denied}
+
+
+def op_mkdir(path, mode=0o755):
+    os.makedirs(path, mode=mode, exist_ok=True)
+    return {}
+
+
+def op_read(path, offset=0, length=-1, b64=False):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+    if b64:
+        # binary safe, e.g. for collectl's compressed files
+        return {'data': base64.b64encode(data).decode(), 'offset': offset + len(data)}
+    return {'data': data.decode(errors='ignore'), 'offset': offset + len(data)}
+
+
+def op_stat(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return {'exists': False}
+    return {'exists': True, 'size': st.st_size, 'mtime': st.st_mtime,
+            'mode': st.st_mode, 'isdir': os.path.isdir(path)}
+
+
+def op_append(path, data):
+    with open(path, 'a') as f:
+        f.write(data)
+        return {'size': f.tell()}
+
+
+def op_tail(path, offset=0, length=1 << 20, b64=False):
+    """ Return what was appended to path since offset """
+    try:
+        size = os.stat(path).st_size
+    except FileNotFoundError:
+        return {'data': '', 'offset': offset}
+    if size < offset:  # truncated or rotated, start again
+        offset = 0
+    return op_read(path, offset, min(length, size - offset), b64)
+
+
+def op_list(root, patterns=('*',)):
+    """ [path relative to root, size, mtime] of the files under root whose
+    name or relative path matches one of the patterns """
+    files = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            rel = os.path.relpath(path, root)
+            if any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(rel, p) for p in patterns):
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append([rel, st.st_size, st.st_mtime])
+    return {'files': files}
+
+
+OPS = {
+    'run': op_run,
+    'kill': op_kill,
+    'mkdir': op_mkdir,
+    'read': op_read,
+    'stat': op_stat,
+    'append': op_append,
+    'tail': op_tail,
+    'list': op_list,
+}
+
+
+def serve(infile=None, outfile=None):
+    infile = infile or sys.stdin
+    outfile = outfile or sys.stdout
+    outfile.write(json.dumps({'hello': PROTOCOL_VERSION, 'pid': os.getpid()}) + '\n')
+    outfile.flush()
+    for line in infile:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        response = {'id': request.get('id')}
+        try:
+            response['result'] = OPS[request['op']](**request.get('args', {}))
+            response['ok'] = True
+        except Exception as e:
+            response['ok'] = False
+            response['error'] = '%s: %s' % (e.__class__.__name__, e)
+        outfile.write(json.dumps(response) + '\n')
+        outfile.flush()
+
+
+# ---------------------------------------------------------------------------
+# Client side: used by cbt on the head node
+# ---------------------------------------------------------------------------
+
+def agent_source():
+    with open(os.path.abspath(__file__.replace('.pyc', '.py'))) as f:
+        return f.read()
+
+
+def bootstrap_command(python='python3'):
+    """
+    Shell command starting an agent that reads its own source from stdin,
+    so nothing has to be installed on the node beforehand.
+    """
+    source = agent_source()
+    code = 'import sys; exec(sys.stdin.read(%d))' % len(source)
+    return '%s -u -c %s' % (python, shlex.quote(code)), source
+
+
+class RemoteAgent(object):
+    """
+    One running agent, reached through the stdin/stdout of a local process
+    (usually ssh). Calls are serialized per agent.
+    """
+    def __init__(self, host, args, source):
+        self.host = host
+        self.args = args
+        self.lock = threading.Lock()
+        self.next_id = 0
+        self.pid = None
+        self.proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     stderr=subprocess.DEVNULL, close_fds=True)
+        self.proc.stdin.write(source.encode())
+        self.proc.stdin.flush()
+
+    def handshake(self, timeout=30):
+        """ Wait for the agent to announce itself, kept apart from __init__ so
+        that many agents can be started in parallel """
+        ready, _, _ = select.select([self.proc.stdout], [], [], timeout)
+        hello = self.proc.stdout.readline() if ready else b''
+        try:
+            self.pid = json.loads(hello)['pid']
+        except (ValueError, KeyError):
+            self.close()
+            raise AgentError('agent on %s did not start' % self.host)
+
+    def send(self, op, **kwargs):
+        self.next_id += 1
+        request = {'id': self.next_id, 'op': op, 'args': kwargs}
+        try:
+            self.proc.stdin.write((json.dumps(request) + '\n').encode())
+            self.proc.stdin.flush()
+        except (IOError, OSError) as e:
+            raise AgentError('agent on %s is gone: %s' % (self.host, e))
+        return self.next_id
+
+    def recv(self, request_id):
+        line = self.proc.stdout.readline()
+        if not line:
+            raise AgentError('agent on %s is gone' % self.host)
+        response = json.loads(line)
+        if response.get('id') != request_id:
+            raise AgentError('agent on %s answered out of order' % self.host)
+        if not response['ok']:
+            raise AgentError('%s: %s' % (self.host, response['error']))
+        return response['result']
+
+    def call(self, op, **kwargs):
+        with self.lock:
+            return self.recv(self.send(op, **kwargs))
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def close(self):
+        if self.proc.poll() is None:
+            try:
+                self.proc.stdin.close()
+                self.proc.wait(5)
+            except (IOError, OSError, subprocess.TimeoutExpired):
+                self.proc.kill()
+                self.proc.wait()
+
+
+def call_each(requests):
+    """
+    Issue a list of (RemoteAgent, op, kwargs) requests, all of them being
+    sent before any response is read so that the nodes work in parallel and
+    the requests to one node are pipelined. Returns the list of results, an
+    AgentError in place of the result of a failed request.
+    """
+    # lock in a stable order to stay deadlock free between threads
+    ordered = sorted(set(a for a, _, _ in requests), key=lambda a: a.host)
+    for a in ordered:
+        a.lock.acquire()
+    try:
+        pending = []
+        for a, op, kwargs in requests:
+            try:
+                pending.append(a.send(op, **kwargs))
+            except AgentError as e:
+                pending.append(e)
+        results = []
+        for (a, _, _), request_id in zip(requests, pending):
+            if isinstance(request_id, AgentError):
+                results.append(request_id)
+                continue
+            try:
+                results.append(a.recv(request_id))
+            except AgentError as e:
+                results.append(e)
+        return results
+    finally:
+        for a in ordered:
+            a.lock.release()
+
+
+def call_many(agents, op, **kwargs):
+    """
+    Issue the same request to several agents at once.
+    agents is a list of (label, RemoteAgent), returns {label: result}.
+    """
+    results = call_each([(a, op, kwargs) for _, a in agents])
+    errors = [str(r) for r in results if isinstance(r, AgentError)]
+    if errors:
+        raise AgentError('\n'.join(errors))
+    return dict((label, r) for (label, _), r in zip(agents, results))
+
+
+if __name__ == '__main__':
+    serve()
@@ -11,17 +11,22 @@ import common
 logger = logging.getLogger('cbt')
 
 
+def config_id(config):
+    """ The id-<sha1> of the results directory of a benchmark config """
+    hashable = json.dumps(sorted((k, v) for k, v in config.items() if k != 'acceptable')).encode()
+    digest = hashlib.sha1(hashable).hexdigest()[:8]
+    return 'id-{}'.format(digest)
+
+
 class Benchmark(object):
     def __init__(self, archive_dir, cluster, config):
         self.acceptable = config.pop('acceptable', {})
         self.config = config
         self.cluster = cluster
-        hashable = json.dumps(sorted(self.config.items())).encode()
-        digest = hashlib.sha1(hashable).hexdigest()[:8]
         self.archive_dir = os.path.join(archive_dir,
                                         'results',
                                         '{:0>8}'.format(config.get('iteration')),
-                                        'id-{}'.format(digest))
+                                        config_id(self.config))
         # This would show several dirs if run continuously
         logger.info("Results dir: %s", self.archive_dir )
         self.run_dir = os.path.join(settings.cluster.get('tmp_dir'),
@@ -162,8 +167,9 @@ class Benchmark(object):
     def dropcaches(self):
         nodes = settings.getnodes('clients', 'osds')
 
-        common.pdsh(nodes, 'sync').communicate()
-        common.pdsh(nodes, 'echo 3 | sudo tee /proc/sys/vm/drop_caches').communicate()
+        with common.Batch(nodes) as batch:
+            batch.add('sync')
+            batch.add('echo 3 | sudo tee /proc/sys/vm/drop_caches')
 
     def __str__(self):
         return str(self.config)
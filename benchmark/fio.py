@@ -8,6 +8,8 @@ import pathlib
 import client_endpoints_factory
 
 from .benchmark import Benchmark
+from . import fio_jobfile
+from . import steadystate
 
 logger = logging.getLogger("cbt")
 
@@ -42,11 +44,19 @@ class Fio(Benchmark):
         self.random_distribution = config.get('random_distribution', None)
         self.rate_iops = config.get('rate_iops', None)
         self.fio_out_format = "json,normal"
+        # one fio process per client running the endpoints from a job file,
+        # driven from the head through fio servers on the clients with client_server
+        self.client_server = bool(config.get('client_server', False))
+        self.job_file = bool(config.get('job_file', False)) or self.client_server
         self.prefill_flag = config.get('prefill', True)
         self.norandommap = config.get("norandommap", False)
         self.out_dir = self.archive_dir
         self.client_endpoints = config.get("client_endpoints", None)
         self.recov_test_type = config.get('recov_test_type', 'blocking')
+        self.steady_state = steadystate.get_config(config.get('steady_state', None))
+        if self.steady_state and 'recovery_test' in cluster.config:
+            logger.warning('steady_state is not watched during recovery tests')
+            self.steady_state = None
 
     def exists(self):
         if os.path.exists(self.out_dir):
@@ -146,9 +156,17 @@ class Fio(Benchmark):
 
         # cmd_path_full includes any valgrind or other preprocessors vs cmd_path
         cmd = 'sudo %s' % self.cmd_path_full
+        cmd += self.run_options(ep_num)
+
+        # End the fio_cmd
+        cmd += ' > %s' % (out_file)
+        return cmd
+
+    def run_options(self, ep_num):
+        out_file = '%s/output.%d' % (self.run_dir, ep_num)
 
         # IO options
-        cmd += ' --ioengine=%s' % self.ioengine
+        cmd = ' --ioengine=%s' % self.ioengine
         cmd += ' --direct=%s' % self.direct
         if self.bssplit is not None:
             cmd += ' --bssplit=%s' % self.bssplit
@@ -197,11 +215,18 @@ class Fio(Benchmark):
             if self.log_avg_msec is not None:
                 cmd += ' --log_avg_msec=%d' % self.log_avg_msec
         cmd += ' --output-format=%s' % self.fio_out_format
-
-        # End the fio_cmd
-        cmd += ' > %s' % (out_file)
+        cmd += steadystate.fio_options(self.steady_state)
         return cmd
 
+    def job_file_command(self):
+        """ Copies the job file of all the endpoints to the clients, returns the command running it """
+        job_file = '%s/fio.job' % self.run_dir
+        options = fio_jobfile.write_job_files([(str(i), self.run_options(i))
+                                               for i in range(self.endpoints_per_client)], job_file)
+        if self.client_server:
+            return fio_jobfile.client_command(self.cmd_path, options, job_file, self.run_dir)
+        return 'sudo %s%s %s > %s/output.all' % (self.cmd_path_full, options, job_file, self.run_dir)
+
     def run(self):
         super(Fio, self).run()
 
@@ -228,24 +253,42 @@ class Fio(Benchmark):
             # Wait for signal to start client IO
             self.cluster.wait_start_io()
 
-        monitoring.start(self.run_dir)
-
-        logger.info('Running fio %s test.', self.mode)
-        ps = []
-        for i in range(self.endpoints_per_client):
-            p = common.pdsh(settings.getnodes('clients'), self.run_command(i))
-            ps.append(p)
-        for p in ps:
-            p.wait()
-        # If we were doing recovery, wait until it's done.
-        if 'recovery_test' in self.cluster.config:
-            self.cluster.wait_recovery_done()
-
-        monitoring.stop(self.run_dir)
+        with common.stream_results(self.run_dir, self.out_dir):
+            monitoring.start(self.run_dir)
+
+            logger.info('Running fio %s test.', self.mode)
+            nodes = settings.getnodes('clients')
+            if self.client_server:
+                # the fio client on the head drives fio servers on the clients
+                fio_jobfile.start_servers('sudo %s' % self.cmd_path_full, self.run_dir)
+                nodes = settings.getnodes('head')
+            if self.job_file:
+                commands = [self.job_file_command()]
+            else:
+                commands = [self.run_command(i) for i in range(self.endpoints_per_client)]
+            ps = []
+            for command in commands:
+                p = common.pdsh(nodes, command)
+                ps.append(p)
+            cmd_name = pathlib.PurePath(self.cmd_path).name
+            with steadystate.watch(self.steady_state, self.run_dir, self.out_dir, nodes=nodes,
+                                   stop_command='sudo killall -2 %s' % cmd_name):
+                for p in ps:
+                    p.wait()
+            if self.client_server:
+                fio_jobfile.stop_servers(self.cmd_path)
+                fio_jobfile.sync_client_output(self.run_dir, self.out_dir)
+            # If we were doing recovery, wait until it's done.
+            if 'recovery_test' in self.cluster.config:
+                self.cluster.wait_recovery_done()
+
+            monitoring.stop(self.run_dir)
 
         # Finally, get the historic ops
         self.cluster.dump_historic_ops(self.run_dir)
         common.sync_files('%s/*' % self.run_dir, self.out_dir)
+        if self.steady_state:
+            steadystate.strip_status_reports(self.out_dir)
         self.analyze(self.out_dir)
 
     def cleanup(self):
@@ -260,23 +303,32 @@ class Fio(Benchmark):
 
     def analyze(self, out_dir):
         logger.info('Convert results to json format.')
+        if self.client_server:
+            fio_jobfile.parse_client_output(out_dir)
+            return
         for client in settings.getnodes('clients').split(','):
             host = settings.host_info(client)["host"]
-            for i in range(self.endpoints_per_client):
-                found = 0
-                out_file = '%s/output.%d.%s' % (out_dir, i, host)
-                json_out_file = '%s/json_output.%d.%s' % (out_dir, i, host)
-                with open(out_file) as fd:
-                    with open(json_out_file, 'w') as json_fd:
-                        for line in fd.readlines():
-                            if len(line.strip()) == 0:
-                                found = 0
-                                break
-                            if found == 1:
-                                json_fd.write(line)
-                            if found == 0:
-                                if "Starting" in line:
-                                    found = 1
+            if not self.job_file:
+                for i in range(self.endpoints_per_client):
+                    self.parse_output('%s/output.%d.%s' % (out_dir, i, host),
+                                      '%s/json_output.%d.%s' % (out_dir, i, host))
+                continue
+            # split the output of the job file into the json output of every endpoint
+            fio_jobfile.parse_output(out_dir, host)
+
+    def parse_output(self, out_file, json_out_file):
+        found = 0
+        with open(out_file) as fd:
+            with open(json_out_file, 'w') as json_fd:
+                for line in fd.readlines():
+                    if len(line.strip()) == 0:
+                        found = 0
+                        break
+                    if found == 1:
+                        json_fd.write(line)
+                    if found == 0:
+                        if "Starting" in line:
+                            found = 1
 
     def __str__(self):
         return "%s\n%s\n%s" % (self.run_dir, self.out_dir, super(Fio, self).__str__())
@@ -0,0 +1,208 @@
+"""
+    fio_jobfile.py -- run the fio processes of a client as one fio process.
+
+The benchmarks build a fio command line per volume or endpoint. A job file
+puts them together, a section per job of every command line, so that a
+client runs a single fio process through a single remote command. The
+results of a process are told apart in the report of the job file by the
+description of its sections.
+
+In client/server mode the clients run fio --server and a single fio client
+on the head starts the job files of all of them at once, reporting every
+client and the sum of all of them in one output.
+"""
+import json
+import os
+import re
+import shlex
+import tempfile
+
+import common
+import settings
+from . import steadystate
+
+# the output of the fio client on the head, in the run directory
+CLIENT_OUTPUT = 'output.clients'
+
+# options of the fio command line that are not job options
+COMMAND_LINE_OPTIONS = ('output', 'output-format', 'status-interval')
+
+
+def parse_options(options):
+    """ [(name, value)] of fio command line options, value None for flags """
+    parsed = []
+    for token in shlex.split(options):
+        if not token.startswith('--'):
+            raise ValueError('%s is not a fio option' % token)
+        name, sep, value = token[2:].partition('=')
+        parsed.append((name, value if sep else None))
+    return parsed
+
+
+def _line(option):
+    name, value = option
+    return name if value is None else '%s=%s' % (name, value)
+
+
+def make_job_file(processes):
+    """
+    (job file, command line options) of the fio processes given as
+    [(label, command line options)], the options shared by all the jobs in
+    the global section and a section per job with description=<label>
+    """
+    command_line = []
+    jobs = []
+    for label, options in processes:
+        shared = []
+        sections = []
+        for name, value in parse_options(options):
+            if name in COMMAND_LINE_OPTIONS:
+                if (name, value) not in command_line:
+                    command_line.append((name, value))
+            elif name == 'name':
+                sections.append((value, []))
+            elif sections:
+                sections[-1][1].append((name, value))
+            else:
+                shared.append((name, value))
+        for name, job_options in sections or [(label, [])]:
+            jobs.append((label, name, shared + job_options))
+    common_options = [o for o in jobs[0][2] if all(o in job[2] for job in jobs)] if jobs else []
+    lines = ['[global]'] + [_line(o) for o in common_options]
+    for label, name, job_options in jobs:
+        lines += ['', '[%s]' % name, 'description=%s' % label]
+        lines += [_line(o) for o in job_options if o not in common_options]
+    return '\n'.join(lines) + '\n', ''.join(' --' + _line(o) for o in command_line)
+
+
+def process_report(report, jobs):
+    """
+    The report of the jobs of one process, with the options of their
+    section among the global options as they would be on its command line
+    """
+    options = dict(report.get('global options', {}))
+    if jobs:
+        options.update((name, value) for name, value in jobs[0].get('job options', {}).items()
+                       if name not in ('name', 'description'))
+    return dict(report, jobs=jobs, **{'global options': options})
+
+
+def split_report(report):
+    """ {label: the report of the process labelled so} of a job file report """
+    jobs = {}
+    for job in report.get('jobs', []):
+        jobs.setdefault(job.get('job options', {}).get('description', ''), []).append(job)
+    return dict((label, process_report(report, label_jobs)) for label, label_jobs in jobs.items())
+
+
+def write_job_files(processes, job_file):
+    """
+    Copies the job file of the processes, given as for make_job_file(), to
+    job_file on every client with its fqdn in place of the shell
+    interpolation of the command lines, returns the command line options
+    to run it with. Raises when a client did not give its fqdn, it would
+    be left without a job file.
+    """
+    fqdn_cmd = '`%s`' % common.get_fqdn_cmd()
+    fqdns = common.get_fqdn_map('clients')
+    missing = [node for node in settings.getnodes('clients').split(',') if node and node not in fqdns]
+    if missing:
+        raise Exception('No fqdn for the clients %s, cannot write their fio job files' % ', '.join(missing))
+    options = ''
+    copies = []
+    with tempfile.TemporaryDirectory(prefix='cbt-fio.') as tmp:
+        for n, (node, names) in enumerate(fqdns.items()):
+            text, options = make_job_file([(label, process_options.replace(fqdn_cmd, names['fqdn']))
+                                           for label, process_options in processes])
+            local = os.path.join(tmp, '%d.job' % n)
+            with open(local, 'w') as fd:
+                fd.write(text)
+            copies.append(common.scp(node, local, job_file))
+        for p in copies:
+            p.communicate()
+    return options
+
+
+def start_servers(fio_cmd, run_dir):
+    """ Starts a daemonized fio server on every client """
+    common.pdsh(settings.getnodes('clients'),
+                '%s --server --daemonize=%s/fio-server.pid' % (fio_cmd, run_dir),
+                continue_if_error=False).communicate()
+
+
+def stop_servers(fio_cmd):
+    """ Stops the fio servers of the clients """
+    common.remote_kill(settings.getnodes('clients'), '%s --server' % fio_cmd.split()[-1], sig='15', full=True)
+
+
+def client_command(fio_cmd, options, job_file, run_dir):
+    """
+    The command, run on the head, driving the fio server of every client
+    with the job file copied to it, in json output
+    """
+    options = re.sub(r' --output-format=\S+', '', options)
+    cmd = '%s --output-format=json%s' % (fio_cmd, options)
+    for client in settings.getnodes('clients').split(','):
+        cmd += ' --client=%s --remote-config=%s' % (settings.host_info(client)['host'], job_file)
+    return 'mkdir -p %s && cd %s && %s > %s' % (run_dir, run_dir, cmd, CLIENT_OUTPUT)
+
+
+def sync_client_output(run_dir, out_dir):
+    """ Copies the output of the fio client from the head to out_dir """
+    common.mkdir_p(out_dir)
+    common.rpdcp(settings.getnodes('head'), '', '%s/%s' % (run_dir, CLIENT_OUTPUT), out_dir).communicate()
+
+
+def split_client_report(report):
+    """
+    {(client, label): the report of the process labelled so on the client}
+    of the report of a fio client, without the All clients sum
+    """
+    jobs = {}
+    for job in report.get('client_stats', []):
+        if job.get('jobname') == 'All clients':
+            continue
+        label = job.get('job options', {}).get('description', '')
+        jobs.setdefault((job.get('hostname', ''), label), []).append(job)
+    report = dict((name, value) for name, value in report.items() if name != 'client_stats')
+    return dict((key, process_report(report, key_jobs)) for key, key_jobs in jobs.items())
+
+
+def read_report(path):
+    """ The final json report in a fio output, whatever the other formats in it """
+    with open(path) as fd:
+        text = fd.read()
+    # the last report is the final one, the others are status reports
+    starts = [m.start() for m in steadystate.REPORT_START.finditer(text)]
+    if not starts:
+        raise ValueError('no fio json report in %s' % path)
+    return json.JSONDecoder().raw_decode(text, starts[-1])[0]
+
+
+def parse_output(out_dir, host):
+    """
+    Writes the report in the output of the job file of a client synced to
+    out_dir to json_output.all.<host> and the report of every process to
+    json_output.<label>.<host>, as without a job file
+    """
+    report = read_report('%s/output.all.%s' % (out_dir, host))
+    with open('%s/json_output.all.%s' % (out_dir, host), 'w') as fd:
+        json.dump(report, fd, indent=2)
+    for label, process in split_report(report).items():
+        with open('%s/json_output.%s.%s' % (out_dir, label, host), 'w') as fd:
+            json.dump(process, fd, indent=2)
+
+
+def parse_client_output(out_dir):
+    """
+    Writes the report in the output of the fio client synced to out_dir to
+    json_output.clients.<head> and the report of every process of every
+    client to json_output.<label>.<client>, as without client/server
+    """
+    head = settings.host_info(settings.getnodes('head'))['host']
+    report = read_report('%s/%s.%s' % (out_dir, CLIENT_OUTPUT, head))
+    with open('%s/json_output.clients.%s' % (out_dir, head), 'w') as fd:
+        json.dump(report, fd, indent=2)
+    for (client, label), process in split_client_report(report).items():
+        with open('%s/json_output.%s.%s' % (out_dir, label, client), 'w') as fd:
+            json.dump(process, fd, indent=2)
@@ -6,6 +6,7 @@ import time
 import logging
 
 from .benchmark import Benchmark
+from . import steadystate
 
 logger = logging.getLogger("cbt")
 
@@ -38,6 +39,10 @@ class KvmRbdFio(Benchmark):
         self.rbdadd_options = config.get('rbdadd_options')
         self.client_ra = config.get('client_ra', '128')
         self.fio_cmd = config.get('fio_cmd', '/usr/bin/fio')
+        self.steady_state = steadystate.get_config(config.get('steady_state', None))
+        if self.steady_state and 'recovery_test' in cluster.config:
+            logger.warning('steady_state is not watched during recovery tests')
+            self.steady_state = None
         # FIXME there are too many permutations, need to put results in SQLITE3
         self.run_dir = '%s/osd_ra-%08d/client_ra-%08d/op_size-%08d/concurrent_procs-%03d/iodepth-%03d/%s' % (self.run_dir, int(self.osd_ra), int(self.client_ra), int(self.op_size), int(self.total_procs), int(self.iodepth), self.mode)
         self.out_dir = '%s/osd_ra-%08d/client_ra-%08d/op_size-%08d/concurrent_procs-%03d/iodepth-%03d/%s' % (self.archive_dir, int(self.osd_ra), int(self.client_ra), int(self.op_size), int(self.total_procs), int(self.iodepth), self.mode)
@@ -59,12 +64,10 @@ class KvmRbdFio(Benchmark):
         for b in self.block_devices:
             bnm = os.path.basename(b)
             mtpt = '/srv/rbdfio-`%s`-%s' % (common.get_fqdn_cmd(), bnm)
-            common.pdsh(clnts, 'sudo mkfs.ext4 %s' % b,
-                        continue_if_error=False).communicate()
-            common.pdsh(clnts, 'sudo mkdir -p %s' % mtpt,
-                        continue_if_error=False).communicate()
-            common.pdsh(clnts, 'sudo mount -t ext4 -o noatime %s %s' % (b, mtpt),
-                        continue_if_error=False).communicate()
+            with common.Batch(clnts, continue_if_error=False) as batch:
+                batch.add('sudo mkfs.ext4 %s' % b)
+                batch.add('sudo mkdir -p %s' % mtpt)
+                batch.add('sudo mount -t ext4 -o noatime %s %s' % (b, mtpt))
         logger.info('Attempting to initialize fio files...')
         initializer_list = []
         for i in range(self.concurrent_procs):
@@ -135,25 +138,29 @@ class KvmRbdFio(Benchmark):
                 fio_cmd += ' --write_lat_log=%s' % out_file
             if 'recovery_test' in self.cluster.config:
                 fio_cmd += ' --time_based'
+            fio_cmd += steadystate.fio_options(self.steady_state)
             fio_cmd += ' --name=%s > %s' % (fiopath, out_file)
             fio_process_list.append(common.pdsh(clnts, fio_cmd, continue_if_error=False))
-        for p in fio_process_list:
-            p.communicate()
+        with steadystate.watch(self.steady_state, self.run_dir, self.out_dir):
+            for p in fio_process_list:
+                p.communicate()
         monitoring.stop(self.run_dir)
         logger.info('Finished rbd fio test')
 
         common.sync_files('%s/*' % self.run_dir, self.out_dir)
+        if self.steady_state:
+            steadystate.strip_status_reports(self.out_dir)
 
     def cleanup(self):
         super(KvmRbdFio, self).cleanup()
         clnts = settings.getnodes('clients')
-        common.pdsh(clnts, 'killall fio').communicate()
-        time.sleep(3)
-        common.pdsh(clnts, 'killall -9 fio').communicate()
-        time.sleep(3)
-        common.pdsh(clnts, 'rm -rf /srv/*/*',
-                    continue_if_error=False).communicate()
-        common.pdsh(clnts, 'sudo umount /srv/* || echo -n').communicate()
+        with common.Batch(clnts) as batch:
+            batch.add('killall fio')
+            batch.add('sleep 3')
+            batch.add('killall -9 fio')
+            batch.add('sleep 3')
+            batch.add('rm -rf /srv/*/*', continue_if_error=False)
+            batch.add('sudo umount /srv/* || echo -n')
 
     def set_client_param(self, param, value):
         cmd = 'find /sys/block/vd* ! -iname vda -exec sudo sh -c "echo %s > {}/queue/%s" \\;' % (value, param)
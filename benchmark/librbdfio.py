@@ -1,6 +1,9 @@
 """
     lirbdfio.py -- module to support the FIO benchmark exercising RBD.
 """
+import asyncio
+import contextlib
+import json
 import os
 import time
 import logging
@@ -8,12 +11,110 @@ import pprint
 import common
 import settings
 import monitoring
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
 from .benchmark import Benchmark
+from . import fio_jobfile
+from . import steadystate
 
 logger = logging.getLogger("cbt")
 
+# the completion latency percentiles fio reports by default
+FIO_PERCENTILES = (1, 5, 10, 20, 30, 40, 50, 60, 70, 80, 90, 95, 99, 99.5, 99.9, 99.95, 99.99)
+
+
+def fio_sla_metrics(reports, percentile: float) -> Tuple[float, float]:
+    """
+    The total iops of fio json reports and the worst completion latency at
+    the percentile of their jobs, in ms
+    """
+    key = '%f' % percentile
+    iops = 0.0
+    latency = 0.0
+    for report in reports:
+        for job in report.get('jobs', []):
+            for ddir in ('read', 'write', 'trim'):
+                stats = job.get(ddir)
+                if not stats or not stats.get('total_ios'):
+                    continue
+                iops += stats['iops']
+                latency = max(latency, stats['clat_ns'].get('percentile', {}).get(key, 0) / 1e6)
+    return iops, latency
+
+
+class SlaSearch(object):
+    """
+    Finds the numjobs and iodepth giving the most iops with the latency
+    within a target. For each numjobs, smallest first, the iodepth doubles
+    from the smallest allowed until the target is missed, the largest is
+    reached or the iops grow by less than min_gain (the knee of the latency
+    curve); the iodepth between the last hit and the first miss is then
+    bisected to an eighth of the last hit. More numjobs are tried as long as
+    they add min_gain iops.
+
+    probe(numjobs, iodepth) runs the workload and returns (iops, latency).
+    """
+    def __init__(self, probe, latency, numjobs, iodepths, min_gain=0.02):
+        self.probe_workload = probe
+        self.latency = latency
+        self.numjobs = sorted(set(numjobs))
+        self.low = min(iodepths)
+        self.high = max(iodepths)
+        self.min_gain = min_gain
+        self.probes = []
+        self.best = None
+
+    def probe(self, numjobs, iodepth):
+        """ The iops of a probe, None when it misses the target """
+        iops, latency = self.probe_workload(numjobs, iodepth)
+        result = {'numjobs': numjobs, 'iodepth': iodepth, 'iops': iops, 'latency_ms': latency,
+                  'sla': latency <= self.latency}
+        self.probes.append(result)
+        logger.info('Probe numjobs %d iodepth %d: %d iops, %.3fms %s', numjobs, iodepth, iops, latency,
+                    'within target' if result['sla'] else 'missed target')
+        if not result['sla']:
+            return None
+        if self.best is None or iops > self.best['iops']:
+            self.best = result
+        return iops
+
+    def search_iodepth(self, numjobs):
+        """ The most iops within the target at numjobs, 0 if none """
+        best = 0.0
+        hit = None
+        iodepth = self.low
+        while True:
+            iops = self.probe(numjobs, iodepth)
+            if iops is None:
+                break
+            gain = iops >= best * (1 + self.min_gain)
+            best = max(best, iops)
+            if not gain or iodepth >= self.high:
+                return best
+            hit = iodepth
+            iodepth = min(iodepth * 2, self.high)
+        miss = iodepth
+        while hit is not None and miss - hit > max(1, hit // 8):
+            iodepth = (hit + miss) // 2
+            iops = self.probe(numjobs, iodepth)
+            if iops is None:
+                miss = iodepth
+            else:
+                hit = iodepth
+                best = max(best, iops)
+        return best
+
+    def run(self):
+        """ The probe with the most iops within the target, None if none """
+        best = 0.0
+        for numjobs in self.numjobs:
+            iops = self.search_iodepth(numjobs)
+            if not iops or iops < best * (1 + self.min_gain):
+                break
+            best = iops
+        return self.best
+
+
 class LibrbdFio(Benchmark):
     """
     Class LibrbdFio
@@ -49,6 +150,14 @@ class LibrbdFio(Benchmark):
         self.random_distribution = config.get('random_distribution', None)
         self.rate_iops = config.get('rate_iops', None)
         self.fio_out_format = config.get('fio_out_format', 'json,normal')
+        # one fio process per client running the volumes from a job file,
+        # driven from the head through fio servers on the clients with client_server
+        self.client_server = bool(config.get('client_server', False))
+        self.job_file = bool(config.get('job_file', False)) or self.client_server
+        self.steady_state = steadystate.get_config(config.get('steady_state', None))
+        if self.steady_state and 'recovery_test' in cluster.config:
+            logger.warning('steady_state is not watched during recovery tests')
+            self.steady_state = None
         self.data_pool = None
 
         iodepth_key: str = self._get_iodepth_key(config.keys())  # type: ignore[arg-type]
@@ -67,6 +176,8 @@ class LibrbdFio(Benchmark):
         # workloads: specify a list of tests
         self.global_fio_options = {}
         self.workloads = config.get('workloads', {})
+        # the archive directories of the workloads run, with their volumes
+        self.workload_dirs = []
         if self.workloads:
             self.backup_global_fio_options()
         self.prefill_vols = config.get('prefill', {'blocksize': '4M',
@@ -163,54 +274,157 @@ class LibrbdFio(Benchmark):
         Main loop for executing workloads
         """
         for wk in self.workloads:
-            ps = []
             # aggregate/overwrite the global options
             test = dict(self.global_fio_options, **self.workloads[wk])
             enable_monitor = True
             logger.info('Running rbd fio %s test, mode %s', wk, test['mode'])
             if 'monitor' in test:
                 enable_monitor = bool(test['monitor'])
+            iodepth_key: str = self._get_iodepth_key(test.keys())  # type: ignore[arg-type]
+            if 'sla' in test:
+                self.run_sla_search(wk, test, iodepth_key, enable_monitor)
+                continue
             # TODO: simplify this loop to have a single iterator for general queu depth
             for job in test['numjobs']:
-                iodepth_key: str = self._get_iodepth_key(test.keys())  # type: ignore[arg-type]
                 for iodepth_value in test[iodepth_key]:
-                    self._iodepth_per_volume = self._calculate_iodepth_per_volume(
-                        int(test.get("volumes_per_client", 1)), int(iodepth_value), iodepth_key
-                    )
-                    self.mode = test['mode']
-                    if 'op_size' in test:
-                        self.op_size = test['op_size']
-                    self.mode = test['mode']
-                    self.numjobs = job
-                    self.iodepth = iodepth_value
-                    self.run_dir =  ( f'{self.base_run_dir}/{self.mode}_{int(self.op_size)}/'
-                                     f'iodepth-{int(self.iodepth):03d}/numjobs-{int(self.numjobs):03d}' )
-                    common.make_remote_dir(self.run_dir)
-
-                    # If there is a script to run specified in the yaml for this workload
-                    # then add it to the process list before the actual test
-                    script_command: str = test.get("pre_workload_script", "")
-                    if script_command != "":
-                        logger.debug("Scheduling script %s to run before this workolad", script_command)
-                        script_process = common.pdsh(settings.getnodes("clients"), script_command)
-                        script_process.wait()
-
-                    number_of_volumes: int = len(self._iodepth_per_volume.keys())
-                    for i in range(number_of_volumes):
-                        fio_cmd = self.mkfiocmd(i)
-                        p = common.pdsh(settings.getnodes('clients'), fio_cmd)
-                        ps.append(p)
-                    if enable_monitor:
-                        time.sleep(self.ramp) # ramp up time before measuring
-                        monitoring.start(self.run_dir)
-                    for p in ps:
-                        p.wait()
-                    if enable_monitor:
-                        monitoring.stop(self.run_dir)
-                    self.restore_global_fio_options()
+                    self.run_workload_test(wk, test, job, iodepth_value, iodepth_key, enable_monitor)
 
         logger.info('== Workloads completed ==')
 
+    def run_workload_test(self, wk, test, job, iodepth_value, iodepth_key: str, enable_monitor: bool) -> str:
+        """
+        Run one numjobs and iodepth combination of a workload, returns the
+        directory of the archive its results go to
+        """
+        self._iodepth_per_volume = self._calculate_iodepth_per_volume(
+            int(test.get("volumes_per_client", 1)), int(iodepth_value), iodepth_key
+        )
+        self.mode = test['mode']
+        if 'op_size' in test:
+            self.op_size = test['op_size']
+        self.mode = test['mode']
+        self.numjobs = job
+        self.iodepth = iodepth_value
+        self.run_dir =  ( f'{self.base_run_dir}/{self.mode}_{int(self.op_size)}/'
+                         f'iodepth-{int(self.iodepth):03d}/numjobs-{int(self.numjobs):03d}' )
+        common.make_remote_dir(self.run_dir)
+
+        # If there is a script to run specified in the yaml for this workload
+        # then add it to the process list before the actual test
+        script_command: str = test.get("pre_workload_script", "")
+        if script_command != "":
+            logger.debug("Scheduling script %s to run before this workolad", script_command)
+            script_process = common.pdsh(settings.getnodes("clients"), script_command)
+            script_process.wait()
+
+        # every workload streams and syncs into its own directory of the
+        # archive, the final sync of run() only covers the files of the run
+        stream_dir = os.path.join(self.out_dir, os.path.relpath(self.run_dir, self.base_run_dir))
+        with common.stream_results(self.run_dir, stream_dir):
+            with common.trace_phase(f'{wk}/iodepth-{int(self.iodepth):03d}/numjobs-{int(self.numjobs):03d}'):
+                asyncio.run(self._run_fio(enable_monitor, stream_dir))
+            if enable_monitor:
+                monitoring.stop(self.run_dir)
+        common.sync_files(f'{self.run_dir}/*', stream_dir)
+        self.workload_dirs.append((stream_dir, len(self._iodepth_per_volume)))
+        self.restore_global_fio_options()
+        return stream_dir
+
+    def run_sla_search(self, wk, test, iodepth_key: str, enable_monitor: bool) -> None:
+        """
+        Search the numjobs and iodepth ranges of a workload for the most iops
+        within its latency target (the sla section) with short fio probes,
+        instead of running every combination
+        """
+        sla = test['sla']
+        percentile = float(sla.get('percentile', 99))
+        if percentile not in FIO_PERCENTILES:
+            raise ValueError('sla percentile %s is not one of the fio completion latency percentiles %s'
+                             % (percentile, list(FIO_PERCENTILES)))
+        numjobs = test['numjobs'] if isinstance(test['numjobs'], list) else [test['numjobs']]
+        iodepths = test[iodepth_key] if isinstance(test[iodepth_key], list) else [test[iodepth_key]]
+        probe_time = int(sla.get('time', 30))
+        probe_ramp = int(sla.get('ramp', 5))
+        # the probes restore the global op_size of the workloads not setting one
+        op_size = int(test.get('op_size', self.op_size))
+        saved_time = self.time
+
+        def probe(job, iodepth_value):
+            self.time = probe_time
+            self.ramp = probe_ramp
+            self.time_based = True
+            stream_dir = self.run_workload_test(wk, test, job, iodepth_value, iodepth_key, enable_monitor)
+            if self.steady_state:
+                steadystate.strip_status_reports(stream_dir)
+            return self.probe_result(stream_dir, percentile)
+
+        search = SlaSearch(probe, float(sla['latency_ms']), numjobs, iodepths, float(sla.get('min_gain', 0.02)))
+        try:
+            with common.trace_phase(f'{wk}/sla_search'):
+                best = search.run()
+        finally:
+            self.time = saved_time
+        if best is None:
+            logger.warning('%s: no numjobs and iodepth keep the p%s latency within %sms',
+                           wk, sla.get('percentile', 99), sla['latency_ms'])
+        else:
+            logger.info('%s: most iops within p%s %sms: %d at numjobs %d, iodepth %d (%.3fms), %d probes',
+                        wk, sla.get('percentile', 99), sla['latency_ms'], best['iops'],
+                        best['numjobs'], best['iodepth'], best['latency_ms'], len(search.probes))
+        summary_dir = os.path.join(self.out_dir, f"{test['mode']}_{op_size}")
+        common.mkdir_p(summary_dir)
+        with open(os.path.join(summary_dir, 'sla_search.json'), 'w') as fd:
+            json.dump({'workload': wk, 'percentile': percentile, 'latency_ms': float(sla['latency_ms']),
+                       'best': best, 'probes': search.probes}, fd, indent=4)
+
+    def probe_result(self, out_dir: str, percentile: float) -> Tuple[float, float]:
+        """
+        The iops and latency of a probe from the fio output of every volume
+        of every client synced to out_dir
+        """
+        reports = []
+        self.parse(out_dir, len(self._iodepth_per_volume))
+        for client in settings.getnodes('clients').split(','):
+            host = settings.host_info(client)["host"]
+            for i in self._iodepth_per_volume:
+                with open(f'{out_dir}/json_output.{i:d}.{host}') as fd:
+                    reports.append(json.load(fd))
+        return fio_sla_metrics(reports, percentile)
+
+    async def _run_fio(self, enable_monitor: bool = False, out_dir: Optional[str] = None) -> None:
+        """
+        Run one fio process per volume (or per client with job_file) on
+        every client from a single event loop, optionally starting the monitoring once the ramp time is over,
+        watching for steady state when asked to (its verdict goes to out_dir).
+        With client_server a fio client on the head drives the fio servers
+        of the clients, its output is copied to out_dir.
+        """
+        number_of_volumes: int = len(self._iodepth_per_volume.keys())
+        nodes = settings.getnodes('clients')
+        if self.client_server:
+            job_file, options = await asyncio.to_thread(self.write_job_files)
+            server_cmd = self.cmd_path if self.no_sudo else f'sudo {self.cmd_path}'
+            await asyncio.to_thread(fio_jobfile.start_servers, server_cmd, self.run_dir)
+            nodes = settings.getnodes('head')
+            commands = [fio_jobfile.client_command(self.cmd_path, options, job_file, self.run_dir)]
+        elif self.job_file:
+            job_file, options = await asyncio.to_thread(self.write_job_files)
+            commands = [self.mkfiojobcmd(job_file, options)]
+        else:
+            commands = [self.mkfiocmd(i) for i in range(number_of_volumes)]
+        try:
+            jobs = [asyncio.create_task(common.run(nodes, command, keep_output=False)) for command in commands]
+            if enable_monitor:
+                await asyncio.sleep(self.ramp) # ramp up time before measuring
+                await asyncio.to_thread(monitoring.start, self.run_dir)
+            with steadystate.watch(self.steady_state, self.run_dir, out_dir or self.out_dir, nodes=nodes,
+                                   stop_command=f'sudo killall -2 {os.path.basename(self.cmd_path)}'):
+                await asyncio.gather(*jobs)
+        finally:
+            if self.client_server:
+                await asyncio.to_thread(fio_jobfile.stop_servers, self.cmd_path)
+                await asyncio.to_thread(fio_jobfile.sync_client_output, self.run_dir, out_dir or self.out_dir)
+
 
     def run(self):
         super(LibrbdFio, self).run()
@@ -240,30 +454,29 @@ class LibrbdFio(Benchmark):
             # Wait for a signal from the recovery thread to initiate client IO
             self.cluster.wait_start_io()
 
-        if len(self.workloads) > 0:
-            # New style: execute the list of workloads
-            self.run_workloads()
-        else:
-            # Original style
-            monitoring.start(self.run_dir)
-            logger.info('Running rbd fio %s test.', self.mode)
-            ps = []
-            number_of_volumes: int = len(self._iodepth_per_volume.keys())
-            for i in range(number_of_volumes):
-                fio_cmd = self.mkfiocmd(i)
-                p = common.pdsh(settings.getnodes('clients'), fio_cmd)
-                ps.append(p)
-            for p in ps:
-                p.wait()
-        # If we were doing recovery, wait until it's done.
-        if 'recovery_test' in self.cluster.config:
-            self.cluster.wait_recovery_done()
-
-        monitoring.stop(self.run_dir)
+        # Original style streams the whole run, the workloads stream each
+        run_dir = self.run_dir
+        with common.stream_results(self.run_dir, self.out_dir) if not self.workloads else contextlib.nullcontext():
+            if len(self.workloads) > 0:
+                # New style: execute the list of workloads
+                self.run_workloads()
+                self.run_dir = run_dir
+            else:
+                # Original style
+                monitoring.start(self.run_dir)
+                logger.info('Running rbd fio %s test.', self.mode)
+                asyncio.run(self._run_fio())
+            # If we were doing recovery, wait until it's done.
+            if 'recovery_test' in self.cluster.config:
+                self.cluster.wait_recovery_done()
+
+            monitoring.stop(self.run_dir)
 
         # Finally, get the historic ops
         self.cluster.dump_historic_ops(self.run_dir)
         common.sync_files(f'{self.run_dir}/*', self.out_dir)
+        if self.steady_state:
+            steadystate.strip_status_reports(self.out_dir)
         self.analyze(self.out_dir)
 
 
@@ -272,6 +485,20 @@ class LibrbdFio(Benchmark):
         Construct a FIO cmd (note the shell interpolation for the host
         executing FIO).
         """
+        out_file = f'{self.run_dir}/output.{volnum:d}'
+
+        fio_cmd: str = ''
+        if not self.no_sudo:
+            fio_cmd = 'sudo '
+        fio_cmd += self.cmd_path + self.fio_options(volnum)
+        fio_cmd += ' > %s' % out_file
+        return fio_cmd
+
+
+    def fio_options(self, volnum: int) -> str:
+        """
+        The fio command line options of the process for a volume
+        """
         if self.use_existing_volumes and len(self.rbdname):
             rbdname = self.rbdname
         else:
@@ -280,10 +507,7 @@ class LibrbdFio(Benchmark):
         logger.debug('Using rbdname %s', rbdname)
         out_file = f'{self.run_dir}/output.{volnum:d}'
 
-        fio_cmd: str = ''
-        if not self.no_sudo:
-            fio_cmd = 'sudo '
-        fio_cmd += '%s --ioengine=rbd --clientname=admin --pool=%s --rbdname=%s --invalidate=0' % (self.cmd_path, self.pool_name, rbdname)
+        fio_cmd = ' --ioengine=rbd --clientname=admin --pool=%s --rbdname=%s --invalidate=0' % (self.pool_name, rbdname)
         fio_cmd += ' --rw=%s' % self.mode
         fio_cmd += ' --output-format=%s' % self.fio_out_format
         if (self.mode == 'readwrite' or self.mode == 'randrw'):
@@ -320,12 +544,33 @@ class LibrbdFio(Benchmark):
             fio_cmd += ' --log_avg_msec=%s' % self.log_avg_msec
         if self.rate_iops is not None:
             fio_cmd += ' --rate_iops=%s' % self.rate_iops
+        fio_cmd += steadystate.fio_options(self.steady_state)
 
-        # End the fio_cmd
-        fio_cmd += ' %s > %s' % (self.names, out_file)
+        fio_cmd += ' %s' % self.names
         return fio_cmd
 
 
+    def write_job_files(self) -> Tuple[str, str]:
+        """
+        Write a job file running the fio process of every volume to each
+        client, return its path and the fio options to run it with
+        """
+        job_file = f'{self.run_dir}/fio.job'
+        options = fio_jobfile.write_job_files([(str(i), self.fio_options(i)) for i in self._iodepth_per_volume],
+                                              job_file)
+        return job_file, options
+
+
+    def mkfiojobcmd(self, job_file: str, options: str) -> str:
+        """
+        Construct the FIO cmd running the job file of a client
+        """
+        fio_cmd: str = ''
+        if not self.no_sudo:
+            fio_cmd = 'sudo '
+        return f'{fio_cmd}{self.cmd_path}{options} {job_file} > {self.run_dir}/output.all'
+
+
     def mkrecovimage(self):
         """
         Create a reecovery image
@@ -335,12 +580,14 @@ class LibrbdFio(Benchmark):
         if self.use_existing_volumes is False:
             self.cluster.rmpool(self.recov_pool_name, self.recov_pool_profile)
             self.cluster.mkpool(self.recov_pool_name, self.recov_pool_profile, 'rbd')
+            images = []
             for node in common.get_fqdn_list('clients'):
                 for volnum in range(0, self.volumes_per_client):
                     node = node.rpartition("@")[2]
-                    self.cluster.mkimage( f'cbt-librbdfio-recov-{node}-{volnum:d}',
-                                         self.vol_size, self.recov_pool_name, self.data_pool,
-                                         self.vol_object_size )
+                    images.append((f'cbt-librbdfio-recov-{node}-{volnum:d}',
+                                   self.vol_size, self.recov_pool_name, self.data_pool,
+                                   self.vol_object_size))
+            self.cluster.mkimages(images)
         monitoring.stop()
 
 
@@ -356,12 +603,14 @@ class LibrbdFio(Benchmark):
                 self.data_pool = self.pool_name + "-data"
                 self.cluster.rmpool(self.data_pool, self.data_pool_profile)
                 self.cluster.mkpool(self.data_pool, self.data_pool_profile, 'rbd')
+        images = []
         for node in common.get_fqdn_list('clients'):
             for volnum in range(0, self.volumes_per_client):
                 node = node.rpartition("@")[2]
-                self.cluster.mkimage( f'cbt-librbdfio-{node}-{volnum:d}',
-                                     self.vol_size, self.pool_name, self.data_pool,
-                                     self.vol_object_size)
+                images.append((f'cbt-librbdfio-{node}-{volnum:d}',
+                               self.vol_size, self.pool_name, self.data_pool,
+                               self.vol_object_size))
+        self.cluster.mkimages(images)
         monitoring.stop()
 
 
@@ -399,33 +648,58 @@ class LibrbdFio(Benchmark):
         logger.info('Recovery thread completed!')
 
 
-    def parse(self, out_dir):
+    def parse(self, out_dir, volumes: Optional[int] = None):
         """
         Filters the JSON output from the mix output and writes it to a
         separate file.
         """
+        if self.client_server:
+            fio_jobfile.parse_client_output(out_dir)
+            return
         for client in settings.getnodes('clients').split(','):
             host = settings.host_info(client)["host"]
-            for i in range(self.volumes_per_client):
-                found = 0
+            self.parse_client(out_dir, host, volumes or self.volumes_per_client)
+
+
+    def parse_client(self, out_dir, host, volumes):
+        """
+        Writes the JSON output of every volume of a client, split from the
+        output of its job file with job_file
+        """
+        if not self.job_file:
+            for i in range(volumes):
                 out_file = f'{out_dir}/output.{i:d}.{host}'
                 json_out_file = f'{out_dir}/json_output.{i:d}.{host}'
-                with open(out_file) as fd:
-                    with open(json_out_file, 'w') as json_fd:
-                        for line in fd.readlines():
-                            if len(line.strip()) == 0:
-                                found = 0
-                                break
-                            if found == 1:
-                                json_fd.write(line)
-                            if found == 0:
-                                if "Starting" in line:
-                                    found = 1
+                self.parse_output(out_file, json_out_file)
+            return
+        fio_jobfile.parse_output(out_dir, host)
+
+
+    def parse_output(self, out_file, json_out_file):
+        """
+        Writes the JSON part of a fio output file to json_out_file
+        """
+        found = 0
+        with open(out_file) as fd:
+            with open(json_out_file, 'w') as json_fd:
+                for line in fd.readlines():
+                    if len(line.strip()) == 0:
+                        found = 0
+                        break
+                    if found == 1:
+                        json_fd.write(line)
+                    if found == 0:
+                        if "Starting" in line:
+                            found = 1
 
 
     def analyze(self, out_dir):
         logger.info('Convert results to json format.')
-        self.parse(out_dir)
+        if self.workloads:
+            for workload_dir, volumes in self.workload_dirs:
+                self.parse(workload_dir, volumes)
+        else:
+            self.parse(out_dir)
 
     def _get_iodepth_key(self, configuration_keys: List[str]) -> str:
         """
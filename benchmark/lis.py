@@ -1,4 +1,5 @@
 import operator as op
+import re
 
 # a mini s-expr interpreter
 # inspired by https://norvig.com/lispy.html
@@ -7,13 +8,31 @@ Symbol = str
 List = list
 
 
+class String(str):
+    """ A quoted string literal, evaluates to itself """
+
+
+# arithmetic and comparison operators, for the constraints of a sweep
+OPERATORS = {
+    '+': op.add, '-': op.sub, '*': op.mul, '/': op.truediv, '%': op.mod,
+    '<': op.lt, '<=': op.le, '>': op.gt, '>=': op.ge, '=': op.eq, '!=': op.ne,
+    'and': lambda *args: all(args), 'not': op.not_,
+    'min': min, 'max': max}
+
+# a double or single quoted string, a parenthesis or anything else up to a
+# space or a parenthesis
+TOKEN_RE = re.compile(r'"[^"]*"|\'[^\']*\'|[()]|[^\s()]+')
+
+
 class Lispy:
     @staticmethod
     def _tokenize(s):
-        return s.replace('(', ' ( ').replace(')', ' ) ').split()
+        return TOKEN_RE.findall(s)
 
     @staticmethod
     def _atom(token):
+        if len(token) > 1 and token[0] in '"\'' and token[-1] == token[0]:
+            return String(token[1:-1])
         try:
             return int(token)
         except ValueError:
@@ -41,7 +60,9 @@ class Lispy:
         return self._read_from_tokens(self._tokenize(s))
 
     def eval(self, stmt, env):
-        if isinstance(stmt, Symbol):
+        if isinstance(stmt, String):
+            return str(stmt)
+        elif isinstance(stmt, Symbol):
             return env.eval(stmt)
         elif isinstance(stmt, List):
             func = self.eval(stmt[0], env)
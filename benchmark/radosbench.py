@@ -107,6 +107,10 @@ class Radosbench(Benchmark):
                       runtime=self.read_time)
 
     def _run(self, mode, run_dir, out_dir, max_objects, runtime):
+        with common.trace_phase(mode):
+            self._run_mode(mode, run_dir, out_dir, max_objects, runtime)
+
+    def _run_mode(self, mode, run_dir, out_dir, max_objects, runtime):
         # We'll always drop caches for rados bench
         self.dropcaches()
 
@@ -150,10 +154,12 @@ class Radosbench(Benchmark):
             recovery_callback = self.recovery_callback
             self.cluster.create_recovery_test(run_dir, recovery_callback)
 
+        out_dir = os.path.join(self.out_dir, out_dir)
+
         # Run rados bench
-        with monitoring.monitor(run_dir) as monitor:
+        with common.stream_results(run_dir, out_dir), monitoring.monitor(run_dir) as monitor:
             logger.info('Running radosbench %s test.' % mode)
-            ps = []
+            rados_bench_cmds = []
             for i in range(self.concurrent_procs):
                 out_file = '%s/output.%s' % (run_dir, i)
                 objecter_log = '%s/objecter.%s.log' % (run_dir, i)
@@ -188,10 +194,8 @@ class Radosbench(Benchmark):
                     run_name=run_name,
                     stderr=objecter_log,
                     stdout=out_file)
-                p = common.pdsh(settings.getnodes('clients'), rados_bench_cmd)
-                ps.append(p)
-            for p in ps:
-                p.wait()
+                rados_bench_cmds.append(rados_bench_cmd)
+            common.run_all(settings.getnodes('clients'), rados_bench_cmds, keep_output=False)
 
         # If we were doing recovery, wait until it's done (but not for prefill).
         if mode != 'prefill' and 'recovery_test' in self.cluster.config:
@@ -200,18 +204,20 @@ class Radosbench(Benchmark):
         # Finally, get the historic ops
         self.cluster.dump_historic_ops(run_dir)
 
-        out_dir = os.path.join(self.out_dir, out_dir)
         common.sync_files('%s/*' % run_dir, out_dir)
         self.analyze(out_dir)
 
     def mkpools(self):
         with monitoring.monitor("%s/pool_monitoring" % self.run_dir):
             if self.pool_per_proc:  # allow use of a separate storage pool per process
+                pools = []
                 for i in range(self.concurrent_procs):
                     for node in settings.getnodes('clients').split(','):
                         node = node.rpartition("@")[2]
                         self.cluster.rmpool('rados-bench-%s-%s' % (node, i), self.pool_profile)
-                        self.cluster.mkpool('rados-bench-%s-%s' % (node, i), self.pool_profile, 'radosbench')
+                        pools.append(('rados-bench-%s-%s' % (node, i), self.pool_profile, 'radosbench'))
+                # created in one batch with a single health check
+                self.cluster.mkpools(pools)
             else:  # the default behavior is to use a single Ceph storage pool for all rados bench processes
                 self.cluster.rmpool('rados-bench-cbt', self.pool_profile)
                 self.cluster.mkpool('rados-bench-cbt', self.pool_profile, 'radosbench')
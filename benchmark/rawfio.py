@@ -5,6 +5,8 @@ import time
 import logging
 
 from .benchmark import Benchmark
+from . import fio_jobfile
+from . import steadystate
 
 logger = logging.getLogger("cbt")
 
@@ -33,6 +35,14 @@ class RawFio(Benchmark):
         self.op_size = config.get('op_size', 4194304)
         self.vol_size = config.get('vol_size', 65536) * 0.9
         self.fio_cmd = config.get('fio_cmd', 'sudo /usr/bin/fio')
+        # one fio process per client running the block devices from a job file,
+        # driven from the head through fio servers on the clients with client_server
+        self.client_server = bool(config.get('client_server', False))
+        self.job_file = bool(config.get('job_file', False)) or self.client_server
+        self.steady_state = steadystate.get_config(config.get('steady_state', None))
+        if self.steady_state and 'recovery_test' in cluster.config:
+            logger.warning('steady_state is not watched during recovery tests')
+            self.steady_state = None
         # FIXME there are too many permutations, need to put results in SQLITE3
         self.run_dir = '%s/raw_ra-%08d/op_size-%08d/concurrent_procs-%03d/iodepth-%03d/%s' % (self.run_dir, int(self.osd_ra), int(self.op_size), int(self.total_procs), int(self.iodepth), self.mode)
         self.out_dir = '%s/raw_ra-%08d/op_size-%08d/concurrent_procs-%03d/iodepth-%03d/%s' % (self.archive_dir, int(self.osd_ra), int(self.op_size), int(self.total_procs), int(self.iodepth), self.mode)
@@ -84,54 +94,88 @@ class RawFio(Benchmark):
 
         logger.info('Starting raw fio %s test.', self.mode)
 
+        nodes = clnts
+        if self.client_server:
+            # the fio client on the head drives fio servers on the clients
+            fio_jobfile.start_servers(self.fio_cmd, self.run_dir)
+            nodes = settings.getnodes('head')
+        if self.job_file:
+            commands = [self.job_file_command()]
+        else:
+            commands = ['sudo %s%s > %s/output.%d' % (self.fio_cmd, self.run_options(i), self.run_dir, i)
+                        for i in range(self.concurrent_procs)]
         fio_process_list = []
-        for i in range(self.concurrent_procs):
-            b = self.block_devices[i % len(self.block_devices)]
-            fiopath = b
-            out_file = '%s/output.%d' % (self.run_dir, i)
-            fio_cmd = 'sudo %s' % self.fio_cmd
-            fio_cmd += ' --rw=%s' % self.mode
-            if (self.mode == 'readwrite' or self.mode == 'randrw'):
-                fio_cmd += ' --rwmixread=%s --rwmixwrite=%s' % (self.rwmixread, self.rwmixwrite)
-            fio_cmd += ' --ioengine=%s' % self.ioengine
-            fio_cmd += ' --runtime=%s' % self.time
-            fio_cmd += ' --ramp_time=%s' % self.ramp
-            if self.startdelay:
-                fio_cmd += ' --startdelay=%s' % self.startdelay
-            if self.rate_iops:
-                fio_cmd += ' --rate_iops=%s' % self.rate_iops
-            fio_cmd += ' --numjobs=%s' % self.numjobs
-            fio_cmd += ' --direct=%s' % self.direct
-            fio_cmd += ' --bs=%dB' % self.op_size
-            fio_cmd += ' --iodepth=%d' % self.iodepth
-            fio_cmd += ' --size=%dM' % self.vol_size
-            if self.log_iops:
-                fio_cmd += ' --write_iops_log=%s' % out_file
-            if self.log_bw:
-                fio_cmd += ' --write_bw_log=%s' % out_file
-            if self.log_lat:
-                fio_cmd += ' --write_lat_log=%s' % out_file
-            fio_cmd += ' --output-format=%s' % self.fio_out_format
-            if 'recovery_test' in self.cluster.config:
-                fio_cmd += ' --time_based'
-            fio_cmd += ' --name=%s > %s' % (fiopath, out_file)
+        for fio_cmd in commands:
             logger.debug("FIO CMD: %s" % fio_cmd)
-            fio_process_list.append(common.pdsh(clnts, fio_cmd, continue_if_error=False))
-        for p in fio_process_list:
-            p.communicate()
+            fio_process_list.append(common.pdsh(nodes, fio_cmd, continue_if_error=False))
+        with steadystate.watch(self.steady_state, self.run_dir, self.out_dir, nodes=nodes):
+            for p in fio_process_list:
+                p.communicate()
+        if self.client_server:
+            fio_jobfile.stop_servers(self.fio_cmd)
+            fio_jobfile.sync_client_output(self.run_dir, self.out_dir)
         monitoring.stop(self.run_dir)
         logger.info('Finished raw fio test')
 
         common.sync_files('%s/*' % self.run_dir, self.out_dir)
+        if self.steady_state:
+            steadystate.strip_status_reports(self.out_dir)
+        if self.client_server:
+            fio_jobfile.parse_client_output(self.out_dir)
+        elif self.job_file:
+            for client in clnts.split(','):
+                fio_jobfile.parse_output(self.out_dir, settings.host_info(client)['host'])
+
+    def run_options(self, i):
+        b = self.block_devices[i % len(self.block_devices)]
+        fiopath = b
+        out_file = '%s/output.%d' % (self.run_dir, i)
+        fio_cmd = ' --rw=%s' % self.mode
+        if (self.mode == 'readwrite' or self.mode == 'randrw'):
+            fio_cmd += ' --rwmixread=%s --rwmixwrite=%s' % (self.rwmixread, self.rwmixwrite)
+        fio_cmd += ' --ioengine=%s' % self.ioengine
+        fio_cmd += ' --runtime=%s' % self.time
+        fio_cmd += ' --ramp_time=%s' % self.ramp
+        if self.startdelay:
+            fio_cmd += ' --startdelay=%s' % self.startdelay
+        if self.rate_iops:
+            fio_cmd += ' --rate_iops=%s' % self.rate_iops
+        fio_cmd += ' --numjobs=%s' % self.numjobs
+        fio_cmd += ' --direct=%s' % self.direct
+        fio_cmd += ' --bs=%dB' % self.op_size
+        fio_cmd += ' --iodepth=%d' % self.iodepth
+        fio_cmd += ' --size=%dM' % self.vol_size
+        if self.log_iops:
+            fio_cmd += ' --write_iops_log=%s' % out_file
+        if self.log_bw:
+            fio_cmd += ' --write_bw_log=%s' % out_file
+        if self.log_lat:
+            fio_cmd += ' --write_lat_log=%s' % out_file
+        fio_cmd += ' --output-format=%s' % self.fio_out_format
+        if 'recovery_test' in self.cluster.config:
+            fio_cmd += ' --time_based'
+        fio_cmd += steadystate.fio_options(self.steady_state)
+        fio_cmd += ' --name=%s' % fiopath
+        return fio_cmd
+
+    def job_file_command(self):
+        """ Copies the job file of all the block devices to the clients, returns the command running it """
+        job_file = '%s/fio.job' % self.run_dir
+        options = fio_jobfile.write_job_files([(str(i), self.run_options(i))
+                                               for i in range(self.concurrent_procs)], job_file)
+        if self.client_server:
+            return fio_jobfile.client_command(self.fio_cmd, options, job_file, self.run_dir)
+        return 'sudo %s%s %s > %s/output.all' % (self.fio_cmd, options, job_file, self.run_dir)
 
     def cleanup(self):
         super(RawFio, self).cleanup()
         clnts = settings.getnodes('clients')
 
         logger.debug("Kill fio: %s" % clnts)
-        common.pdsh(clnts, 'killall fio').communicate()
-        time.sleep(3)
-        common.pdsh(clnts, 'killall -9 fio').communicate()
+        with common.Batch(clnts) as batch:
+            batch.add('killall fio')
+            batch.add('sleep 3')
+            batch.add('killall -9 fio')
 
     def set_client_param(self, param, value):
         cmd = 'find /sys/block/vd* ! -iname vda -exec sudo sh -c "echo %s > {}/queue/%s" \;' % (value, param)
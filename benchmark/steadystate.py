@@ -0,0 +1,262 @@
+"""
+    steadystate.py -- end fio benchmarks once their throughput has settled.
+
+fio keeps its iops/bw logs in memory until a job ends, so what is watched
+while the test runs are the status reports fio appends to its output every
+status_interval seconds. The outputs of every client are tailed through the
+agents and their rates, interval by interval, summed over all the clients,
+volumes and jobs. The test is in steady state once, over the last `window`
+seconds, the least squares slope of the sum and its largest deviation from
+the mean both stay within a percentage of the mean, like fio's own
+iops_slope and iops criteria but for the cluster as a whole.
+"""
+import contextlib
+import json
+import logging
+import os
+import re
+import threading
+
+import agent
+import common
+import settings
+
+logger = logging.getLogger("cbt")
+
+DEFAULTS = {
+    'metric': 'iops',     # iops or bw
+    'window': 60,         # seconds the criteria have to hold for
+    'slope': 0.1,         # largest slope, in % of the mean per second
+    'deviation': 10,      # largest deviation from the mean, in % of the mean
+    'ramp': 0,            # seconds ignored at the start
+    'interval': 5,        # fio status_interval, in seconds
+    'terminate': True,    # end the test once in steady state
+}
+
+REPORT_START = re.compile(r'^\{\s*"fio version"', re.M)
+# output.all is the output of a client running a job file, output.clients
+# the output on the head of a fio client driving the servers of the clients
+OUTPUT = re.compile(r'^output\.(\d+|all|clients)$')
+SYNCED_OUTPUT = re.compile(r'^output\.(\d+|all|clients)\.')
+
+
+def get_config(config):
+    """ The steady_state section of a benchmark with the defaults, None if unset """
+    if not config:
+        return None
+    return dict(DEFAULTS, **(config if isinstance(config, dict) else {}))
+
+
+def fio_options(config):
+    """ The fio options the steady state detection needs """
+    if not config:
+        return ''
+    return ' --status-interval=%d' % config['interval']
+
+
+def report_jobs(report):
+    """ The jobs of a fio report, those of every client for a fio client """
+    if 'client_stats' in report:
+        return [job for job in report['client_stats'] if job.get('jobname') != 'All clients']
+    return report.get('jobs', [])
+
+
+def report_total(report, metric):
+    """ The ios (iops) or KiB (bw) done by all the jobs of a fio report """
+    key = 'io_kbytes' if metric == 'bw' else 'total_ios'
+    return sum(job.get(ddir, {}).get(key, 0) for job in report_jobs(report) for ddir in ('read', 'write', 'trim'))
+
+
+class Series(object):
+    """
+    The summed rates of several fio outputs, from the status reports
+    appended to them
+    """
+    def __init__(self, metric):
+        self.metric = metric
+        self.decoder = json.JSONDecoder()
+        self.buffers = {}
+        self.last = {}
+        self.rates = {}
+
+    def feed(self, output, data):
+        buffer = self.buffers.pop(output, '') + data
+        rates = self.rates.setdefault(output, [])
+        position = 0
+        while True:
+            m = REPORT_START.search(buffer, position)
+            if not m:
+                # a report may start in what is still to come
+                buffer = buffer[-64:]
+                break
+            try:
+                report, position = self.decoder.raw_decode(buffer, m.start())
+            except ValueError:
+                buffer = buffer[m.start():]
+                break
+            now = (report.get('timestamp_ms', 0), report_total(report, self.metric))
+            if output in self.last and now[0] > self.last[output][0]:
+                rates.append((now[1] - self.last[output][1]) * 1000.0 / (now[0] - self.last[output][0]))
+            self.last[output] = now
+        self.buffers[output] = buffer
+
+    def values(self):
+        """ The sums of the intervals every output got past """
+        if not self.rates:
+            return []
+        return [sum(rates[i] for rates in self.rates.values())
+                for i in range(min(len(rates) for rates in self.rates.values()))]
+
+
+def strip_status_reports(local_dir):
+    """
+    Leaves only the final report in the fio outputs synced to local_dir, the
+    way they are without status reports
+    """
+    for dirpath, _, filenames in os.walk(local_dir):
+        for name in filenames:
+            if not SYNCED_OUTPUT.match(name) or '.log' in name:
+                continue
+            path = os.path.join(dirpath, name)
+            with open(path) as fd:
+                text = fd.read()
+            starts = [m.start() for m in REPORT_START.finditer(text)]
+            if len(starts) > 1:
+                with open(path, 'w') as fd:
+                    fd.write(text[:starts[0]] + text[starts[-1]:])
+
+
+def check(values, config):
+    """
+    The mean over the last window of the summed rates, the least squares
+    slope (per second) and the largest deviation from the mean both in % of
+    the mean, and whether they are within the limits; None while there are
+    not enough values
+    """
+    count = max(int(round(config['window'] / config['interval'])), 2)
+    if len(values) < count:
+        return None
+    values = values[-count:]
+    mean = sum(values) / count
+    x_mean = (count - 1) / 2.0
+    fit = (sum((x - x_mean) * (y - mean) for x, y in enumerate(values)) /
+           sum((x - x_mean) ** 2 for x in range(count)) / config['interval'])
+    result = {'mean': mean,
+              'slope': abs(fit) * 100 / mean if mean else 0.0,
+              'deviation': max(abs(y - mean) for y in values) * 100 / mean if mean else 0.0}
+    result['steady'] = bool(mean) and result['slope'] <= config['slope'] and result['deviation'] <= config['deviation']
+    return result
+
+
+class SteadyState(threading.Thread):
+    """
+    Watches the fio outputs under remote_dir on the nodes (the clients by
+    default) and runs the stop command once the test is in steady state.
+    stop() writes the verdict to steady_state.json in local_dir.
+    """
+    def __init__(self, config, remote_dir, local_dir, nodes=None, stop_command='sudo killall -2 fio'):
+        super(SteadyState, self).__init__()
+        self.phases = list(common.trace_phases())
+        self.daemon = True
+        self.config = config
+        self.remote_dir = remote_dir.rstrip('/')
+        self.local_dir = local_dir
+        self.nodes = nodes or settings.getnodes('clients')
+        self.stop_command = stop_command
+        self.stopping = threading.Event()
+        self.agents = []
+        self.own_agents = {}
+        self.offsets = {}
+        self.series = Series(config['metric'])
+        self.result = None
+        self.reached = None
+        self.terminated = False
+
+    def start(self):
+        agents = common.get_agents(self.nodes)
+        if agents is None:
+            self.own_agents = common.spawn_agents(self.nodes)
+            agents = [(host.rpartition('@')[2], a) for host, a in self.own_agents.items()]
+        self.agents = agents
+        super(SteadyState, self).start()
+
+    def run(self):
+        common.inherit_phases(self.phases)
+        while not self.stopping.wait(self.config['interval']):
+            try:
+                self.poll()
+            except Exception as e:
+                # never let the detection disturb the benchmark
+                logger.warning('steady state polling failed: %s' % e)
+                continue
+            if self.reached is not None:
+                if self.config['terminate']:
+                    logger.info('Steady state reached after %ds, ending the test', self.reached)
+                    common.pdsh(self.nodes, self.stop_command).communicate()
+                    self.terminated = True
+                else:
+                    logger.info('Steady state reached after %ds', self.reached)
+                return
+
+    def poll(self):
+        """ Reads the reports appended to the outputs and checks the criteria """
+        listings = agent.call_each([(a, 'list', {'root': self.remote_dir, 'patterns': ['output.*']})
+                                    for _, a in self.agents])
+        requests = []
+        for (label, a), listing in zip(self.agents, listings):
+            if isinstance(listing, agent.AgentError):
+                continue
+            for name, size, _ in listing['files']:
+                path = os.path.join(self.remote_dir, name)
+                if OUTPUT.match(os.path.basename(name)) and size > self.offsets.get((label, path), 0):
+                    requests.append((label, a, path))
+        results = agent.call_each([(a, 'tail', {'path': path, 'offset': self.offsets.get((label, path), 0)})
+                                   for label, a, path in requests])
+        for (label, a, path), result in zip(requests, results):
+            if isinstance(result, agent.AgentError):
+                continue
+            self.series.feed((label, path), result['data'])
+            self.offsets[(label, path)] = result['offset']
+        if self.reached is not None:
+            return
+        skip = int(self.config['ramp'] / self.config['interval'])
+        values = self.series.values()[skip:]
+        self.result = check(values, self.config)
+        if self.result and self.result['steady']:
+            self.reached = (skip + len(values) + 1) * self.config['interval']
+
+    def stop(self):
+        self.stopping.set()
+        if self.is_alive():
+            self.join()
+        try:
+            self.poll()
+        except Exception as e:
+            logger.warning('steady state polling failed: %s' % e)
+        for a in self.own_agents.values():
+            a.close()
+        if self.reached is None:
+            logger.info('Steady state not reached: %s', self.result)
+        common.mkdir_p(self.local_dir)
+        with open(os.path.join(self.local_dir, 'steady_state.json'), 'w') as fd:
+            json.dump({'steady_state': self.reached is not None, 'reached_after': self.reached,
+                       'terminated': self.terminated,
+                       'criteria': self.config, 'window': self.result,
+                       self.config['metric']: self.series.values()}, fd, indent=4)
+
+
+@contextlib.contextmanager
+def watch(config, remote_dir, local_dir, nodes=None, stop_command='sudo killall -2 fio'):
+    """
+    Runs a SteadyState for the duration of the block when the benchmark has
+    a steady_state section
+    """
+    if not config:
+        yield None
+        return
+    controller = SteadyState(config, remote_dir, local_dir, nodes, stop_command)
+    controller.start()
+    try:
+        yield controller
+    finally:
+        controller.stop()
@@ -1,7 +1,10 @@
 import copy
 import itertools
+import logging
 
 import settings
+from benchmark.benchmark import config_id
+from benchmark.lis import Lispy, Env, OPERATORS
 from benchmark.radosbench import Radosbench
 from benchmark.fio import Fio
 from benchmark.hsbench import Hsbench
@@ -14,29 +17,88 @@ from benchmark.cosbench import Cosbench
 from benchmark.cephtestrados import CephTestRados
 from benchmark.getput import Getput
 
+logger = logging.getLogger("cbt")
+
+# settings of a benchmark that apply to the sweep as a whole rather than to
+# one of its configs, left out of the permutations and of the config id
+SWEEP_SETTINGS = ('constraints', 'exclude')
+
+
+class Sweep(object):
+    """
+    The benchmarks of an iteration, built as they are iterated over. Every
+    iteration over the sweep builds them afresh, only the ids of the
+    configs already seen in it are kept.
+    """
+    def __init__(self, archive, cluster, iteration):
+        self.archive = archive
+        self.cluster = cluster
+        self.iteration = iteration
+
+    def __iter__(self):
+        return _generate(self.archive, self.cluster, self.iteration)
+
+
 def get_all(archive, cluster, iteration):
+    return Sweep(archive, cluster, iteration)
+
+
+def _generate(archive, cluster, iteration):
+    seen = set()
     for benchmark, config in sorted(settings.benchmarks.items()):
         default = {"benchmark": benchmark,
                    "iteration": iteration}
         for current in all_configs(config):
             current.update(default)
+            # repeated values in the lists make the same config twice
+            digest = config_id(current)
+            if digest in seen:
+                logger.debug('Skipping %s config %s, already in the sweep', benchmark, digest)
+                continue
+            seen.add(digest)
             yield get_object(archive, cluster, benchmark, current)
 
 
+def _accepted(current, constraints, exclude):
+    """
+    Whether a config satisfies every constraint and matches none of the
+    exclusions of its sweep
+    """
+    for exclusion in exclude:
+        if all(current.get(param) == value for param, value in exclusion.items()):
+            return False
+    if constraints:
+        env = Env(Env(None, **OPERATORS), **current)
+        return all(Lispy().eval(constraint, env) for constraint in constraints)
+    return True
+
+
 def all_configs(config):
     """
     return all parameter combinations for config
     config: dict - list of params
-    iterate over all top-level lists in config
+    iterate over all top-level lists in config, lazily, leaving out the
+    combinations that fail one of the constraints, s-expressions such as
+    '(<= (* iodepth numjobs) 32)', or match all the settings of one of the
+    exclude dicts
     """
     cycle_over_lists = []
     cycle_over_names = []
     default = {}
 
+    constraints = config.get('constraints', [])
+    if isinstance(constraints, str):
+        constraints = [constraints]
+    constraints = [Lispy().parse(constraint) for constraint in constraints]
+    exclude = config.get('exclude', [])
+    if isinstance(exclude, dict):
+        exclude = [exclude]
     for param, value in list(config.items()):
         # acceptable applies to benchmark as a whole, no need to it to
         # the set for permutation
-        if param == 'acceptable':
+        if param in SWEEP_SETTINGS:
+            continue
+        elif param == 'acceptable':
             default[param] = value
         elif isinstance(value, list):
             cycle_over_lists.append(value)
@@ -45,6 +107,11 @@ def all_configs(config):
             default[param] = value
 
     for permutation in itertools.product(*cycle_over_lists):
+        current = dict(default)
+        current.update(list(zip(cycle_over_names, permutation)))
+        # only the configs that are kept pay for the copy
+        if not _accepted(current, constraints, exclude):
+            continue
         current = copy.deepcopy(default)
         current.update(list(zip(cycle_over_names, permutation)))
         yield current
@@ -2,9 +2,11 @@
 import argparse
 import collections
 import logging
+import os
 import pprint
 import sys
 
+import common
 import settings
 import benchmarkfactory
 from cluster.ceph import Ceph
@@ -47,6 +49,12 @@ def main(argv):
     logger.debug("Settings.cluster:\n    %s",
                  pprint.pformat(settings.cluster).replace("\n", "\n    "))
 
+    if settings.common.get('trace', True):
+        common.start_trace(os.path.join(settings.cluster.get('archive_dir'), 'results', 'remote_calls.jsonl'))
+
+    if settings.common.get('agent', False):
+        common.start_agents(settings.getnodes('head', 'clients', 'osds', 'mons', 'rgws', 'mdss', 'mgrs'))
+
     global_init = collections.OrderedDict()
     rebuild_every_test = settings.cluster.get('rebuild_every_test', False)
     archive_dir = settings.cluster.get('archive_dir')
@@ -55,21 +63,28 @@ def main(argv):
     # FIXME: Create ClusterFactory and parametrically match benchmarks and clusters.
     cluster = Ceph(settings.cluster)
 
+    # The benchmarks of every iteration, built as they are used, for the
+    # prefill and again for the runs
+    sweeps = [benchmarkfactory.get_all(archive_dir, cluster, iteration)
+              for iteration in range(settings.cluster.get("iterations", 0))]
+
     # Only initialize and prefill upfront if we aren't rebuilding for each test.
     if not rebuild_every_test:
         if not cluster.use_existing:
             cluster.initialize();
         # Why does it need to iterate for the creation of benchmarks?
-        for iteration in range(settings.cluster.get("iterations", 0)):
-            benchmarks = benchmarkfactory.get_all(archive_dir, cluster, iteration)
+        for benchmarks in sweeps:
             for b in benchmarks:
                 if b.exists():
                     continue
                 if b.getclass() not in global_init:
-                    b.initialize()
-                    b.initialize_endpoints()
-                    b.prefill()
-                    b.cleanup()
+                    with common.trace_phase('%s.initialize' % b.getclass()):
+                        b.initialize()
+                        b.initialize_endpoints()
+                    with common.trace_phase('%s.prefill' % b.getclass()):
+                        b.prefill()
+                    with common.trace_phase('%s.cleanup' % b.getclass()):
+                        b.cleanup()
                 # Only initialize once per class.
                 global_init[b.getclass()] = b
 
@@ -77,22 +92,27 @@ def main(argv):
     # Run the benchmarks
     return_code = 0
     try:
-        for iteration in range(settings.cluster.get("iterations", 0)):
-            benchmarks = benchmarkfactory.get_all(archive_dir, cluster, iteration)
+        for iteration, benchmarks in enumerate(sweeps):
             for b in benchmarks:
                 if not b.exists() and not settings.cluster.get('is_teuthology', False):
                     continue
 
                 if rebuild_every_test:
                     cluster.initialize()
-                    b.initialize()
+                    with common.trace_phase('%s.initialize' % b.getclass()):
+                        b.initialize()
                 # Always try to initialize endpoints before running the test
-                b.initialize_endpoints()
+                with common.trace_phase('%s.initialize_endpoints' % b.getclass()):
+                    b.initialize_endpoints()
                 logger.info(f"Running benchmark %s == iteration %d ==" % (b, iteration))
-                b.run()
+                with common.trace_phase('%s.run' % b.getclass()):
+                    b.run()
     except:
         return_code = 1  # FAIL
         logger.exception("During tests")
+    finally:
+        common.stop_agents()
+        common.stop_trace()
 
     return return_code
 
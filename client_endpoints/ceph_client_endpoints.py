@@ -65,9 +65,10 @@ class CephClientEndpoints(ClientEndpoints):
         common.pdsh(settings.getnodes('head'), fs_new_cmd, continue_if_error=False).communicate()
 
     def mount_fs(self):
+        nodes = common.get_fqdn_list('clients')
         for ep_num in range(0, self.endpoints_per_client):
             dir_name = self.get_dir_name(ep_num)
-            for node in common.get_fqdn_list('clients'):
+            for node in nodes:
                 common.pdsh(node, 'sudo mkdir -p -m0755 -- %s' % dir_name, continue_if_error=False).communicate()
                 # FIXME: Apparently something is racey because we can get:
                 # "mount error 2 = No such file or directory" without the pause.
@@ -82,42 +83,39 @@ class CephClientEndpoints(ClientEndpoints):
 
     def create_rbd(self):
         self.pool = self.name
-        dp_option = ''
+        data_pool = None
 
         self.cluster.rmpool(self.pool, self.pool_profile)
         self.cluster.mkpool(self.pool, self.pool_profile, 'rbd')
         if self.data_pool_profile:
             self.data_pool = '%s-data' % self.name
-            dp_option = '--data-pool %s' % self.data_pool
+            data_pool = self.data_pool
             self.cluster.rmpool(self.data_pool, self.data_pool_profile)
             self.cluster.mkpool(self.data_pool, self.data_pool_profile, 'rbd')
 
+        # Make the RBD Images, the disabled features are left out at creation
+        images = []
         for node in common.get_fqdn_list('clients'):
             for ep_num in range(0, self.endpoints_per_client):
-                rbd_name = self.get_rbd_name(node, ep_num)
-
-                # Make the RBD Image
-                cmd = '%s -c %s create %s --pool %s --size %s %s --order %s' % (self.rbd_cmd, self.tmp_conf, rbd_name, self.pool, self.endpoint_size, dp_option, self.order)
-                common.pdsh(settings.getnodes('head'), cmd, continue_if_error=False).communicate()
-
-                # Disable Features
-                if self.disabled_features:
-                    cmd = 'sudo %s feature disable %s/%s %s' % (self.rbd_cmd, self.pool, rbd_name, self.disabled_features)
-                    common.pdsh(settings.getnodes('head'), cmd, continue_if_error=False).communicate()
+                images.append((self.get_rbd_name(node, ep_num), self.endpoint_size, self.pool, data_pool, self.order))
+        self.cluster.mkimages(images, self.disabled_features)
 
     def create_rbd_recovery(self):
         self.pool = '%s-recov' % self.name
         self.cluster.rmpool(self.pool, self.recov_pool_profile)
         self.cluster.mkpool(self.pool, self.recov_pool_profile, 'rbd')
+        images = []
         for node in common.get_fqdn_list('clients'):
             for ep_num in range(0, self.endpoints_per_client):
                 rbd_name = '%s-%s' % (self.pool, self.get_rbd_name(node, ep_num))
-                self.cluster.mkimage(rbd_name, self.endpoint_size, self.pool, self.data_pool, self.order)
+                images.append((rbd_name, self.endpoint_size, self.pool, self.data_pool, self.order))
+        self.cluster.mkimages(images)
 
     def mount_rbd(self):
+        nodes = common.get_fqdn_list('clients')
         for ep_num in range(0, self.endpoints_per_client):
             dir_name = self.get_dir_name(ep_num)
-            for node in common.get_fqdn_list('clients'):
+            for node in nodes:
                 rbd_name = self.get_rbd_name(node, ep_num)
                 rbd_device = self.map_rbd(node, rbd_name)
 
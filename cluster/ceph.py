@@ -1,4 +1,7 @@
+import asyncio
 import common
+import configparser
+import hashlib
 import settings
 import monitoring
 import os
@@ -7,8 +10,14 @@ import uuid
 import threading
 import logging
 import json
+import queue
 
+from . import config_snapshot
 from .cluster import Cluster
+from .health import HealthWatcher, pending_autoscale, unscrubbed_pgs
+from .pools import PoolSpec, spec_tags
+from .prefill import Prefill
+from .recovery import RecoveryRecorder, summary
 
 
 logger = logging.getLogger("cbt")
@@ -23,77 +32,212 @@ def sshtarget(user, host):
 # to bring an OSD up, this sequence of steps must be performed in this order
 # but there are no cross-OSD dependencies so we can bring up multiple OSDs
 # in parallel.
+OSD_STAGES = ['prepare', 'auth', 'crush', 'mkfs', 'start', 'up_in']
+
+# cluster settings that do not change how the cluster is built, left out of
+# its fingerprint
+FINGERPRINT_IGNORED = ['archive_dir', 'iterations', 'rebuild_every_test', 'reuse_cluster', 'is_teuthology',
+                       'pool_profiles', 'recovery_test', 'idle_duration']
+
+# pools the cluster makes for itself, kept by a reset
+SYSTEM_POOLS = ['.mgr', 'device_health_metrics']
+
+# the features rbd enables by default, and the one each of them needs
+RBD_DEFAULT_FEATURES = ['layering', 'exclusive-lock', 'object-map', 'fast-diff', 'deep-flatten']
+RBD_FEATURE_DEPENDS = {'object-map': 'exclusive-lock', 'fast-diff': 'object-map', 'journaling': 'exclusive-lock'}
+# the rbd features by bit, for rbd_default_features given as a mask
+RBD_FEATURE_BITS = ['layering', 'striping', 'exclusive-lock', 'object-map', 'fast-diff', 'deep-flatten',
+                    'journaling', 'data-pool', 'operations', 'migrating', 'non-primary']
+
+
+def rbd_features(disabled_features, default_features=None):
+    """
+    The default rbd features (RBD_DEFAULT_FEATURES unless given, as names or
+    a mask like rbd_default_features) without the disabled ones (comma or
+    space separated) and those needing them
+    """
+    if default_features is None:
+        defaults = RBD_DEFAULT_FEATURES
+    elif str(default_features).strip().isdigit():
+        mask = int(default_features)
+        defaults = [feature for bit, feature in enumerate(RBD_FEATURE_BITS) if mask & (1 << bit)]
+    else:
+        defaults = str(default_features).replace(',', ' ').split()
+    disabled = set(disabled_features.replace(',', ' ').split())
+    features = []
+    for feature in defaults:
+        depends = RBD_FEATURE_DEPENDS.get(feature)
+        if feature not in disabled and (depends is None or depends in features):
+            features.append(feature)
+    return features
+
+
+def conf_option(conf_file, name, sections=('client', 'global')):
+    """ The value of an option in a ceph.conf, from the first of the sections that sets it, or None """
+    parser = configparser.ConfigParser(strict=False, interpolation=None, inline_comment_prefixes=(';', '#'))
+    try:
+        parser.read(conf_file)
+    except configparser.Error as e:
+        logger.warning('Cannot read %s: %s', conf_file, e)
+        return None
+    for section in sections:
+        if not parser.has_section(section):
+            continue
+        # ceph takes spaces, dashes and underscores alike in option names
+        for key, value in parser.items(section):
+            if key.replace(' ', '_').replace('-', '_') == name:
+                return value
+    return None
+
+
+class OsdSpec(object):
+    """ One OSD to provision and the time spent in each of its stages """
+    def __init__(self, osdnum, host, devnumstr, osduuid, osddir, crimson_cpuset):
+        self.osdnum = osdnum
+        self.host = host
+        self.devnumstr = devnumstr
+        self.osduuid = osduuid
+        self.osddir = osddir
+        self.crimson_cpuset = crimson_cpuset
+        self.timings = {}
+        self.started = None
+
+    def __str__(self):
+        return 'osd.%d %s %s' % (self.osdnum, self.host, self.osduuid)
+
+
+class RateLimiter(object):
+    """ Spaces events out by at least 1/rate seconds, whatever the thread """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.next_time)
+            self.next_time = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
 
 
 class OsdThread(threading.Thread):
-    def __init__(self, cl_obj, devnumstr, osdnum, clusterid, host, osduuid, osddir, tmp_dir, crimson_cpuset):
-        threading.Thread.__init__(self, name='OsdThread-%d' % osdnum)
-        self.start_time = time.time()
-        self.response_time = -1.0
+    """ mkfs and start of one OSD, holding one of the parallel create slots """
+    def __init__(self, cl_obj, osd, slots, limiter):
+        threading.Thread.__init__(self, name='OsdThread-%d' % osd.osdnum)
+        self.phases = list(common.trace_phases())
+        self.cl_obj = cl_obj
+        self.osd = osd
+        self.slots = slots
+        self.limiter = limiter
+        self.exc = None
+
+    def run(self):
+        common.inherit_phases(self.phases)
+        try:
+            with self.slots:
+                self.mkfs_and_start()
+        except Exception as e:
+            self.exc = e
+
+    def mkfs_and_start(self):
+        osd = self.osd
+        ceph_conf = self.cl_obj.tmp_conf
+        ceph_osd_cmd = self.cl_obj.ceph_osd_cmd
+        # if crimson is being used, optionally set a per-osd cpuset
+        if osd.crimson_cpuset:
+            ceph_osd_cmd = "%s --cpuset %s" % (ceph_osd_cmd, osd.crimson_cpuset)
+        phost = sshtarget(settings.cluster.get('user'), osd.host)
+
+        start = time.time()
+        cmd = 'ulimit -n 16384 && ulimit -c unlimited && exec %s -c %s -i %d --mkfs --osd-uuid %s' % (ceph_osd_cmd, ceph_conf, osd.osdnum, osd.osduuid)
+        common.pdsh(phost, 'sudo sh -c "%s"' % cmd).communicate()
+        osd.timings['mkfs'] = time.time() - start
+
+        # Start the OSD, no faster than osd_online_rate across the cluster
+        self.limiter.wait()
+        start = time.time()
+        common.pdsh(phost, self.cl_obj.osd_start_command(osd)).communicate()
+        osd.started = time.time()
+        osd.timings['start'] = osd.started - start
+
+
+class OsdHostThread(threading.Thread):
+    """
+    Provisions the OSDs of one host: the keyring directories, the auth keys
+    and the crush entries of all of them take one round trip each, then the
+    OSDs are made and started in parallel. Every batched stage is accounted
+    to all the OSDs of the batch.
+    """
+    def __init__(self, cl_obj, host, osds, slots, limiter, done):
+        threading.Thread.__init__(self, name='OsdHostThread-%s' % host)
+        self.phases = list(common.trace_phases())
         self.cl_obj = cl_obj
-        self.devnumstr = devnumstr
-        self.osdnum = osdnum
-        self.clusterid = clusterid
         self.host = host
-        self.osduuid = osduuid
-        self.osddir = osddir
-        self.tmp_dir = tmp_dir
-        self.crimson_cpuset = crimson_cpuset;
+        self.osds = osds
+        self.slots = slots
+        self.limiter = limiter
+        self.done = done
+        self.start_time = time.time()
+        self.response_time = -1.0
         self.exc = None
 
+    def batch_stage(self, stage, make_command):
+        start = time.time()
+        with common.Batch(sshtarget(settings.cluster.get('user'), self.host)) as batch:
+            for osd in self.osds:
+                batch.add(make_command(osd))
+        for osd in self.osds:
+            osd.timings[stage] = time.time() - start
+
     def run(self):
+        common.inherit_phases(self.phases)
         try:
+            ceph_cmd = self.cl_obj.ceph_cmd
             ceph_conf = self.cl_obj.tmp_conf
-            ceph_osd_cmd = self.cl_obj.ceph_osd_cmd
-            # if crimson is being used, optionally set a per-osd cpuset
-            if self.crimson_cpuset:
-                ceph_osd_cmd = "%s --cpuset %s" % (ceph_osd_cmd, self.crimson_cpuset)
-            phost = sshtarget(settings.cluster.get('user'), self.host)
-
-            # Setup the keyring directory
-            data_dir = '%s/osd.%s' % (self.tmp_dir, self.osdnum)
-            common.pdsh(phost, 'sudo rm -rf %s' % data_dir).communicate()
-            common.pdsh(phost, 'mkdir -p %s' % data_dir).communicate()
-            key_fn = '%s/keyring' % data_dir
-
-            # Setup crush and the keyring
-            common.pdsh(phost, 'sudo %s auth get-or-create osd.%s mon \'allow rwx\' osd \'allow *\' -o %s' % (self.cl_obj.ceph_cmd, self.osdnum, key_fn)).communicate()
-
-            common.pdsh(phost, 'sudo %s -c %s osd crush add osd.%d 1.0 host=%s rack=localrack root=default' % (self.cl_obj.ceph_cmd, ceph_conf, self.osdnum, self.host)).communicate()
-            cmd = 'ulimit -n 16384 && ulimit -c unlimited && exec %s -c %s -i %d --mkfs --osd-uuid %s' % (ceph_osd_cmd, ceph_conf, self.osdnum, self.osduuid)
-            common.pdsh(phost, 'sudo sh -c "%s"' % cmd).communicate()
-
-            # Start the OSD
-            pidfile = "%s/ceph-osd.%d.pid" % (self.cl_obj.pid_dir, self.osdnum)
-            cmd = '%s -c %s -i %d --pid-file=%s' % (ceph_osd_cmd, ceph_conf, self.osdnum, pidfile)
-            if self.cl_obj.osd_valgrind:
-                cmd = common.setup_valgrind(self.cl_obj.osd_valgrind, 'osd.%d' % self.osdnum, self.cl_obj.tmp_dir) + ' ' + cmd
-            else:
-                cmd = '%s %s' % (self.cl_obj.ceph_run_cmd, cmd)
-            stdout_file = "%s/osd.%d.stdout" % (self.cl_obj.tmp_dir, self.osdnum)
-            stderr_file = "%s/osd.%d.stderr" % (self.cl_obj.tmp_dir, self.osdnum)
-            common.pdsh(phost, 'sudo sh -c "ulimit -n 16384 && ulimit -c unlimited && exec %s > %s 2> %s < /dev/null &"' % (cmd, stdout_file, stderr_file)).communicate()
+            tmp_dir = self.cl_obj.tmp_dir
+
+            # Setup the keyring directories, crush and the keyrings
+            self.batch_stage('prepare', lambda osd: 'sudo rm -rf %s/osd.%d; mkdir -p %s/osd.%d' % (tmp_dir, osd.osdnum, tmp_dir, osd.osdnum))
+            self.batch_stage('auth', lambda osd: 'sudo %s auth get-or-create osd.%s mon \'allow rwx\' osd \'allow *\' -o %s/osd.%d/keyring' % (ceph_cmd, osd.osdnum, tmp_dir, osd.osdnum))
+            self.batch_stage('crush', lambda osd: 'sudo %s -c %s osd crush add osd.%d 1.0 host=%s rack=localrack root=default' % (ceph_cmd, ceph_conf, osd.osdnum, self.host))
 
+            threads = [OsdThread(self.cl_obj, osd, self.slots, self.limiter) for osd in self.osds]
+            for thrd in threads:
+                thrd.start()
+            for thrd in threads:
+                thrd.join()
+            failed = [thrd for thrd in threads if thrd.exc is not None]
+            if failed:
+                self.exc = failed[0].exc
         except Exception as e:
             self.exc = e
         finally:
             self.response_time = time.time() - self.start_time
+            self.done.put(self)
 
     def __str__(self):
-        return 'osd thrd %d %s %s' % (self.osdnum, self.host, self.osduuid)
+        return 'osd host thrd %s: %s' % (self.host, ', '.join('osd.%d' % osd.osdnum for osd in self.osds))
 
-    # this is intended to be called by parent thread after join()
+    # this is intended to be called by parent thread once the thread is done
     def postprocess(self):
         if not (self.exc is None):
             logger.error('thread %s: %s' % (self.name, str(self.exc)))
-            raise Exception('OSD %s creation did not complete' % self.osdnum)
-        logger.info('thread %s completed creation of OSD %d elapsed time %f' % (self.name, self.osdnum, self.response_time))
+            raise Exception('OSD creation on %s did not complete' % self.host)
+        logger.info('thread %s completed creation of %d OSDs elapsed time %f' % (self.name, len(self.osds), self.response_time))
 
 
 class Ceph(Cluster):
     def _set_default_attributes(self, config):
         """ Factorised method to reuse for mock init and unit tests"""
+        # not slept on anymore, the health checks only accept a status polled
+        # after they start: the recovery tests give the cluster up to
+        # maxhealthtries waits this long to react to OSDs going out or in
         self.health_wait = config.get('health_wait', 5)
+        self.health_poll_interval = config.get('health_poll_interval', 0.5)
+        self.health_poll_max_interval = config.get('health_poll_max_interval', 5)
+        self.health_watcher = None
         self.ceph_osd_cmd = config.get('ceph-osd_cmd', '/usr/bin/ceph-osd')
         self.ceph_mon_cmd = config.get('ceph-mon_cmd', '/usr/bin/ceph-mon')
         self.ceph_run_cmd = config.get('ceph-run_cmd', '/usr/bin/ceph-run')
@@ -123,6 +267,17 @@ class Ceph(Cluster):
         self.ceph_osd_online_tmo = config.get('osd_online_timeout', 120)
         self.ceph_osd_parallel_creates = config.get('osd_parallel_creates')
         self.disable_bal = config.get('disable_balancer', False)
+        self.reuse_cluster = config.get('reuse_cluster', False)
+        self.cluster_state_fn = '%s/cluster_state.json' % self.tmp_dir
+        self.osds = []
+        # these parameters control the pool prefills
+        self.prefill_nodes = config.get('prefill_nodes', 'clients')
+        self.prefill_procs = config.get('prefill_procs_per_node', 1)
+        self.prefill_concurrent_ios = config.get('prefill_concurrent_ios', 16)
+        self.prefill_progress_interval = config.get('prefill_progress_interval', 10)
+        # these parameters control the parallel rbd image creation
+        self.image_create_nodes = config.get('image_create_nodes', ['head'])
+        self.image_create_parallel = config.get('image_create_parallel', 8)
 
         self.client_keyring = '/etc/ceph/ceph.keyring'
         self.client_secret = '/etc/ceph/ceph.secret'
@@ -150,6 +305,7 @@ class Ceph(Cluster):
         self.prefill_recov_objects = 0
         self.prefill_recov_object_size = 0
         self.prefill_recov_time = 0
+        self.prefill_recov_bytes = 0
         self.recov_pool_name = ''
 
     def __init__(self, config, _init_threads=True):
@@ -165,6 +321,7 @@ class Ceph(Cluster):
         """Only used by serialise_benchmark.py -- do not call in production code"""
         return cls(config, _init_threads=False )
 
+    @common.trace_phase('Ceph.initialize')
     def initialize(self):
         # Reset the rulesets
         self.ruleset_map = {}
@@ -176,6 +333,11 @@ class Ceph(Cluster):
 
         super(Ceph, self).initialize()
 
+        # a cluster built from the same definition only needs a reset
+        if self.reuse_cluster and self.reset():
+            return True
+        common.pdsh(settings.getnodes('head'), 'rm -f %s' % self.cluster_state_fn).communicate()
+
         # unmount any rbd volumes
         self.unmount_all()
 
@@ -185,11 +347,10 @@ class Ceph(Cluster):
         # Cleanup old junk and create new junk
         self.cleanup()
         common.mkdir_p(self.tmp_dir)
-        common.pdsh(settings.getnodes('head', 'clients', 'mons', 'osds', 'rgws', 'mdss', 'mgrs'), 'mkdir -p -m0755 -- %s' % self.tmp_dir).communicate()
-        common.pdsh(settings.getnodes('clients', 'mons', 'osds', 'rgws', 'mdss', 'mgrs'), 'mkdir -p -m0755 -- %s' % self.pid_dir).communicate()
-        common.pdsh(settings.getnodes('clients', 'mons', 'osds', 'rgws', 'mdss', 'mgrs'), 'mkdir -p -m0755 -- %s' % self.log_dir).communicate()
-        common.pdsh(settings.getnodes('clients', 'mons', 'osds', 'rgws', 'mdss', 'mgrs'), 'mkdir -p -m0755 -- %s' % self.monitoring_dir).communicate()
-        common.pdsh(settings.getnodes('clients', 'mons', 'osds', 'rgws', 'mdss', 'mgrs'), 'mkdir -p -m0755 -- %s' % self.core_dir).communicate()
+        common.remote_mkdir(settings.getnodes('head', 'clients', 'mons', 'osds', 'rgws', 'mdss', 'mgrs'), self.tmp_dir, continue_if_error=True)
+        with common.Batch(settings.getnodes('clients', 'mons', 'osds', 'rgws', 'mdss', 'mgrs')) as batch:
+            for remote_dir in [self.pid_dir, self.log_dir, self.monitoring_dir, self.core_dir]:
+                batch.add('mkdir -p -m0755 -- %s' % remote_dir)
         self.distribute_conf()
 
         # Set the core directory
@@ -231,23 +392,129 @@ class Ceph(Cluster):
             time.sleep(self.idle_duration)
             monitoring.stop()
 
+        self.save_cluster_state()
         return True
 
+    def fingerprint(self):
+        """ Digest of what the cluster is built from: the cluster settings and the ceph.conf file """
+        definition = dict((key, value) for key, value in self.config.items() if key not in FINGERPRINT_IGNORED)
+        conf_file = self.config.get('conf_file')
+        if conf_file and os.path.exists(conf_file):
+            with open(conf_file, 'rb') as f:
+                definition['conf_file_sha1'] = hashlib.sha1(f.read()).hexdigest()
+        return hashlib.sha1(json.dumps(definition, sort_keys=True, default=str).encode()).hexdigest()
+
+    def save_cluster_state(self):
+        """ Leaves the fingerprint and the OSD layout of the cluster just built on the head """
+        state = {'fingerprint': self.fingerprint(),
+                 'osds': [[osd.osdnum, osd.host, osd.devnumstr] for osd in self.osds]}
+        common.remote_append(settings.getnodes('head'), self.cluster_state_fn, json.dumps(state))
+
+    def read_cluster_state(self):
+        """ The state saved by the last initialize(), None unless the cluster answers too """
+        with common.Batch(settings.getnodes('head')) as batch:
+            batch.add('cat %s' % self.cluster_state_fn)
+            batch.add('timeout 30 %s -c %s health' % (self.ceph_cmd, self.tmp_conf))
+        for (rc, output), (health_rc, _) in zip(batch.results[0].values(), batch.results[1].values()):
+            if rc == 0 and health_rc == 0 and output.strip():
+                try:
+                    return json.loads(output.strip().splitlines()[-1])
+                except ValueError:
+                    return None
+        return None
+
+    @common.trace_phase('Ceph.reset')
+    def reset(self):
+        """
+        Brings a running cluster that initialize() built from the same
+        definition back to a clean state instead of rebuilding it: the
+        filesystems and the pools are removed, the OSDs restarted and the
+        caches dropped. Returns False without touching anything when there is
+        no such cluster.
+        """
+        if self.osd_valgrind:
+            return False
+        state = self.read_cluster_state()
+        if state is None or state.get('fingerprint') != self.fingerprint():
+            return False
+        logger.info('The cluster definition did not change, resetting the running cluster instead of rebuilding it.')
+        osds = []
+        for osdnum, host, devnumstr in state['osds']:
+            crimson_cpuset = self.crimson_cpusets[devnumstr] if devnumstr < len(self.crimson_cpusets) else None
+            osds.append(OsdSpec(osdnum, host, devnumstr, None, '%s/osd-device-%s-data' % (self.mnt_dir, devnumstr), crimson_cpuset))
+
+        self.unmount_all()
+        self.remove_filesystems()
+        self.remove_pools()
+        self.restart_osds(osds)
+        with common.Batch(settings.getnodes('clients', 'osds')) as batch:
+            batch.add('sync')
+            batch.add('echo 3 | sudo tee /proc/sys/vm/drop_caches')
+        self.check_health()
+        # the crush rules are still there, only their names need to be known again
+        self.make_profiles()
+        self.osds = osds
+        return True
+
+    def remove_filesystems(self):
+        if not settings.cluster.get('mdss'):
+            return
+        stdout, _ = common.pdsh(settings.getnodes('head'), '%s -c %s fs ls --format=json' % (self.ceph_cmd, self.tmp_conf)).communicate()
+        names = [fs.get('name') for fs in json.loads(stdout[stdout.index('['):])] if '[' in stdout else []
+        with common.Batch(settings.getnodes('head')) as batch:
+            for name in names:
+                batch.add('sudo %s -c %s fs fail %s' % (self.ceph_cmd, self.tmp_conf, name))
+                batch.add('sudo %s -c %s fs rm %s --yes-i-really-mean-it' % (self.ceph_cmd, self.tmp_conf, name))
+
+    def remove_pools(self):
+        """
+        Deletes the pools of the benchmarks, in one round trip, but those made
+        from a profile with reuse set
+        """
+        keep_rgw = bool(settings.cluster.get('rgws'))
+        reused = set(PoolSpec(name, profile, None).digest()
+                     for name, profile in self.config.get('pool_profiles', {}).items() if profile.get('reuse'))
+        pools = []
+        for name, pool in self.pool_details().items():
+            if name in SYSTEM_POOLS or (keep_rgw and 'rgw' in pool.get('application_metadata', {})):
+                continue
+            if reused.intersection(spec_tags(pool)):
+                logger.info('Keeping pool %s, its profile has reuse set.', name)
+                continue
+            pools.append(name)
+        logger.info('Deleting pools %s', ', '.join(pools))
+        with common.Batch(settings.getnodes('head')) as batch:
+            for name in pools:
+                batch.add('sudo %s -c %s osd pool delete %s %s --yes-i-really-really-mean-it' % (self.ceph_cmd, self.tmp_conf, name, name))
+
+    def restart_osds(self, osds):
+        """ Stops every OSD, marks them down and starts them again on all the hosts at once """
+        common.pdsh(settings.getnodes('osds'), 'sudo killall -w ceph-osd').communicate()
+        common.pdsh(settings.getnodes('head'), '%s -c %s osd down %s' % (self.ceph_cmd, self.tmp_conf, ' '.join(str(osd.osdnum) for osd in osds))).communicate()
+        hosts = []
+        for osd in osds:
+            if osd.host not in hosts:
+                hosts.append(osd.host)
+
+        async def start():
+            return await asyncio.gather(*[common.run(sshtarget(settings.cluster.get('user'), host),
+                                                     '; '.join(self.osd_start_command(osd) for osd in osds if osd.host == host))
+                                          for host in hosts])
+        asyncio.run(start())
+        for osd in osds:
+            osd.started = time.time()
+        self.wait_osds_up_in(osds)
+
+    @common.trace_phase('Ceph.shutdown')
     def shutdown(self):
         nodes = settings.getnodes('clients', 'osds', 'mons', 'rgws', 'mdss', 'mgrs')
 
-        common.pdsh(nodes, 'sudo killall -9 massif-amd64-li').communicate()
-        common.pdsh(nodes, 'sudo killall -9 memcheck-amd64-').communicate()
-        common.pdsh(nodes, 'sudo killall -9 ceph-osd').communicate()
-        common.pdsh(nodes, 'sudo killall -9 ceph-mon').communicate()
-        common.pdsh(nodes, 'sudo killall -9 ceph-mds').communicate()
-        common.pdsh(nodes, 'sudo killall -9 ceph-mgr').communicate()
-        common.pdsh(nodes, 'sudo killall -9 rados').communicate()
-        common.pdsh(nodes, 'sudo killall -9 rest-bench').communicate()
-        common.pdsh(nodes, 'sudo killall -9 radosgw').communicate()
-        common.pdsh(nodes, 'sudo killall -9 radosgw-admin').communicate()
-        common.pdsh(nodes, 'sudo /etc/init.d/apache2 stop').communicate()
-        common.pdsh(nodes, 'sudo killall -9 pdsh').communicate()
+        with common.Batch(nodes) as batch:
+            for name in ['massif-amd64-li', 'memcheck-amd64-', 'ceph-osd', 'ceph-mon', 'ceph-mds', 'ceph-mgr',
+                         'rados', 'rest-bench', 'radosgw', 'radosgw-admin']:
+                batch.add('sudo killall -9 %s' % name)
+            batch.add('sudo /etc/init.d/apache2 stop')
+            batch.add('sudo killall -9 pdsh')
         monitoring.stop()
 
     def cleanup(self):
@@ -255,6 +522,7 @@ class Ceph(Cluster):
         logger.info('Deleting %s', self.tmp_dir)
         common.pdsh(nodes, 'sudo rm -rf %s' % self.tmp_dir).communicate()
 
+    @common.trace_phase('Ceph.setup_fs')
     def setup_fs(self):
         use_existing = settings.cluster.get('use_existing', True)
         if use_existing:
@@ -270,18 +538,20 @@ class Ceph(Cluster):
         mkfs_threads = []
         for device in range(0, sc.get('osds_per_node')):
             osds = settings.getnodes('osds')
-            common.pdsh(osds, 'sudo umount /dev/disk/by-partlabel/osd-device-%s-data' % device).communicate()
-            common.pdsh(osds, 'sudo rm -rf %s/osd-device-%s-data' % (self.mnt_dir, device)).communicate()
-            common.pdsh(osds, 'sudo mkdir -p -m0755 -- %s/osd-device-%s-data' % (self.mnt_dir, device)).communicate()
+            with common.Batch(osds) as batch:
+                batch.add('sudo umount /dev/disk/by-partlabel/osd-device-%s-data' % device)
+                batch.add('sudo rm -rf %s/osd-device-%s-data' % (self.mnt_dir, device))
+                batch.add('sudo mkdir -p -m0755 -- %s/osd-device-%s-data' % (self.mnt_dir, device))
 
             if fs == 'tmpfs':
                 logger.info('using tmpfs osds, not creating a file system.')
             elif fs == 'zfs':
                 logger.info('ruhoh, zfs detected.  No mkfs for you!')
-                common.pdsh(osds, 'sudo zpool destroy osd-device-%s-data' % device).communicate()
-                common.pdsh(osds, 'sudo zpool create -f -O xattr=sa -m legacy osd-device-%s-data /dev/disk/by-partlabel/osd-device-%s-data' % (device, device)).communicate()
-                common.pdsh(osds, 'sudo zpool add osd-device-%s-data log /dev/disk/by-partlabel/osd-device-%s-zil' % (device, device)).communicate()
-                common.pdsh(osds, 'sudo mount %s -t zfs osd-device-%s-data %s/osd-device-%s-data' % (mount_opts, device, self.mnt_dir, device)).communicate()
+                with common.Batch(osds) as batch:
+                    batch.add('sudo zpool destroy osd-device-%s-data' % device)
+                    batch.add('sudo zpool create -f -O xattr=sa -m legacy osd-device-%s-data /dev/disk/by-partlabel/osd-device-%s-data' % (device, device))
+                    batch.add('sudo zpool add osd-device-%s-data log /dev/disk/by-partlabel/osd-device-%s-zil' % (device, device))
+                    batch.add('sudo mount %s -t zfs osd-device-%s-data %s/osd-device-%s-data' % (mount_opts, device, self.mnt_dir, device))
             else:
                 # do mkfs and mount in 1 long command
                 # alternative is to wait until make_osds to mount it
@@ -298,14 +568,16 @@ class Ceph(Cluster):
             logger.info('for device %d on all hosts awaiting mkfs and mount' % device)
             t.communicate()
 
+    @common.trace_phase('Ceph.distribute_conf')
     def distribute_conf(self):
         nodes = settings.getnodes('head', 'clients', 'osds', 'mons', 'rgws', 'mgrs')
         conf_file = self.config.get("conf_file")
         logger.info("Distributing %s.", conf_file)
         common.pdsh(nodes, 'mkdir -p -m0755 /etc/ceph').communicate()
         common.pdcp(nodes, '', conf_file, self.tmp_conf).communicate()
-        common.pdsh(nodes, 'sudo mv /etc/ceph/ceph.conf /etc/ceph/ceph.conf.cbt.bak').communicate()
-        common.pdsh(nodes, 'sudo ln -s %s /etc/ceph/ceph.conf' % self.tmp_conf).communicate()
+        with common.Batch(nodes) as batch:
+            batch.add('sudo mv /etc/ceph/ceph.conf /etc/ceph/ceph.conf.cbt.bak')
+            batch.add('sudo ln -s %s /etc/ceph/ceph.conf' % self.tmp_conf)
 
     def get_mon_hosts(self):
         # get the list of mons
@@ -342,21 +614,26 @@ class Ceph(Cluster):
             raise ValueError("Failed to parse monitor syntax: %r" % mon_hosts)
         return mon_hosts
 
+    @common.trace_phase('Ceph.make_mons')
     def make_mons(self):
         # Build and distribute the client keyring
         client_admin_dir = "%s/client.admin" % self.tmp_dir
-        common.pdsh(settings.getnodes('head', 'clients', 'osds', 'mons', 'rgws', 'mgrs'), 'rm -rf %s' % client_admin_dir).communicate()
-        common.pdsh(settings.getnodes('head', 'clients', 'osds', 'mons', 'rgws', 'mgrs'), 'mkdir -p %s' % client_admin_dir).communicate()
+        all_nodes = settings.getnodes('head', 'clients', 'osds', 'mons', 'rgws', 'mgrs')
+        with common.Batch(all_nodes) as batch:
+            batch.add('rm -rf %s' % client_admin_dir)
+            batch.add('mkdir -p %s' % client_admin_dir)
 
         keyring_fn = os.path.join(client_admin_dir, "keyring")
-        common.pdsh(settings.getnodes('head'), '%s --create-keyring --gen-key --name=mon. %s --cap mon \'allow *\'' % (self.ceph_authtool_cmd, keyring_fn)).communicate()
-        common.pdsh(settings.getnodes('head'), '%s --gen-key --name=client.admin --cap mon \'allow *\' --cap osd \'allow *\' --cap mds \'allow *\' --cap mgr \'allow *\' %s' % (self.ceph_authtool_cmd, keyring_fn)).communicate()
+        with common.Batch(settings.getnodes('head')) as batch:
+            batch.add('%s --create-keyring --gen-key --name=mon. %s --cap mon \'allow *\'' % (self.ceph_authtool_cmd, keyring_fn))
+            batch.add('%s --gen-key --name=client.admin --cap mon \'allow *\' --cap osd \'allow *\' --cap mds \'allow *\' --cap mgr \'allow *\' %s' % (self.ceph_authtool_cmd, keyring_fn))
         common.rscp(settings.getnodes('head'), keyring_fn, '%s.tmp' % keyring_fn).communicate()
-        common.pdcp(settings.getnodes('head', 'clients', 'osds', 'mons', 'rgws', 'mgrs'), '', '%s.tmp' % keyring_fn, keyring_fn).communicate()
-        common.pdsh(settings.getnodes('head', 'clients', 'osds', 'mons', 'rgws', 'mgrs'), 'sudo mv %s %s.cbt.bak' % (self.client_keyring, self.client_keyring)).communicate()
-        common.pdsh(settings.getnodes('head', 'clients', 'osds', 'mons', 'rgws', 'mgrs'), 'sudo ln -s %s %s' % (keyring_fn, self.client_keyring)).communicate()
-        common.pdsh(settings.getnodes('head', 'clients', 'osds', 'mons', 'rgws', 'mgrs'), 'sudo mv %s %s.cbt.bak' % (self.client_secret, self.client_secret)).communicate()
-        common.pdsh(settings.getnodes('head', 'clients', 'osds', 'mons', 'rgws', 'mgrs'), 'sudo sh -c \'%s --print-key %s > %s\'' % (self.ceph_authtool_cmd, self.client_keyring, self.client_secret)).communicate()
+        common.pdcp(all_nodes, '', '%s.tmp' % keyring_fn, keyring_fn).communicate()
+        with common.Batch(all_nodes) as batch:
+            batch.add('sudo mv %s %s.cbt.bak' % (self.client_keyring, self.client_keyring))
+            batch.add('sudo ln -s %s %s' % (keyring_fn, self.client_keyring))
+            batch.add('sudo mv %s %s.cbt.bak' % (self.client_secret, self.client_secret))
+            batch.add('sudo sh -c \'%s --print-key %s > %s\'' % (self.ceph_authtool_cmd, self.client_keyring, self.client_secret))
         # Build the monmap, retrieve it, and distribute it
         mons = settings.getnodes('mons').split(',')
         cmd = 'monmaptool --create --clobber'
@@ -375,11 +652,12 @@ class Ceph(Cluster):
         for monhost, mons in monhosts.items():
             if user:
                 monhost = '%s@%s' % (user, monhost)
-            for mon, addr in mons.items():
-                common.pdsh(monhost, 'sudo rm -rf %s/mon.%s' % (self.tmp_dir, mon)).communicate()
-                common.pdsh(monhost, 'mkdir -p %s/mon.%s' % (self.tmp_dir, mon)).communicate()
-                common.pdsh(monhost, 'sudo sh -c "ulimit -c unlimited && exec %s --mkfs -c %s -i %s --monmap=%s --keyring=%s"' % (self.ceph_mon_cmd, self.tmp_conf, mon, self.monmap_fn, keyring_fn)).communicate()
-                common.pdsh(monhost, 'cp %s %s/mon.%s/keyring' % (keyring_fn, self.tmp_dir, mon)).communicate()
+            with common.Batch(monhost) as batch:
+                for mon, addr in mons.items():
+                    batch.add('sudo rm -rf %s/mon.%s' % (self.tmp_dir, mon))
+                    batch.add('mkdir -p %s/mon.%s' % (self.tmp_dir, mon))
+                    batch.add('sudo sh -c "ulimit -c unlimited && exec %s --mkfs -c %s -i %s --monmap=%s --keyring=%s"' % (self.ceph_mon_cmd, self.tmp_conf, mon, self.monmap_fn, keyring_fn))
+                    batch.add('cp %s %s/mon.%s/keyring' % (keyring_fn, self.tmp_dir, mon))
 
         # Start the mons
         for monhost, mons in monhosts.items():
@@ -394,12 +672,10 @@ class Ceph(Cluster):
                     cmd = '%s %s' % (self.ceph_run_cmd, cmd)
                 common.pdsh(monhost, 'sudo %s' % cmd).communicate()
 
+    @common.trace_phase('Ceph.make_osds')
     def make_osds(self):
-        osdnum = 0
         osdhosts = settings.cluster.get('osds')
-        clusterid = self.config.get('clusterid')
         user = settings.cluster.get('user')
-        thread_list = []
 
         # set up degree of OSD creation parallelism
 
@@ -407,47 +683,115 @@ class Ceph(Cluster):
             self.ceph_osd_online_rate,
             self.ceph_osd_online_tmo,
             str(self.ceph_osd_parallel_creates)))
-        osd_online_interval = 1.0 / self.ceph_osd_online_rate
         max_parallel_creates = settings.cluster.get('osds_per_node') * len(osdhosts)
         if self.ceph_osd_parallel_creates:
             max_parallel_creates = int(self.ceph_osd_parallel_creates)
 
-        # build OSDs in parallel, except for "ceph osd create" command
-        # which must be 1 at a time
-
-        threads_finished = 0
+        osds = []
         for host in osdhosts:
             for devnumstr in range(0, settings.cluster.get('osds_per_node')):
-                pdshhost = sshtarget(user, host)
                 crimson_cpuset = self.crimson_cpusets[devnumstr] if devnumstr < len(self.crimson_cpusets) else None
-                # Build the OSD
-                osduuid = str(uuid.uuid4())
 #                osddir='/var/lib/ceph/osd/%s-%d'%(clusterid, osdnum)
                 osddir = '%s/osd-device-%s-data' % (self.mnt_dir, devnumstr)
-                # create the OSD first, so we know what number it has been assigned.
-                common.pdsh(pdshhost, 'sudo %s -c %s osd create %s' % (self.ceph_cmd, self.tmp_conf, osduuid)).communicate()
-                # bring the OSD online in background while continuing to create OSDs in foreground
-                thrd = OsdThread(self, devnumstr, osdnum, clusterid, host, osduuid, osddir, self.tmp_dir, crimson_cpuset)
-                logger.info('starting creation of OSD %d ' % osdnum)
-                thrd.start()
-                thread_list.append(thrd)
-
-                # only allow up to max_parallel_creates threads to be active
-                active_thread_count = len(thread_list) - threads_finished
-                if active_thread_count >= max_parallel_creates:
-                    thrd = thread_list[threads_finished]
-                    thrd.join(self.ceph_osd_online_tmo)
-                    thrd.postprocess()
-                    threads_finished += 1
-                time.sleep(osd_online_interval)  # don't flood Ceph with OSD commands
-                osdnum += 1
-
-        # wait for rest of them to finish
-        for thrd in thread_list[threads_finished:]:
-            # an exception is thrown if the thread failed, hopefully
-            thrd.join(self.ceph_osd_online_tmo)
+                osds.append(OsdSpec(len(osds), host, devnumstr, str(uuid.uuid4()), osddir, crimson_cpuset))
+        self.allocate_osd_ids(osds)
+
+        # one worker per host, OSDs made and started in parallel up to
+        # max_parallel_creates, hosts joined in completion order
+        slots = threading.BoundedSemaphore(max_parallel_creates)
+        limiter = RateLimiter(self.ceph_osd_online_rate)
+        done = queue.Queue()
+        thread_list = []
+        for host in osdhosts:
+            host_osds = [osd for osd in osds if osd.host == host]
+            thrd = OsdHostThread(self, host, host_osds, slots, limiter, done)
+            logger.info('starting creation of OSDs %s on %s' % (', '.join(str(osd.osdnum) for osd in host_osds), host))
+            thrd.start()
+            thread_list.append(thrd)
+        for _ in thread_list:
+            try:
+                thrd = done.get(timeout=self.ceph_osd_online_tmo)
+            except queue.Empty:
+                pending = [str(t) for t in thread_list if t.is_alive()]
+                raise Exception('OSD creation did not complete within %ds: %s' % (self.ceph_osd_online_tmo, '; '.join(pending)))
+            thrd.join()
             thrd.postprocess()
 
+        self.wait_osds_up_in(osds)
+        self.report_osd_timings(osds)
+        self.osds = osds
+
+    def osd_start_command(self, osd):
+        """ The command starting an OSD made by make_osds() in the background on its host """
+        ceph_osd_cmd = self.ceph_osd_cmd
+        # if crimson is being used, optionally set a per-osd cpuset
+        if osd.crimson_cpuset:
+            ceph_osd_cmd = "%s --cpuset %s" % (ceph_osd_cmd, osd.crimson_cpuset)
+        pidfile = "%s/ceph-osd.%d.pid" % (self.pid_dir, osd.osdnum)
+        cmd = '%s -c %s -i %d --pid-file=%s' % (ceph_osd_cmd, self.tmp_conf, osd.osdnum, pidfile)
+        if self.osd_valgrind:
+            cmd = common.setup_valgrind(self.osd_valgrind, 'osd.%d' % osd.osdnum, self.tmp_dir) + ' ' + cmd
+        else:
+            cmd = '%s %s' % (self.ceph_run_cmd, cmd)
+        stdout_file = "%s/osd.%d.stdout" % (self.tmp_dir, osd.osdnum)
+        stderr_file = "%s/osd.%d.stderr" % (self.tmp_dir, osd.osdnum)
+        return 'sudo sh -c "ulimit -n 16384 && ulimit -c unlimited && exec %s > %s 2> %s < /dev/null &"' % (cmd, stdout_file, stderr_file)
+
+    def allocate_osd_ids(self, osds):
+        """
+        Creates all the OSDs in one round trip to the head, "ceph osd create"
+        returning the id assigned to each uuid
+        """
+        with common.Batch(settings.getnodes('head')) as batch:
+            for osd in osds:
+                batch.add('sudo %s -c %s osd create %s' % (self.ceph_cmd, self.tmp_conf, osd.osduuid))
+        for osd, result in zip(osds, batch.results):
+            for host, (rc, output) in result.items():
+                # the id is the last line, stderr warnings can come first
+                lines = output.strip().splitlines()
+                if rc != 0 or not lines or not lines[-1].strip().isdigit():
+                    raise Exception('%s: "osd create %s" gave no osd id, rc=%s:\n%s' % (host, osd.osduuid, rc, output))
+                osd.osdnum = int(lines[-1].strip())
+
+    def wait_osds_up_in(self, osds):
+        """ Waits until the osdmap shows every OSD up and in, or osd_online_timeout """
+        pending = dict((osd.osdnum, osd) for osd in osds)
+        deadline = time.time() + self.ceph_osd_online_tmo
+        while pending:
+            stdout, _ = common.pdsh(settings.getnodes('head'), '%s -c %s osd dump --format=json' % (self.ceph_cmd, self.tmp_conf)).communicate()
+            now = time.time()
+            try:
+                osdmap = json.loads(stdout[stdout.index('{'):])
+            except ValueError:
+                logger.warning('Cannot read the osdmap, not waiting for the OSDs to be up and in')
+                return
+            for entry in osdmap.get('osds', []):
+                osd = pending.get(entry.get('osd'))
+                if osd is not None and entry.get('up') and entry.get('in'):
+                    osd.timings['up_in'] = now - (osd.started or now)
+                    del pending[osd.osdnum]
+            if pending and now >= deadline:
+                logger.warning('OSDs not up and in after %ds: %s' % (self.ceph_osd_online_tmo, ', '.join('osd.%d' % n for n in sorted(pending))))
+                return
+            if pending:
+                time.sleep(1)
+
+    def report_osd_timings(self, osds):
+        """ Logs the slowest OSD of every stage and keeps the breakdown in the archive """
+        for stage in OSD_STAGES:
+            timed = [osd for osd in osds if stage in osd.timings]
+            if not timed:
+                continue
+            slowest = max(timed, key=lambda osd: osd.timings[stage])
+            logger.info('OSD %-7s avg %7.2fs max %7.2fs (osd.%d on %s)' % (
+                stage, sum(osd.timings[stage] for osd in timed) / len(timed),
+                slowest.timings[stage], slowest.osdnum, slowest.host))
+        results_dir = os.path.join(settings.cluster.get('archive_dir'), 'results')
+        common.mkdir_p(results_dir)
+        with open(os.path.join(results_dir, 'osd_timings.json'), 'w') as fd:
+            json.dump([dict(osd=osd.osdnum, host=osd.host, **osd.timings) for osd in osds], fd, indent=1)
+
+    @common.trace_phase('Ceph.start_mgrs')
     def start_mgrs(self):
         user = settings.cluster.get('user')
         mgrhosts = settings.cluster.get('mgrs')
@@ -464,10 +808,12 @@ class Ceph(Cluster):
                     cmd = "%s %s" % (self.ceph_run_cmd, cmd)
                 pdshhost = sshtarget(user, mgrhost)
                 data_dir = "%s/mgr.%s" % (self.tmp_dir, mgrname)
-                common.pdsh(pdshhost, 'sudo mkdir -p %s' % data_dir).communicate()
-                common.pdsh(pdshhost, 'sudo %s auth get-or-create mgr.%s mon \'allow profile mgr\' mds \'allow *\' osd \'allow *\' -o %s/keyring' % (self.ceph_cmd, mgrname, data_dir)).communicate()
-                common.pdsh(pdshhost, 'sudo sh -c "ulimit -n 16384 && ulimit -c unlimited && exec %s"' % cmd).communicate()
+                with common.Batch(pdshhost) as batch:
+                    batch.add('sudo mkdir -p %s' % data_dir)
+                    batch.add('sudo %s auth get-or-create mgr.%s mon \'allow profile mgr\' mds \'allow *\' osd \'allow *\' -o %s/keyring' % (self.ceph_cmd, mgrname, data_dir))
+                    batch.add('sudo sh -c "ulimit -n 16384 && ulimit -c unlimited && exec %s"' % cmd)
 
+    @common.trace_phase('Ceph.start_mds')
     def start_mds(self):
         user = settings.cluster.get('user')
         mdshosts = settings.cluster.get('mdss')
@@ -484,10 +830,12 @@ class Ceph(Cluster):
                     cmd = "%s %s" % (self.ceph_run_cmd, cmd)
                 pdshhost = sshtarget(user, mdshost)
                 data_dir = "%s/mds.%s" % (self.tmp_dir, mdsname)
-                common.pdsh(pdshhost, 'sudo mkdir -p %s' % data_dir).communicate()
-                common.pdsh(pdshhost, 'sudo %s auth get-or-create mds.%s mon \'allow profile mds\' osd \'allow rw tag cephfs *=*\' mds \'allow\' mgr \'allow profile mds\' -o %s/keyring' % (self.ceph_cmd, mdsname, data_dir)).communicate()
-                common.pdsh(pdshhost, 'sudo sh -c "ulimit -n 16384 && ulimit -c unlimited && exec %s"' % cmd).communicate()
+                with common.Batch(pdshhost) as batch:
+                    batch.add('sudo mkdir -p %s' % data_dir)
+                    batch.add('sudo %s auth get-or-create mds.%s mon \'allow profile mds\' osd \'allow rw tag cephfs *=*\' mds \'allow\' mgr \'allow profile mds\' -o %s/keyring' % (self.ceph_cmd, mdsname, data_dir))
+                    batch.add('sudo sh -c "ulimit -n 16384 && ulimit -c unlimited && exec %s"' % cmd)
 
+    @common.trace_phase('Ceph.start_rgw')
     def start_rgw(self):
         user = settings.cluster.get('user')
         rgwhosts = settings.cluster.get('rgws')
@@ -553,109 +901,115 @@ class Ceph(Cluster):
     def disable_balancer(self):
         common.pdsh(settings.getnodes('head'), "ceph balancer off").communicate()
 
-    def check_health(self, check_list=None, logfile=None, recstatsfile=None):
-        # Wait for a defined amount of time in case ceph health is delayed
-        time.sleep(self.health_wait)
-        logline = ""
-        if logfile:
-            logline = "| tee -a %s" % logfile
-        ret = 0
+    def get_health_watcher(self):
+        """ The status watcher of the head node, started on first use """
+        if self.health_watcher is None:
+            self.health_watcher = HealthWatcher(settings.getnodes('head'), self.ceph_cmd, self.tmp_conf,
+                                                self.health_poll_interval, self.health_poll_max_interval)
+            self.health_watcher.start()
+        return self.health_watcher
+
+    def wait_status(self, predicate, timeout=None, logfile=None, recstatsfile=None):
+        """
+        Waits until the predicate holds for a fresh cluster status, logging the
+        health of every status seen to logfile and the degraded/misplaced
+        object counts to recstatsfile on the head. Returns the number of
+        statuses the predicate did not hold for, and whether it ever held.
+        """
+        misses = [0]
+
+        def on_status(status):
+            if logfile:
+                common.remote_append(settings.getnodes('head'), logfile, '%s\n' % status.health_text())
+            self.log_recovery_stats(recstatsfile, status)
+
+        def check(status):
+            if predicate(status):
+                return True
+            misses[0] += 1
+            logger.info("%s", status.health_text())
+            return False
+
+        status = self.get_health_watcher().wait_for(check, timeout, on_status)
+        return misses[0], status is not None
 
+    def check_health(self, check_list=None, logfile=None, recstatsfile=None):
         # Match any of these things to continue checking health
         check_list = ["degraded", "peering", "recovery_wait", "stuck", "inactive", "unclean", "recovery", "stale"]
         if recstatsfile:
             header = "Time, Num Deg Objs, Total Deg Objs"
-            stdout, stderr = common.pdsh(settings.getnodes('head'), 'echo %s >> %s' % (header, recstatsfile)).communicate()
-
-        while True:
-            stdout, stderr = common.pdsh(settings.getnodes('head'), '%s -c %s health %s' % (self.ceph_cmd, self.tmp_conf, logline)).communicate()
-            self.log_recovery_stats(recstatsfile)
-            if check_list and not any(x in stdout for x in check_list):
-                break
-            if "HEALTH_OK" in stdout:
-                break
-            else:
-                ret = ret + 1
-            logger.info("%s", stdout)
-            time.sleep(1)
+            common.remote_append(settings.getnodes('head'), recstatsfile, header + '\n')
 
+        ret, _ = self.wait_status(lambda status: status.healthy(check_list), None, logfile, recstatsfile)
         return ret
 
-    def log_recovery_stats(self, recstatsfile=None):
-        if not recstatsfile:
+    def log_recovery_stats(self, recstatsfile=None, status=None):
+        if not recstatsfile or status is None:
             return
-        PGMAP = "pgmap"
         NUM_DEG = "degraded_objects"
         NUM_DEG_TOT = "degraded_total"
         NUM_MISP = "misplaced_objects"
         NUM_MISP_TOT = "misplaced_total"
-        fmtjson = "--format=json"
         separator = ","
-        stdout, stderr = common.pdsh(settings.getnodes('head'), '%s -c %s -s %s' % (self.ceph_cmd, self.tmp_conf, fmtjson)).communicate()
-        stdout = stdout.split(':', 1)[1]
-        stdout = stdout.strip()
-        try:
-            jsondata = json.loads(stdout)
-        except ValueError as e:
-            logger.error(str(e))
-            return
         degstats = []
-        degstats.append(str(time.time()))
-        if NUM_DEG in jsondata[PGMAP]:
-            degstats.append(str(jsondata[PGMAP][NUM_DEG]))
-        if NUM_DEG_TOT in jsondata[PGMAP]:
-            degstats.append(str(jsondata[PGMAP][NUM_DEG_TOT]))
-        if NUM_MISP in jsondata[PGMAP]:
-            degstats.append(str(jsondata[PGMAP][NUM_MISP]))
-        if NUM_MISP_TOT in jsondata[PGMAP]:
-            degstats.append(str(jsondata[PGMAP][NUM_MISP_TOT]))
+        degstats.append(str(status.polled))
+        for key in (NUM_DEG, NUM_DEG_TOT, NUM_MISP, NUM_MISP_TOT):
+            if key in status.pgmap:
+                degstats.append(str(status.pgmap[key]))
 
         if len(degstats):
             message = separator.join(degstats)
-            stdout, stderr = common.pdsh(settings.getnodes('head'), 'echo %s >> %s' % (message, recstatsfile)).communicate()
+            common.remote_append(settings.getnodes('head'), recstatsfile, message + '\n')
 
     def check_backfill(self, check_list=None, logfile=None, recstatsfile=None):
-        # Wait for a defined amount of time in case ceph health is delayed
-        time.sleep(self.health_wait)
-        logline = ""
-        if logfile:
-            logline = "| tee -a %s" % logfile
-        ret = 0
-
         if recstatsfile:
             header = "Time, Num Misplaced Objs, Total Misplaced Objs"
-            stdout, stderr = common.pdsh(settings.getnodes('head'), 'echo %s >> %s' % (header, recstatsfile)).communicate()
+            common.remote_append(settings.getnodes('head'), recstatsfile, header + '\n')
 
-        # Match any of these things to continue checking backfill
-        check_list = ["backfill", "misplaced"]
-        while True:
-            stdout, stderr = common.pdsh(settings.getnodes('head'), '%s -c %s -s %s' % (self.ceph_cmd, self.tmp_conf, logline)).communicate()
-            if check_list and not any(x in stdout for x in check_list):
-                break
-            else:
-                ret = ret + 1
-            for line in stdout.splitlines():
-                if 'misplaced' in line:
-                    self.log_recovery_stats(recstatsfile)
-                    logger.info("%s", line)
-            time.sleep(1)
+        # Wait until nothing is misplaced or backfilling
+        ret, _ = self.wait_status(lambda status: not status.backfilling(), None, logfile, recstatsfile)
         return ret
 
     def check_scrub(self):
         logger.info('Waiting until Scrubbing completes...')
+        watcher = self.get_health_watcher()
         while True:
-            stdout, stderr = common.pdsh(settings.getnodes('head'), '%s -c %s pg dump | cut -f 16 | grep "0.000000" | wc -l' % (self.ceph_cmd, self.tmp_conf)).communicate()
-            if " 0\n" in stdout:
+            # every PG has been scrubbed and deep scrubbed once
+            unscrubbed = unscrubbed_pgs(watcher.query('pg dump pgs'))
+            if not unscrubbed:
                 break
-            else:
-                logger.info(stdout)
+            logger.info('%d PGs not scrubbed yet', unscrubbed)
             time.sleep(1)
 
     def dump_config(self, run_dir):
         common.pdsh(settings.getnodes('osds'), 'sudo %s -c %s daemon osd.0 config show > %s/ceph_settings.out' % (self.ceph_cmd, self.tmp_conf, run_dir)).communicate()
+        self.snapshot_config(run_dir)
+
+    def snapshot_config(self, run_dir):
+        """
+        Saves the running config of every OSD, mon and mgr, collected from all
+        their nodes at once, to ceph_config.json in run_dir on the first OSD
+        node (see cluster/config_snapshot.py and tools/config_diff.py) and
+        warns about the settings that differ between daemons of a type
+        """
+        nodes = settings.getnodes('osds', 'mons', 'mgrs')
+        command = config_snapshot.config_show_command(self.ceph_cmd, '%s/config_show' % run_dir)
+        snapshot = config_snapshot.ConfigSnapshot()
+        for host, result in asyncio.run(common.run(nodes, command)).items():
+            for daemon, config in config_snapshot.parse_config_dumps(result.output()[0]).items():
+                snapshot.add(daemon, host, config)
+        logger.info('Config of %d daemons, %d distinct', len(snapshot.daemons), len(snapshot.configs))
+        for daemon_type, keys in snapshot.divergent().items():
+            for key, values in keys.items():
+                logger.warning('%s setting %s differs: %s', daemon_type, key,
+                               ', '.join('%s on %s' % (value, ','.join(daemons)) for value, daemons in values.items()))
+        snapshot.save(min(common.expanded_node_list(settings.getnodes('osds'))), '%s/ceph_config.json' % run_dir)
+        return snapshot
 
     def dump_historic_ops(self, run_dir):
-        common.pdsh(settings.getnodes('osds'), 'find /var/run/ceph/ceph-osd*.asok -maxdepth 1 -exec sudo %s --admin-daemon {} dump_historic_ops \; > %s/historic_ops.out' % (self.ceph_cmd, run_dir)).communicate()
+        # each dump follows a "# <admin socket>" line naming its OSD (see post_processing/formatter/historic_ops_formatter.py)
+        out = '%s/historic_ops.out' % run_dir
+        common.pdsh(settings.getnodes('osds'), 'rm -f %s; for asok in /var/run/ceph/ceph-osd*.asok; do echo "# $asok" >> %s; sudo %s --admin-daemon $asok dump_historic_ops >> %s; done' % (out, out, self.ceph_cmd, out)).communicate()
 
     def set_osd_param(self, param, value):
         common.pdsh(settings.getnodes('osds'), 'find /dev/disk/by-partlabel/osd-device-*data -exec readlink {} \; | cut -d"/" -f 3 | sed "s/[0-9]$//" | xargs -I{} sudo sh -c "echo %s > /sys/block/\'{}\'/queue/%s"' % (value, param))
@@ -677,11 +1031,18 @@ class Ceph(Cluster):
         self.startiorequest.wait()
 
     def maybe_populate_recovery_pool(self):
-        if self.prefill_recov_objects > 0 or self.prefill_recov_time > 0:
-            logger.info('prefilling %s %sbyte objects into recovery pool %s' % (self.prefill_recov_objects, self.prefill_recov_object_size, self.recov_pool_name))
-            common.pdsh(settings.getnodes('head'), 'sudo %s -p %s bench %s write -b %s --max-objects %s --no-cleanup' % (self.rados_cmd, self.recov_pool_name, self.prefill_recov_time, self.prefill_recov_object_size, self.prefill_recov_objects)).communicate()
+        if self.prefill_recov_objects > 0 or self.prefill_recov_bytes > 0 or self.prefill_recov_time > 0:
+            self.prefill_pool(self.recov_pool_name, self.prefill_recov_object_size, self.prefill_recov_objects,
+                              self.prefill_recov_bytes, self.prefill_recov_time)
             self.check_health()
 
+    @common.trace_phase('Ceph.prefill')
+    def prefill_pool(self, pool, object_size, objects=0, total_bytes=0, runtime=0):
+        """ Fills the pool from prefill_procs_per_node processes on every prefill node, the head without clients """
+        nodes = settings.getnodes(self.prefill_nodes) or settings.getnodes('head')
+        return Prefill(self.rados_cmd, self.tmp_conf, pool, object_size, objects, total_bytes, runtime, nodes,
+                       self.prefill_procs, self.prefill_concurrent_ios, self.prefill_progress_interval).run()
+
     def wait_recovery_done(self):
         self.stoprequest.set()
         while True:
@@ -694,28 +1055,27 @@ class Ceph(Cluster):
         ret = 0
         if not timeout:
             return ret
-        logline = ""
-        if logfile:
-            logdate = 'echo "[`date`] ceph progress" >> %s' % (logfile)
-            logline = "| tee -a %s" % logfile
-        pg_autoscaler_states = ["Complete", "Nothing in progress"]
-        time.sleep(20)
-        start_time = time.time()
+        # The pools only carry their target PG counts once the mgr autoscaler
+        # ran (every minute), until then autoscale-status shows the pending
+        # changes
+        deadline = time.time() + timeout if timeout > 0 else None
         while True:
-            stdout, stderr = common.pdsh(settings.getnodes('head'), '%s;%s -c %s progress %s' % (logdate, self.ceph_cmd, self.tmp_conf, logline)).communicate()
-            output = (stdout, stderr)
-            for i in range(len(output)):
-                if any(pg_state in output[i] for pg_state in pg_autoscaler_states):
-                    return ret
-            if timeout > 0:
-                cur_time = time.time()
-                if cur_time - start_time > timeout:
-                    logger.info("check_pg_autoscaler() state timeout exceeded...")
-                    ret = ret + 1
+            # a fresh status for the last round too
+            remaining = None if deadline is None else max(deadline - time.time(), self.health_poll_max_interval)
+            _, done = self.wait_status(lambda status: not status.autoscaling(), remaining, logfile)
+            if done:
+                pending = pending_autoscale(self.get_health_watcher().query('osd pool autoscale-status'))
+                if not pending:
                     return ret
-            logger.info("%s", stdout)
-            time.sleep(10)
-        return ret
+                logger.info("PG autoscaler about to resize pools %s", ', '.join(pending))
+                if logfile:
+                    common.remote_append(settings.getnodes('head'), logfile,
+                                         'pending autoscale: %s\n' % ', '.join(pending))
+            if deadline is not None and time.time() >= deadline:
+                logger.info("check_pg_autoscaler() state timeout exceeded...")
+                ret = ret + 1
+                return ret
+            time.sleep(10 if deadline is None else min(10, max(deadline - time.time(), 0)))
 
     # FIXME: This is a total hack that assumes there is only 1 existing ruleset!
     # Will change pending a fix for http://tracker.ceph.com/issues/8060
@@ -734,19 +1094,19 @@ class Ceph(Cluster):
     def make_profiles(self):
         crush_profiles = self.config.get('crush_profiles', {})
         for name, profile in list(crush_profiles.items()):
-            common.pdsh(settings.getnodes('head'), '%s -c %s osd crush add-bucket %s-root root' % (self.ceph_cmd, self.tmp_conf, name)).communicate()
-            common.pdsh(settings.getnodes('head'), '%s -c %s osd crush add-bucket %s-rack rack' % (self.ceph_cmd, self.tmp_conf, name)).communicate()
-            common.pdsh(settings.getnodes('head'), '%s -c %s osd crush move %s-rack root=%s-root' % (self.ceph_cmd, self.tmp_conf, name, name)).communicate()
-            # FIXME: We need to build a dict mapping OSDs to hosts and create a proper hierarchy!
-            common.pdsh(settings.getnodes('head'), '%s -c %s osd crush add-bucket %s-host host' % (self.ceph_cmd, self.tmp_conf, name)).communicate()
-            common.pdsh(settings.getnodes('head'), '%s -c %s osd crush move %s-host rack=%s-rack' % (self.ceph_cmd, self.tmp_conf, name, name)).communicate()
-
             osds = profile.get('osds', None)
             if not osds:
                 raise Exception("No OSDs defined for crush profile, bailing!")
-            for i in osds:
-                common.pdsh(settings.getnodes('head'), '%s -c %s osd crush set %s 1.0 host=%s-host' % (self.ceph_cmd, self.tmp_conf, i, name)).communicate()
-            common.pdsh(settings.getnodes('head'), '%s -c %s osd crush rule create-simple %s %s-root osd' % (self.ceph_cmd, self.tmp_conf, name, name)).communicate()
+            with common.Batch(settings.getnodes('head')) as batch:
+                batch.add('%s -c %s osd crush add-bucket %s-root root' % (self.ceph_cmd, self.tmp_conf, name))
+                batch.add('%s -c %s osd crush add-bucket %s-rack rack' % (self.ceph_cmd, self.tmp_conf, name))
+                batch.add('%s -c %s osd crush move %s-rack root=%s-root' % (self.ceph_cmd, self.tmp_conf, name, name))
+                # FIXME: We need to build a dict mapping OSDs to hosts and create a proper hierarchy!
+                batch.add('%s -c %s osd crush add-bucket %s-host host' % (self.ceph_cmd, self.tmp_conf, name))
+                batch.add('%s -c %s osd crush move %s-host rack=%s-rack' % (self.ceph_cmd, self.tmp_conf, name, name))
+                for i in osds:
+                    batch.add('%s -c %s osd crush set %s 1.0 host=%s-host' % (self.ceph_cmd, self.tmp_conf, i, name))
+                batch.add('%s -c %s osd crush rule create-simple %s %s-root osd' % (self.ceph_cmd, self.tmp_conf, name, name))
             self.set_ruleset(name)
 
         erasure_profiles = self.config.get('erasure_profiles', {})
@@ -756,139 +1116,120 @@ class Ceph(Cluster):
             common.pdsh(settings.getnodes('head'), '%s -c %s osd erasure-code-profile set %s crush-failure-domain=osd k=%s m=%s' % (self.ceph_cmd, self.tmp_conf, name, k, m)).communicate()
             self.set_ruleset(name)
 
-    def mkpool(self, name, profile_name, application, base_name=None):
+    def pool_spec(self, name, profile_name, application, base_name=None):
         pool_profiles = self.config.get('pool_profiles', {'default': {}})
         profile = pool_profiles.get(profile_name, {})
-
-        pg_size = profile.get('pg_size', 1024)
-        pgp_size = profile.get('pgp_size', 1024)
-        erasure_profile = profile.get('erasure_profile', '')
-        replication = str(profile.get('replication', None))
-        ec_overwrites = profile.get('ec_overwrites', False)
-        cache_profile = profile.get('cache_profile', None)
-
-        # Options for cache tiering
-        crush_profile = profile.get('crush_profile', None)
-        cache_mode = profile.get('cache_mode', None)
-        hit_set_type = profile.get('hit_set_type', None)
-        hit_set_count = profile.get('hit_set_count', None)
-        hit_set_period = profile.get('hit_set_period', None)
-        target_max_objects = profile.get('target_max_objects', None)
-        target_max_bytes = profile.get('target_max_bytes', None)
-        min_read_recency_for_promote = profile.get('min_read_recency_for_promote', None)
-        min_write_recency_for_promote = profile.get('min_write_recency_for_promote', None)
-        # Options for prefilling objects
-        prefill_objects = profile.get('prefill_objects', 0)
-        prefill_object_size = profile.get('prefill_object_size', 0)
-        prefill_time = profile.get('prefill_time', 0)
+        spec = PoolSpec(name, profile, application, base_name)
+        if spec.crush_profile:
+            try:
+                # set crush profile using the integer 0-based index of crush rule
+                # displayed by: ceph osd crush rule ls
+                int(spec.crush_profile)
+            except ValueError:
+                self.get_ruleset(spec.crush_profile)
         # Options for prefilling recovery objects
         recov_pool = profile.get('recov_pool', False)
         if recov_pool:
             self.prefill_recov_objects = profile.get('prefill_recov_objects', 0)
             self.prefill_recov_object_size = profile.get('prefill_recov_object_size', 0)
             self.prefill_recov_time = profile.get('prefill_recov_time', 0)
-            if self.prefill_recov_objects > 0:
+            self.prefill_recov_bytes = profile.get('prefill_recov_bytes', 0)
+            if self.prefill_recov_objects > 0 or self.prefill_recov_bytes > 0:
                 self.recov_pool_name = name
+        return spec
 
-        # Add mandatory UI option to create a pool that starts with "." in releases after quincy (Sigh again).
-        yes_flag = ""
-        if self.version_compat not in ['argonaut', 'bobcat', 'cuttlefish', 'dumpling', 'emperor', 'firefly', 'giant', 'hammer', 'infernalis', 'jewel', 'kraken', 'luminous', 'mimic', 'nautilus', 'octopus', 'pacific', 'quincy']:
-            if name.startswith("."):
-                yes_flag = "--yes-i-really-mean-it"
-
-        if replication and replication == 'erasure':
-            common.pdsh(settings.getnodes('head'), 'sudo %s -c %s osd pool create %s %d %d erasure %s %s' % (self.ceph_cmd, self.tmp_conf, name, pg_size, pgp_size, erasure_profile, yes_flag),
-                        continue_if_error=False).communicate()
-            if ec_overwrites is True:
-                common.pdsh(settings.getnodes('head'), 'sudo %s -c %s osd pool set %s allow_ec_overwrites true' % (self.ceph_cmd, self.tmp_conf, name), continue_if_error=False).communicate()
-        else:
-            common.pdsh(settings.getnodes('head'), 'sudo %s -c %s osd pool create %s %d %d %s' % (self.ceph_cmd, self.tmp_conf, name, pg_size, pgp_size, yes_flag),
-                        continue_if_error=False).communicate()
-        if self.version_compat not in ['argonaut', 'bobcat', 'cuttlefish', 'dumpling', 'emperor', 'firefly', 'giant', 'hammer', 'infernalis', 'jewel']:
-            common.pdsh(settings.getnodes('head'), 'sudo %s -c %s osd pool application enable %s %s' % (self.ceph_cmd, self.tmp_conf, name, application), continue_if_error=False).communicate()
-
-        if replication and replication.isdigit():
-            pool_repl_size = int(replication)
-            pool_min_repl_size = 1
-            if (pool_repl_size > 2):
-                pool_min_repl_size = pool_repl_size - 1
-
-            # Add mandatory UI option to actually create a pool of size 1 (Sigh).
-            yes_flag = ""
-            if int(replication) == 1:
-                yes_flag = "--yes-i-really-mean-it"
-
-            common.pdsh(settings.getnodes('head'), 'sudo %s -c %s osd pool set %s size %s %s' % (self.ceph_cmd, self.tmp_conf, name, replication, yes_flag),
-                        continue_if_error=False).communicate()
-            common.pdsh(settings.getnodes('head'), 'sudo %s -c %s osd pool set %s min_size %d %s' % (self.ceph_cmd, self.tmp_conf, name, pool_min_repl_size, yes_flag),
-                        continue_if_error=False).communicate()
-
-        if crush_profile:
-            try:
-                rule_index = int(crush_profile)
-                # set crush profile using the integer 0-based index of crush rule
-                # displayed by: ceph osd crush rule ls
-                ruleset = crush_profile
-            except ValueError:
-                ruleset = self.get_ruleset(crush_profile)
-            common.pdsh(settings.getnodes('head'), 'sudo %s -c %s osd pool set %s crush_ruleset %s' % (self.ceph_cmd, self.tmp_conf, name, crush_profile),
-                        continue_if_error=False).communicate()
+    def pool_details(self):
+        """ The pools of "ceph osd pool ls detail" by name, from a fresh cluster status """
+        status = self.get_health_watcher().wait_for(lambda status: True, self.health_poll_max_interval * 4)
+        if status is None:
+            return {}
+        return dict((pool.get('pool_name'), pool) for pool in status.pools)
 
-        logger.info('Checking Health after pool creation.')
-        self.check_health()
+    def mkpool(self, name, profile_name, application, base_name=None):
+        self.mkpools([(name, profile_name, application, base_name)])
+
+    @common.trace_phase('Ceph.mkpool')
+    def mkpools(self, pools):
+        """
+        Makes the pools given as (name, profile_name, application[, base_name])
+        and their cache pools. One batch creates and configures all of them,
+        then the cluster health is checked once, or twice when a pool is
+        prefilled. A pool whose profile has reuse set is kept as it is when it
+        was made from the same profile before.
+        """
+        specs = [self.pool_spec(*pool) for pool in pools]
+        # If there is a cache profile assigned, make a cache pool
+        cache_specs = [self.pool_spec('%s-cache' % spec.name, spec.cache_profile, spec.application, spec.name)
+                       for spec in specs if spec.cache_profile]
+        specs = specs + cache_specs
+
+        details = self.pool_details() if any(spec.reuse for spec in specs) else {}
+        made = []
+        for spec in specs:
+            if spec.reuse and spec.matches(details.get(spec.name)):
+                logger.info('Reusing pool %s, it was made from the same profile.', spec.name)
+            else:
+                made.append(spec)
 
-        if prefill_objects > 0 or prefill_time > 0:
-            logger.info('prefilling %s %sbyte objects into pool %s' % (prefill_objects, prefill_object_size, name))
-            common.pdsh(settings.getnodes('head'), 'sudo %s -p %s bench %s write -b %s --max-objects %s --no-cleanup' % (self.rados_cmd, name, prefill_time, prefill_object_size, prefill_objects)).communicate()
+        with_application = self.version_compat not in ['argonaut', 'bobcat', 'cuttlefish', 'dumpling', 'emperor', 'firefly', 'giant', 'hammer', 'infernalis', 'jewel']
+        create = []
+        finish = []
+        for spec in made:
+            # Add mandatory UI option to create a pool that starts with "." in releases after quincy (Sigh again).
+            yes_flag = ""
+            if self.version_compat not in ['argonaut', 'bobcat', 'cuttlefish', 'dumpling', 'emperor', 'firefly', 'giant', 'hammer', 'infernalis', 'jewel', 'kraken', 'luminous', 'mimic', 'nautilus', 'octopus', 'pacific', 'quincy']:
+                if spec.name.startswith("."):
+                    yes_flag = "--yes-i-really-mean-it"
+            create.extend(spec.create_commands(self.ceph_cmd, self.tmp_conf, yes_flag, with_application))
+            finish.extend(spec.tier_commands(self.ceph_cmd, self.tmp_conf) + spec.option_commands(self.ceph_cmd, self.tmp_conf))
+            if with_application:
+                finish.append(spec.tag_command(self.ceph_cmd, self.tmp_conf))
+        prefills = [spec for spec in made if spec.prefill]
+        if not prefills:
+            create, finish = create + finish, []
+
+        with common.Batch(settings.getnodes('head'), continue_if_error=False) as batch:
+            for command in create:
+                batch.add(command)
+            for command in finish:
+                batch.add(command, continue_if_error=True)
+
+        if prefills:
+            logger.info('Checking Health after pool creation.')
             self.check_health()
-
-        if base_name and cache_mode:
-            logger.info("Adding %s as cache tier for %s.", name, base_name)
-            common.pdsh(settings.getnodes('head'), 'sudo %s -c %s osd tier add %s %s' % (self.ceph_cmd, self.tmp_conf, base_name, name)).communicate()
-            common.pdsh(settings.getnodes('head'), 'sudo %s -c %s osd tier cache-mode %s %s' % (self.ceph_cmd, self.tmp_conf, name, cache_mode)).communicate()
-            common.pdsh(settings.getnodes('head'), 'sudo %s -c %s osd tier set-overlay %s %s' % (self.ceph_cmd, self.tmp_conf, base_name, name)).communicate()
-
-        if hit_set_type:
-            common.pdsh(settings.getnodes('head'), 'sudo %s -c %s osd pool set %s hit_set_type %s' % (self.ceph_cmd, self.tmp_conf, name, hit_set_type)).communicate()
-        if hit_set_count:
-            common.pdsh(settings.getnodes('head'), 'sudo %s -c %s osd pool set %s hit_set_count %s' % (self.ceph_cmd, self.tmp_conf, name, hit_set_count)).communicate()
-        if hit_set_period:
-            common.pdsh(settings.getnodes('head'), 'sudo %s -c %s osd pool set %s hit_set_period %s' % (self.ceph_cmd, self.tmp_conf, name, hit_set_period)).communicate()
-        if target_max_objects:
-            common.pdsh(settings.getnodes('head'), 'sudo %s -c %s osd pool set %s target_max_objects %s' % (self.ceph_cmd, self.tmp_conf, name, target_max_objects)).communicate()
-        if target_max_bytes:
-            common.pdsh(settings.getnodes('head'), 'sudo %s -c %s osd pool set %s target_max_bytes %s' % (self.ceph_cmd, self.tmp_conf, name, target_max_bytes)).communicate()
-        if min_read_recency_for_promote:
-            common.pdsh(settings.getnodes('head'), 'sudo %s -c %s osd pool set %s min_read_recency_for_promote %s' % (self.ceph_cmd, self.tmp_conf, name, min_read_recency_for_promote)).communicate()
-        if min_write_recency_for_promote:
-            common.pdsh(settings.getnodes('head'), 'sudo %s -c %s osd pool set %s min_write_recency_for_promote %s' % (self.ceph_cmd, self.tmp_conf, name, min_write_recency_for_promote)).communicate()
+            for spec in prefills:
+                self.prefill_pool(spec.name, spec.prefill_object_size, spec.prefill_objects, spec.prefill_bytes, spec.prefill_time)
+            with common.Batch(settings.getnodes('head')) as batch:
+                for command in finish:
+                    batch.add(command)
 
         logger.info('Final Pool Health Check.')
         self.check_health()
 
-        # If there is a cache profile assigned, make a cache pool
-        if cache_profile:
-            cache_name = '%s-cache' % name
-            self.mkpool(cache_name, cache_profile, name, application)
-
+    @common.trace_phase('Ceph.rmpool')
     def rmpool(self, name, profile_name):
         pool_profiles = self.config.get('pool_profiles', {'default': {}})
         profile = pool_profiles.get(profile_name, {})
+        if profile.get('reuse', False) and PoolSpec(name, profile, None).matches(self.pool_details().get(name)):
+            logger.info('Keeping pool %s for reuse.', name)
+            return
         cache_profile = profile.get('cache_profile', None)
         if cache_profile:
             cache_name = '%s-cache' % name
 
             # flush and remove the overlay and such
-            common.pdsh(settings.getnodes('head'), 'sudo %s -c %s osd tier cache-mode %s forward' % (self.ceph_cmd, self.tmp_conf, cache_name)).communicate()
-            common.pdsh(settings.getnodes('head'), 'sudo %s -c %s -p %s cache-flush-evict-all' % (self.rados_cmd, self.tmp_conf, cache_name)).communicate()
-            common.pdsh(settings.getnodes('head'), 'sudo %s -c %s osd tier remove-overlay %s' % (self.ceph_cmd, self.tmp_conf, name)).communicate()
-            common.pdsh(settings.getnodes('head'), 'sudo %s -c %s osd tier remove %s %s' % (self.ceph_cmd, self.tmp_conf, name, cache_name)).communicate()
+            with common.Batch(settings.getnodes('head')) as batch:
+                batch.add('sudo %s -c %s osd tier cache-mode %s forward' % (self.ceph_cmd, self.tmp_conf, cache_name))
+                batch.add('sudo %s -c %s -p %s cache-flush-evict-all' % (self.rados_cmd, self.tmp_conf, cache_name))
+                batch.add('sudo %s -c %s osd tier remove-overlay %s' % (self.ceph_cmd, self.tmp_conf, name))
+                batch.add('sudo %s -c %s osd tier remove %s %s' % (self.ceph_cmd, self.tmp_conf, name, cache_name))
 
             # delete the cache pool
             self.rmpool(cache_name, cache_profile)
         common.pdsh(settings.getnodes('head'), 'sudo %s -c %s osd pool delete %s %s --yes-i-really-really-mean-it' % (self.ceph_cmd, self.tmp_conf, name, name),
                     continue_if_error=False).communicate()
 
+    @common.trace_phase('Ceph.mkimage')
     def mkimage(self, name, size, pool, data_pool, order):
         dp_option = ''
         if data_pool:
@@ -898,22 +1239,75 @@ class Ceph(Cluster):
         except Exception as e:
             logger.error(str(e))
 
+    @common.trace_phase('Ceph.mkimages')
+    def mkimages(self, images, disabled_features=None):
+        """
+        Creates the rbd images given as (name, size, pool, data_pool, order),
+        spread over the image_create_nodes and image_create_parallel at a time
+        on each of them, with the features left by disabled_features set at
+        creation. Then checks that they all exist with one listing per pool.
+        """
+        features = ''
+        if disabled_features:
+            conf_file = self.config.get('conf_file')
+            enabled = rbd_features(disabled_features,
+                                   conf_option(conf_file, 'rbd_default_features') if conf_file else None)
+            # with no --image-feature the rbd_default_features would apply
+            features = ' '.join('--image-feature %s' % feature for feature in enabled) or '--rbd-default-features 0'
+        nodes = common.expanded_node_list(settings.getnodes(*self.image_create_nodes))
+        commands = dict((node, []) for node in nodes)
+        for i, (name, size, pool, data_pool, order) in enumerate(images):
+            dp_option = '--data-pool %s' % data_pool if data_pool else ''
+            command = '%s -c %s create %s --size %s --pool %s %s --order %s %s' % (self.rbd_cmd, self.tmp_conf, name, size, pool, dp_option, order, features)
+            commands[nodes[i % len(nodes)]].append(command)
+
+        def script(node_commands):
+            parallel = max(int(self.image_create_parallel), 1)
+            return '; '.join('%s & wait' % ' & '.join(node_commands[i:i + parallel])
+                             for i in range(0, len(node_commands), parallel))
+
+        async def create():
+            return await asyncio.gather(*[common.run(node, script(node_commands))
+                                          for node, node_commands in commands.items() if node_commands])
+        # the exit status of a parallel rbd create is lost in the wait, the
+        # listing below tells which images are missing
+        errors = []
+        for results in asyncio.run(create()):
+            errors.extend((result.host, line.strip()) for result in results.values() for line in result.stderr)
+
+        pools = sorted(set(pool for _, _, pool, _, _ in images))
+        with common.Batch(settings.getnodes('head')) as batch:
+            for pool in pools:
+                batch.add('%s -c %s ls --pool %s --format=json' % (self.rbd_cmd, self.tmp_conf, pool))
+        missing = []
+        for pool, results in zip(pools, batch.results):
+            existing = set()
+            for rc, output in results.values():
+                existing.update(json.loads(output) if rc == 0 and output.strip() else [])
+            missing.extend('%s/%s' % (pool, name) for name, _, image_pool, _, _ in images
+                           if image_pool == pool and name not in existing)
+        if missing:
+            for host, line in errors:
+                logger.error('%s: %s', host, line)
+            raise Exception('%d rbd images were not created: %s' % (len(missing), ', '.join(missing[:10])))
+
     def unmount_all(self):
         # Should take care of pretty much everything so long as wierd mnt_dirs aren't used.
-        common.pdsh(settings.getnodes('clients'), 'sudo umount $(grep %s /proc/mounts | cut -f2 -d" " | sort -r)' % self.mnt_dir).communicate()
+        with common.Batch(settings.getnodes('clients')) as batch:
+            batch.add('sudo umount $(grep %s /proc/mounts | cut -f2 -d" " | sort -r)' % self.mnt_dir)
 
-        # Kill the fuse processes for good measure
-        common.pdsh(settings.getnodes('clients'), 'sudo killall -SIGKILL %s' % self.rbd_fuse_cmd).communicate()
-        common.pdsh(settings.getnodes('clients'), 'sudo killall -SIGKILL %s' % self.ceph_fuse_cmd).communicate()
+            # Kill the fuse processes for good measure
+            batch.add('sudo killall -SIGKILL %s' % self.rbd_fuse_cmd)
+            batch.add('sudo killall -SIGKILL %s' % self.ceph_fuse_cmd)
 
-        # Unmount RBD and NBD for good measure
-        common.pdsh(settings.getnodes('clients'), 'sudo find /dev/rbd* -maxdepth 0 -type b -exec umount \'{}\' \\;').communicate()
-        common.pdsh(settings.getnodes('clients'), 'sudo find /dev/nbd* -maxdepth 0 -type b -exec umount \'{}\' \\;').communicate()
+            # Unmount RBD and NBD for good measure
+            batch.add('sudo find /dev/rbd* -maxdepth 0 -type b -exec umount \'{}\' \\;')
+            batch.add('sudo find /dev/nbd* -maxdepth 0 -type b -exec umount \'{}\' \\;')
 
-        # Unmap rbd, nbd, and clear the targetcli config
-        common.pdsh(settings.getnodes('clients'), 'sudo find /dev/rbd* -maxdepth 0 -type b -exec %s unmap \'{}\' \\;' % self.rbd_cmd).communicate()
-        common.pdsh(settings.getnodes('clients'), 'sudo find /dev/nbd* -maxdepth 0 -type b -exec %s unmap \'{}\' \\;' % self.rbd_nbd_cmd).communicate()
-        common.pdsh(settings.getnodes('clients'), 'sudo targetcli clearconfig confirm=True', continue_if_error=False).communicate()
+            # Unmap rbd, nbd, and clear the targetcli config
+            batch.add('sudo find /dev/rbd* -maxdepth 0 -type b -exec %s unmap \'{}\' \\;' % self.rbd_cmd)
+            batch.add('sudo find /dev/nbd* -maxdepth 0 -type b -exec %s unmap \'{}\' \\;' % self.rbd_nbd_cmd)
+            batch.add('sudo targetcli clearconfig confirm=True', continue_if_error=False)
 
     def get_urls(self):
         return self.urls
@@ -925,33 +1319,36 @@ class Ceph(Cluster):
         if self.urls:
             cmd = "%s" % self.radosgw_admin_cmd
             node = settings.getnodes('head')
-            common.pdsh(node, '%s -c %s user create --uid=%s --display-name=%s' % (cmd, self.tmp_conf, user, user)).communicate()
-            common.pdsh(node, '%s -c %s key create --uid=%s --key-type=s3 --access_key=%s --secret_key=%s' % (cmd, self.tmp_conf, user, access_key, secret_key)).communicate()
-            common.pdsh(node, '%s -c %s user modify --uid=%s --max-buckets=0' % (cmd, self.tmp_conf, user)).communicate()
+            with common.Batch(node) as batch:
+                batch.add('%s -c %s user create --uid=%s --display-name=%s' % (cmd, self.tmp_conf, user, user))
+                batch.add('%s -c %s key create --uid=%s --key-type=s3 --access_key=%s --secret_key=%s' % (cmd, self.tmp_conf, user, access_key, secret_key))
+                batch.add('%s -c %s user modify --uid=%s --max-buckets=0' % (cmd, self.tmp_conf, user))
 
     def add_swift_user(self, user, subuser, key):
         if self.auth_urls:
             cmd = "%s" % self.radosgw_admin_cmd
             node = settings.getnodes('head')
-            common.pdsh(node, '%s -c %s user create --uid=%s --display-name=%s' % (cmd, self.tmp_conf, user, user)).communicate()
-            common.pdsh(node, '%s -c %s subuser create --uid=%s --subuser=%s --access=full' % (cmd, self.tmp_conf, user, subuser)).communicate()
-            common.pdsh(node, '%s -c %s key create --subuser=%s --key-type=swift --secret=%s' % (cmd, self.tmp_conf, subuser, key)).communicate()
-            common.pdsh(node, '%s -c %s user modify --uid=%s --max-buckets=0' % (cmd, self.tmp_conf, user)).communicate()
+            with common.Batch(node) as batch:
+                batch.add('%s -c %s user create --uid=%s --display-name=%s' % (cmd, self.tmp_conf, user, user))
+                batch.add('%s -c %s subuser create --uid=%s --subuser=%s --access=full' % (cmd, self.tmp_conf, user, subuser))
+                batch.add('%s -c %s key create --subuser=%s --key-type=swift --secret=%s' % (cmd, self.tmp_conf, subuser, key))
+                batch.add('%s -c %s user modify --uid=%s --max-buckets=0' % (cmd, self.tmp_conf, user))
 
     def make_rgw_pools(self):
         rgw_pools = self.config.get('rgw_pools', {})
-        self.mkpool('.rgw.root', rgw_pools.get('root', 'default'), 'rgw')
-        self.mkpool('default.rgw.control', rgw_pools.get('control', 'default'), 'rgw')
-        self.mkpool('default.rgw.meta', rgw_pools.get('meta', 'default'), 'rgw')
-        self.mkpool('default.rgw.log', rgw_pools.get('log', 'default'), 'rgw')
-        self.mkpool('default.rgw.buckets', rgw_pools.get('buckets', 'default'), 'rgw')
-        self.mkpool('default.rgw.buckets.index', rgw_pools.get('buckets_index', 'default'), 'rgw')
-        self.mkpool('default.rgw.buckets.data', rgw_pools.get('buckets_data', 'default'), 'rgw')
+        self.mkpools([('.rgw.root', rgw_pools.get('root', 'default'), 'rgw'),
+                      ('default.rgw.control', rgw_pools.get('control', 'default'), 'rgw'),
+                      ('default.rgw.meta', rgw_pools.get('meta', 'default'), 'rgw'),
+                      ('default.rgw.log', rgw_pools.get('log', 'default'), 'rgw'),
+                      ('default.rgw.buckets', rgw_pools.get('buckets', 'default'), 'rgw'),
+                      ('default.rgw.buckets.index', rgw_pools.get('buckets_index', 'default'), 'rgw'),
+                      ('default.rgw.buckets.data', rgw_pools.get('buckets_data', 'default'), 'rgw')])
 
 
 class RecoveryTestThreadBlocking(threading.Thread):
     def __init__(self, config, cluster, callback, stoprequest, haltrequest):
         threading.Thread.__init__(self)
+        self.phases = list(common.trace_phases())
         self.config = config
         self.cluster = cluster
         self.callback = callback
@@ -965,46 +1362,70 @@ class RecoveryTestThreadBlocking(threading.Thread):
         self.health_checklist = ["degraded", "peering", "recovery_wait", "stuck", "inactive", "unclean", "recovery"]
         self.ceph_cmd = self.cluster.ceph_cmd
         self.lasttime = time.time()
+        self.recorder = None
+        self.cycle = 0
 
     def logcmd(self, message):
         return 'echo "[`date`] %s" >> %s/recovery.log' % (message, self.config.get('run_dir'))
 
+    def log(self, message):
+        common.remote_append(settings.getnodes('head'), '%s/recovery.log' % self.config.get('run_dir'),
+                             '[%s] %s\n' % (time.strftime('%a %b %d %H:%M:%S %Z %Y'), message))
+
+    def reacted(self, predicate):
+        """ Whether the cluster shows the predicate within health_wait seconds """
+        _, held = self.cluster.wait_status(predicate, self.cluster.health_wait)
+        return held
+
+    def start_recording(self):
+        self.recorder = RecoveryRecorder(self.cluster.get_health_watcher(), self.config.get('sample_interval', 1.0))
+        self.recorder.start()
+
+    def save_recording(self):
+        if self.recorder is None:
+            return
+        path = '%s/recovery_timeseries.%d.json' % (self.config.get('run_dir'), self.cycle)
+        self.log('Recovery time series: %s' % summary(self.recorder.finish(settings.getnodes('head'), path)))
+        self.recorder = None
+        self.cycle += 1
+
     def pre(self):
         pre_time = self.config.get("pre_time", 60)
-        common.pdsh(settings.getnodes('head'), self.logcmd('Starting Recovery Test Thread, waiting %s seconds.' % pre_time)).communicate()
+        self.log('Starting Recovery Test Thread, waiting %s seconds.' % pre_time)
         time.sleep(pre_time)
         lcmd = self.logcmd("Setting the ceph osd noup flag")
         common.pdsh(settings.getnodes('head'), '%s -c %s osd set noup;%s' % (self.ceph_cmd, self.cluster.tmp_conf, lcmd)).communicate()
         self.state = 'markdown'
 
     def markdown(self):
+        self.start_recording()
         for osdnum in self.config.get('osds'):
             lcmd = self.logcmd("Marking OSD %s down." % osdnum)
             common.pdsh(settings.getnodes('head'), '%s -c %s osd down %s;%s' % (self.ceph_cmd, self.cluster.tmp_conf, osdnum, lcmd)).communicate()
             lcmd = self.logcmd("Marking OSD %s out." % osdnum)
             common.pdsh(settings.getnodes('head'), '%s -c %s osd out %s;%s' % (self.ceph_cmd, self.cluster.tmp_conf, osdnum, lcmd)).communicate()
-        common.pdsh(settings.getnodes('head'), self.logcmd('Waiting for the cluster to break and heal')).communicate()
+        self.log('Waiting for the cluster to break and heal')
+        self.outhealthtries = 0
+        self.inhealthtries = 0
         self.lasttime = time.time()
+        self.recorder.mark('osds_out', self.lasttime)
         self.state = 'osdout'
 
     def osdout(self):
         reclog = "%s/recovery.log" % self.config.get('run_dir')
         recstatslog = "%s/recovery_stats.log" % self.config.get('run_dir')
-        ret = self.cluster.check_health(self.health_checklist, reclog, recstatslog)
-
-        common.pdsh(settings.getnodes('head'), self.logcmd("ret: %s" % ret)).communicate()
-
-        if self.outhealthtries < self.maxhealthtries and ret == 0:
-            self.outhealthtries = self.outhealthtries + 1
-            return  # Cluster hasn't become unhealthy yet.
-
-        if ret == 0:
-            common.pdsh(settings.getnodes('head'), self.logcmd('Cluster never went unhealthy.')).communicate()
+        if not self.reacted(lambda status: not status.healthy(self.health_checklist)):
+            if self.outhealthtries < self.maxhealthtries:
+                self.outhealthtries = self.outhealthtries + 1
+                return  # Cluster hasn't become unhealthy yet.
+            self.log('Cluster never went unhealthy.')
         else:
-            common.pdsh(settings.getnodes('head'), self.logcmd('Cluster appears to have healed.')).communicate()
+            ret = self.cluster.check_health(self.health_checklist, reclog, recstatslog)
+            self.log("ret: %s" % ret)
+            self.log('Cluster appears to have healed.')
             rectime = str(time.time() - self.lasttime)
-            common.pdsh(settings.getnodes('head'), 'echo Time: %s >> %s' % (rectime, recstatslog)).communicate()
-            common.pdsh(settings.getnodes('head'), self.logcmd('Time: %s' % rectime)).communicate()
+            common.remote_append(settings.getnodes('head'), recstatslog, 'Time: %s\n' % rectime)
+            self.log('Time: %s' % rectime)
         lcmd = self.logcmd("Unsetting the ceph osd noup flag")
         common.pdsh(settings.getnodes('head'), '%s -c %s osd unset noup;%s' % (self.ceph_cmd, self.cluster.tmp_conf, lcmd)).communicate()
         for osdnum in self.config.get('osds'):
@@ -1013,63 +1434,63 @@ class RecoveryTestThreadBlocking(threading.Thread):
             lcmd = self.logcmd("Marking OSD %s in." % osdnum)
             common.pdsh(settings.getnodes('head'), '%s -c %s osd in %s;%s' % (self.ceph_cmd, self.cluster.tmp_conf, osdnum, lcmd)).communicate()
         self.lasttime = time.time()
+        self.recorder.mark('osds_in', self.lasttime)
         self.state = "osdin"
 
     def osdin(self):
-        # Wait until the cluster is done backfilling.
-        ret = self.cluster.check_backfill(self.health_checklist, "%s/recovery.log" % self.config.get('run_dir'))
-        common.pdsh(settings.getnodes('head'), self.logcmd("ret: %s" % ret)).communicate()
-
-        if self.inhealthtries < self.maxhealthtries and ret == 0:
-            self.inhealthtries = self.inhealthtries + 1
-            return  # Cluster hasn't become unhealthy yet.
-
-        if ret == 0:
-            common.pdsh(settings.getnodes('head'), self.logcmd('Cluster never went into backfill.')).communicate()
+        if not self.reacted(lambda status: status.backfilling()):
+            if self.inhealthtries < self.maxhealthtries:
+                self.inhealthtries = self.inhealthtries + 1
+                return  # Cluster hasn't started backfilling yet.
+            self.log('Cluster never went into backfill.')
         else:
-            common.pdsh(settings.getnodes('head'), self.logcmd('Cluster appears to have healed.')).communicate()
-            common.pdsh(settings.getnodes('head'), self.logcmd('Time: %s' % str(time.time() - self.lasttime))).communicate()
+            # Wait until the cluster is done backfilling.
+            ret = self.cluster.check_backfill(self.health_checklist, "%s/recovery.log" % self.config.get('run_dir'))
+            self.log("ret: %s" % ret)
+            self.log('Cluster appears to have healed.')
+            self.log('Time: %s' % str(time.time() - self.lasttime))
+            self.recorder.mark('backfilled')
         self.state = "post"
 
     def post(self):
+        self.save_recording()
         if self.stoprequest.isSet():
-            common.pdsh(settings.getnodes('head'), self.logcmd('Cluster is healthy, but stoprequest is set, finishing now.')).communicate()
+            self.log('Cluster is healthy, but stoprequest is set, finishing now.')
             self.haltrequest.set()
             return
 
         if self.config.get("repeat", False):
-            # reset counters
-            self.outhealthtries = 0
-            self.inhealthtries = 0
-
-            common.pdsh(settings.getnodes('head'), self.logcmd('Cluster is healthy, but repeat is set.  Moving to "markdown" state.')).communicate()
+            self.log('Cluster is healthy, but repeat is set.  Moving to "markdown" state.')
             self.state = "markdown"
             return
 
         post_time = self.config.get("post_time", 60)
-        common.pdsh(settings.getnodes('head'), self.logcmd('Cluster is healthy, completion in %s seconds.' % post_time)).communicate()
+        self.log('Cluster is healthy, completion in %s seconds.' % post_time)
         time.sleep(post_time)
         self.state = "done"
 
     def done(self):
-        common.pdsh(settings.getnodes('head'), self.logcmd("Done.  Calling parent callback function.")).communicate()
+        self.log("Done.  Calling parent callback function.")
         self.callback()
         self.haltrequest.set()
 
     def join(self, timeout=None):
-        common.pdsh(settings.getnodes('head'), self.logcmd('Received notification that parent is finished and waiting.')).communicate()
+        self.log('Received notification that parent is finished and waiting.')
         super(RecoveryTestThreadBlocking, self).join(timeout)
 
     def run(self):
+        common.inherit_phases(self.phases)
         self.haltrequest.clear()
         self.stoprequest.clear()
         while not self.haltrequest.isSet():
             self.states[self.state]()
-        common.pdsh(settings.getnodes('head'), self.logcmd('Exiting recovery test thread.  Last state was: %s' % self.state)).communicate()
+        self.save_recording()
+        self.log('Exiting recovery test thread.  Last state was: %s' % self.state)
 
 class RecoveryTestThreadBackground(threading.Thread):
     def __init__(self, config, cluster, callback, stoprequest, haltrequest, startiorequest):
         threading.Thread.__init__(self)
+        self.phases = list(common.trace_phases())
         self.config = config
         self.cluster = cluster
         self.callback = callback
@@ -1084,47 +1505,72 @@ class RecoveryTestThreadBackground(threading.Thread):
         self.health_checklist = ["degraded", "peering", "recovery_wait", "stuck", "inactive", "unclean", "recovery"]
         self.ceph_cmd = self.cluster.ceph_cmd
         self.lasttime = time.time()
+        self.recorder = None
+        self.cycle = 0
 
     def logcmd(self, message):
         return 'echo "[`date`] %s" >> %s/recovery.log' % (message, self.config.get('run_dir'))
 
+    def log(self, message):
+        common.remote_append(settings.getnodes('head'), '%s/recovery.log' % self.config.get('run_dir'),
+                             '[%s] %s\n' % (time.strftime('%a %b %d %H:%M:%S %Z %Y'), message))
+
+    def reacted(self, predicate):
+        """ Whether the cluster shows the predicate within health_wait seconds """
+        _, held = self.cluster.wait_status(predicate, self.cluster.health_wait)
+        return held
+
+    def start_recording(self):
+        self.recorder = RecoveryRecorder(self.cluster.get_health_watcher(), self.config.get('sample_interval', 1.0))
+        self.recorder.start()
+
+    def save_recording(self):
+        if self.recorder is None:
+            return
+        path = '%s/recovery_timeseries.%d.json' % (self.config.get('run_dir'), self.cycle)
+        self.log('Recovery time series: %s' % summary(self.recorder.finish(settings.getnodes('head'), path)))
+        self.recorder = None
+        self.cycle += 1
+
     def pre(self):
         pre_time = self.config.get("pre_time", 60)
-        common.pdsh(settings.getnodes('head'), self.logcmd('Starting Recovery Test Thread, waiting %s seconds.' % pre_time)).communicate()
+        self.log('Starting Recovery Test Thread, waiting %s seconds.' % pre_time)
         time.sleep(pre_time)
         lcmd = self.logcmd("Setting the ceph osd noup flag")
         common.pdsh(settings.getnodes('head'), '%s -c %s osd set noup;%s' % (self.ceph_cmd, self.cluster.tmp_conf, lcmd)).communicate()
         self.state = 'markdown'
 
     def markdown(self):
+        self.start_recording()
         for osdnum in self.config.get('osds'):
             lcmd = self.logcmd("Marking OSD %s down." % osdnum)
             common.pdsh(settings.getnodes('head'), '%s -c %s osd down %s;%s' % (self.ceph_cmd, self.cluster.tmp_conf, osdnum, lcmd)).communicate()
             lcmd = self.logcmd("Marking OSD %s out." % osdnum)
             common.pdsh(settings.getnodes('head'), '%s -c %s osd out %s;%s' % (self.ceph_cmd, self.cluster.tmp_conf, osdnum, lcmd)).communicate()
-        common.pdsh(settings.getnodes('head'), self.logcmd('Waiting for the cluster to break and heal')).communicate()
+        self.log('Waiting for the cluster to break and heal')
+        self.outhealthtries = 0
+        self.inhealthtries = 0
         self.lasttime = time.time()
+        self.recorder.mark('osds_out', self.lasttime)
         self.state = 'osdout'
 
     def osdout(self):
         reclog = "%s/recovery.log" % self.config.get('run_dir')
         recstatslog = "%s/recovery_stats.log" % self.config.get('run_dir')
-        ret = self.cluster.check_health(self.health_checklist, reclog, recstatslog)
-
-        common.pdsh(settings.getnodes('head'), self.logcmd("ret: %s" % ret)).communicate()
-
-        if ret == 0:
-            common.pdsh(settings.getnodes('head'), self.logcmd('Cluster never went unhealthy.')).communicate()
+        if not self.reacted(lambda status: not status.healthy(self.health_checklist)):
+            self.log('Cluster never went unhealthy.')
         else:
-            common.pdsh(settings.getnodes('head'), self.logcmd('Cluster appears to have healed.')).communicate()
+            ret = self.cluster.check_health(self.health_checklist, reclog, recstatslog)
+            self.log("ret: %s" % ret)
+            self.log('Cluster appears to have healed.')
             rectime = str(time.time() - self.lasttime)
-            common.pdsh(settings.getnodes('head'), 'echo Time: %s >> %s' % (rectime, recstatslog)).communicate()
-            common.pdsh(settings.getnodes('head'), self.logcmd('Time: %s' % rectime)).communicate()
+            common.remote_append(settings.getnodes('head'), recstatslog, 'Time: %s\n' % rectime)
+            self.log('Time: %s' % rectime)
 
         # Populate the recovery pool
         self.cluster.maybe_populate_recovery_pool()
 
-        common.pdsh(settings.getnodes('head'), self.logcmd("osdout state - Sleeping for 10 secs after populating recovery pool.")).communicate()
+        self.log("osdout state - Sleeping for 10 secs after populating recovery pool.")
         time.sleep(10)
         lcmd = self.logcmd("Unsetting the ceph osd noup flag")
         common.pdsh(settings.getnodes('head'), '%s -c %s osd unset noup;%s' % (self.ceph_cmd, self.cluster.tmp_conf, lcmd)).communicate()
@@ -1134,61 +1580,63 @@ class RecoveryTestThreadBackground(threading.Thread):
             lcmd = self.logcmd("Marking OSD %s in." % osdnum)
             common.pdsh(settings.getnodes('head'), '%s -c %s osd in %s;%s' % (self.ceph_cmd, self.cluster.tmp_conf, osdnum, lcmd)).communicate()
         self.lasttime = time.time()
+        self.recorder.mark('osds_in', self.lasttime)
         self.state = "osdin"
 
     def osdin(self):
         # Set startiorequest event to initiate client IO on another pool
+        if not self.startiorequest.isSet():
+            self.recorder.mark('client_io')
         self.startiorequest.set()
-        # Make recovery thread Wait until the cluster is done backfilling.
         recstatslog = "%s/recovery_backfill_stats.log" % self.config.get('run_dir')
-        ret = self.cluster.check_backfill(self.health_checklist, "%s/recovery.log" % self.config.get('run_dir'), recstatslog)
-        common.pdsh(settings.getnodes('head'), self.logcmd("ret: %s" % ret)).communicate()
-
-        if self.inhealthtries < self.maxhealthtries and ret == 0:
-            self.inhealthtries = self.inhealthtries + 1
-            return # Cluster hasn't become unhealthy yet.
-
-        if ret == 0:
-            common.pdsh(settings.getnodes('head'), self.logcmd('Cluster never went into backfill.')).communicate()
+        if not self.reacted(lambda status: status.backfilling()):
+            if self.inhealthtries < self.maxhealthtries:
+                self.inhealthtries = self.inhealthtries + 1
+                return  # Cluster hasn't started backfilling yet.
+            self.log('Cluster never went into backfill.')
         else:
-            common.pdsh(settings.getnodes('head'), self.logcmd('Cluster appears to have healed.')).communicate()
+            # Make recovery thread Wait until the cluster is done backfilling.
+            ret = self.cluster.check_backfill(self.health_checklist, "%s/recovery.log" % self.config.get('run_dir'),
+                                              recstatslog)
+            self.log("ret: %s" % ret)
+            self.log('Cluster appears to have healed.')
             rectime = str(time.time() - self.lasttime)
-            common.pdsh(settings.getnodes('head'), 'echo Time: %s >> %s' % (rectime, recstatslog)).communicate()
-            common.pdsh(settings.getnodes('head'), self.logcmd('Time: %s' % rectime)).communicate()
+            common.remote_append(settings.getnodes('head'), recstatslog, 'Time: %s\n' % rectime)
+            self.log('Time: %s' % rectime)
+            self.recorder.mark('backfilled')
         self.state = "post"
 
     def post(self):
+        self.save_recording()
         if self.stoprequest.isSet():
-            common.pdsh(settings.getnodes('head'), self.logcmd('Cluster is healthy, but stoprequest is set, finishing now.')).communicate()
+            self.log('Cluster is healthy, but stoprequest is set, finishing now.')
             self.haltrequest.set()
             return
 
         if self.config.get("repeat", False):
-            # reset counters
-            self.outhealthtries = 0
-            self.inhealthtries = 0
-
-            common.pdsh(settings.getnodes('head'), self.logcmd('Cluster is healthy, but repeat is set.  Moving to "markdown" state.')).communicate()
+            self.log('Cluster is healthy, but repeat is set.  Moving to "markdown" state.')
             self.state = "markdown"
             return
 
-        common.pdsh(settings.getnodes('head'), self.logcmd('Cluster is healthy, finishing up...')).communicate()
+        self.log('Cluster is healthy, finishing up...')
         self.state = "done"
 
     def done(self):
-        common.pdsh(settings.getnodes('head'), self.logcmd("Done.  Calling parent callback function.")).communicate()
+        self.log("Done.  Calling parent callback function.")
         self.callback()
         self.haltrequest.set()
 
     def join(self, timeout=None):
-        common.pdsh(settings.getnodes('head'), self.logcmd('Received notification that parent is finished and waiting.')).communicate()
+        self.log('Received notification that parent is finished and waiting.')
         super(RecoveryTestThreadBackground, self).join(timeout)
 
     def run(self):
+        common.inherit_phases(self.phases)
         self.haltrequest.clear()
         self.stoprequest.clear()
         self.startiorequest.clear()
         while not self.haltrequest.isSet():
           self.states[self.state]()
-        common.pdsh(settings.getnodes('head'), self.logcmd('Exiting recovery test thread.  Last state was: %s' % self.state)).communicate()
+        self.save_recording()
+        self.log('Exiting recovery test thread.  Last state was: %s' % self.state)
 
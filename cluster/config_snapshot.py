@@ -0,0 +1,150 @@
+import common
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+
+logger = logging.getLogger("cbt")
+
+# daemons whose admin sockets are snapshotted
+DAEMON_TYPES = ['osd', 'mon', 'mgr']
+
+# settings expected to differ from one daemon to the next, kept apart from
+# the deduplicated configs and left out of the diffs
+IDENTITY_KEYS = ['name', 'id', 'host', 'admin_socket', 'log_file', 'pid_file', 'keyring', 'run_dir',
+                 'osd_data', 'osd_journal', 'osd_uuid', 'mon_data', 'mgr_data',
+                 'bluestore_block_path', 'bluestore_block_db_path', 'bluestore_block_wal_path',
+                 'public_addr', 'public_addrv', 'cluster_addr', 'cluster_addrv', 'crimson_seastar_cpu_cores']
+
+ASOK_DAEMON = re.compile(r'(?:^|[/-])((%s)\.[^/.]+)\.asok$' % '|'.join(DAEMON_TYPES))
+
+
+def config_show_command(ceph_cmd, work_dir):
+    """
+    Dumps "config show" of every daemon admin socket of a node at once, each
+    after a "# <admin socket>" line
+    """
+    return ('mkdir -p %(d)s; for asok in /var/run/ceph/*.asok; do sudo %(ceph)s --admin-daemon $asok config show > %(d)s/`basename $asok` & done; wait; '
+            'for f in %(d)s/*.asok; do echo "# $f"; cat $f; done; rm -rf %(d)s' % {'ceph': ceph_cmd, 'd': work_dir})
+
+
+def parse_config_dumps(text):
+    """ {daemon: config} of the output of config_show_command() """
+    decoder = json.JSONDecoder()
+    configs = {}
+    daemon = None
+    position = 0
+    while position < len(text):
+        if text[position].isspace():
+            position += 1
+        elif text[position] == '#':
+            end = text.find('\n', position)
+            end = len(text) if end < 0 else end
+            m = ASOK_DAEMON.search(text[position + 1:end].strip())
+            daemon = m.group(1) if m else None
+            position = end
+        else:
+            try:
+                config, position = decoder.raw_decode(text, position)
+            except ValueError:
+                # not a config (an error of a dead daemon), skip the line
+                end = text.find('\n', position)
+                position = len(text) if end < 0 else end
+                continue
+            if daemon and isinstance(config, dict):
+                configs[daemon] = config
+    return configs
+
+
+def digest(config):
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class ConfigSnapshot(object):
+    """
+    The running configuration of every daemon of a run. Every distinct
+    config is kept once, by digest, the settings expected to differ from
+    one daemon to the next (IDENTITY_KEYS and any value naming the daemon)
+    apart from it:
+
+        {"daemons": {"osd.0": {"host": <host>, "config": <digest>,
+                               "identity": {<key>: <value>, ...}}, ...},
+         "configs": {<digest>: {<key>: <value>, ...}, ...}}
+    """
+    def __init__(self, daemons=None, configs=None):
+        self.daemons = daemons or {}
+        self.configs = configs or {}
+
+    def add(self, daemon, host, config):
+        identity = {}
+        settings = {}
+        for key, value in config.items():
+            if key in IDENTITY_KEYS or (isinstance(value, str) and daemon in value):
+                identity[key] = value
+            else:
+                settings[key] = value
+        key = digest(settings)
+        self.configs.setdefault(key, settings)
+        self.daemons[daemon] = {'host': host, 'config': key, 'identity': identity}
+
+    def config(self, daemon):
+        return self.configs[self.daemons[daemon]['config']]
+
+    def to_dict(self):
+        return {'daemons': self.daemons, 'configs': self.configs}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('daemons'), data.get('configs'))
+
+    def divergent(self):
+        """
+        {daemon type: {key: {value: [daemons]}}} of the settings not the same
+        on every daemon of a type, the values as json (null when missing)
+        """
+        result = {}
+        for daemon_type in DAEMON_TYPES:
+            daemons = sorted(d for d in self.daemons if d.split('.')[0] == daemon_type)
+            keys = set(self.daemons[d]['config'] for d in daemons)
+            if len(keys) < 2:
+                continue
+            for key in sorted(set().union(*[self.configs[k] for k in keys])):
+                values = {}
+                for d in daemons:
+                    values.setdefault(json.dumps(self.config(d).get(key)), []).append(d)
+                if len(values) > 1:
+                    result.setdefault(daemon_type, {})[key] = values
+        return result
+
+    def diff(self, previous):
+        """
+        {daemon: {key: [previous value, value]}} of the settings changed since
+        the previous snapshot, for the daemons in both; None stands for a
+        setting one of them does not have
+        """
+        result = {}
+        for daemon in sorted(set(self.daemons) & set(previous.daemons)):
+            if self.daemons[daemon]['config'] == previous.daemons[daemon]['config']:
+                continue
+            old, new = previous.config(daemon), self.config(daemon)
+            for key in sorted(set(old) | set(new)):
+                if old.get(key) != new.get(key):
+                    result.setdefault(daemon, {})[key] = [old.get(key), new.get(key)]
+        return result
+
+    def save(self, node, path):
+        """ Writes the snapshot to path on node, in one copy """
+        fd, local = tempfile.mkstemp(prefix='cbt-config.', suffix='.json')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.to_dict(), f, sort_keys=True, separators=(',', ':'))
+            common.scp(node, local, path).communicate()
+        finally:
+            os.unlink(local)
+
+
+def load(path):
+    with open(path) as f:
+        return ConfigSnapshot.from_dict(json.load(f))
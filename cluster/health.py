@@ -0,0 +1,258 @@
+import common
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger("cbt")
+
+# PG states in which the placement groups have not been counted in yet
+UNSETTLED_PG_STATES = ["creating", "unknown"]
+
+
+def _json_lines(stdout):
+    # pdsh prefixes the lines with the host, the json documents start at the
+    # first bracket
+    docs = []
+    for line in stdout.splitlines():
+        starts = [i for i in (line.find('{'), line.find('[')) if i >= 0]
+        if starts:
+            docs.append(json.loads(line[min(starts):]))
+    return docs
+
+
+def _never(stamp):
+    # a PG never scrubbed has a zero stamp, in seconds or as a date
+    return stamp is not None and (stamp.startswith('0.000000') or stamp.startswith('1970-01-01'))
+
+
+def unscrubbed_pgs(stdout):
+    """ Number of PGs "ceph pg dump pgs --format=json" shows as never scrubbed or deep scrubbed """
+    count = 0
+    for doc in _json_lines(stdout):
+        if isinstance(doc, dict):
+            doc = doc.get('pg_map', doc).get('pg_stats', [])
+        count += sum(1 for pg in doc if _never(pg.get('last_scrub_stamp')) or _never(pg.get('last_deep_scrub_stamp')))
+    return count
+
+
+def pending_autoscale(stdout):
+    """ Names of the pools "ceph osd pool autoscale-status --format=json" would still resize """
+    pools = []
+    for doc in _json_lines(stdout):
+        if isinstance(doc, list):
+            pools.extend(pool.get('pool_name') for pool in doc if pool.get('would_adjust'))
+    return pools
+
+
+class ClusterStatus(object):
+    """
+    One snapshot of "ceph -s", "ceph osd pool ls detail" and, when a listener
+    asks for it, "ceph osd pool stats" (json)
+    """
+    def __init__(self, status, pools, polled, pool_stats=None):
+        self.status = status
+        self.pools = pools
+        self.polled = polled
+        self.pool_stats = pool_stats or []
+
+    @property
+    def pgmap(self):
+        return self.status.get('pgmap', {})
+
+    def health(self):
+        return self.status.get('health', {}).get('status', 'HEALTH_UNKNOWN')
+
+    def health_text(self):
+        """ The equivalent of "ceph health detail" on one line """
+        checks = self.status.get('health', {}).get('checks', {})
+        return ' '.join([self.health()] + ['%s: %s' % (name, check.get('summary', {}).get('message', ''))
+                                           for name, check in sorted(checks.items())])
+
+    def pg_states(self):
+        return dict((s['state_name'], s['count']) for s in self.pgmap.get('pgs_by_state', []))
+
+    def pgs_in(self, words):
+        """ Number of PGs with a state containing any of the words """
+        return sum(count for state, count in self.pg_states().items() if any(w in state for w in words))
+
+    def settled(self):
+        """ Every PG of every pool exists and has been peered once """
+        if self.pgs_in(UNSETTLED_PG_STATES):
+            return False
+        return self.pgmap.get('num_pgs', 0) == sum(pool.get('pg_num', 0) for pool in self.pools)
+
+    def healthy(self, check_list):
+        """ Settled and either HEALTH_OK or none of check_list in the health or the PG states """
+        if not self.settled():
+            return False
+        if self.health() == 'HEALTH_OK':
+            return True
+        return not any(word in self.health_text() for word in check_list) and not self.pgs_in(check_list)
+
+    def misplaced(self):
+        return self.pgmap.get('misplaced_objects', 0)
+
+    def degraded(self):
+        return self.pgmap.get('degraded_objects', 0)
+
+    def backfilling(self):
+        return self.misplaced() > 0 or self.pgs_in(['backfill']) > 0
+
+    def autoscaling(self):
+        """ A progress event is open or a pool has not reached its target PG count """
+        if self.status.get('progress_events'):
+            return True
+        for pool in self.pools:
+            if pool.get('pg_num') != pool.get('pg_num_target', pool.get('pg_num')):
+                return True
+            if pool.get('pg_placement_num') != pool.get('pg_placement_num_target', pool.get('pg_placement_num')):
+                return True
+        return False
+
+    def key(self):
+        # what a waiter can care about, the io rates change at every poll
+        pools = [(p.get('pool_name'), p.get('pg_num'), p.get('pg_num_target')) for p in self.pools]
+        return (self.health_text(), sorted(self.pg_states().items()), self.degraded(), self.misplaced(),
+                sorted(self.status.get('progress_events', {})), pools)
+
+
+class HealthWatcher(threading.Thread):
+    """
+    Polls the cluster status of the head node in the background while someone
+    waits on it, one round trip per poll. The polls start min_interval apart
+    and back off up to max_interval as long as nothing changes:
+
+        watcher.wait_for(lambda status: status.misplaced() == 0, timeout=600)
+
+    Only snapshots polled after wait_for() was called are considered.
+
+    Listeners get every snapshot and make the watcher poll at their own fixed
+    interval for as long as they are registered.
+    """
+    def __init__(self, head, ceph_cmd, conf, min_interval=0.5, max_interval=5.0):
+        threading.Thread.__init__(self, name='HealthWatcher')
+        self.daemon = True
+        self.ceph_cmd = ceph_cmd
+        self.conf = conf
+        self.command = '%s -c %s -s --format=json; %s -c %s osd pool ls detail --format=json' % (ceph_cmd, conf, ceph_cmd, conf)
+        self.pool_stats_command = '%s -c %s osd pool stats --format=json' % (ceph_cmd, conf)
+        self.head = head
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.cond = threading.Condition()
+        self.wakeup = threading.Event()
+        self.waiters = 0
+        self.listeners = {}
+        self.snapshot = None
+        self.stopped = False
+        self.polls = 0
+
+    def add_listener(self, listener, interval, pool_stats=False):
+        """ listener(status) is called from the watcher thread with every snapshot """
+        with self.cond:
+            self.listeners[listener] = (interval, pool_stats)
+            self.cond.notify_all()
+        self.wakeup.set()
+
+    def remove_listener(self, listener):
+        with self.cond:
+            self.listeners.pop(listener, None)
+
+    def query(self, args):
+        """ The output of one "ceph ARGS --format=json" on the head, outside of the polls """
+        stdout, _ = common.pdsh(self.head, '%s -c %s %s --format=json' % (self.ceph_cmd, self.conf, args)).communicate()
+        return stdout
+
+    def poll(self, pool_stats=False):
+        polled = time.time()
+        command = self.command
+        if pool_stats:
+            command = '%s; %s' % (command, self.pool_stats_command)
+        stdout, _ = common.pdsh(self.head, command).communicate()
+        self.polls += 1
+        status = None
+        lists = []
+        for doc in _json_lines(stdout):
+            if isinstance(doc, dict):
+                status = status or doc
+            else:
+                lists.append(doc)
+        if status is None:
+            raise ValueError('no status in %r' % stdout[:200])
+        # the pool stats come last, an empty list is as good as the other
+        pools = next((doc for doc in lists if doc and 'pg_num' in doc[0]), lists[0] if lists else [])
+        stats = [doc for doc in lists if doc is not pools]
+        return ClusterStatus(status, pools, polled, stats[0] if stats else [])
+
+    def run(self):
+        interval = self.min_interval
+        last_key = None
+        while True:
+            with self.cond:
+                while not self.waiters and not self.listeners and not self.stopped:
+                    interval = self.min_interval
+                    self.cond.wait()
+                if self.stopped:
+                    return
+                listeners = list(self.listeners.items())
+            # a wake up asked for before this poll is served by it
+            self.wakeup.clear()
+            started = time.time()
+            try:
+                snapshot = self.poll(any(pool_stats for _, (_, pool_stats) in listeners))
+            except Exception as e:
+                logger.warning('Cluster status poll failed: %s', e)
+                snapshot = None
+            with self.cond:
+                if snapshot is not None:
+                    self.snapshot = snapshot
+                    self.cond.notify_all()
+                    key = snapshot.key()
+                    interval = self.min_interval if key != last_key else min(interval * 2, self.max_interval)
+                    last_key = key
+                else:
+                    interval = self.max_interval
+            if listeners:
+                if snapshot is not None:
+                    for listener, _ in listeners:
+                        listener(snapshot)
+                # a fixed rate, whatever the time the poll took
+                interval = max(min(every for _, (every, _) in listeners) - (time.time() - started), 0)
+            self.wakeup.wait(interval)
+
+    def wait_for(self, predicate, timeout=None, on_status=None):
+        """
+        Returns the first fresh snapshot the predicate holds for, or None after
+        timeout seconds (None or a negative value wait forever). on_status is
+        called with every fresh snapshot before the predicate.
+        """
+        since = time.time()
+        deadline = since + timeout if timeout is not None and timeout >= 0 else None
+        seen = None
+        with self.cond:
+            self.waiters += 1
+            self.cond.notify_all()
+        self.wakeup.set()
+        try:
+            while True:
+                with self.cond:
+                    while self.snapshot is None or self.snapshot is seen or self.snapshot.polled < since:
+                        remaining = None if deadline is None else deadline - time.time()
+                        if remaining is not None and remaining <= 0:
+                            return None
+                        self.cond.wait(remaining)
+                    seen = self.snapshot
+                if on_status:
+                    on_status(seen)
+                if predicate(seen):
+                    return seen
+        finally:
+            with self.cond:
+                self.waiters -= 1
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        self.wakeup.set()
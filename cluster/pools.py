@@ -0,0 +1,114 @@
+import hashlib
+import json
+import logging
+
+logger = logging.getLogger("cbt")
+
+# osd pool set options of a pool profile, applied in this order
+POOL_OPTIONS = ['hit_set_type', 'hit_set_count', 'hit_set_period', 'target_max_objects', 'target_max_bytes',
+                'min_read_recency_for_promote', 'min_write_recency_for_promote']
+
+# application metadata key holding the digest of the spec a pool was made from
+SPEC_KEY = 'cbt_spec'
+
+
+def spec_tags(detail):
+    """ The spec digests a pool of "ceph osd pool ls detail" is tagged with """
+    return [meta.get(SPEC_KEY) for meta in detail.get('application_metadata', {}).values() if meta.get(SPEC_KEY)]
+
+
+class PoolSpec(object):
+    """
+    What a pool profile asks for, as data: the commands making the pool and
+    a digest of everything that went into it. A pool made from a spec is
+    tagged with the digest (in its application metadata) once it is
+    complete, including its prefill, so a later run with the same profile
+    can tell it apart from a pool made differently and keep it.
+    """
+    def __init__(self, name, profile, application, base_name=None):
+        self.name = name
+        self.application = application
+        self.base_name = base_name
+        self.pg_num = profile.get('pg_size', 1024)
+        self.pgp_num = profile.get('pgp_size', 1024)
+        self.replication = str(profile.get('replication', None))
+        self.erasure_profile = profile.get('erasure_profile', '')
+        self.ec_overwrites = profile.get('ec_overwrites', False)
+        self.crush_profile = profile.get('crush_profile', None)
+        self.cache_profile = profile.get('cache_profile', None)
+        self.cache_mode = profile.get('cache_mode', None)
+        self.options = [(option, profile.get(option)) for option in POOL_OPTIONS if profile.get(option)]
+        self.prefill_objects = profile.get('prefill_objects', 0)
+        self.prefill_object_size = profile.get('prefill_object_size', 0)
+        self.prefill_time = profile.get('prefill_time', 0)
+        self.prefill_bytes = profile.get('prefill_bytes', 0)
+        self.reuse = profile.get('reuse', False)
+
+    @property
+    def erasure(self):
+        return self.replication == 'erasure'
+
+    @property
+    def size(self):
+        return int(self.replication) if self.replication.isdigit() else None
+
+    @property
+    def min_size(self):
+        return self.size - 1 if self.size and self.size > 2 else 1
+
+    @property
+    def prefill(self):
+        return self.prefill_objects > 0 or self.prefill_bytes > 0 or self.prefill_time > 0
+
+    def digest(self):
+        # what the profile asks for, the name and the application come from the caller
+        spec = dict((key, value) for key, value in self.__dict__.items()
+                    if key not in ('name', 'application', 'base_name', 'reuse'))
+        return hashlib.sha1(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+    def create_commands(self, ceph_cmd, conf, pool_yes_flag='', with_application=True):
+        """ The commands creating the pool and setting its replication and crush rule, in order """
+        prefix = 'sudo %s -c %s osd pool' % (ceph_cmd, conf)
+        if self.erasure:
+            commands = ['%s create %s %d %d erasure %s %s' % (prefix, self.name, self.pg_num, self.pgp_num, self.erasure_profile, pool_yes_flag)]
+            if self.ec_overwrites is True:
+                commands.append('%s set %s allow_ec_overwrites true' % (prefix, self.name))
+        else:
+            commands = ['%s create %s %d %d %s' % (prefix, self.name, self.pg_num, self.pgp_num, pool_yes_flag)]
+        if with_application:
+            commands.append('%s application enable %s %s' % (prefix, self.name, self.application))
+        if self.size:
+            # Add mandatory UI option to actually create a pool of size 1 (Sigh).
+            yes_flag = '--yes-i-really-mean-it' if self.size == 1 else ''
+            commands.append('%s set %s size %d %s' % (prefix, self.name, self.size, yes_flag))
+            commands.append('%s set %s min_size %d %s' % (prefix, self.name, self.min_size, yes_flag))
+        if self.crush_profile:
+            commands.append('%s set %s crush_ruleset %s' % (prefix, self.name, self.crush_profile))
+        return commands
+
+    def option_commands(self, ceph_cmd, conf):
+        """ The commands setting the cache tiering options, once the pool is a tier """
+        return ['sudo %s -c %s osd pool set %s %s %s' % (ceph_cmd, conf, self.name, option, value)
+                for option, value in self.options]
+
+    def tier_commands(self, ceph_cmd, conf):
+        """ The commands making the pool a cache tier of its base pool """
+        if not (self.base_name and self.cache_mode):
+            return []
+        prefix = 'sudo %s -c %s osd tier' % (ceph_cmd, conf)
+        return ['%s add %s %s' % (prefix, self.base_name, self.name),
+                '%s cache-mode %s %s' % (prefix, self.name, self.cache_mode),
+                '%s set-overlay %s %s' % (prefix, self.base_name, self.name)]
+
+    def tag_command(self, ceph_cmd, conf):
+        return 'sudo %s -c %s osd pool application set %s %s %s %s' % (ceph_cmd, conf, self.name, self.application,
+                                                                       SPEC_KEY, self.digest())
+
+    def matches(self, detail):
+        """ The pool of "ceph osd pool ls detail" was made from this spec and still has its PG counts """
+        if not detail:
+            return False
+        if self.digest() not in spec_tags(detail):
+            return False
+        return (detail.get('pg_num_target', detail.get('pg_num')) == self.pg_num and
+                detail.get('pg_placement_num_target', detail.get('pg_placement_num')) == self.pgp_num)
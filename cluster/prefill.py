@@ -0,0 +1,99 @@
+import asyncio
+import common
+import logging
+import re
+import time
+
+logger = logging.getLogger("cbt")
+
+# the per second lines of rados bench: sec, cur ops, started, finished, ...
+PROGRESS_LINE = re.compile(r'^\s*(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s')
+
+
+class Prefill(object):
+    """
+    Fills a pool with "rados bench write --no-cleanup" from procs processes
+    on every node at once instead of a single one on the head. Each process
+    has its own run name, cbt-prefill-<node>-<n>, so the objects and the bench
+    metadata of the processes never collide, and the target object count
+    (a byte count is rounded up to whole objects) is split between them, the
+    remainder going to the first ones. Without a target the processes write
+    for runtime seconds.
+
+    The finished object counts rados bench prints every second are logged
+    every progress_interval seconds.
+    """
+    def __init__(self, rados_cmd, conf, pool, object_size, objects=0, total_bytes=0, runtime=0,
+                 nodes=None, procs=1, concurrent_ios=16, progress_interval=10):
+        self.rados_cmd = rados_cmd
+        self.conf = conf
+        self.pool = pool
+        # the object size of rados bench when none is given
+        self.object_size = int(object_size or 0) or 4194304
+        self.objects = int(objects or 0)
+        if total_bytes and not self.objects:
+            self.objects = -(-int(total_bytes) // self.object_size)
+        self.runtime = runtime
+        self.nodes = nodes
+        self.procs = max(int(procs), 1)
+        self.concurrent_ios = concurrent_ios
+        self.progress_interval = progress_interval
+        self.finished = {}
+
+    def plan(self):
+        """ [(node, run_name, objects)] for every process, objects is 0 for a time based fill """
+        slots = [(node, n) for n in range(self.procs) for node in common.expanded_node_list(self.nodes)]
+        plan = []
+        for i, (node, n) in enumerate(slots):
+            share = 0
+            if self.objects:
+                share = self.objects // len(slots) + (1 if i < self.objects % len(slots) else 0)
+                if not share:
+                    continue
+            plan.append((node, 'cbt-prefill-%s-%d' % (node.rpartition('@')[2], n), share))
+        return plan
+
+    def command(self, run_name, objects):
+        max_objects = '--max-objects %d' % objects if objects else ''
+        return 'sudo %s -c %s -p %s bench %s write -b %d --concurrent-ios %d %s --run-name %s --no-cleanup' % (
+            self.rados_cmd, self.conf, self.pool, self.runtime, self.object_size, self.concurrent_ios,
+            max_objects, run_name)
+
+    def progress(self):
+        return sum(self.finished.values())
+
+    def run(self):
+        """ Runs the fill and returns the number of objects written """
+        plan = self.plan()
+        started = time.time()
+        reported = [started]
+        target = '/%d' % self.objects if self.objects else ''
+        logger.info('Prefilling pool %s with %s%d byte objects from %d processes on %s',
+                    self.pool, '%d ' % self.objects if self.objects else '', self.object_size, len(plan), self.nodes)
+
+        def on_line(run_name):
+            def parse(host, stream, line):
+                m = PROGRESS_LINE.match(line)
+                if stream != 'stdout' or not m:
+                    return
+                self.finished[run_name] = int(m.group(4))
+                now = time.time()
+                if now - reported[0] >= self.progress_interval:
+                    reported[0] = now
+                    done = self.progress()
+                    logger.info('Prefilling pool %s: %d%s objects, %.1f MB/s', self.pool, done, target,
+                                done * self.object_size / 1e6 / (now - started))
+            return parse
+
+        async def run_plan():
+            return await asyncio.gather(*[common.run(node, self.command(run_name, objects), on_line=on_line(run_name),
+                                                     keep_output=False)
+                                          for node, run_name, objects in plan])
+
+        for results in asyncio.run(run_plan()):
+            for result in results.values():
+                if result.rc:
+                    logger.warning('Prefill of pool %s failed on %s: rc=%s', self.pool, result.host, result.rc)
+        done = self.progress()
+        logger.info('Prefilled pool %s with %d%s objects in %.1fs', self.pool, done, target, time.time() - started)
+        return done
@@ -0,0 +1,198 @@
+import common
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger("cbt")
+
+# pgmap fields of "ceph -s", ceph leaves the ones that are 0 out
+RECOVERY_FIELDS = ['degraded_objects', 'degraded_total', 'degraded_ratio',
+                   'misplaced_objects', 'misplaced_total', 'misplaced_ratio',
+                   'recovering_objects_per_sec', 'recovering_bytes_per_sec', 'recovering_keys_per_sec',
+                   'num_objects_recovered', 'num_bytes_recovered',
+                   'read_bytes_sec', 'write_bytes_sec', 'read_op_per_sec', 'write_op_per_sec']
+
+# sections of "ceph osd pool stats" kept per pool
+POOL_SECTIONS = ['recovery', 'recovery_rate', 'client_io_rate']
+
+
+class RecoveryRecorder(object):
+    """
+    Samples the recovery counters of the cluster, and of every pool, at a
+    fixed interval through the health watcher of the cluster. The samples are
+    kept in memory column by column and saved as one json document:
+
+        {"start": <epoch>, "interval": <s>, "events": [[<s>, <name>], ...],
+         "columns": {"time": [<s>, ...], "degraded_objects": [...],
+                     "pool.rbd.recovering_bytes_per_sec": [...], ...}}
+
+    Times are relative to start, a column is null where a sample did not
+    have the field. mark() records the steps of the test.
+    """
+    def __init__(self, watcher, interval=1.0):
+        self.watcher = watcher
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.start_time = None
+        self.events = []
+        self.columns = {'time': []}
+
+    def start(self):
+        self.start_time = time.time()
+        self.watcher.add_listener(self.sample, self.interval, pool_stats=True)
+
+    def stop(self):
+        self.watcher.remove_listener(self.sample)
+
+    def mark(self, name, when=None):
+        with self.lock:
+            self.events.append([round((when or time.time()) - self.start_time, 3), name])
+
+    def sample(self, status):
+        row = {'time': round(status.polled - self.start_time, 3)}
+        for field in RECOVERY_FIELDS:
+            row[field] = status.pgmap.get(field, 0)
+        for pool in status.pool_stats:
+            for section in POOL_SECTIONS:
+                for field, value in pool.get(section, {}).items():
+                    row['pool.%s.%s' % (pool.get('pool_name'), field)] = value
+        self.append(row)
+
+    def append(self, row):
+        with self.lock:
+            count = len(self.columns['time'])
+            for name in row:
+                if name not in self.columns:
+                    self.columns[name] = [None] * count
+            for name, values in self.columns.items():
+                values.append(row.get(name))
+
+    def to_dict(self):
+        with self.lock:
+            return {'start': self.start_time, 'interval': self.interval, 'events': list(self.events),
+                    'columns': dict((name, list(values)) for name, values in self.columns.items())}
+
+    def finish(self, node, path):
+        """ Stops sampling, saves the samples to path on node and returns their analysis """
+        self.stop()
+        self.save(node, path)
+        return analyze(self.to_dict())
+
+    def save(self, node, path):
+        """ Writes the samples to path on node, in one copy """
+        fd, local = tempfile.mkstemp(prefix='cbt-recovery.', suffix='.json')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.to_dict(), f, separators=(',', ':'))
+            common.scp(node, local, path).communicate()
+        finally:
+            os.unlink(local)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _event(data, name):
+    return next((t for t, event in data['events'] if event == name), None)
+
+
+def _values(data, name):
+    return [v or 0 for v in data['columns'].get(name, [None] * len(data['columns']['time']))]
+
+
+def _time_to_zero(times, values, since):
+    """ Time from since until values went back to 0 after being above 0 """
+    seen = False
+    for t, value in zip(times, values):
+        if since is None or t < since:
+            continue
+        if value > 0:
+            seen = True
+        elif seen:
+            return t - since
+    return None
+
+
+def _mean(values):
+    return sum(values) / len(values) if values else None
+
+
+def analyze(data):
+    """
+    Sums a recording up:
+      - time_to_heal: from the osds_out event until nothing is degraded
+      - time_to_backfill: from the osds_in event until nothing is misplaced
+      - recovery: mean and peak bytes/objects per second while recovery is
+        active, and the curve as [time, bytes/s, objects/s]
+      - client: the window in which recovery is active and the client op/s
+        inside it against outside of it (after the client_io event when
+        there is one), impact being the fraction of op/s lost
+      - pools: peak degraded and misplaced objects of every pool and when it
+        was clean again
+    """
+    times = data['columns']['time']
+    degraded = _values(data, 'degraded_objects')
+    misplaced = _values(data, 'misplaced_objects')
+    rate_bytes = _values(data, 'recovering_bytes_per_sec')
+    rate_objects = _values(data, 'recovering_objects_per_sec')
+    client_ops = [r + w for r, w in zip(_values(data, 'read_op_per_sec'), _values(data, 'write_op_per_sec'))]
+    active = [d > 0 or m > 0 or b > 0 for d, m, b in zip(degraded, misplaced, rate_bytes)]
+
+    result = {'samples': len(times),
+              'duration': times[-1] - times[0] if times else 0,
+              'time_to_heal': _time_to_zero(times, degraded, _event(data, 'osds_out')),
+              'time_to_backfill': _time_to_zero(times, misplaced, _event(data, 'osds_in'))}
+
+    during = [i for i, a in enumerate(active) if a]
+    result['recovery'] = {
+        'mean_bytes_per_sec': _mean([rate_bytes[i] for i in during]),
+        'peak_bytes_per_sec': max([rate_bytes[i] for i in during] or [None]),
+        'mean_objects_per_sec': _mean([rate_objects[i] for i in during]),
+        'curve': [[times[i], rate_bytes[i], rate_objects[i]] for i in during]}
+
+    client = {'window': None, 'ops_during': None, 'ops_outside': None, 'impact': None}
+    if during:
+        first, last = times[during[0]], times[during[-1]]
+        client_start = _event(data, 'client_io')
+        inside = [client_ops[i] for i in during if client_start is None or times[i] >= client_start]
+        outside = [client_ops[i] for i, t in enumerate(times)
+                   if not first <= t <= last and (client_start is None or t >= client_start)]
+        client['window'] = [first, last]
+        client['ops_during'] = _mean(inside)
+        client['ops_outside'] = _mean(outside)
+        if client['ops_during'] is not None and client['ops_outside']:
+            client['impact'] = 1 - client['ops_during'] / client['ops_outside']
+    result['client'] = client
+
+    pools = {}
+    for name in data['columns']:
+        if name.startswith('pool.'):
+            pools[name[len('pool.'):name.rindex('.')]] = None
+    for pool in pools:
+        pool_degraded = _values(data, 'pool.%s.degraded_objects' % pool)
+        pool_misplaced = _values(data, 'pool.%s.misplaced_objects' % pool)
+        dirty = [i for i in range(len(times)) if pool_degraded[i] or pool_misplaced[i]]
+        pools[pool] = {'peak_degraded': max(pool_degraded or [0]), 'peak_misplaced': max(pool_misplaced or [0]),
+                       'clean_at': times[dirty[-1] + 1] if dirty and dirty[-1] + 1 < len(times) else None}
+    result['pools'] = pools
+    return result
+
+
+def summary(result):
+    """ One line for the recovery log """
+    def seconds(value):
+        return 'n/a' if value is None else '%.1fs' % value
+    parts = ['%d samples' % result['samples'],
+             'time to heal %s' % seconds(result['time_to_heal']),
+             'time to backfill %s' % seconds(result['time_to_backfill'])]
+    if result['recovery']['peak_bytes_per_sec'] is not None:
+        parts.append('recovery %.1f MB/s mean, %.1f MB/s peak' % (result['recovery']['mean_bytes_per_sec'] / 1e6,
+                                                                 result['recovery']['peak_bytes_per_sec'] / 1e6))
+    if result['client']['impact'] is not None:
+        parts.append('client op/s -%.1f%% during recovery' % (100 * result['client']['impact']))
+    return ', '.join(parts)
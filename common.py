@@ -1,13 +1,27 @@
 """
 Common classes to wrap around pdsh (parallel shell)
 """
+import asyncio
+import atexit
+import base64
+import contextlib
 import errno
+import json
 import logging
 import os
+import re
+import shlex
+import shutil
 import signal
 import socket
 import subprocess
+import sys
+import tarfile
+import threading
+import time
+import uuid
 
+import agent
 import settings
 
 logger = logging.getLogger("cbt")
@@ -41,6 +55,131 @@ def join_nostr(command):
         return ' '.join(command)
     return command
 
+# Remote call tracing
+#
+# When a trace is started every remote call (pdsh, copies, run(), agent
+# requests) appends one JSON line to the trace file with its start and end
+# time, kind, node set, command class, exit code, bytes of output and the
+# phase of the run it belongs to. tools/trace_report.py reads it back.
+
+#global
+TRACE = None
+TRACE_LOCK = threading.Lock()
+# the phases are those of the calling thread, the threads cbt starts take
+# the ones they were created in (see inherit_phases())
+TRACE_PHASES = threading.local()
+# number of subcommand words kept in the command class
+CEPH_TOOLS = {'ceph': 3, 'rados': 1, 'rbd': 1, 'radosgw-admin': 2}
+
+
+def start_trace(path):
+    global TRACE
+    stop_trace()
+    TRACE = open(path, 'a', buffering=1)
+
+
+def stop_trace():
+    global TRACE
+    with TRACE_LOCK:
+        if TRACE is not None:
+            TRACE.close()
+            TRACE = None
+
+
+atexit.register(stop_trace)
+
+
+@contextlib.contextmanager
+def trace_phase(name):
+    """
+    Attributes the remote calls made meanwhile to a phase of the run, phases
+    nest. Usable as a decorator as well.
+    """
+    phases = trace_phases()
+    phases.append(name)
+    try:
+        yield
+    finally:
+        phases.pop()
+
+
+def trace_phases():
+    """ The phases the calling thread is in, outermost first """
+    if not hasattr(TRACE_PHASES, 'stack'):
+        TRACE_PHASES.stack = []
+    return TRACE_PHASES.stack
+
+
+def inherit_phases(phases):
+    """
+    Puts the calling thread in the phases, a copy of the trace_phases() of
+    the thread that created it taken in its __init__
+    """
+    trace_phases()[:] = phases
+
+
+def command_class(command):
+    """
+    Reduces a command line to a pattern for grouping: the executable name,
+    followed by the subcommand for the ceph tools, e.g. 'ceph osd pool set'
+    """
+    command = join_nostr(command).strip()
+    if command.startswith('echo cbt-batch-'):
+        return 'batch'
+    try:
+        lexer = shlex.shlex(command, posix=True, punctuation_chars=True)
+        lexer.whitespace_split = True
+        tokens = list(lexer)
+    except ValueError:
+        tokens = command.split()
+    # the first command of a compound one that is not environment setup
+    segments = [[]]
+    for token in tokens:
+        if token in ('&&', '||', ';', '|', '&'):
+            segments.append([])
+        else:
+            segments[-1].append(token)
+    words = next((s for s in segments if s and s[0] not in ('ulimit', 'cd', 'export')), [])
+    while words and (words[0] in ('sudo', 'env', 'nohup', 'exec', 'time') or
+                     words[0].startswith('-') or '=' in words[0]):
+        words = words[1:]
+    if not words:
+        return ''
+    if words[0] in ('sh', 'bash') and len(words) > 2 and words[1] == '-c':
+        return command_class(words[2])
+    name = os.path.basename(words[0])
+    if name in CEPH_TOOLS:
+        sub = []
+        skip = False
+        for word in words[1:]:
+            if skip:
+                skip = False
+            elif word in ('-c', '--conf', '-p', '--pool', '-n', '--name', '--id', '-i'):
+                skip = True
+            elif re.match(r'^[a-z][a-z0-9_-]*$', word) and len(sub) < CEPH_TOOLS[name]:
+                sub.append(word)
+        name = ' '.join([name] + sub)
+    return name
+
+
+def trace_call(kind, nodes, command, start, rc, nbytes):
+    if TRACE is None:
+        return
+    record = {'t0': round(start, 4), 't1': round(time.time(), 4), 'k': kind,
+              'n': nodes, 'c': command_class(command), 'rc': rc, 'b': nbytes,
+              'p': '/'.join(trace_phases())}
+    with TRACE_LOCK:
+        if TRACE is not None:
+            TRACE.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+
+def traced(proc, kind, nodes, command):
+    """ Makes the communicate() of a CheckedPopen(Multi) record a trace entry """
+    if TRACE is not None:
+        proc.trace = (kind, nodes, command, time.time())
+    return proc
+
+
 class CheckedPopen(object):
     """
     This class overrides the communicate() method to check the return code and
@@ -48,6 +187,7 @@ class CheckedPopen(object):
     """ 
     UNINIT = -720
     OK = 0
+    trace = None
 
     def __init__(self, args, continue_if_error=False, shell=False, env_vars={}):
         logger.debug('CheckedPopen continue_if_error=%s, shell=%s args=%s'
@@ -73,6 +213,9 @@ class CheckedPopen(object):
 
     def communicate(self, input=None):
         stdoutdata, stderrdata = self.popen_obj.communicate(input=input)
+        if self.trace is not None:
+            trace_call(*self.trace, self.popen_obj.returncode, len(stdoutdata) + len(stderrdata))
+            self.trace = None
         stdoutdata = stdoutdata.decode(errors='ignore')
         stderrdata = stderrdata.decode(errors='ignore')
         self.myrtncode = self.popen_obj.returncode  # THIS is the thing we couldn't do before
@@ -117,6 +260,19 @@ class CheckedPopenLocal(CheckedPopen):
 # work correctly.
 
 
+#global
+NODEFILE_CACHE = {}
+def read_nodefile(path):
+    # node files are read again only once they have been modified
+    mtime = os.stat(path).st_mtime_ns
+    cached = NODEFILE_CACHE.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'r') as nodefile:
+            cached = (mtime, [h.strip() for h in nodefile.readlines()])
+        NODEFILE_CACHE[path] = cached
+    return cached[1]
+
+
 def expanded_node_list(nodes):
     # nodes is a comma-separated list for pdsh "-w" parameter
     # nodes may have some entries with '^' prefix, pdsh syntax meaning
@@ -124,9 +280,7 @@ def expanded_node_list(nodes):
     node_list = []
     for h in nodes.split(','):
         if h.startswith('^'):  # pdsh syntax for file containing list of nodes
-            with open(h[1:], 'r') as nodefile:
-                list_from_file = [h.strip() for h in nodefile.readlines()]
-                node_list.extend(list_from_file)
+            node_list.extend(read_nodefile(h[1:]))
         else:
             node_list.append(h)
     # logger.info("full list of hosts: %s" % str(full_node_list))
@@ -148,90 +302,758 @@ def sh(local_node, command, continue_if_error=True):
     return CheckedPopenLocal(local_node, join_nostr(command),
                              continue_if_error=continue_if_error, shell=True)
 
-# Follow-up: implement recognise port option
-def pdsh(nodes, command, continue_if_error=True):
-    local_node = get_localnode(nodes)
-    if local_node:
-        return sh(local_node, command, continue_if_error=continue_if_error)
-    else:
-        pdsh_cmd = settings.common.get("pdsh_cmd", "pdsh")
-        pdsh_ssh_args = settings.common.get("pdsh_ssh_args", None)
-        env = {}
+class CheckedPopenMulti(object):
+    """
+    This class aggregates one CheckedPopen per host so that the callers can
+    treat them as a single pdsh invocation: the output lines are prefixed with
+    the host name and the return code is the last non-zero one seen.
+    """
+    trace = None
+
+    def __init__(self, procs, args, continue_if_error=False):
+        self.procs = procs
+        self.args = args
+        self.myrtncode = CheckedPopen.UNINIT
+        self.continue_if_error = continue_if_error
+
+    def __str__(self):
+        return 'checked_Popen_multi args=%s continue_if_error=%s rtncode=%d' % (join_nostr(self.args), str(self.continue_if_error), self.myrtncode)
+
+    def communicate(self, input=None):
+        out = []
+        err = []
+        rtncode = CheckedPopen.OK
+        for host, proc in self.procs:
+            stdoutdata, stderrdata = proc.communicate(input=input)
+            out.extend('%s: %s\n' % (host, line) for line in stdoutdata.splitlines())
+            err.extend('%s: %s\n' % (host, line) for line in stderrdata.splitlines())
+            if proc.myrtncode != CheckedPopen.OK:
+                rtncode = proc.myrtncode
+        stdoutdata = ''.join(out)
+        stderrdata = ''.join(err)
+        self.myrtncode = rtncode
+        if self.trace is not None:
+            trace_call(*self.trace, rtncode, len(stdoutdata) + len(stderrdata))
+            self.trace = None
+        if self.myrtncode != CheckedPopen.OK and not self.continue_if_error:
+            raise Exception('\n'.join([str(self),
+                                       'stdout:', stdoutdata,
+                                       'stderr:', stderrdata]))
+        return stdoutdata, stderrdata
+
+    def wait(self):
+        self.communicate()
+        return self.myrtncode
+
+    def kill(self, sig=signal.SIGINT):
+        for host, proc in self.procs:
+            proc.kill(sig)
+
+
+class PdshTransport(object):
+    """
+    The default transport: every call forks pdsh (or pdcp/rpdcp/scp), which
+    opens a new ssh session to each of the nodes.
+    """
+    def __init__(self, config):
+        self.pdsh_cmd = config.get("pdsh_cmd", "pdsh")
+        self.pdcp_cmd = config.get("pdcp_cmd", "pdcp")
+        self.rpdcp_cmd = config.get("rpdcp_cmd", "rpdcp")
+        self.env = {}
+        pdsh_ssh_args = config.get("pdsh_ssh_args", None)
         if pdsh_ssh_args:
-            env = {'PDSH_SSH_ARGS':pdsh_ssh_args}
+            self.env = {'PDSH_SSH_ARGS': pdsh_ssh_args}
+
+    def pdsh(self, nodes, command, continue_if_error=True):
         # -f: fan out n nodes, -R rcmd name (ssh by default), -w target node list
-        args = [pdsh_cmd, '-f', str(len(expanded_node_list(nodes))), '-R', 'ssh', '-w', nodes, join_nostr(command)]
+        args = [self.pdsh_cmd, '-f', str(len(expanded_node_list(nodes))), '-R', 'ssh', '-w', nodes, join_nostr(command)]
         # -S means pdsh fails if any host fails
         if not continue_if_error:
             args.insert(1, '-S')
-        return CheckedPopen(args, continue_if_error=continue_if_error, env_vars=env)
+        return CheckedPopen(args, continue_if_error=continue_if_error, env_vars=self.env)
+
+    def pdcp(self, nodes, flags, localfile, remotefile):
+        args = [self.pdcp_cmd, '-f', '10', '-R', 'ssh', '-w', nodes]
+        if flags:
+            args += [flags]
+        return CheckedPopen(args + [localfile, remotefile],
+                            continue_if_error=False, env_vars=self.env)
+
+    def rpdcp(self, nodes, flags, remotefile, localdir):
+        args = [self.rpdcp_cmd, '-f', '10', '-R', 'ssh', '-w', nodes]
+        if flags:
+            args += [flags]
+        return CheckedPopen(args + [remotefile, localdir],
+                            continue_if_error=False, env_vars=self.env)
+
+    def scp(self, node, localfile, remotefile):
+        return CheckedPopen(['scp', localfile, '%s:%s' % (node, remotefile)],
+                            continue_if_error=False)
+
+    def rscp(self, node, remotefile, localfile):
+        return CheckedPopen(['scp', '%s:%s' % (node, remotefile), localfile],
+                            continue_if_error=False)
+
+    def remote_args(self, host, command):
+        """ argv of a local process running command on host over stdio """
+        return ['ssh', host, command]
+
+    def stream_args(self, nodes, command, concurrency):
+        """
+        [(label, argv, env)] of the local processes run by the asyncio engine,
+        a label of None means that the process prefixes its output lines with
+        the host name like pdsh does.
+        """
+        args = [self.pdsh_cmd, '-f', str(concurrency), '-R', 'ssh', '-w', nodes, join_nostr(command)]
+        return [(None, args, self.env)]
+
+    def close(self):
+        pass
+
+
+class SshMuxTransport(PdshTransport):
+    """
+    Runs every remote call through OpenSSH connection multiplexing. The first
+    call to a host starts a ControlMaster that stays alive for
+    ssh_control_persist, every later ssh or scp to that host is a new channel
+    on the already authenticated connection instead of a fresh handshake.
+    """
+    def __init__(self, config):
+        super(SshMuxTransport, self).__init__(config)
+        self.ssh_cmd = config.get("ssh_cmd", "ssh")
+        self.scp_cmd = config.get("scp_cmd", "scp")
+        self.control_dir = config.get("ssh_control_dir", "/tmp/cbt-ssh.%d" % os.getpid())
+        self.control_persist = str(config.get("ssh_control_persist", "10m"))
+        self.extra_args = shlex.split(config.get("ssh_args", ""))
+        self.hosts = set()
+
+    def mux_args(self):
+        return ['-o', 'ControlMaster=auto',
+                '-o', 'ControlPath=%s/%%C' % self.control_dir,
+                '-o', 'ControlPersist=%s' % self.control_persist,
+                '-o', 'BatchMode=yes'] + self.extra_args
+
+    def _host_label(self, host):
+        # pdsh labels its output and rpdcp its files without the user part
+        return host.rpartition('@')[2]
+
+    def _spawn(self, nodes, make_args, continue_if_error, shell=False):
+        mkdir_p(self.control_dir)
+        procs = []
+        all_args = []
+        for host in expanded_node_list(nodes):
+            self.hosts.add(host)
+            args = make_args(host)
+            all_args.append(join_nostr(args))
+            procs.append((self._host_label(host),
+                          CheckedPopen(args, continue_if_error=True, shell=shell)))
+        return CheckedPopenMulti(procs, all_args, continue_if_error=continue_if_error)
+
+    def pdsh(self, nodes, command, continue_if_error=True):
+        return self._spawn(nodes,
+                           lambda host: [self.ssh_cmd] + self.mux_args() + [host, join_nostr(command)],
+                           continue_if_error)
+
+    def pdcp(self, nodes, flags, localfile, remotefile):
+        flag_args = [flags] if flags else []
+        return self._spawn(nodes,
+                           lambda host: [self.scp_cmd] + flag_args + self.mux_args() + [localfile, '%s:%s' % (host, remotefile)],
+                           False)
+
+    def rpdcp(self, nodes, flags, remotefile, localdir):
+        # Mimic rpdcp: every copied entry gets the host name as a suffix.
+        # Copy into a private directory first and rename from there.
+        def make_cmd(host):
+            scp_args = [self.scp_cmd] + ([flags] if flags else []) + self.mux_args()
+            scp_args += ['%s:%s' % (host, remotefile), '"$d"/']
+            return ('d=$(mktemp -d -p %s) && %s; rc=$?; '
+                    'for i in "$d"/*; do [ -e "$i" ] && mv "$i" %s/"$(basename "$i")".%s; done; '
+                    'rmdir "$d"; exit $rc') % (
+                        shlex.quote(localdir),
+                        ' '.join(a if a == '"$d"/' else shlex.quote(a) for a in scp_args),
+                        shlex.quote(localdir), shlex.quote(self._host_label(host)))
+        return self._spawn(nodes, make_cmd, False, shell=True)
+
+    def scp(self, node, localfile, remotefile):
+        mkdir_p(self.control_dir)
+        self.hosts.add(node)
+        return CheckedPopen([self.scp_cmd] + self.mux_args() + [localfile, '%s:%s' % (node, remotefile)],
+                            continue_if_error=False)
+
+    def rscp(self, node, remotefile, localfile):
+        mkdir_p(self.control_dir)
+        self.hosts.add(node)
+        return CheckedPopen([self.scp_cmd] + self.mux_args() + ['%s:%s' % (node, remotefile), localfile],
+                            continue_if_error=False)
+
+    def remote_args(self, host, command):
+        self.hosts.add(host)
+        mkdir_p(self.control_dir)
+        return [self.ssh_cmd] + self.mux_args() + [host, command]
+
+    def stream_args(self, nodes, command, concurrency):
+        return [(self._host_label(host), self.remote_args(host, join_nostr(command)), {})
+                for host in expanded_node_list(nodes)]
+
+    def close(self):
+        # Tear down the master connections, they would otherwise linger
+        # until ControlPersist expires.
+        for host in self.hosts:
+            subprocess.call([self.ssh_cmd] + self.mux_args() + ['-O', 'exit', host],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.hosts = set()
+
+
+FAKECLUSTER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fakecluster.py')
+
+
+class FakeTransport(PdshTransport):
+    """
+    Simulates the nodes on the local host (see fakecluster.py) to benchmark
+    and test cbt itself without a cluster: each node gets a private directory
+    tree under fake_root and its commands are answered by fixtures after
+    fake_latency seconds. The nodes must still resolve and not name the local
+    host, e.g. 127.1.0.1, 127.1.0.2, ...
+    """
+    def __init__(self, config):
+        super(FakeTransport, self).__init__(config)
+        self.root = config.get("fake_root", "/tmp/cbt-fake.%d" % os.getpid())
+        self.args = [sys.executable, FAKECLUSTER, '--root', self.root,
+                     '--latency', str(config.get("fake_latency", 0))]
+        if config.get("fake_fixtures"):
+            self.args += ['--fixtures', config["fake_fixtures"]]
+        # every simulated node is a python process for the per-host calls
+        # (sync, agents), only that many of them run at a time
+        self.slots = int(config.get("fake_exec_slots", 16))
+        self.calls = 0
+
+    def _hosts(self, nodes):
+        return ','.join(expanded_node_list(nodes))
+
+    def pdsh(self, nodes, command, continue_if_error=True):
+        args = self.args + ['pdsh', '-f', str(len(expanded_node_list(nodes))), '-w', self._hosts(nodes), join_nostr(command)]
+        if not continue_if_error:
+            args.insert(len(self.args) + 1, '-S')
+        return CheckedPopen(args, continue_if_error=continue_if_error)
+
+    def pdcp(self, nodes, flags, localfile, remotefile):
+        args = self.args + ['pdcp'] + (['-r'] if flags and 'r' in flags else [])
+        return CheckedPopen(args + ['-w', self._hosts(nodes), localfile, remotefile], continue_if_error=False)
+
+    def rpdcp(self, nodes, flags, remotefile, localdir):
+        args = self.args + ['rpdcp'] + (['-r'] if flags and 'r' in flags else [])
+        return CheckedPopen(args + ['-w', self._hosts(nodes), remotefile, localdir], continue_if_error=False)
+
+    def scp(self, node, localfile, remotefile):
+        return self.pdcp(node, '-r', localfile, remotefile)
+
+    def rscp(self, node, remotefile, localfile):
+        return CheckedPopen(self.args + ['rscp', node, remotefile, localfile], continue_if_error=False)
+
+    def remote_args(self, host, command):
+        args = self.args + ['exec', host, command]
+        if self.slots > 0 and shutil.which('flock'):
+            mkdir_p(self.root)
+            self.calls += 1
+            args = ['flock', os.path.join(self.root, '.slot-%d' % (self.calls % self.slots))] + args
+        return args
+
+    def stream_args(self, nodes, command, concurrency):
+        return [(None, self.args + ['pdsh', '-f', str(concurrency), '-w', self._hosts(nodes), join_nostr(command)], {})]
+
+
+TRANSPORTS = {
+    'pdsh': PdshTransport,
+    'ssh': SshMuxTransport,
+    'fake': FakeTransport,
+}
+
+#global
+SINGLETON_TRANSPORT = None
+def get_transport():
+    """
+    Returns the transport selected with the 'transport' key of the common
+    section, the pdsh transport being the default. It is rebuilt whenever
+    the common section is replaced.
+    """
+    global SINGLETON_TRANSPORT
+    name = settings.common.get("transport", "pdsh")
+    if (SINGLETON_TRANSPORT is None or SINGLETON_TRANSPORT[0] != name or
+            SINGLETON_TRANSPORT[1] is not settings.common):
+        if name not in TRANSPORTS:
+            raise ValueError('Unknown transport "%s", valid ones are: %s' % (name, ', '.join(sorted(TRANSPORTS))))
+        if SINGLETON_TRANSPORT is not None:
+            SINGLETON_TRANSPORT[2].close()
+        SINGLETON_TRANSPORT = (name, settings.common, TRANSPORTS[name](settings.common))
+    return SINGLETON_TRANSPORT[2]
+
+
+def close_transport():
+    """ Closes the current transport, those it replaced are closed already """
+    global SINGLETON_TRANSPORT
+    if SINGLETON_TRANSPORT is not None:
+        SINGLETON_TRANSPORT[2].close()
+        SINGLETON_TRANSPORT = None
+
+
+atexit.register(close_transport)
+
+
+# Follow-up: implement recognise port option
+def pdsh(nodes, command, continue_if_error=True):
+    local_node = get_localnode(nodes)
+    if local_node:
+        proc = sh(local_node, command, continue_if_error=continue_if_error)
+    else:
+        proc = get_transport().pdsh(nodes, command, continue_if_error=continue_if_error)
+    return traced(proc, 'pdsh', nodes, command)
 
 
 def pdcp(nodes, flags, localfile, remotefile):
     local_node = get_localnode(nodes)
     if local_node:
-        return sh(local_node, ['cp', flags, localfile, remotefile], continue_if_error=False)
+        proc = sh(local_node, ['cp', flags, localfile, remotefile], continue_if_error=False)
     else:
-        pdcp_cmd = settings.common.get("pdcp_cmd", "pdcp")
-        pdsh_ssh_args = settings.common.get("pdsh_ssh_args", None)
-        env = {}
-        if pdsh_ssh_args:
-            env = {'PDSH_SSH_ARGS':pdsh_ssh_args}
-        args = [pdcp_cmd, '-f', '10', '-R', 'ssh', '-w', nodes]
-        if flags:
-            args += [flags]
-        return CheckedPopen(args + [localfile, remotefile],
-                            continue_if_error=False, env_vars=env)
+        proc = get_transport().pdcp(nodes, flags, localfile, remotefile)
+    return traced(proc, 'pdcp', nodes, 'pdcp')
 
 
 def rpdcp(nodes, flags, remotefile, localdir):
     local_node = get_localnode(nodes)
     if local_node:
         assert len(expanded_node_list(nodes)) == 1
-        return sh(local_node, ['for', 'i', 'in', remotefile, ';',
+        proc = sh(local_node, ['for', 'i', 'in', remotefile, ';',
                                'do', 'cp', flags, '${i}', "%s/$(basename ${i}).%s" % (localdir, local_node), ';',
                                'done'],
                   continue_if_error=False)
     else:
-        rpdcp_cmd = settings.common.get("rpdcp_cmd", "rpdcp")
-        pdsh_ssh_args = settings.common.get("pdsh_ssh_args", None)
-        env = {}
-        if pdsh_ssh_args:
-            env = {'PDSH_SSH_ARGS':pdsh_ssh_args}
-        args = [rpdcp_cmd, '-f', '10', '-R', 'ssh', '-w', nodes]
-        if flags:
-            args += [flags]
-        return CheckedPopen(args + [remotefile, localdir],
-                            continue_if_error=False, env_vars=env)
+        proc = get_transport().rpdcp(nodes, flags, remotefile, localdir)
+    return traced(proc, 'rpdcp', nodes, 'rpdcp')
 
 
 def scp(node, localfile, remotefile):
     local_node = get_localnode(node)
     if local_node:
-        return sh(local_node, ['cp', localfile, remotefile], continue_if_error=False)
+        proc = sh(local_node, ['cp', localfile, remotefile], continue_if_error=False)
     else:
-        return CheckedPopen(['scp', localfile, '%s:%s' % (node, remotefile)],
-                            continue_if_error=False)
+        proc = get_transport().scp(node, localfile, remotefile)
+    return traced(proc, 'scp', node, 'scp')
 
 
 def rscp(node, remotefile, localfile):
     local_node = get_localnode(node)
     if local_node:
-        return sh(local_node, ['cp', remotefile, localfile], continue_if_error=False)
+        proc = sh(local_node, ['cp', remotefile, localfile], continue_if_error=False)
     else:
-        return CheckedPopen(['scp', '%s:%s' % (node, remotefile), localfile],
-                            continue_if_error=False)
+        proc = get_transport().rscp(node, remotefile, localfile)
+    return traced(proc, 'rscp', node, 'rscp')
+
+
+#global
+AGENTS = {}
+def start_agents(nodes):
+    """
+    Start a remote agent (see agent.py) on each of the nodes. A node where
+    the agent cannot be started keeps using the transport.
+    """
+    hosts = [host for host in expanded_node_list(nodes) if host not in AGENTS or not AGENTS[host].alive()]
+    AGENTS.update(spawn_agents(','.join(hosts)))
+    atexit.register(stop_agents)
+
+
+def spawn_agents(nodes):
+    """
+    Starts an agent on each of the nodes in parallel and returns {host: agent}
+    for the ones that answered, the caller owns them.
+    """
+    python = settings.common.get("agent_python", "python3")
+    command, source = agent.bootstrap_command(python)
+    started = []
+    for host in expanded_node_list(nodes):
+        if not host:
+            continue
+        if getLocalhost(host.rpartition('@')[2]):
+            args = ['sh', '-c', command]
+        else:
+            args = get_transport().remote_args(host, command)
+        started.append(agent.RemoteAgent(host, args, source))
+    agents = {}
+    for a in started:
+        try:
+            a.handshake()
+            agents[a.host] = a
+        except agent.AgentError as e:
+            logger.warning('%s, using %s for this node' % (str(e), settings.common.get("transport", "pdsh")))
+    return agents
+
+
+def stop_agents():
+    for a in AGENTS.values():
+        a.close()
+    AGENTS.clear()
+
+
+def get_agents(nodes):
+    """ Returns [(host, agent)] if every node has a live agent, None otherwise """
+    agents = []
+    for host in expanded_node_list(nodes):
+        a = AGENTS.get(host)
+        if a is None or not a.alive():
+            return None
+        agents.append((host.rpartition('@')[2], a))
+    return agents
+
+
+def _agents_call(agents, op, continue_if_error, **kwargs):
+    start = time.time()
+    rc = 0
+    try:
+        return agent.call_many(agents, op, **kwargs)
+    except agent.AgentError as e:
+        rc = 1
+        if not continue_if_error:
+            raise
+        logger.warning('agent %s failed: %s, continuing anyway...' % (op, str(e)))
+    finally:
+        trace_call('agent', ','.join(label for label, _ in agents), kwargs.get('cmd', 'agent ' + op), start, rc, 0)
+
+
+def remote_mkdir(nodes, path, continue_if_error=False):
+    agents = get_agents(nodes)
+    if agents:
+        return _agents_call(agents, 'mkdir', continue_if_error, path=path)
+    pdsh(nodes, 'mkdir -p -m0755 -- %s' % path, continue_if_error=continue_if_error).communicate()
+
+
+def remote_kill(nodes, name, sig='9', full=False, sudo=True):
+    """
+    Signal processes on the nodes by name like killall, or by a pattern
+    matched against the full command line like pkill -f.
+    """
+    agents = get_agents(nodes)
+    if agents:
+        return _agents_call(agents, 'kill', True, name=name, signal=sig, full=full, sudo=sudo)
+    cmd = 'pkill -%s -f %s' % (sig, shlex.quote(name)) if full else 'killall -%s %s' % (sig, name)
+    if sudo:
+        cmd = 'sudo ' + cmd
+    pdsh(nodes, cmd).communicate()
+
+
+def remote_append(nodes, path, data):
+    """ Append a line to a file on the nodes """
+    agents = get_agents(nodes)
+    if agents:
+        return _agents_call(agents, 'append', True, path=path, data=data)
+    pdsh(nodes, 'echo %s >> %s' % (shlex.quote(data.rstrip('\n')), path)).communicate()
+
+
+# asyncio execution engine
+#
+# run() starts the remote command on a node set and reads the output of every
+# host line by line while it is produced, so that callers can follow hundreds
+# of client processes from one event loop without a thread per process and
+# without keeping their whole output in memory.
+
+PDSH_EXIT_RE = re.compile(r'^pdsh@[^:]*: (\S+): ssh exited with exit code (\d+)$')
+
+
+class RemoteResult(object):
+    """ Outcome of run() on one host, rc is None if the command was cancelled """
+    def __init__(self, host):
+        self.host = host
+        self.rc = None
+        self.nbytes = 0
+        self.stdout = []
+        self.stderr = []
+
+    def output(self):
+        return ''.join(self.stdout), ''.join(self.stderr)
+
+    def __str__(self):
+        return '%s: rc=%s' % (self.host, self.rc)
+
+
+async def _terminate(proc, grace=5):
+    # the process leads its own session (pdsh, ssh or sh), signal the group
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        await asyncio.wait_for(proc.wait(), grace)
+    except ProcessLookupError:
+        pass
+    except asyncio.TimeoutError:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await proc.wait()
+
+
+async def _pump(reader, stream, label, results, on_line, keep_output):
+    while True:
+        line = await reader.readline()
+        if not line:
+            return
+        line = line.decode(errors='ignore')
+        host = label
+        if host is None:
+            match = PDSH_EXIT_RE.match(line.rstrip('\n'))
+            if match:
+                if match.group(1) in results:
+                    results[match.group(1)].rc = int(match.group(2))
+                continue
+            host, sep, rest = line.partition(': ')
+            if not sep or host not in results:
+                logger.debug('pdsh: %s' % line.rstrip('\n'))
+                continue
+            line = rest
+        results[host].nbytes += len(line)
+        if keep_output:
+            getattr(results[host], stream).append(line)
+        if on_line is not None:
+            on_line(host, stream, line.rstrip('\n'))
+
+
+async def _run_process(label, args, env, results, on_line, keep_output, semaphore):
+    async with semaphore:
+        full_env = dict(os.environ)
+        full_env.update(env)
+        full_env['LC_ALL'] = 'C'
+        proc = await asyncio.create_subprocess_exec(*args, stdin=subprocess.DEVNULL,
+                                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                                    start_new_session=True, env=full_env)
+        try:
+            await asyncio.gather(_pump(proc.stdout, 'stdout', label, results, on_line, keep_output),
+                                 _pump(proc.stderr, 'stderr', label, results, on_line, keep_output))
+            rc = await proc.wait()
+        except BaseException:
+            # cancelled or timed out: do not leave the remote command behind
+            await asyncio.shield(_terminate(proc))
+            raise
+        if label is not None:
+            results[label].rc = rc
+        else:
+            # pdsh only reports the hosts that failed
+            reported = any(result.rc for result in results.values())
+            for result in results.values():
+                if result.rc is None:
+                    result.rc = rc if rc != 0 and not reported else 0
+
+
+async def run(nodes, command, on_line=None, timeout=None, concurrency=None,
+              continue_if_error=True, keep_output=True):
+    """
+    Runs command on the nodes and returns {host: RemoteResult}.
+
+    on_line(host, stream, line) is called for every line of output as soon as
+    it arrives, stream being 'stdout' or 'stderr'. With keep_output=False the
+    output is only handed to on_line and not kept in the results.
+    concurrency limits the number of hosts running the command at the same
+    time (all of them by default). When the timeout (in seconds) expires or
+    the calling task is cancelled the local processes are terminated, which
+    closes their ssh sessions, and asyncio.TimeoutError/CancelledError is
+    raised.
+    """
+    hosts = [host.rpartition('@')[2] for host in expanded_node_list(nodes)]
+    concurrency = concurrency or max(len(hosts), 1)
+    results = dict((host, RemoteResult(host)) for host in hosts)
+    local_node = get_localnode(nodes)
+    if local_node:
+        procs = [(local_node, ['sh', '-c', join_nostr(command)], {})]
+        results = {local_node: RemoteResult(local_node)}
+    else:
+        procs = get_transport().stream_args(nodes, command, concurrency)
+    logger.debug('run concurrency=%d timeout=%s on %s: %s' % (concurrency, timeout, nodes, join_nostr(command)))
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.time()
+    try:
+        await asyncio.wait_for(asyncio.gather(*[_run_process(label, args, env, results, on_line, keep_output, semaphore)
+                                                for label, args, env in procs]),
+                               timeout)
+    finally:
+        rcs = [r.rc for r in results.values()]
+        trace_call('run', nodes, command, start, next((rc for rc in rcs if rc != 0), 0),
+                   sum(r.nbytes for r in results.values()))
+    failed = [r for r in results.values() if r.rc != 0]
+    if failed:
+        if not continue_if_error:
+            raise Exception('\n'.join(['run "%s" failed:' % join_nostr(command)] +
+                                       ['%s\nstdout:\n%s\nstderr:\n%s' % ((r,) + r.output()) for r in failed]))
+        logger.warning(join_nostr(command))
+        logger.warning('error seen on %s, continuing anyway...' % ', '.join(str(r) for r in failed))
+    return results
+
+
+def run_all(nodes, commands, **kwargs):
+    """
+    Blocking helper: runs every command of the list on the nodes at the same
+    time in a private event loop and returns the run() results in order.
+    """
+    async def run_commands():
+        return await asyncio.gather(*[run(nodes, command, **kwargs) for command in commands])
+    return asyncio.run(run_commands())
+
+
+class Batch(object):
+    """
+    Collects commands for a node set and ships them as one remote invocation,
+    while still reporting the exit status and the output of every command on
+    every host:
+
+        with common.Batch(nodes) as batch:
+            batch.add('sudo killall -9 ceph-osd')
+            batch.add('sudo killall -9 ceph-mon')
+        rc, output = batch.results[0]['host1']
+
+    A command added with continue_if_error=False stops the batch on the hosts
+    where it fails and makes run() raise once all hosts have reported, which
+    matches a sequence of pdsh(..., continue_if_error=False).communicate().
+    """
+    def __init__(self, nodes, continue_if_error=True):
+        self.nodes = nodes
+        self.continue_if_error = continue_if_error
+        self.commands = []
+        self.results = []
+        self.token = 'cbt-batch-%s' % uuid.uuid4().hex[:12]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.run()
+        return False
+
+    def add(self, command, continue_if_error=None):
+        if continue_if_error is None:
+            continue_if_error = self.continue_if_error
+        self.commands.append((join_nostr(command), continue_if_error))
+
+    def script(self):
+        parts = []
+        for i, (command, continue_if_error) in enumerate(self.commands):
+            # the echo ends the last line of the output, should it have no newline
+            parts.append('echo %s-begin-%d; ( %s ) 2>&1; rc=$?; echo; echo %s-end-%d-$rc' %
+                         (self.token, i, command, self.token, i))
+            if not continue_if_error:
+                parts.append('[ $rc -eq 0 ] || exit $rc')
+        # bash whatever the shell of the transport: the login shell of the
+        # user for pdsh and ssh, /bin/sh for the agents
+        return 'bash -c %s' % shlex.quote('; '.join(parts))
+
+    def _parse(self, lines):
+        # Returns [(rc, output)] for one host, rc is None for the commands
+        # that did not run
+        results = [(None, '')] * len(self.commands)
+        begin = re.compile(r'^%s-begin-(\d+)$' % self.token)
+        end = re.compile(r'^%s-end-(\d+)-(\d+)$' % self.token)
+        output = []
+        for line in lines:
+            if begin.match(line):
+                output = []
+            elif end.match(line):
+                m = end.match(line)
+                # less the newline echoed before the end marker
+                results[int(m.group(1))] = (int(m.group(2)), ''.join(output)[:-1])
+            else:
+                output.append(line + '\n')
+        return results
+
+    def run(self):
+        """ Runs the commands, results[i] maps each host to (rc, output) of command i """
+        if not self.commands:
+            return self.results
+        logger.debug('Batch of %d commands on %s' % (len(self.commands), self.nodes))
+        per_host = {}
+        agents = get_agents(self.nodes)
+        if agents:
+            for host, result in _agents_call(agents, 'run', False, cmd=self.script()).items():
+                per_host[host] = result['stdout'].splitlines()
+        else:
+            stdout, stderr = pdsh(self.nodes, self.script()).communicate()
+            per_host = split_host_output(self.nodes, stdout)
+        self.results = [{} for _ in self.commands]
+        for host, lines in per_host.items():
+            for i, result in enumerate(self._parse(lines)):
+                self.results[i][host] = result
+        failed = self.failed(stopping_only=True)
+        if failed:
+            raise Exception('\n'.join('%s: "%s" failed rc=%s:\n%s' % (host, command, rc, output)
+                                      for command, host, rc, output in failed))
+        return self.results
+
+    def failed(self, stopping_only=False):
+        """ Returns (command, host, rc, output) for every command that failed """
+        failed = []
+        for (command, continue_if_error), result in zip(self.commands, self.results):
+            if stopping_only and continue_if_error:
+                continue
+            for host, (rc, output) in sorted(result.items()):
+                if rc != 0:
+                    failed.append((command, host, rc, output))
+        return failed
 
 
 def get_fqdn_cmd():
     return 'hostname -f'
 
 
+#global
+FQDN_CACHE = (None, set(), {})
+def _sweep_fqdns(nodes):
+    # one parallel pdsh for all the remote nodes, the local ones are answered
+    # without a round trip
+    fqdns = {}
+    remote = []
+    for node in nodes:
+        local_node = getLocalhost(node.rpartition('@')[2])
+        if local_node:
+            fqdn = get_fqdn_local()
+            fqdns[node] = {'fqdn': fqdn, 'short': socket.gethostname().split('.')[0]}
+        else:
+            remote.append(node)
+    if remote:
+        labels = dict((node.rpartition('@')[2], node) for node in remote)
+        stdout, stderr = pdsh(','.join(remote), 'echo $(%s) $(hostname -s)' % get_fqdn_cmd()).communicate()
+        for line in stdout.splitlines():
+            label, _, names = line.partition(': ')
+            names = names.split()
+            if label in labels and len(names) == 2:
+                fqdns[labels[label]] = {'fqdn': names[0], 'short': names[1]}
+    missing = [node for node in nodes if node not in fqdns]
+    if missing:
+        logger.warning('Could not get the fqdn of %s' % ', '.join(missing))
+    return fqdns
+
+
+def get_fqdn_map(nodes=None, refresh=False):
+    """
+    Returns {node: {'fqdn': ..., 'short': ...}} for the nodes of the roles
+    given (all the roles by default), nodes being named as in getnodes().
+    All the nodes of the cluster are swept in one pdsh the first time and
+    the result kept for the cluster session, refresh=True sweeps again.
+    """
+    global FQDN_CACHE
+    all_nodes = [node for node in settings.getnodes(*settings.ROLES).split(',') if node]
+    owner, swept, fqdns = FQDN_CACHE
+    if refresh or owner is not settings.cluster:
+        swept = set()
+        fqdns = {}
+        FQDN_CACHE = (settings.cluster, swept, fqdns)
+    # a node that did not answer is not asked again until a refresh
+    unknown = [node for node in all_nodes if node not in swept]
+    if unknown:
+        fqdns.update(_sweep_fqdns(unknown))
+        swept.update(unknown)
+    if nodes is None:
+        wanted = all_nodes
+    else:
+        wanted = settings.getnodes(nodes).split(',')
+    return dict((node, dict(fqdns[node])) for node in wanted if node in fqdns)
+
+
 def get_fqdn_list(nodes):
-    stdout, stderr = pdsh(settings.getnodes(nodes), '%s' % get_fqdn_cmd()).communicate()
-    print(stdout)
-    ret = [i.split(' ', 1)[1] for i in stdout.splitlines()]
-    print(ret)
+    ret = [info['fqdn'] for info in get_fqdn_map(nodes).values()]
+    logger.debug('fqdns of %s: %s' % (nodes, ret))
     return ret
 
 
@@ -253,21 +1075,317 @@ def clean_remote_dir(remote_dir):
 
 def make_remote_dir(remote_dir):
     nodes = settings.getnodes('clients', 'osds', 'mons', 'rgws', 'mds')
-    pdsh(nodes, 'mkdir -p -m0755 -- %s' % remote_dir,
-         continue_if_error=False).communicate()
+    remote_mkdir(nodes, remote_dir)
+
+
+SYNC_MANIFEST = '.sync_manifest.json'
+
+
+def split_host_output(nodes, stdout):
+    """
+    Splits the output of pdsh(nodes, ...) into {host: [lines]}, every host of
+    nodes being present even if it did not output anything
+    """
+    local_node = get_localnode(nodes)
+    if local_node:
+        # only the first line is prefixed by sh()
+        return {local_node: stdout[len(local_node) + 2:].splitlines()}
+    per_host = dict((host.rpartition('@')[2], []) for host in expanded_node_list(nodes))
+    for line in stdout.splitlines():
+        host, _, rest = line.partition(': ')
+        per_host.setdefault(host, []).append(rest)
+    return per_host
 
 
 def sync_files(remote_dir, local_dir):
+    """
+    Copies remote_dir (a directory or a glob) from every node into local_dir
+    the way rpdcp -r does: each entry gets the host name as a suffix.
+
+    By default the files are chowned and copied with rpdcp. With sync: tar
+    in the common section every node streams a compressed tar of the files
+    that changed since the last sync of local_dir according to a size/mtime
+    manifest, sync_parallel (default 32) nodes at a time.
+    """
     nodes = settings.getnodes('clients', 'osds', 'mons', 'rgws', 'mds')
 
     if not os.path.exists(local_dir):
         os.makedirs(local_dir)
 
-    if 'user' in settings.cluster:
-        pdsh(nodes,
-             'sudo chown -R {0}.{0} {1}'.format(settings.cluster['user'], remote_dir),
-             continue_if_error=False).communicate()
-    rpdcp(nodes, '-r', remote_dir, local_dir).communicate()
+    if settings.common.get('sync', 'rpdcp') != 'tar':
+        if 'user' in settings.cluster:
+            pdsh(nodes,
+                 'sudo chown -R {0}.{0} {1}'.format(settings.cluster['user'], remote_dir),
+                 continue_if_error=False).communicate()
+        rpdcp(nodes, '-r', remote_dir, local_dir).communicate()
+        return
+
+    manifest_file = os.path.join(local_dir, SYNC_MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+
+    # One parallel listing of the files with their size and mtime, the nodes
+    # with nothing new are left alone afterwards.
+    parent = os.path.dirname(remote_dir.rstrip('/'))
+    stdout, stderr = pdsh(nodes, "sudo find %s -type f -printf '%%s %%T@ %%p\\n' 2>/dev/null" % remote_dir).communicate()
+    wanted = {}
+    for label, lines in split_host_output(nodes, stdout).items():
+        for line in lines:
+            fields = line.split(' ', 2)
+            if len(fields) != 3 or not fields[2].startswith(parent + '/'):
+                continue
+            path = os.path.relpath(fields[2], parent)
+            stamp = '%s %s' % (fields[0], fields[1])
+            if manifest.get(label, {}).get(path) == stamp:
+                continue
+            try:
+                # already shipped by a ResultStreamer
+                st = os.stat(sync_local_path(local_dir, path, label))
+                if st.st_size == int(fields[0]) and int(st.st_mtime) == int(float(fields[1])):
+                    manifest.setdefault(label, {})[path] = stamp
+                    continue
+            except (OSError, ValueError):
+                pass
+            wanted.setdefault(label, {})[path] = stamp
+
+    hosts = dict((host.rpartition('@')[2], host) for host in expanded_node_list(nodes))
+    slots = threading.BoundedSemaphore(max(int(settings.common.get('sync_parallel', 32)), 1))
+    threads = []
+    for label, files in wanted.items():
+        if label not in hosts:
+            continue
+        thread = SyncThread(hosts[label], label, parent, sorted(files), local_dir, slots)
+        thread.start()
+        threads.append((thread, files))
+    errors = []
+    for thread, files in threads:
+        thread.join()
+        if thread.error:
+            errors.append(thread.error)
+        host_manifest = manifest.setdefault(thread.label, {})
+        for path in thread.copied:
+            host_manifest[path] = files[path]
+
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f)
+    if errors:
+        raise Exception('\n'.join(errors))
+
+
+def sync_local_path(local_dir, name, label):
+    """
+    Where the remote entry name (relative to the synced directory) lands in
+    local_dir: the host name is appended to its top level component, like
+    rpdcp does.
+    """
+    top, _, rest = name.partition('/')
+    if rest:
+        return os.path.join(local_dir, '%s.%s' % (top, label), rest)
+    return os.path.join(local_dir, '%s.%s' % (top, label))
+
+
+class SyncThread(threading.Thread):
+    """
+    Streams the given files of one node as a tar, compressed on the fly, and
+    unpacks them under local_dir with the node name appended to the top level
+    entry: <parent>/output.0 becomes <local_dir>/output.0.<label> and
+    <parent>/logs/osd.0.log becomes <local_dir>/logs.<label>/osd.0.log,
+    holding one of the parallel sync slots
+    """
+    def __init__(self, host, label, parent, files, local_dir, slots):
+        super(SyncThread, self).__init__()
+        self.phases = list(trace_phases())
+        self.host = host
+        self.label = label
+        self.parent = parent
+        self.files = files
+        self.local_dir = local_dir
+        self.slots = slots
+        self.copied = []
+        self.error = None
+
+    def run(self):
+        inherit_phases(self.phases)
+        with self.slots:
+            self.sync()
+
+    def sync(self):
+        compress = settings.common.get('sync_compression', 'gzip')
+        command = 'sudo tar -C %s --no-recursion --null -T - -cf -' % shlex.quote(self.parent)
+        if compress == 'gzip':
+            # a failing tar is not to be hidden by gzip
+            command = 'bash -c %s' % shlex.quote('set -o pipefail; %s | gzip -1' % command)
+        if getLocalhost(self.label):
+            args = ['sh', '-c', command]
+        else:
+            args = get_transport().remote_args(self.host, command)
+        start = time.time()
+        nbytes = 0
+        proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, close_fds=True)
+        wanted = set(self.files)
+        try:
+            feeder = threading.Thread(target=self._feed, args=(proc.stdin,))
+            feeder.start()
+            with tarfile.open(fileobj=proc.stdout, mode='r|gz' if compress == 'gzip' else 'r|') as tar:
+                for member in tar:
+                    if not member.isfile() or member.name not in wanted:
+                        continue
+                    dest = sync_local_path(self.local_dir, member.name, self.label)
+                    mkdir_p(os.path.dirname(dest))
+                    with open(dest, 'wb') as f:
+                        shutil.copyfileobj(tar.extractfile(member), f)
+                    os.utime(dest, (member.mtime, member.mtime))
+                    nbytes += member.size
+                    self.copied.append(member.name)
+            feeder.join()
+        except (tarfile.TarError, OSError) as e:
+            proc.kill()
+            self.error = '%s: sync failed: %s' % (self.label, e)
+        stderr = proc.stderr.read().decode(errors='ignore')
+        rc = proc.wait()
+        trace_call('sync', self.host, 'tar', start, rc, nbytes)
+        if rc == 1 and self.error is None:
+            # files that changed while being read are only a warning, they
+            # will be fetched again next time
+            logger.warning('%s: tar exited with %d: %s' % (self.label, rc, stderr.strip()))
+        elif rc != 0 and self.error is None:
+            self.error = '%s: sync failed, tar exited with %d: %s' % (self.label, rc, stderr.strip())
+        missing = len(self.files) - len(self.copied)
+        if missing and self.error is None:
+            logger.warning('%s: %d files were not synced' % (self.label, missing))
+
+    def _feed(self, stdin):
+        try:
+            stdin.write(b''.join(name.encode() + b'\0' for name in self.files))
+            stdin.close()
+        except OSError:
+            pass
+
+
+STREAM_PATTERNS = ['output.*', 'json_output.*', '*_lat.*.log', '*_clat.*.log', '*_slat.*.log',
+                   '*_bw.*.log', '*_iops.*.log', 'collectl/*', 'top/*']
+STREAM_CHUNK = 4 << 20
+
+
+class ResultStreamer(threading.Thread):
+    """
+    Ships the result files of a run to the archive while the benchmark runs.
+    Every interval the files under remote_dir matching the patterns (fio
+    outputs and logs, collectl and top files by default) are listed on each
+    node through the agents, and what was appended to them since the last
+    poll is appended to the local copies, laid out like
+    sync_files(remote_dir + '/*', local_dir) does. The final sync_files()
+    then skips the files that were already shipped.
+
+    Uses the agents started by cbt if there are, otherwise starts its own
+    for the duration of the run.
+    """
+    def __init__(self, remote_dir, local_dir, nodes=None, interval=None, patterns=None):
+        super(ResultStreamer, self).__init__()
+        self.phases = list(trace_phases())
+        self.daemon = True
+        self.remote_dir = remote_dir.rstrip('/')
+        self.local_dir = local_dir
+        self.nodes = nodes or settings.getnodes('clients', 'osds', 'mons', 'rgws', 'mds')
+        self.interval = interval or settings.common.get('stream_interval', 10)
+        self.patterns = patterns or settings.common.get('stream_patterns', STREAM_PATTERNS)
+        self.stopping = threading.Event()
+        self.agents = []
+        self.own_agents = {}
+        self.shipped = 0
+
+    def start(self):
+        agents = get_agents(self.nodes)
+        if agents is None:
+            self.own_agents = spawn_agents(self.nodes)
+            agents = [(host.rpartition('@')[2], a) for host, a in self.own_agents.items()]
+        self.agents = agents
+        mkdir_p(self.local_dir)
+        super(ResultStreamer, self).start()
+
+    def run(self):
+        inherit_phases(self.phases)
+        while not self.stopping.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                # never let the streaming disturb the benchmark, the final
+                # sync_files() picks up whatever was missed
+                logger.warning('result streaming failed: %s' % e)
+
+    def poll(self):
+        start = time.time()
+        shipped = self.shipped
+        listings = agent.call_each([(a, 'list', {'root': self.remote_dir, 'patterns': self.patterns})
+                                    for _, a in self.agents])
+        pending = []
+        for (label, a), listing in zip(self.agents, listings):
+            if isinstance(listing, agent.AgentError):
+                continue
+            for name, size, mtime in listing['files']:
+                dest = sync_local_path(self.local_dir, name, label)
+                offset = os.path.getsize(dest) if os.path.exists(dest) else 0
+                if size < offset:
+                    # rewritten from scratch
+                    os.truncate(dest, 0)
+                    offset = 0
+                if size > offset:
+                    pending.append([a, os.path.join(self.remote_dir, name), dest, offset, size, mtime])
+        # every round fetches a chunk of every file that is behind
+        while pending:
+            results = agent.call_each([(a, 'tail', {'path': path, 'offset': offset, 'length': STREAM_CHUNK, 'b64': True})
+                                       for a, path, dest, offset, size, mtime in pending])
+            behind = []
+            for entry, result in zip(pending, results):
+                a, path, dest, offset, size, mtime = entry
+                if isinstance(result, agent.AgentError) or result['offset'] <= offset:
+                    continue
+                mkdir_p(os.path.dirname(dest))
+                data = base64.b64decode(result['data'])
+                with open(dest, 'ab') as f:
+                    f.write(data)
+                self.shipped += len(data)
+                entry[3] = result['offset']
+                if entry[3] < size:
+                    behind.append(entry)
+                else:
+                    os.utime(dest, (mtime, mtime))
+            pending = behind
+        trace_call('stream', self.nodes, 'stream', start, 0, self.shipped - shipped)
+
+    def stop(self):
+        self.stopping.set()
+        if self.is_alive():
+            self.join()
+        try:
+            self.poll()
+        except Exception as e:
+            logger.warning('result streaming failed: %s' % e)
+        finally:
+            for a in self.own_agents.values():
+                a.close()
+            self.own_agents = {}
+        logger.info('Streamed %d bytes of results from %s' % (self.shipped, self.remote_dir))
+
+
+@contextlib.contextmanager
+def stream_results(remote_dir, local_dir):
+    """
+    Runs a ResultStreamer for the duration of the block when stream_results
+    is set in the common section.
+    """
+    if not settings.common.get('stream_results', False):
+        yield None
+        return
+    streamer = ResultStreamer(remote_dir, local_dir)
+    streamer.start()
+    try:
+        yield streamer
+    finally:
+        streamer.stop()
 
 
 def mkdir_p(path):
@@ -0,0 +1,1871 @@
+#!/usr/bin/env python3
+"""
+Loopback fake cluster for cbt.
+
+Stands in for pdsh, pdcp, rpdcp, scp and ssh when the 'fake' transport is
+selected (see common.FakeTransport) so that cbt can be run end to end,
+benchmarked and tested without any Ceph node. Any number of hosts is
+simulated on the local machine:
+
+  - every host gets a private directory tree under --root (<root>/<host>/)
+    in which the paths of its commands are resolved, so /tmp/cbt/output.0 of
+    one host never collides with the one of another host
+  - the commands are interpreted by a small shell (sequences, && and ||,
+    pipes, subshells, if/for, redirections, variables, command and
+    arithmetic substitution, globbing) instead of being executed: the shell
+    and file utilities cbt relies on (echo, mkdir, rm, find, tar, gzip, ...)
+    are emulated on the host tree, the Ceph and benchmark tools are answered
+    by fixtures
+  - nothing sleeps for real: commands accumulate a simulated duration (the
+    --latency of the transport, the latency of the fixtures, sleep) and the
+    output of every host is released once its duration has elapsed, hosts
+    running in parallel up to the pdsh fanout
+
+Fixtures are tried in order, the ones of --fixtures (YAML) before the
+built-in FIXTURES, and match a regular expression against the command line
+of a simple command (sudo, env, nice, ... stripped, basename of the
+executable):
+
+    files:                          # created on every host when first used
+      /var/run/ceph/ceph-osd.0.asok: ''
+    fixtures:
+      - match: '^ceph .*health'
+        stdout: "HEALTH_WARN 1 osds down\\n"    # {host} is replaced
+        latency: 0.2                            # seconds
+        rc: 0
+      - match: '^fio '
+        generator: fio              # synthetic output from the arguments
+        latency: 60
+
+The generators are fio, rados_bench, config_show, and ceph_status,
+osd_create, osd_dump, ceph_osd, pools and rbd_images which keep OSDs, pools
+and images shared by the hosts (see GENERATORS). A
+command neither emulated nor matched succeeds without any output and is
+listed in <root>/unhandled.log.
+
+Usage (the arguments are built by common.FakeTransport):
+    fakecluster.py [--root=DIR] [--fixtures=FILE] [--latency=S] pdsh [-S] [-f N] -w HOSTS COMMAND
+    fakecluster.py ... exec HOST COMMAND
+    fakecluster.py ... pdcp [-r] -w HOSTS LOCAL REMOTE
+    fakecluster.py ... rpdcp [-r] -w HOSTS REMOTE LOCALDIR
+    fakecluster.py ... rscp HOST REMOTE LOCAL
+
+This file only depends on the standard library (and PyYAML to read a
+fixtures file).
+"""
+import argparse
+import fnmatch
+import glob
+import gzip
+import heapq
+import io
+import json
+import math
+import os
+import random
+import re
+import shutil
+import socket
+import sys
+import tarfile
+import time
+import zlib
+
+CEPH_VERSION = 'ceph version 18.2.0 (5dd24139a1eada541a3bc16b6941c5dde975e26d) reef (stable)'
+FIO_VERSION = 'fio-3.35'
+
+# Files every simulated host starts with
+FILES = {
+    '/var/run/ceph/ceph-osd.0.asok': '',
+}
+
+FIXTURES = [
+    {'match': r'^(ceph|rados|rbd|radosgw-admin|ceph-\S+) (.* )?(-v|--version)( |$)', 'stdout': CEPH_VERSION + '\n'},
+    {'match': r'^fio (.* )?--version( |$)', 'stdout': FIO_VERSION + '\n'},
+    {'match': r'^fio ', 'generator': 'fio'},
+    {'match': r'^rados (.* )?bench ', 'generator': 'rados_bench'},
+    {'match': r'^ceph (.* )?health( |$)', 'stdout': 'HEALTH_OK\n'},
+    {'match': r'^ceph (.* )?(-s|status)( |$)', 'generator': 'ceph_status'},
+    {'match': r'^ceph (.* )?progress( |$)', 'stdout': 'Nothing in progress\n'},
+    {'match': r'^ceph (.* )?osd create( |$)', 'generator': 'osd_create'},
+    {'match': r'^ceph (.* )?osd dump( |$)', 'generator': 'osd_dump'},
+    {'match': r'^ceph (.* )?osd pool (create|delete|rm|ls|set|stats|application) ', 'generator': 'pools'},
+    {'match': r'^ceph (.* )?osd pool ls$', 'generator': 'pools'},
+    {'match': r'^ceph-osd ', 'generator': 'ceph_osd'},
+    {'match': r'^rbd (.* )?(create|ls|rm) ', 'generator': 'rbd_images'},
+    {'match': r'^ceph (.* )?daemon \S+ config show( |$)',
+     'stdout': '{\n    "name": "osd.0",\n    "osd_op_num_shards": "8",\n    "osd_memory_target": "4294967296"\n}\n'},
+    {'match': r'^ceph (.* )?--admin-daemon \S+ config show( |$)', 'generator': 'config_show'},
+    {'match': r'^ceph (.* )?--admin-daemon \S+ dump_historic_ops( |$)',
+     'stdout': '{\n    "size": 20,\n    "duration": 600,\n    "ops": []\n}\n'},
+    # everything else the tools and daemons are asked succeeds silently
+    {'match': r'^(ceph|rados|rbd|radosgw-admin|ceph-\S+|monmaptool|collectl|perf|blktrace|valgrind)( |$)'},
+]
+
+
+class ShellExit(Exception):
+    def __init__(self, rc):
+        super(ShellExit, self).__init__(rc)
+        self.rc = rc
+
+
+class ShellSyntaxError(Exception):
+    pass
+
+
+# ---------------------------------------------------------------------------
+# Parsing
+# ---------------------------------------------------------------------------
+
+OPERATORS = ['2>&1', '1>&2', '>&2', '2>>', '&&', '||', '>>', '&>', '2>', ';;', ';', '&', '|', '(', ')', '<', '>', '\n']
+KEYWORDS = ('if', 'then', 'elif', 'else', 'fi', 'for', 'in', 'do', 'done', 'while')
+
+
+def _skip_quoted(text, i):
+    """ Index after the quoted or substituted construct starting at text[i] """
+    c = text[i]
+    if c == "'":
+        end = text.find("'", i + 1)
+        if end < 0:
+            raise ShellSyntaxError('unterminated quote')
+        return end + 1
+    if c == '"' or c == '`':
+        i += 1
+        while i < len(text) and text[i] != c:
+            if text[i] == '\\':
+                i += 1
+            elif c == '"' and text.startswith('$(', i):
+                i = _skip_quoted(text, i) - 1
+            i += 1
+        if i >= len(text):
+            raise ShellSyntaxError('unterminated %s' % c)
+        return i + 1
+    if text.startswith('${', i):
+        end = text.find('}', i)
+        if end < 0:
+            raise ShellSyntaxError('unterminated ${')
+        return end + 1
+    # $( ... ) and $(( ... ))
+    depth = 0
+    i += 1
+    while i < len(text):
+        if text[i] == '(':
+            depth += 1
+        elif text[i] == ')':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        elif text[i] in '\'"`':
+            i = _skip_quoted(text, i) - 1
+        elif text[i] == '\\':
+            i += 1
+        i += 1
+    raise ShellSyntaxError('unterminated $(')
+
+
+def tokenize(text):
+    """ [(kind, value)], kind being 'word' (raw text, quotes kept) or 'op' """
+    tokens = []
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c in ' \t':
+            i += 1
+            continue
+        if c == '#' and (i == 0 or text[i - 1] in ' \t\n;'):
+            while i < len(text) and text[i] != '\n':
+                i += 1
+            continue
+        op = next((op for op in OPERATORS if text.startswith(op, i)), None)
+        # 2> and friends are operators only at the start of a word
+        if op is not None and (not op[0].isdigit() or i == 0 or text[i - 1] in ' \t\n;&|()<>'):
+            tokens.append(('op', ';' if op == '\n' else op))
+            i += len(op)
+            continue
+        start = i
+        while i < len(text):
+            c = text[i]
+            if c in ' \t\n;&|()<>':
+                break
+            if c == '\\':
+                i += 2
+            elif c in '\'"`' or (c == '$' and text[i + 1:i + 2] in ('(', '{')):
+                i = _skip_quoted(text, i)
+            else:
+                i += 1
+        tokens.append(('word', text[start:i]))
+    return tokens
+
+
+class Parser(object):
+    """
+    Recursive descent parser producing tuples:
+      ('list', [(node, background)])   ('andor', node, [(op, node)])
+      ('pipe', [node])                 ('sub', list, redirs)
+      ('if', [(cond, body)], else)     ('for', name, [words], body)
+      ('while', cond, body)            ('simple', [words], redirs)
+    """
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def expect_word(self, word):
+        kind, value = self.next()
+        if kind != 'word' or value != word:
+            raise ShellSyntaxError('expected %s, got %s' % (word, value))
+
+    def at_keyword(self, *words):
+        kind, value = self.peek()
+        return kind == 'word' and value in words
+
+    def parse(self):
+        node = self.parse_list(())
+        if self.pos < len(self.tokens):
+            raise ShellSyntaxError('unexpected %s' % self.peek()[1])
+        return node
+
+    def parse_list(self, terminators):
+        items = []
+        while True:
+            while self.peek() == ('op', ';'):
+                self.next()
+            kind, value = self.peek()
+            if kind is None or (kind == 'op' and value == ')') or self.at_keyword(*terminators):
+                return ('list', items)
+            node = self.parse_andor()
+            background = False
+            if self.peek() == ('op', '&'):
+                self.next()
+                background = True
+            elif self.peek() == ('op', ';'):
+                self.next()
+            items.append((node, background))
+
+    def parse_andor(self):
+        first = self.parse_pipe()
+        rest = []
+        while self.peek() in (('op', '&&'), ('op', '||')):
+            op = self.next()[1]
+            while self.peek() == ('op', ';'):
+                self.next()
+            rest.append((op, self.parse_pipe()))
+        return ('andor', first, rest) if rest else first
+
+    def parse_pipe(self):
+        commands = [self.parse_command()]
+        while self.peek() == ('op', '|'):
+            self.next()
+            commands.append(self.parse_command())
+        return ('pipe', commands) if len(commands) > 1 else commands[0]
+
+    def parse_redirs(self, redirs):
+        while True:
+            kind, value = self.peek()
+            if kind != 'op' or value not in ('>', '>>', '<', '2>', '2>>', '&>', '2>&1', '1>&2', '>&2'):
+                return redirs
+            self.next()
+            if value in ('2>&1', '1>&2', '>&2'):
+                redirs.append((value, None))
+                continue
+            kind, target = self.next()
+            if kind != 'word':
+                raise ShellSyntaxError('missing redirection target')
+            redirs.append((value, target))
+
+    def parse_command(self):
+        kind, value = self.peek()
+        if (kind, value) == ('op', '('):
+            self.next()
+            body = self.parse_list(())
+            if self.next() != ('op', ')'):
+                raise ShellSyntaxError('missing )')
+            return ('sub', body, self.parse_redirs([]))
+        if self.at_keyword('if'):
+            self.next()
+            branches = []
+            orelse = None
+            while True:
+                cond = self.parse_list(('then',))
+                self.expect_word('then')
+                branches.append((cond, self.parse_list(('elif', 'else', 'fi'))))
+                keyword = self.next()[1]
+                if keyword == 'elif':
+                    continue
+                if keyword == 'else':
+                    orelse = self.parse_list(('fi',))
+                    self.expect_word('fi')
+                break
+            return ('if', branches, orelse)
+        if self.at_keyword('for'):
+            self.next()
+            name = self.next()[1]
+            words = []
+            if self.at_keyword('in'):
+                self.next()
+                while self.peek()[0] == 'word' and not self.at_keyword('do'):
+                    words.append(self.next()[1])
+            while self.peek() == ('op', ';'):
+                self.next()
+            self.expect_word('do')
+            body = self.parse_list(('done',))
+            self.expect_word('done')
+            return ('for', name, words, body)
+        if self.at_keyword('while'):
+            self.next()
+            cond = self.parse_list(('do',))
+            self.expect_word('do')
+            body = self.parse_list(('done',))
+            self.expect_word('done')
+            return ('while', cond, body)
+        words = []
+        redirs = []
+        while True:
+            self.parse_redirs(redirs)
+            kind, value = self.peek()
+            if kind != 'word':
+                break
+            words.append(self.next()[1])
+        if not words and not redirs:
+            raise ShellSyntaxError('unexpected %s' % value)
+        return ('simple', words, redirs)
+
+
+# ---------------------------------------------------------------------------
+# Execution
+# ---------------------------------------------------------------------------
+
+class Sink(object):
+    """ Where a command writes: a buffer, a file of the host or nowhere """
+    def __init__(self, buf=None, path=None, append=False):
+        self.buf = buf
+        self.f = open(path, 'ab' if append else 'wb') if path else None
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        if self.buf is not None:
+            self.buf.extend(data)
+        elif self.f is not None:
+            self.f.write(data)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+
+
+class Host(object):
+    """ One simulated host: its directory tree, shell variables and clock """
+    def __init__(self, name, cluster):
+        self.name = name
+        self.label = name.rpartition('@')[2]
+        self.user = name.rpartition('@')[0] or 'cbt'
+        self.cluster = cluster
+        self.root = os.path.join(cluster.root, self.label)
+        self.cwd = '/home/%s' % self.user
+        self.vars = {'HOME': self.cwd, 'USER': self.user, 'HOSTNAME': self.label, '?': '0', '$': '4242'}
+        self.delay = 0.0
+        if not os.path.isdir(self.root):
+            for path, content in cluster.files.items():
+                self.write_file(path, content)
+            os.makedirs(self.path(self.cwd), exist_ok=True)
+
+    # paths
+
+    def vpath(self, path):
+        """ Absolute path on the host """
+        return os.path.normpath(os.path.join(self.cwd, path))
+
+    def path(self, path):
+        """ Local path of a host path, None for /dev/null """
+        vpath = self.vpath(path)
+        if vpath == '/dev/null':
+            return None
+        return self.root + vpath
+
+    def unpath(self, local):
+        return '/' + os.path.relpath(local, self.root).replace('\\', '/') if local != self.root else '/'
+
+    def write_file(self, path, data, append=False):
+        local = self.path(path)
+        if local is None:
+            return
+        os.makedirs(os.path.dirname(local), exist_ok=True)
+        with open(local, 'ab' if append else 'wb') as f:
+            f.write(data.encode() if isinstance(data, str) else data)
+
+    # expansion
+
+    def expand(self, word, split=True):
+        """
+        Expands a raw word into fields: variables, command and arithmetic
+        substitution, quote removal, field splitting and globbing
+        """
+        fields = [[]]   # list of [(text, quoted)]
+        i = 0
+        quote = None
+        while i < len(word):
+            c = word[i]
+            if quote is None and c == "'":
+                end = word.index("'", i + 1)
+                fields[-1].append((word[i + 1:end], True))
+                i = end + 1
+            elif c == '"':
+                quote = None if quote else '"'
+                fields[-1].append(('', True))
+                i += 1
+            elif c == '\\':
+                nxt = word[i + 1:i + 2]
+                if quote and nxt not in '$`"\\':
+                    fields[-1].append(('\\', True))
+                    i += 1
+                else:
+                    fields[-1].append((nxt, True))
+                    i += 2
+            elif c == '$' or c == '`':
+                value, i = self.substitute(word, i)
+                if quote or not split:
+                    fields[-1].append((value, True))
+                else:
+                    parts = value.split()
+                    if value[:1].isspace() and fields[-1]:
+                        fields.append([])
+                    for n, part in enumerate(parts):
+                        if n:
+                            fields.append([])
+                        fields[-1].append((part, True))
+                    if value[-1:].isspace() and parts:
+                        fields.append([])
+            else:
+                fields[-1].append((c, quote is not None))
+                i += 1
+        out = []
+        for field in fields:
+            if not field:
+                continue
+            text = ''.join(t for t, _ in field)
+            if split and any(not quoted and any(g in t for g in '*?[') for t, quoted in field):
+                matches = sorted(glob.glob(self.path(text) or text))
+                if matches:
+                    if os.path.isabs(text):
+                        out.extend(self.unpath(m) for m in matches)
+                    else:
+                        out.extend(os.path.relpath(m, self.path('.')) for m in matches)
+                    continue
+            out.append(text)
+        return out
+
+    def expand_one(self, word):
+        return ''.join(self.expand(word, split=False))
+
+    def substitute(self, word, i):
+        """ Value of the $ or ` construct at word[i] and the index after it """
+        if word[i] == '`':
+            end = _skip_quoted(word, i)
+            return self.capture(word[i + 1:end - 1].replace('\\`', '`')), end
+        if word.startswith('$((', i):
+            end = _skip_quoted(word, i)
+            expr = self.expand_one(word[i + 3:end - 2])
+            expr = re.sub(r'[A-Za-z_]\w*', lambda m: self.vars.get(m.group(0), '0') or '0', expr)
+            if not re.match(r'^[\d\s+\-*/%()<>=!&|]*$', expr):
+                raise ShellSyntaxError('bad arithmetic %s' % expr)
+            return str(int(eval(expr.replace('/', '//'), {'__builtins__': {}}))), end
+        if word.startswith('$(', i):
+            end = _skip_quoted(word, i)
+            return self.capture(word[i + 2:end - 1]), end
+        if word.startswith('${', i):
+            end = word.index('}', i)
+            name, _, default = word[i + 2:end].partition(':-')
+            return self.vars.get(name) or self.expand_one(default), end + 1
+        m = re.match(r'[A-Za-z_]\w*|[?$#@0-9]', word[i + 1:])
+        if not m:
+            return '$', i + 1
+        return self.vars.get(m.group(0), ''), i + 1 + len(m.group(0))
+
+    def capture(self, command):
+        out = bytearray()
+        saved = self.vars['?']
+        try:
+            self.run_text(command, io.BytesIO(), Sink(out), Sink())
+        except ShellExit:
+            pass
+        self.vars['?'] = saved
+        return out.decode(errors='ignore').rstrip('\n')
+
+    # execution
+
+    def run_text(self, text, stdin, out, err):
+        try:
+            node = Parser(text).parse()
+        except (ShellSyntaxError, ValueError) as e:
+            err.write('sh: syntax error: %s\n' % e)
+            return 2
+        return self.execute(node, stdin, out, err)
+
+    def execute(self, node, stdin, out, err):
+        kind = node[0]
+        if kind == 'list':
+            rc = 0
+            for item, background in node[1]:
+                # background commands run to completion as well, they are
+                # only simulated
+                rc = self.execute(item, stdin, out, err)
+                if background:
+                    rc = 0
+                self.vars['?'] = str(rc)
+            return rc
+        if kind == 'andor':
+            rc = self.execute(node[1], stdin, out, err)
+            for op, item in node[2]:
+                self.vars['?'] = str(rc)
+                if (op == '&&') == (rc == 0):
+                    rc = self.execute(item, stdin, out, err)
+            return rc
+        if kind == 'pipe':
+            data = stdin
+            for item in node[1][:-1]:
+                buf = bytearray()
+                self.execute(item, data, Sink(buf), err)
+                data = io.BytesIO(bytes(buf))
+            return self.execute(node[1][-1], data, out, err)
+        if kind == 'if':
+            for cond, body in node[1]:
+                if self.execute(cond, stdin, out, err) == 0:
+                    return self.execute(body, stdin, out, err)
+            return self.execute(node[2], stdin, out, err) if node[2] else 0
+        if kind == 'for':
+            rc = 0
+            values = [field for word in node[2] for field in self.expand(word)]
+            for value in values:
+                self.vars[node[1]] = value
+                rc = self.execute(node[3], stdin, out, err)
+            return rc
+        if kind == 'while':
+            rc = 0
+            # a simulated host has nothing to wait for, bound the loops
+            for _ in range(1000):
+                if self.execute(node[1], stdin, out, err) != 0:
+                    break
+                rc = self.execute(node[2], stdin, out, err)
+            return rc
+        if kind == 'sub':
+            return self.redirected(node[2], stdin, out, err, lambda i, o, e: self.subshell(node[1], i, o, e))
+        words = node[1]
+        return self.redirected(node[2], stdin, out, err, lambda i, o, e: self.simple(words, i, o, e))
+
+    def subshell(self, node, stdin, out, err):
+        saved = (dict(self.vars), self.cwd)
+        try:
+            return self.execute(node, stdin, out, err)
+        except ShellExit as e:
+            return e.rc
+        finally:
+            self.vars, self.cwd = saved
+
+    def redirected(self, redirs, stdin, out, err, run):
+        if not redirs:
+            return run(stdin, out, err)
+        fds = {1: out, 2: err}
+        opened = []
+        try:
+            for op, target in redirs:
+                if op == '2>&1':
+                    fds[2] = fds[1]
+                    continue
+                if op in ('1>&2', '>&2'):
+                    fds[1] = fds[2]
+                    continue
+                local = self.path(self.expand_one(target))
+                if op == '<':
+                    if local is None:
+                        stdin = io.BytesIO()
+                        continue
+                    try:
+                        with open(local, 'rb') as f:
+                            stdin = io.BytesIO(f.read())
+                    except IOError as e:
+                        err.write('sh: %s: %s\n' % (target, e.strerror))
+                        return 1
+                    continue
+                try:
+                    if local is not None:
+                        os.makedirs(os.path.dirname(local), exist_ok=True)
+                    sink = Sink(path=local, append=op.endswith('>>'))
+                except IOError as e:
+                    err.write('sh: %s: %s\n' % (target, e.strerror))
+                    return 1
+                opened.append(sink)
+                if op == '&>':
+                    fds[1] = fds[2] = sink
+                else:
+                    fds[2 if op.startswith('2') else 1] = sink
+            return run(stdin, fds[1], fds[2])
+        finally:
+            for sink in opened:
+                sink.close()
+
+    def simple(self, words, stdin, out, err):
+        argv = []
+        assigns = []
+        for word in words:
+            if not argv and re.match(r'^[A-Za-z_]\w*=', word):
+                name, _, value = word.partition('=')
+                assigns.append((name, self.expand_one(value)))
+            else:
+                argv.extend(self.expand(word))
+        if not argv:
+            self.vars.update(assigns)
+            return 0
+        return self.command(argv, stdin, out, err)
+
+    def command(self, argv, stdin, out, err):
+        argv = strip_wrappers(argv)
+        if not argv:
+            return 0
+        name = os.path.basename(argv[0])
+        line = ' '.join([name] + argv[1:])
+        for fixture in self.cluster.user_fixtures:
+            if fixture['re'].search(line):
+                return self.fixture(fixture, argv, stdin, out, err)
+        if name in ('sh', 'bash', 'dash') and '-c' in argv:
+            try:
+                node = Parser(argv[argv.index('-c') + 1]).parse()
+            except (ShellSyntaxError, IndexError) as e:
+                err.write('%s: syntax error: %s\n' % (name, e))
+                return 2
+            return self.subshell(node, stdin, out, err)
+        builtin = BUILTINS.get(name)
+        if builtin is not None:
+            try:
+                return builtin(self, argv, stdin, out, err)
+            except ShellExit:
+                raise
+            except (IOError, OSError, ValueError, IndexError, KeyError, tarfile.TarError) as e:
+                err.write('%s: %s\n' % (name, e))
+                return 1
+        for fixture in self.cluster.fixtures:
+            if fixture['re'].search(line):
+                return self.fixture(fixture, argv, stdin, out, err)
+        self.cluster.unhandled.setdefault(line, self.label)
+        return 0
+
+    def fixture(self, fixture, argv, stdin, out, err):
+        self.delay += float(fixture.get('latency', 0))
+        for path, content in fixture.get('files', {}).items():
+            self.write_file(self.expand_one(path), content)
+        rc = int(fixture.get('rc', 0))
+        if 'generator' in fixture:
+            rc = GENERATORS[fixture['generator']](self, argv, stdin, out, err) or rc
+        out.write(fixture.get('stdout', '').replace('{host}', self.label))
+        err.write(fixture.get('stderr', '').replace('{host}', self.label))
+        return rc
+
+    def seed(self, argv):
+        return random.Random(zlib.crc32(('%s %s' % (self.label, ' '.join(argv))).encode()))
+
+
+WRAPPERS = {
+    # name: (options taking a value, number of positional arguments)
+    'sudo': (('-u', '-g', '-C', '-D', '-h', '-p', '-r', '-t', '-U'), 0),
+    'nice': (('-n',), 0),
+    'ionice': (('-c', '-n', '-p'), 0),
+    'timeout': (('-k', '-s'), 1),
+    'stdbuf': (('-i', '-o', '-e'), 0),
+    'nohup': ((), 0),
+    'exec': ((), 0),
+    'ceph-run': ((), 0),
+    'command': ((), 0),
+    'time': ((), 0),
+    'env': (('-u',), 0),
+}
+
+
+def strip_wrappers(argv):
+    """ The command run by sudo, env, nice, timeout, ... """
+    while argv and os.path.basename(argv[0]) in WRAPPERS:
+        with_value, positional = WRAPPERS[os.path.basename(argv[0])]
+        i = 1
+        while i < len(argv):
+            arg = argv[i]
+            if arg == '--':
+                i += 1
+                break
+            if arg in with_value:
+                i += 2
+            elif arg.startswith('-') and len(arg) > 1:
+                i += 1
+            elif os.path.basename(argv[0]) == 'env' and '=' in arg:
+                i += 1
+            else:
+                break
+        argv = argv[i + positional:]
+    return argv
+
+
+# ---------------------------------------------------------------------------
+# Emulated utilities
+# ---------------------------------------------------------------------------
+
+def _flags(argv, known):
+    """ Splits -abc style flags from the operands """
+    flags = set()
+    operands = []
+    for i, arg in enumerate(argv[1:], 1):
+        if arg == '--':
+            operands.extend(argv[i + 1:])
+            break
+        if arg.startswith('-') and len(arg) > 1 and all(c in known for c in arg[1:]):
+            flags.update(arg[1:])
+        else:
+            operands.append(arg)
+    return flags, operands
+
+
+def _unescape(text):
+    return (text.replace('\\n', '\n').replace('\\t', '\t').replace('\\0', '\0')
+            .replace('\\\\', '\\'))
+
+
+def sh_true(host, argv, stdin, out, err):
+    return 0
+
+
+def sh_false(host, argv, stdin, out, err):
+    return 1
+
+
+def sh_exit(host, argv, stdin, out, err):
+    raise ShellExit(int(argv[1]) if len(argv) > 1 else int(host.vars['?']))
+
+
+def sh_cd(host, argv, stdin, out, err):
+    target = host.vpath(argv[1] if len(argv) > 1 else host.vars['HOME'])
+    if not os.path.isdir(host.path(target)):
+        err.write('cd: %s: No such file or directory\n' % target)
+        return 1
+    host.cwd = target
+    return 0
+
+
+def sh_export(host, argv, stdin, out, err):
+    for arg in argv[1:]:
+        if '=' in arg:
+            name, _, value = arg.partition('=')
+            host.vars[name] = value
+    return 0
+
+
+def sh_sleep(host, argv, stdin, out, err):
+    host.delay += sum(float(a.rstrip('s')) for a in argv[1:])
+    return 0
+
+
+def sh_echo(host, argv, stdin, out, err):
+    args = argv[1:]
+    newline = True
+    escapes = False
+    while args and args[0] in ('-n', '-e', '-ne', '-en'):
+        newline = newline and 'n' not in args[0]
+        escapes = escapes or 'e' in args[0]
+        args = args[1:]
+    text = ' '.join(args)
+    out.write((_unescape(text) if escapes else text) + ('\n' if newline else ''))
+    return 0
+
+
+def sh_printf(host, argv, stdin, out, err):
+    fmt = _unescape(argv[1])
+    args = argv[2:]
+    specs = re.findall(r'%[-\d.]*[sdfx]', fmt)
+    if not specs:
+        out.write(fmt)
+        return 0
+    while True:
+        values = []
+        for spec in specs:
+            value = args.pop(0) if args else ''
+            values.append(value if spec.endswith('s') else (float(value or 0) if spec.endswith('f') else int(value or 0)))
+        out.write(fmt % tuple(values))
+        if not args:
+            return 0
+
+
+def sh_cat(host, argv, stdin, out, err):
+    flags, files = _flags(argv, 'uv')
+    if not files:
+        out.write(stdin.read())
+        return 0
+    rc = 0
+    for name in files:
+        local = host.path(name)
+        if local is None:
+            continue
+        try:
+            with open(local, 'rb') as f:
+                out.write(f.read())
+        except IOError as e:
+            err.write('cat: %s: %s\n' % (name, e.strerror))
+            rc = 1
+    return rc
+
+
+def sh_tee(host, argv, stdin, out, err):
+    flags, files = _flags(argv, 'ai')
+    data = stdin.read()
+    for name in files:
+        host.write_file(name, data, append='a' in flags)
+    out.write(data)
+    return 0
+
+
+def sh_mkdir(host, argv, stdin, out, err):
+    args = [a for a in argv]
+    if '-m' in args:
+        i = args.index('-m')
+        del args[i:i + 2]
+    flags, dirs = _flags(args, 'pv')
+    rc = 0
+    for name in dirs:
+        local = host.path(name)
+        if 'p' in flags:
+            os.makedirs(local, exist_ok=True)
+        else:
+            try:
+                os.mkdir(local)
+            except OSError as e:
+                err.write("mkdir: cannot create directory '%s': %s\n" % (name, e.strerror))
+                rc = 1
+    return rc
+
+
+def sh_rm(host, argv, stdin, out, err):
+    flags, paths = _flags(argv, 'rRfvd')
+    rc = 0
+    for name in paths:
+        local = host.path(name)
+        if local is None or host.vpath(name) == '/':
+            continue
+        if os.path.isdir(local) and not os.path.islink(local):
+            if flags & set('rR'):
+                shutil.rmtree(local)
+                continue
+            err.write("rm: cannot remove '%s': Is a directory\n" % name)
+            rc = 1
+        elif os.path.lexists(local):
+            os.unlink(local)
+        elif 'f' not in flags:
+            err.write("rm: cannot remove '%s': No such file or directory\n" % name)
+            rc = 1
+    return rc
+
+
+def sh_touch(host, argv, stdin, out, err):
+    flags, files = _flags(argv, 'acm')
+    for name in files:
+        host.write_file(name, b'', append=True)
+        os.utime(host.path(name))
+    return 0
+
+
+def sh_cp(host, argv, stdin, out, err):
+    flags, paths = _flags(argv, 'rRapf')
+    dest = host.path(paths[-1])
+    for name in paths[:-1]:
+        src = host.path(name)
+        target = os.path.join(dest, os.path.basename(src)) if os.path.isdir(dest) else dest
+        if os.path.isdir(src):
+            shutil.copytree(src, target, dirs_exist_ok=True)
+        else:
+            shutil.copy2(src, target)
+    return 0
+
+
+def sh_mv(host, argv, stdin, out, err):
+    flags, paths = _flags(argv, 'f')
+    dest = host.path(paths[-1])
+    for name in paths[:-1]:
+        shutil.move(host.path(name), dest)
+    return 0
+
+
+def sh_test(host, argv, stdin, out, err):
+    args = argv[1:-1] if argv[0] == '[' else argv[1:]
+    negate = False
+    if args[:1] == ['!']:
+        negate = True
+        args = args[1:]
+    if len(args) == 0:
+        result = False
+    elif len(args) == 1:
+        result = args[0] != ''
+    elif len(args) == 2:
+        op, value = args
+        local = host.path(value) or '/dev/null'
+        result = {'-d': os.path.isdir, '-e': os.path.exists, '-f': os.path.isfile,
+                  '-s': lambda p: os.path.exists(p) and os.path.getsize(p) > 0,
+                  '-L': os.path.islink, '-h': os.path.islink,
+                  '-x': lambda p: os.access(p, os.X_OK), '-r': os.path.exists, '-w': os.path.exists,
+                  '-S': lambda p: os.path.exists(p),
+                  '-z': lambda p: value == '', '-n': lambda p: value != ''}[op](local)
+    else:
+        left, op, right = args[:3]
+        if op in ('=', '=='):
+            result = left == right
+        elif op == '!=':
+            result = left != right
+        else:
+            left, right = int(left or 0), int(right or 0)
+            result = {'-eq': left == right, '-ne': left != right, '-lt': left < right,
+                      '-le': left <= right, '-gt': left > right, '-ge': left >= right}[op]
+    return 0 if result != negate else 1
+
+
+def sh_hostname(host, argv, stdin, out, err):
+    name = host.label
+    if '-s' in argv and not re.match(r'^[\d.]+$', name):
+        name = name.split('.')[0]
+    if '-i' in argv or '-I' in argv:
+        try:
+            name = socket.gethostbyname(host.label)
+        except socket.error:
+            name = '127.0.0.1'
+    out.write(name + '\n')
+    return 0
+
+
+def sh_date(host, argv, stdin, out, err):
+    now = time.time() + host.delay
+    fmt = next((a[1:] for a in argv[1:] if a.startswith('+')), '%a %b %d %H:%M:%S %Z %Y')
+    out.write(time.strftime(fmt.replace('%s', str(int(now))).replace('%N', '%09d' % int(now % 1 * 1e9)),
+                            time.localtime(now)) + '\n')
+    return 0
+
+
+def sh_basename(host, argv, stdin, out, err):
+    out.write(os.path.basename(argv[1].rstrip('/')) + '\n')
+    return 0
+
+
+def sh_dirname(host, argv, stdin, out, err):
+    out.write((os.path.dirname(argv[1].rstrip('/')) or '.') + '\n')
+    return 0
+
+
+def sh_readlink(host, argv, stdin, out, err):
+    flags, paths = _flags(argv, 'fem')
+    for name in paths:
+        out.write(host.vpath(name) + '\n')
+    return 0
+
+
+def sh_grep(host, argv, stdin, out, err):
+    args = argv[1:]
+    flags = set()
+    while args and args[0].startswith('-') and len(args[0]) > 1:
+        flags.update(args.pop(0)[1:])
+    pattern = args.pop(0)
+    if 'F' in flags:
+        pattern = re.escape(pattern)
+    regex = re.compile(pattern, re.I if 'i' in flags else 0)
+    data = stdin.read() if not args else b''.join(open(host.path(a), 'rb').read() for a in args)
+    lines = [l for l in data.decode(errors='ignore').splitlines() if bool(regex.search(l)) != ('v' in flags)]
+    if 'c' in flags:
+        out.write('%d\n' % len(lines))
+    elif 'q' not in flags:
+        out.write(''.join(l + '\n' for l in lines))
+    return 0 if lines else 1
+
+
+def sh_wc(host, argv, stdin, out, err):
+    flags, files = _flags(argv, 'lcw')
+    data = stdin.read() if not files else b''.join(open(host.path(f), 'rb').read() for f in files)
+    counts = {'l': data.count(b'\n'), 'w': len(data.split()), 'c': len(data)}
+    out.write(' '.join(str(counts[f]) for f in 'lwc' if f in (flags or set('lwc'))) + '\n')
+    return 0
+
+
+def sh_head_tail(host, argv, stdin, out, err):
+    count = 10
+    args = argv[1:]
+    if args and args[0] == '-n':
+        count = int(args[1])
+        args = args[2:]
+    elif args and re.match(r'^-\d+$', args[0]):
+        count = int(args[0][1:])
+        args = args[1:]
+    data = stdin.read() if not args else open(host.path(args[0]), 'rb').read()
+    lines = data.splitlines(True)
+    out.write(b''.join(lines[:count] if os.path.basename(argv[0]) == 'head' else lines[-count:] if count else []))
+    return 0
+
+
+def sh_cut(host, argv, stdin, out, err):
+    delim = '\t'
+    fields = []
+    for i, arg in enumerate(argv[1:], 1):
+        if arg.startswith('-d'):
+            delim = arg[2:] or argv[i + 1]
+        elif arg.startswith('-f'):
+            spec = arg[2:] or argv[i + 1]
+            for part in spec.split(','):
+                lo, _, hi = part.partition('-')
+                fields.extend(range(int(lo), int(hi or lo) + 1))
+    for line in stdin.read().decode(errors='ignore').splitlines():
+        parts = line.split(delim)
+        out.write(delim.join(parts[f - 1] for f in fields if f <= len(parts)) + '\n')
+    return 0
+
+
+def sh_xargs(host, argv, stdin, out, err):
+    args = argv[1:]
+    replace = None
+    if args and args[0].startswith('-I'):
+        replace = args[0][2:] or args[1]
+        args = args[1:] if args[0][2:] else args[2:]
+    items = stdin.read().decode(errors='ignore').split('\n' if replace else None)
+    items = [i for i in items if i.strip()]
+    rc = 0
+    if replace:
+        for item in items:
+            rc = host.command([a.replace(replace, item) for a in args], io.BytesIO(), out, err) or rc
+    elif items:
+        rc = host.command((args or ['echo']) + items, io.BytesIO(), out, err)
+    return rc
+
+
+def sh_find(host, argv, stdin, out, err):
+    """ find PATH... [-maxdepth N] [-type f|d] [-name PAT] [-printf FMT | -exec CMD {} ;] """
+    paths = []
+    i = 1
+    while i < len(argv) and not argv[i].startswith('-'):
+        paths.append(argv[i])
+        i += 1
+    maxdepth = None
+    ftype = None
+    name = None
+    printf = None
+    exec_args = None
+    while i < len(argv):
+        arg = argv[i]
+        if arg == '-maxdepth':
+            maxdepth = int(argv[i + 1])
+        elif arg == '-type':
+            ftype = argv[i + 1]
+        elif arg == '-name':
+            name = argv[i + 1]
+        elif arg == '-printf':
+            printf = _unescape(argv[i + 1])
+        elif arg == '-exec':
+            end = argv.index(';', i) if ';' in argv[i:] else len(argv)
+            exec_args = argv[i + 1:end]
+            i = end - 1
+        i += 2 if arg in ('-maxdepth', '-type', '-name', '-printf') else 1
+    rc = 0
+    for start in paths or ['.']:
+        local = host.path(start)
+        if local is None or not os.path.lexists(local):
+            err.write("find: '%s': No such file or directory\n" % start)
+            rc = 1
+            continue
+        entries = [(local, 0)]
+        if os.path.isdir(local):
+            for dirpath, dirnames, filenames in os.walk(local):
+                depth = os.path.relpath(dirpath, local).count(os.sep) + (dirpath != local)
+                if maxdepth is not None and depth >= maxdepth:
+                    dirnames[:] = []
+                    if depth > maxdepth:
+                        continue
+                for entry in sorted(dirnames) + sorted(filenames):
+                    entries.append((os.path.join(dirpath, entry), depth + 1))
+        for path, depth in entries:
+            if maxdepth is not None and depth > maxdepth:
+                continue
+            if ftype == 'f' and not os.path.isfile(path) or ftype == 'd' and not os.path.isdir(path):
+                continue
+            if name is not None and not fnmatch.fnmatch(os.path.basename(path), name):
+                continue
+            shown = start.rstrip('/') + path[len(local):] if path != local else start
+            if exec_args is not None:
+                rc = host.command([a.replace('{}', shown) for a in exec_args], io.BytesIO(), out, err) or rc
+            elif printf is not None:
+                st = os.stat(path)
+                out.write(re.sub(r'%(T@|[spfP%])', lambda m: {
+                    's': str(st.st_size), 'T@': '%.10f' % st.st_mtime, 'p': shown,
+                    'f': os.path.basename(path), 'P': os.path.relpath(path, local), '%': '%'}[m.group(1)], printf))
+            else:
+                out.write(shown + '\n')
+    return rc
+
+
+def sh_tar(host, argv, stdin, out, err):
+    """ Only creates archives: tar [-C DIR] [--null] [--no-recursion] [-T LIST] -c[z]f - [PATH...] """
+    directory = host.cwd
+    names = []
+    null = False
+    recursive = True
+    create = False
+    compress = False
+    from_list = None
+    args = argv[1:]
+    if args and not args[0].startswith('-'):
+        args[0] = '-' + args[0]
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '-C' or arg == '--directory':
+            directory = host.vpath(args[i + 1])
+            i += 1
+        elif arg == '--null':
+            null = True
+        elif arg == '--no-recursion':
+            recursive = False
+        elif arg in ('-T', '--files-from'):
+            from_list = args[i + 1]
+            i += 1
+        elif arg.startswith('--'):
+            pass
+        elif arg.startswith('-'):
+            create = create or 'c' in arg
+            compress = compress or 'z' in arg
+            if arg.endswith('f'):
+                i += 1
+            if 'x' in arg or 't' in arg:
+                err.write('tar: only archive creation is simulated\n')
+                return 2
+        else:
+            names.append(arg)
+        i += 1
+    if not create:
+        err.write('tar: only archive creation is simulated\n')
+        return 2
+    if from_list is not None:
+        data = stdin.read() if from_list == '-' else open(host.path(from_list), 'rb').read()
+        names.extend(n for n in data.decode(errors='ignore').split('\0' if null else '\n') if n)
+    buf = io.BytesIO()
+    rc = 0
+    with tarfile.open(fileobj=buf, mode='w:gz' if compress else 'w', format=tarfile.GNU_FORMAT) as tar:
+        for name in names:
+            local = host.root + os.path.normpath(os.path.join(directory, name))
+            if not os.path.lexists(local):
+                err.write('tar: %s: Cannot stat: No such file or directory\n' % name)
+                rc = 2
+                continue
+            tar.add(local, arcname=name, recursive=recursive)
+    out.write(buf.getvalue())
+    return rc
+
+
+def sh_gzip(host, argv, stdin, out, err):
+    flags, files = _flags(argv, 'cdfn123456789')
+    level = int(next((f for f in sorted(flags) if f.isdigit()), '6'))
+    data = stdin.read()
+    out.write(gzip.decompress(data) if 'd' in flags else gzip.compress(data, compresslevel=level))
+    return 0
+
+
+BUILTINS = {
+    'true': sh_true, ':': sh_true, 'false': sh_false, 'exit': sh_exit,
+    'cd': sh_cd, 'export': sh_export, 'sleep': sh_sleep,
+    'echo': sh_echo, 'printf': sh_printf, 'cat': sh_cat, 'tee': sh_tee,
+    'mkdir': sh_mkdir, 'rm': sh_rm, 'touch': sh_touch, 'cp': sh_cp, 'mv': sh_mv,
+    'test': sh_test, '[': sh_test,
+    'hostname': sh_hostname, 'date': sh_date, 'basename': sh_basename, 'dirname': sh_dirname,
+    'readlink': sh_readlink, 'grep': sh_grep, 'wc': sh_wc, 'head': sh_head_tail, 'tail': sh_head_tail,
+    'cut': sh_cut, 'xargs': sh_xargs, 'find': sh_find, 'tar': sh_tar, 'gzip': sh_gzip,
+    # no process ever runs on a simulated host
+    'killall': sh_true, 'pkill': sh_true, 'kill': sh_true, 'wait': sh_true,
+    'ulimit': sh_true, 'umask': sh_true, 'set': sh_true, 'trap': sh_true,
+    'chown': sh_true, 'chmod': sh_true, 'chgrp': sh_true, 'sync': sh_true, 'modprobe': sh_true,
+}
+
+
+# ---------------------------------------------------------------------------
+# Generators of synthetic tool output
+# ---------------------------------------------------------------------------
+
+FIO_FLAGS = ('time_based', 'norandommap', 'group_reporting', 'randrepeat', 'invalidate', 'direct', 'end_fsync')
+
+
+def _fio_options(argv):
+    """ [(name, value)] of the fio command line, value None for flags and job files """
+    options = []
+    i = 1
+    while i < len(argv):
+        arg = argv[i]
+        if arg.startswith('--'):
+            name, sep, value = arg[2:].partition('=')
+            if not sep and name not in FIO_FLAGS and i + 1 < len(argv) and not argv[i + 1].startswith('-'):
+                value = argv[i + 1]
+                i += 1
+            options.append((name, value if (sep or value) else None))
+        else:
+            options.append((None, arg))
+        i += 1
+    return options
+
+
+def _fio_job_file(text):
+    """ [(section, {option: value})] of a fio job file, flags set to '1' """
+    sections = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line[0] in '#;':
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            sections.append((line[1:-1], {}))
+        elif sections:
+            name, _, value = line.partition('=')
+            sections[-1][1][name.strip()] = value.strip() if _ else '1'
+    return sections
+
+
+def _size(text):
+    m = re.match(r'^(\d+)([kKmMgG]?)[iI]?[bB]?$', str(text))
+    if not m:
+        return 4096
+    return int(m.group(1)) * {'': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}[m.group(2).lower()]
+
+
+# the completion latency percentiles fio reports by default
+FIO_PERCENTILES = (1, 5, 10, 20, 30, 40, 50, 60, 70, 80, 90, 95, 99, 99.5, 99.9, 99.95, 99.99)
+
+
+def _lat_stats(mean):
+    return {'min': int(mean * 0.4), 'max': int(mean * 6), 'mean': mean, 'stddev': mean * 0.1, 'N': 1}
+
+
+def _clat_stats(mean):
+    """ _lat_stats with the percentiles of a shifted exponential distribution """
+    stats = _lat_stats(mean)
+    if mean:
+        stats['percentile'] = dict(('%f' % p, int(mean * (0.4 - 0.6 * math.log(1 - p / 100.0))))
+                                   for p in FIO_PERCENTILES)
+    return stats
+
+
+def gen_fio_client(host, options, out):
+    """
+    fio --client: the job file (--remote-config) of every server is run on
+    its host, the jobs reported in client_stats with an All clients sum
+    """
+    servers = []
+    for name, value in options:
+        if name == 'client':
+            servers.append([value, None])
+        elif name == 'remote-config' and servers:
+            servers[-1][1] = value
+    global_options = {}
+    stats = []
+    for server, job_file in servers:
+        buf = bytearray()
+        gen_fio(host.cluster.host(server), ['fio', '--output-format=json', job_file], None, Sink(buf), Sink())
+        report = json.loads(bytes(buf).decode())
+        global_options.update(report['global options'])
+        stats += [dict(job, hostname=server, port=8765) for job in report['jobs']]
+    if len(servers) > 1 and stats:
+        total = dict(stats[0], jobname='All clients', hostname='', **{'job options': {}})
+        for ddir in ('read', 'write'):
+            total[ddir] = dict(stats[0][ddir])
+            for key in ('io_bytes', 'io_kbytes', 'bw_bytes', 'bw', 'iops', 'total_ios'):
+                total[ddir][key] = sum(job[ddir][key] for job in stats)
+        stats.append(total)
+    now = time.time() + host.delay
+    out.write(json.dumps({'fio version': FIO_VERSION, 'timestamp': int(now), 'timestamp_ms': int(now * 1000),
+                          'time': time.ctime(now), 'global options': global_options,
+                          'client_stats': stats}, indent=2) + '\n')
+    return 0
+
+
+def gen_fio(host, argv, stdin, out, err):
+    """
+    Writes a fio json(+normal) report consistent with the arguments: one job
+    per --name (or job file section) and numjobs, latency growing with the
+    queue depth and the block size, and the iops/bw/lat logs asked for.
+    A server returns at once, a client runs the job files of its servers.
+    """
+    options = _fio_options(argv)
+    if any(name == 'server' for name, _ in options):
+        return 0
+    if any(name == 'client' for name, _ in options):
+        return gen_fio_client(host, options, out)
+    first_name = next((n for n, (k, _) in enumerate(options) if k == 'name'), len(options))
+    global_options = dict((k, v if v is not None else '1') for k, v in options[:first_name]
+                          if k not in (None, 'output', 'output-format', 'name'))
+    opts = dict((k, v) for k, v in options if k is not None)
+    specs = [(v, opts, {}) for k, v in options if k == 'name']
+    for job_file in [v for k, v in options if k is None]:
+        local = host.path(job_file)
+        if not local or not os.path.isfile(local):
+            continue
+        with open(local) as f:
+            sections = _fio_job_file(f.read())
+        section_globals = {}
+        for name, section in sections:
+            if name == 'global':
+                section_globals.update(section)
+                global_options.update(section)
+            else:
+                specs.append((name, dict(opts, **dict(section_globals, **section)), section))
+    specs = specs or [('job', opts, {})]
+    runtime = int(opts.get('runtime') or specs[0][1].get('runtime') or 60)
+    rng = host.seed(argv)
+    jobs = []
+    for name, spec, job_options in specs:
+        iodepth = int(spec.get('iodepth') or 1)
+        bs = _size(spec.get('bs') or '4k')
+        rw = spec.get('rw') or spec.get('readwrite') or 'read'
+        read_pct = int(spec.get('rwmixread') or 50) if rw in ('rw', 'readwrite', 'randrw') else (100 if 'read' in rw else 0)
+        for _ in range(int(spec.get('numjobs') or 1)):
+            lat_ns = (50000 + bs / 4.0) * (1 + iodepth / 16.0) * rng.uniform(0.95, 1.05)
+            iops = iodepth * 1e9 / lat_ns
+            job = {'jobname': name, 'groupid': 0, 'error': 0, 'job options': dict(job_options)}
+            for ddir, share in (('read', read_pct), ('write', 100 - read_pct)):
+                ddir_iops = iops * share / 100.0
+                total_ios = int(ddir_iops * runtime)
+                job[ddir] = {'io_bytes': total_ios * bs, 'io_kbytes': total_ios * bs // 1024,
+                             'bw_bytes': int(ddir_iops * bs), 'bw': int(ddir_iops * bs / 1024),
+                             'iops': float(ddir_iops), 'runtime': runtime * 1000 if share else 0,
+                             'total_ios': total_ios, 'short_ios': 0, 'drop_ios': 0,
+                             'slat_ns': _lat_stats(lat_ns * 0.05 if share else 0),
+                             'clat_ns': _clat_stats(lat_ns if share else 0),
+                             'lat_ns': _lat_stats(lat_ns * 1.05 if share else 0)}
+            jobs.append((job, spec, bs, read_pct))
+    now = time.time() + host.delay
+    report = {'fio version': FIO_VERSION, 'timestamp': int(now), 'timestamp_ms': int(now * 1000),
+              'time': time.ctime(now), 'global options': global_options,
+              'jobs': [job for job, _, _, _ in jobs], 'disk_util': []}
+    formats = (opts.get('output-format') or 'normal').split(',')
+    text = ''
+    if 'normal' in formats:
+        text += 'Starting %d process%s\n' % (len(jobs), 'es' if len(jobs) > 1 else '')
+    if 'json' in formats:
+        # the status reports of --status-interval, with the totals so far
+        interval = int(opts.get('status-interval') or 0)
+        for elapsed in (range(interval, runtime, interval) if interval > 0 else []):
+            status_jobs = []
+            for job in report['jobs']:
+                status_job = dict(job)
+                for ddir in ('read', 'write'):
+                    status_job[ddir] = dict(job[ddir], total_ios=job[ddir]['total_ios'] * elapsed // runtime,
+                                            io_kbytes=job[ddir]['io_kbytes'] * elapsed // runtime)
+                status_jobs.append(status_job)
+            at = now - runtime + elapsed
+            status = dict(report, timestamp=int(at), timestamp_ms=int(at * 1000), jobs=status_jobs)
+            text += json.dumps(status, indent=2) + '\n'
+        text += json.dumps(report, indent=2) + '\n'
+    if 'normal' in formats:
+        text += '\n'
+        for job in report['jobs']:
+            text += '%s: (groupid=0, jobs=1): err= 0: pid=4242\n' % job['jobname']
+            for ddir in ('read', 'write'):
+                if job[ddir]['total_ios']:
+                    text += '  %s: IOPS=%d, BW=%dKiB/s (%dB/s)(%dMiB/%dmsec)\n' % (
+                        ddir, job[ddir]['iops'], job[ddir]['bw'], job[ddir]['bw_bytes'],
+                        job[ddir]['io_bytes'] >> 20, job[ddir]['runtime'])
+    for log, suffixes in (('write_iops_log', ('iops',)), ('write_bw_log', ('bw',)),
+                          ('write_lat_log', ('lat', 'clat', 'slat'))):
+        for n, (job, spec, bs, read_pct) in enumerate(jobs, 1):
+            prefix = spec.get(log)
+            if not prefix:
+                continue
+            for suffix in suffixes:
+                rows = []
+                for second in range(1, min(runtime, 60) + 1):
+                    value = {'iops': job['write']['iops'] + job['read']['iops'],
+                             'bw': job['write']['bw'] + job['read']['bw']}.get(suffix, job['write']['clat_ns']['mean'] or job['read']['clat_ns']['mean'])
+                    rows.append('%d, %d, %d, %d, 0\n' % (second * 1000, value * rng.uniform(0.9, 1.1), 1 if read_pct < 100 else 0, bs))
+                host.write_file('%s_%s.%d.log' % (prefix, suffix, n), ''.join(rows))
+    if opts.get('output'):
+        host.write_file(opts['output'], text)
+    else:
+        out.write(text)
+    return 0
+
+
+def gen_rados_bench(host, argv, stdin, out, err):
+    """ rados bench SECONDS write|seq|rand [-b SIZE] [-t N|--concurrent-ios N] [--max-objects N] output """
+    i = argv.index('bench')
+    seconds = int(argv[i + 1])
+    mode = argv[i + 2]
+    size = 4 << 20
+    concurrency = 16
+    max_objects = 0
+    for n, arg in enumerate(argv):
+        if arg == '-b':
+            size = _size(argv[n + 1])
+        elif arg in ('-t', '--concurrent-ios'):
+            concurrency = int(argv[n + 1])
+        elif arg == '--max-objects':
+            max_objects = int(argv[n + 1])
+    rng = host.seed(argv)
+    latency = (0.002 + size / 400e6) * (1 + concurrency / 32.0)
+    iops = concurrency / latency
+    bandwidth = iops * size / float(1 << 20)
+    verb = 'writes' if mode == 'write' else 'reads'
+    lines = ['hints = 1\n',
+             'Maintaining %d concurrent %s of %d bytes to objects of size %d for up to %d seconds or %d objects\n'
+             % (concurrency, verb, size, size, seconds, max_objects),
+             'Object prefix: benchmark_data_%s_4242\n' % host.label,
+             '  sec Cur ops   started  finished  avg MB/s  cur MB/s last lat(s)  avg lat(s)\n']
+    finished = 0
+    samples = []
+    for second in range(min(seconds or 60, 60) + 1):
+        current = bandwidth * rng.uniform(0.9, 1.1) if second else 0
+        samples.append(current)
+        finished += int(current * (1 << 20) / size)
+        if max_objects and finished >= max_objects:
+            finished = max_objects
+        lines.append('%5d %7d %9d %9d %9.4f %9.4f %11.6f %11.6f\n' % (
+            second, concurrency if second else 0, finished + concurrency, finished,
+            finished * size / float(1 << 20) / max(second, 1), current, latency, latency))
+        if max_objects and finished >= max_objects:
+            break
+    total = finished if max_objects else int(iops * seconds)
+    summary = [('Total time run', '%.4f' % (seconds + latency)),
+               ('Total %s made' % verb, total)]
+    if mode == 'write':
+        summary += [('Write size', size), ('Object size', size)]
+    else:
+        summary += [('Read size', size), ('Object size', size)]
+    summary += [('Bandwidth (MB/sec)', '%.4f' % bandwidth),
+                ('Stddev Bandwidth', '%.4f' % (bandwidth * 0.05)),
+                ('Max bandwidth (MB/sec)', '%d' % max(samples)),
+                ('Min bandwidth (MB/sec)', '%d' % min(samples[1:] or [0])),
+                ('Average IOPS', '%d' % iops),
+                ('Stddev IOPS', '%.4f' % (iops * 0.05)),
+                ('Max IOPS', '%d' % (iops * 1.1)),
+                ('Min IOPS', '%d' % (iops * 0.9)),
+                ('Average Latency(s)', '%.6f' % latency),
+                ('Stddev Latency(s)', '%.6f' % (latency * 0.1)),
+                ('Max latency(s)', '%.6f' % (latency * 4)),
+                ('Min latency(s)', '%.6f' % (latency * 0.3))]
+    lines += ['%-22s %s\n' % (key + ':', value) for key, value in summary]
+    out.write(''.join(lines))
+    return 0
+
+
+def gen_ceph_status(host, argv, stdin, out, err):
+    pools = _pools(host)
+    num_pgs = sum(pool['pg_num'] for pool in pools)
+    status = {'fsid': '00000000-0000-0000-0000-000000000000',
+              'health': {'status': 'HEALTH_OK', 'checks': {}},
+              'pgmap': {'num_pgs': num_pgs,
+                        'pgs_by_state': [{'state_name': 'active+clean', 'count': num_pgs}] if num_pgs else [],
+                        'num_pools': len(pools), 'num_objects': 0},
+              'progress_events': {}}
+    if any(a.startswith('--format') and 'json' in a for a in argv) or 'json' in argv:
+        out.write(json.dumps(status) + '\n')
+    else:
+        out.write('  cluster:\n    id:     %s\n    health: HEALTH_OK\n\n  data:\n    pools:   %d pools, %d pgs\n'
+                  '    pgs:     %d active+clean\n' % (status['fsid'], len(pools), num_pgs, num_pgs))
+    return 0
+
+
+def _pools(host):
+    # the pools are shared by the hosts: <root>/.pools/NAME holds the pool as json
+    path = os.path.join(host.cluster.root, '.pools')
+    if not os.path.isdir(path):
+        return []
+    pools = []
+    for name in sorted(os.listdir(path)):
+        with open(os.path.join(path, name)) as f:
+            pools.append(json.load(f))
+    return sorted(pools, key=lambda pool: pool['pool'])
+
+
+def gen_pools(host, argv, stdin, out, err):
+    """
+    ceph osd pool create NAME [PG [PGP]] ..., delete/rm NAME, set NAME pg_num|pgp_num|size|min_size N,
+    ls [detail], stats, application enable NAME APP, application set NAME APP KEY VALUE
+    """
+    path = os.path.join(host.cluster.root, '.pools')
+    os.makedirs(path, exist_ok=True)
+    i = argv.index('pool')
+    op = argv[i + 1]
+    pools = _pools(host)
+    if op == 'ls':
+        if 'detail' in argv[i + 2:] and any('json' in a for a in argv[i + 2:]):
+            out.write(json.dumps(pools) + '\n')
+        elif 'detail' in argv[i + 2:]:
+            out.write(''.join("pool %d '%s' replicated size 3 pg_num %d pgp_num %d\n"
+                              % (p['pool'], p['pool_name'], p['pg_num'], p['pg_placement_num']) for p in pools))
+        else:
+            out.write(''.join('%s\n' % p['pool_name'] for p in pools))
+        return 0
+    if op == 'stats':
+        # a clean, idle cluster: ceph leaves the zero rates out
+        stats = [{'pool_name': p['pool_name'], 'pool_id': p['pool'], 'recovery': {}, 'recovery_rate': {},
+                  'client_io_rate': {}} for p in pools]
+        out.write(json.dumps(stats) + '\n')
+        return 0
+    name = argv[i + 3] if op == 'application' else argv[i + 2]
+    fname = os.path.join(path, name.replace('/', '_'))
+    if op in ('set', 'application') and not os.path.exists(fname):
+        err.write("Error ENOENT: unrecognized pool '%s'\n" % name)
+        return 2
+    if op == 'create':
+        numbers = [int(a) for a in argv[i + 3:i + 5] if a.isdigit()]
+        pg_num = numbers[0] if numbers else 32
+        pgp_num = numbers[1] if len(numbers) > 1 else pg_num
+        pool = {'pool': max([p['pool'] for p in pools] or [0]) + 1, 'pool_name': name,
+                'pg_num': pg_num, 'pg_placement_num': pgp_num,
+                'pg_num_target': pg_num, 'pg_placement_num_target': pgp_num,
+                'size': 3, 'min_size': 2, 'application_metadata': {}}
+        if not os.path.exists(fname):
+            with open(fname, 'w') as f:
+                json.dump(pool, f)
+        err.write("pool '%s' created\n" % name)
+    elif op in ('delete', 'rm'):
+        if not os.path.exists(fname):
+            err.write("pool '%s' does not exist\n" % name)
+            return 0
+        os.unlink(fname)
+        err.write("pool '%s' removed\n" % name)
+    elif op == 'set':
+        with open(fname) as f:
+            pool = json.load(f)
+        key = {'pg_num': 'pg_num', 'pgp_num': 'pg_placement_num'}.get(argv[i + 3])
+        if key:
+            pool[key] = pool[key + '_target'] = int(argv[i + 4])
+        elif argv[i + 3] in ('size', 'min_size'):
+            pool[argv[i + 3]] = int(argv[i + 4])
+        with open(fname, 'w') as f:
+            json.dump(pool, f)
+    elif op == 'application':
+        with open(fname) as f:
+            pool = json.load(f)
+        metadata = pool.setdefault('application_metadata', {}).setdefault(argv[i + 4], {})
+        if argv[i + 2] == 'set':
+            metadata[argv[i + 5]] = argv[i + 6]
+        with open(fname, 'w') as f:
+            json.dump(pool, f)
+    return 0
+
+
+def gen_rbd_images(host, argv, stdin, out, err):
+    """ rbd create NAME --size N [--pool P] [--image-feature F]... [--rbd-default-features F,...], rm NAME [--pool P], ls [--pool P] [--format=json] """
+    op = next(a for a in argv if a in ('create', 'ls', 'rm'))
+    i = argv.index(op)
+    pool = 'rbd'
+    for n, arg in enumerate(argv):
+        if arg in ('--pool', '-p'):
+            pool = argv[n + 1]
+    # the images are shared by the hosts: <root>/.rbd/POOL/NAME holds the image as json
+    path = os.path.join(host.cluster.root, '.rbd', pool)
+    os.makedirs(path, exist_ok=True)
+    if op == 'ls':
+        names = sorted(os.listdir(path))
+        if any('json' in a for a in argv):
+            out.write(json.dumps(names) + '\n')
+        else:
+            out.write(''.join('%s\n' % name for name in names))
+        return 0
+    name = argv[i + 1]
+    if '/' in name:
+        pool, name = name.split('/', 1)
+        path = os.path.join(host.cluster.root, '.rbd', pool)
+        os.makedirs(path, exist_ok=True)
+    fname = os.path.join(path, name)
+    if op == 'rm':
+        if not os.path.exists(fname):
+            err.write('rbd: error opening image %s: (2) No such file or directory\n' % name)
+            return 2
+        os.unlink(fname)
+        return 0
+    features = [argv[n + 1] for n, arg in enumerate(argv) if arg == '--image-feature']
+    if not features:
+        # the defaults of rbd, or those given with --rbd-default-features
+        defaults = 'layering,exclusive-lock,object-map,fast-diff,deep-flatten'
+        if '--rbd-default-features' in argv:
+            defaults = argv[argv.index('--rbd-default-features') + 1]
+        features = [] if defaults == '0' else defaults.split(',')
+    image = {'name': name, 'size': argv[argv.index('--size') + 1] if '--size' in argv else '0',
+             'features': features}
+    try:
+        fd = os.open(fname, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        err.write('rbd: create error: (17) File exists\n')
+        return 17
+    os.write(fd, json.dumps(image).encode())
+    os.close(fd)
+    return 0
+
+
+def _osdmap(host):
+    # the osdmap is shared by all the hosts: <root>/.osdmap/osd.N holds the
+    # uuid of OSD N, osd.N.up exists once its daemon was started
+    path = os.path.join(host.cluster.root, '.osdmap')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _osd_ids(path):
+    return sorted(int(name[4:]) for name in os.listdir(path) if re.match(r'^osd\.\d+$', name))
+
+
+def gen_osd_create(host, argv, stdin, out, err):
+    """ ceph osd create [UUID]: the lowest free id, the same one again for a known uuid """
+    path = _osdmap(host)
+    i = argv.index('create')
+    osd_uuid = argv[i + 1] if len(argv) > i + 1 else ''
+    for osd_id in _osd_ids(path):
+        with open(os.path.join(path, 'osd.%d' % osd_id)) as f:
+            if osd_uuid and f.read() == osd_uuid:
+                out.write('%d\n' % osd_id)
+                return 0
+    osd_id = 0
+    while True:
+        try:
+            fd = os.open(os.path.join(path, 'osd.%d' % osd_id), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            osd_id += 1
+            continue
+        os.write(fd, osd_uuid.encode())
+        os.close(fd)
+        out.write('%d\n' % osd_id)
+        return 0
+
+
+def gen_ceph_osd(host, argv, stdin, out, err):
+    """ ceph-osd -i N: the OSD is up and in unless it is only a --mkfs """
+    if '-i' in argv and '--mkfs' not in argv:
+        with open(os.path.join(_osdmap(host), 'osd.%s.up' % argv[argv.index('-i') + 1]), 'w'):
+            pass
+    return 0
+
+
+def gen_osd_dump(host, argv, stdin, out, err):
+    path = _osdmap(host)
+    osds = []
+    for osd_id in _osd_ids(path):
+        with open(os.path.join(path, 'osd.%d' % osd_id)) as f:
+            osd_uuid = f.read()
+        up = int(os.path.exists(os.path.join(path, 'osd.%d.up' % osd_id)))
+        osds.append({'osd': osd_id, 'uuid': osd_uuid, 'up': up, 'in': up, 'weight': float(up)})
+    if any(a.startswith('--format') and 'json' in a for a in argv) or 'json' in argv:
+        out.write(json.dumps({'epoch': len(osds) + 1, 'osds': osds}) + '\n')
+    else:
+        out.write('epoch %d\n' % (len(osds) + 1))
+        out.write(''.join('osd.%d %s %s weight %.1f %s\n' % (o['osd'], 'up' if o['up'] else 'down',
+                                                            'in' if o['in'] else 'out', o['weight'], o['uuid'])
+                          for o in osds))
+    return 0
+
+
+# settings every simulated daemon runs with
+DAEMON_CONFIG = {
+    'osd_op_num_shards': '8',
+    'osd_memory_target': '4294967296',
+    'osd_op_queue': 'mclock_scheduler',
+    'bluestore_cache_autotune': 'true',
+}
+
+
+def gen_config_show(host, argv, stdin, out, err):
+    """ config show of an admin socket, with the settings of <root>/.config/<daemon> (json) on top """
+    asok = argv[argv.index('--admin-daemon') + 1]
+    name = os.path.basename(asok)[:-len('.asok')].split('-', 1)[-1]
+    config = dict(DAEMON_CONFIG, name=name, host=host.label, admin_socket=asok,
+                  log_file='/var/log/ceph/ceph-%s.log' % name)
+    path = os.path.join(host.cluster.root, '.config', name)
+    if os.path.exists(path):
+        with open(path) as f:
+            config.update(json.load(f))
+    out.write(json.dumps(config, indent=4) + '\n')
+    return 0
+
+
+GENERATORS = {
+    'fio': gen_fio,
+    'rados_bench': gen_rados_bench,
+    'ceph_status': gen_ceph_status,
+    'osd_create': gen_osd_create,
+    'osd_dump': gen_osd_dump,
+    'pools': gen_pools,
+    'rbd_images': gen_rbd_images,
+    'ceph_osd': gen_ceph_osd,
+    'config_show': gen_config_show,
+}
+
+
+# ---------------------------------------------------------------------------
+# The simulated cluster and the command line front ends
+# ---------------------------------------------------------------------------
+
+class FakeCluster(object):
+    def __init__(self, root, fixtures_file=None, latency=0.0):
+        self.root = root
+        self.latency = latency
+        self.files = dict(FILES)
+        self.user_fixtures = []
+        if fixtures_file:
+            import yaml
+            with open(fixtures_file) as f:
+                config = yaml.safe_load(f) or {}
+            self.files.update(config.get('files', {}))
+            self.user_fixtures = [dict(f, re=re.compile(f['match'])) for f in config.get('fixtures', [])]
+        self.fixtures = [dict(f, re=re.compile(f['match'])) for f in FIXTURES]
+        self.unhandled = {}
+        os.makedirs(root, exist_ok=True)
+
+    def host(self, name):
+        return Host(name, self)
+
+    def run(self, name, command, stdin):
+        """ Runs command on a host, returns (host, rc, stdout, stderr) """
+        host = self.host(name)
+        host.delay = self.latency
+        out = bytearray()
+        err = bytearray()
+        try:
+            rc = host.run_text(command, stdin, Sink(out), Sink(err))
+        except ShellExit as e:
+            rc = e.rc
+        except ShellSyntaxError as e:
+            err.extend(b'sh: %s\n' % str(e).encode())
+            rc = 2
+        return host, rc, bytes(out), bytes(err)
+
+    def close(self):
+        if self.unhandled:
+            with open(os.path.join(self.root, 'unhandled.log'), 'a') as f:
+                f.write(''.join('%s: %s\n' % (label, line) for line, label in self.unhandled.items()))
+
+
+def _hosts(spec):
+    return [h for h in spec.split(',') if h]
+
+
+def cmd_pdsh(cluster, args):
+    """ Like pdsh: every output line is prefixed with the host name """
+    start = time.time()
+    hosts = _hosts(args.w)
+    slots = [0.0] * max(min(args.f, len(hosts)), 1)
+    done = []
+    for n, name in enumerate(hosts):
+        host, rc, out, err = cluster.run(name, args.command, io.BytesIO())
+        begin = heapq.heappop(slots)
+        heapq.heappush(slots, begin + host.delay)
+        done.append((begin + host.delay, n, host.label, rc, out, err))
+    worst = 0
+    local = socket.gethostname().split('.')[0]
+    for finish, _, label, rc, out, err in sorted(done):
+        wait = start + finish - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        sys.stdout.buffer.write(b''.join(b'%s: %s\n' % (label.encode(), line) for line in out.splitlines()))
+        sys.stdout.flush()
+        sys.stderr.buffer.write(b''.join(b'%s: %s\n' % (label.encode(), line) for line in err.splitlines()))
+        if rc:
+            sys.stderr.buffer.write(b'pdsh@%s: %s: ssh exited with exit code %d\n' % (local.encode(), label.encode(), rc))
+        sys.stderr.flush()
+        worst = max(worst, rc)
+    return worst if args.S else 0
+
+
+def cmd_exec(cluster, args):
+    """ Like ssh host command: raw output, stdin forwarded """
+    host, rc, out, err = cluster.run(args.host, args.command, sys.stdin.buffer)
+    if host.delay > 0:
+        time.sleep(host.delay)
+    sys.stdout.buffer.write(out)
+    sys.stderr.buffer.write(err)
+    return rc
+
+
+def _copy(src, dest, recursive):
+    if os.path.isdir(src):
+        if not recursive:
+            raise IOError('%s is a directory' % src)
+        shutil.copytree(src, dest, dirs_exist_ok=True)
+    else:
+        os.makedirs(os.path.dirname(dest) or '.', exist_ok=True)
+        shutil.copy2(src, dest)
+
+
+def cmd_pdcp(cluster, args):
+    rc = 0
+    for name in _hosts(args.w):
+        host = cluster.host(name)
+        dest = host.path(args.remote)
+        if os.path.isdir(dest):
+            dest = os.path.join(dest, os.path.basename(args.local.rstrip('/')))
+        try:
+            _copy(args.local, dest, args.recursive)
+        except (IOError, OSError) as e:
+            sys.stderr.write('%s: pdcp: %s\n' % (host.label, e))
+            rc = 1
+    return rc
+
+
+def cmd_rpdcp(cluster, args):
+    """ Every copied entry gets the host name as a suffix """
+    rc = 0
+    for name in _hosts(args.w):
+        host = cluster.host(name)
+        matches = sorted(glob.glob(host.path(args.remote)))
+        if not matches:
+            sys.stderr.write('%s: rpdcp: %s: No such file or directory\n' % (host.label, args.remote))
+            rc = 1
+        for src in matches:
+            try:
+                _copy(src, os.path.join(args.local, '%s.%s' % (os.path.basename(src), host.label)), args.recursive)
+            except (IOError, OSError) as e:
+                sys.stderr.write('%s: rpdcp: %s\n' % (host.label, e))
+                rc = 1
+    return rc
+
+
+def cmd_rscp(cluster, args):
+    host = cluster.host(args.host)
+    try:
+        _copy(host.path(args.remote), args.local, True)
+    except (IOError, OSError) as e:
+        sys.stderr.write('%s: scp: %s\n' % (host.label, e))
+        return 1
+    return 0
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Loopback fake cluster for cbt')
+    parser.add_argument('--root', default='/tmp/cbt-fake', help='Directory holding the trees of the hosts')
+    parser.add_argument('--fixtures', help='YAML file of fixtures tried before the built-in ones')
+    parser.add_argument('--latency', type=float, default=0.0, help='Simulated seconds added to every remote command')
+    sub = parser.add_subparsers(dest='mode', required=True)
+    p = sub.add_parser('pdsh')
+    p.add_argument('-S', action='store_true')
+    p.add_argument('-f', type=int, default=32)
+    p.add_argument('-w', required=True)
+    p.add_argument('command')
+    p = sub.add_parser('exec')
+    p.add_argument('host')
+    p.add_argument('command')
+    for name in ('pdcp', 'rpdcp'):
+        p = sub.add_parser(name)
+        p.add_argument('-r', dest='recursive', action='store_true')
+        p.add_argument('-w', required=True)
+        p.add_argument('local' if name == 'pdcp' else 'remote')
+        p.add_argument('remote' if name == 'pdcp' else 'local')
+    p = sub.add_parser('rscp')
+    p.add_argument('host')
+    p.add_argument('remote')
+    p.add_argument('local')
+    args = parser.parse_args(argv[1:])
+
+    cluster = FakeCluster(args.root, args.fixtures, args.latency)
+    try:
+        return {'pdsh': cmd_pdsh, 'exec': cmd_exec, 'pdcp': cmd_pdcp,
+                'rpdcp': cmd_rpdcp, 'rscp': cmd_rscp}[args.mode](cluster, args)
+    finally:
+        cluster.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
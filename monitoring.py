@@ -29,6 +29,8 @@ class Monitoring(object):
             return BlktraceMonitoring(mconfig)
         if monitoring == 'top':
             return TopMonitoring(mconfig)
+        if monitoring == 'perfcounters':
+            return PerfCounterMonitoring(mconfig)
 
 
 class CollectlMonitoring(Monitoring):
@@ -40,11 +42,11 @@ class CollectlMonitoring(Monitoring):
 
     def start(self, directory):
         collectl_dir = '%s/collectl' % directory
-        common.pdsh(self.nodes, 'mkdir -p -m0755 -- %s' % collectl_dir).communicate()
+        common.remote_mkdir(self.nodes, collectl_dir, continue_if_error=True)
         common.pdsh(self.nodes, ['collectl', self.args.format(collectl_dir=collectl_dir)])
 
     def stop(self, directory):
-        common.pdsh(self.nodes, 'pkill -SIGINT -f collectl').communicate()
+        common.remote_kill(self.nodes, 'collectl', sig='SIGINT', full=True, sudo=False)
 
     @staticmethod
     def _get_default_nodes():
@@ -65,7 +67,7 @@ class PerfMonitoring(Monitoring):
     def start(self, directory):
         perf_dir = '%s/perf' % directory
         self.perf_dir = perf_dir
-        common.pdsh(self.nodes, 'mkdir -p -m0755 -- %s' % perf_dir).communicate()
+        common.remote_mkdir(self.nodes, perf_dir, continue_if_error=True)
 
         perf_template = '{} {} &'.format(self.perf_cmd, self.args_template)
         local_node = common.get_localnode(self.nodes)
@@ -92,7 +94,7 @@ class PerfMonitoring(Monitoring):
             for runner in self.perf_runners:
                 runner.kill()
         else:
-            common.pdsh(self.nodes, 'sudo pkill -SIGINT -f perf\ ').communicate()
+            common.remote_kill(self.nodes, 'perf ', sig='SIGINT', full=True)
         if directory:
             common.pdsh(self.nodes, 'sudo chown {user}.{user} {dir}/perf/perf.data'.format(
                 user=self.user, dir=directory))
@@ -128,13 +130,13 @@ class BlktraceMonitoring(Monitoring):
 
     def start(self, directory):
         blktrace_dir = '%s/blktrace' % directory
-        common.pdsh(self.nodes, 'mkdir -p -m0755 -- %s' % blktrace_dir).communicate()
+        common.remote_mkdir(self.nodes, blktrace_dir, continue_if_error=True)
         for device in range(0, self.osds_per_node):
             common.pdsh(self.nodes, 'cd %s;sudo blktrace -o device%s -d /dev/disk/by-partlabel/osd-device-%s-data'
                         % (blktrace_dir, device, device))
 
     def stop(self, directory):
-        common.pdsh(self.nodes, 'sudo pkill -SIGINT -f blktrace').communicate()
+        common.remote_kill(self.nodes, 'blktrace', sig='SIGINT', full=True)
         if directory and not self.use_existing:
             self._make_movies(directory)
 
@@ -163,7 +165,7 @@ class TopMonitoring(Monitoring):
 
     def start(self, directory):
         top_dir = '%s/top' % directory
-        common.pdsh(self.nodes, 'mkdir -p -m0755 -- %s' % top_dir).communicate()
+        common.remote_mkdir(self.nodes, top_dir, continue_if_error=True)
 
         top_template = '{} {}'.format(self.top_cmd, self.args)
         local_node = common.get_localnode(self.nodes)
@@ -192,7 +194,7 @@ class TopMonitoring(Monitoring):
                 runner.kill()
         else:
             #ToDO: find the pid of the correct top instance process
-            common.pdsh(self.nodes, 'sudo pkill -SIGINT -f top\ ').communicate()
+            common.remote_kill(self.nodes, 'top ', sig='SIGINT', full=True)
         if directory:
             common.pdsh(self.nodes, 'sudo chown {user}.{user} {dir}/top/*top.out'.format(
                 user=self.user, dir=directory))
@@ -202,6 +204,40 @@ class TopMonitoring(Monitoring):
         return ['osds']
 
 
+class PerfCounterMonitoring(Monitoring):
+    """
+    Samples the perf counters of every OSD admin socket during the run with
+    perfcounters.py, copied to the nodes when it starts, into
+    <directory>/perfcounters/perf_counters.bin on each node.
+    """
+    def __init__(self, mconfig):
+        super(PerfCounterMonitoring, self).__init__(mconfig)
+        self.interval = mconfig.get('interval', 1)
+        self.asok_glob = mconfig.get('asok_glob', '/var/run/ceph/ceph-osd.*.asok')
+        self.ceph_cmd = settings.cluster.get('ceph_cmd', '/usr/bin/ceph')
+        self.python = settings.common.get('agent_python', 'python3')
+        self.script = '%s/perfcounters.py' % settings.cluster.get('tmp_dir', '/tmp/cbt')
+        self.user = settings.cluster.get('user')
+
+    def start(self, directory):
+        perfcounters_dir = '%s/perfcounters' % directory
+        common.remote_mkdir(self.nodes, perfcounters_dir, continue_if_error=True)
+        common.pdcp(self.nodes, '', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'perfcounters.py'),
+                    self.script).communicate()
+        common.pdsh(self.nodes, 'sudo %s %s --out %s/perf_counters.bin --interval %s --ceph-cmd %s --asok-glob \'%s\''
+                    % (self.python, self.script, perfcounters_dir, self.interval, self.ceph_cmd, self.asok_glob))
+
+    def stop(self, directory):
+        common.remote_kill(self.nodes, 'perfcounters.py', sig='SIGINT', full=True)
+        if directory:
+            common.pdsh(self.nodes, 'sudo chown {user}.{user} {dir}/perfcounters/perf_counters.bin'.format(
+                user=self.user, dir=directory))
+
+    @staticmethod
+    def _get_default_nodes():
+        return ['osds']
+
+
 def start(directory):
     for m in Monitoring._get_all():
         m.start(directory)
@@ -0,0 +1,304 @@
+"""
+OSD perf counter time series.
+
+This file is both the sampler, copied to the OSD nodes and run there by the
+perfcounters monitoring profile (see monitoring.py), and the reader of what
+it records, used by cbt and the tools on the head node.
+
+Every interval the sampler runs "perf dump" on the admin socket of every
+OSD of its node and writes, per OSD, how much each counter moved since the
+previous dump (the deltas are computed on the node). Gauges (counters
+without the COUNTER or LONGRUNAVG bit in "perf schema") are written as they
+are. A long running average such as osd.op_latency is split into its
+<name>.sum and <name>.avgcount counters.
+
+The file is a stream of little endian binary records after the MAGIC line,
+appended as the samples come so a stopped sampler leaves a readable file:
+
+    b'N' <HH> id, length, name        names of the daemons and the counters
+    b'S' <HddH> daemon id, start, end, count
+         count * <Hd> counter id, value
+                                      one interval of one daemon, counters
+                                      that did not move are left out
+
+Usage (on the node):
+    perfcounters.py --out FILE [--interval S] [--ceph-cmd CMD] [--asok-glob GLOB]
+
+This file only depends on the standard library.
+"""
+import argparse
+import fnmatch
+import glob
+import json
+import os
+import re
+import signal
+import struct
+import subprocess
+import sys
+import time
+
+MAGIC = b'CBTPC1\n'
+
+# perf schema type bits
+PERFCOUNTER_LONGRUNAVG = 0x4
+PERFCOUNTER_COUNTER = 0x8
+
+NAME = struct.Struct('<HH')
+SAMPLE = struct.Struct('<HddH')
+VALUE = struct.Struct('<Hd')
+
+
+# ---------------------------------------------------------------------------
+# Sampler: runs on the OSD nodes
+# ---------------------------------------------------------------------------
+
+def flatten(dump, schema):
+    """
+    {section.counter: (value, cumulative)} of a perf dump, the long running
+    averages as their sum and avgcount, the histograms left out
+    """
+    counters = {}
+    for section, values in dump.items():
+        for name, value in values.items():
+            key = '%s.%s' % (section, name)
+            kind = schema.get(section, {}).get(name, {}).get('type', PERFCOUNTER_COUNTER)
+            if isinstance(value, dict):
+                if 'avgcount' not in value or 'sum' not in value:
+                    continue
+                counters[key + '.sum'] = (float(value['sum']), True)
+                counters[key + '.avgcount'] = (float(value['avgcount']), True)
+            elif isinstance(value, (int, float)):
+                counters[key] = (float(value), bool(kind & (PERFCOUNTER_COUNTER | PERFCOUNTER_LONGRUNAVG)))
+    return counters
+
+
+def deltas(previous, current):
+    """ What moved between two flattened dumps, gauges as they are """
+    moved = {}
+    for key, (value, cumulative) in current.items():
+        if cumulative:
+            # a restarted daemon starts from zero again
+            value = value - previous[key][0] if key in previous and value >= previous[key][0] else value
+        if value:
+            moved[key] = value
+    return moved
+
+
+class Writer(object):
+    def __init__(self, f):
+        self.f = f
+        self.ids = {}
+        if f.tell() == 0:
+            f.write(MAGIC)
+            f.flush()
+
+    def name_id(self, name):
+        if name not in self.ids:
+            self.ids[name] = len(self.ids)
+            encoded = name.encode()
+            self.f.write(b'N' + NAME.pack(self.ids[name], len(encoded)) + encoded)
+        return self.ids[name]
+
+    def write(self, daemon, start, end, values):
+        ids = [(self.name_id(key), value) for key, value in sorted(values.items())]
+        record = b'S' + SAMPLE.pack(self.name_id(daemon), start, end, len(ids))
+        self.f.write(record + b''.join(VALUE.pack(key, value) for key, value in ids))
+        self.f.flush()
+
+
+class Sampler(object):
+    """ Dumps the perf counters of the OSDs of this node every interval """
+    def __init__(self, ceph_cmd, asok_glob, writer):
+        self.ceph_cmd = ceph_cmd
+        self.asok_glob = asok_glob
+        self.writer = writer
+        self.schemas = {}
+        self.previous = {}
+        self.stopped = False
+
+    def admin(self, asok, command):
+        proc = subprocess.run('%s --admin-daemon %s %s' % (self.ceph_cmd, asok, command), shell=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        return json.loads(proc.stdout.decode() or '{}') if proc.returncode == 0 else None
+
+    def sample(self):
+        for asok in sorted(glob.glob(self.asok_glob)):
+            m = re.search(r'(osd\.\d+)\.asok$', asok)
+            daemon = m.group(1) if m else os.path.basename(asok)
+            if daemon not in self.schemas:
+                self.schemas[daemon] = self.admin(asok, 'perf schema') or {}
+            dump = self.admin(asok, 'perf dump')
+            now = time.time()
+            if dump is None:
+                continue
+            current = flatten(dump, self.schemas[daemon])
+            if daemon in self.previous:
+                previous, start = self.previous[daemon]
+                self.writer.write(daemon, start, now, deltas(previous, current))
+            self.previous[daemon] = (current, now)
+
+    def run(self, interval):
+        deadline = time.time()
+        while not self.stopped:
+            self.sample()
+            deadline += interval
+            time.sleep(max(deadline - time.time(), 0))
+
+    def stop(self, signum=None, frame=None):
+        self.stopped = True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Record the perf counters of the OSDs of this node')
+    parser.add_argument('--out', required=True)
+    parser.add_argument('--interval', type=float, default=1.0)
+    parser.add_argument('--ceph-cmd', default='ceph')
+    parser.add_argument('--asok-glob', default='/var/run/ceph/ceph-osd.*.asok')
+    args = parser.parse_args(argv)
+    with open(args.out, 'ab') as f:
+        sampler = Sampler(args.ceph_cmd, args.asok_glob, Writer(f))
+        signal.signal(signal.SIGINT, sampler.stop)
+        signal.signal(signal.SIGTERM, sampler.stop)
+        sampler.run(args.interval)
+
+
+# ---------------------------------------------------------------------------
+# Reader: used on the head node
+# ---------------------------------------------------------------------------
+
+def load(path):
+    """ {daemon: [(start, end, {counter: value})]} of a file written by the sampler """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data:
+        return {}
+    if not data.startswith(MAGIC):
+        raise ValueError('%s is not a perf counter time series' % path)
+    names = {}
+    series = {}
+    pos = len(MAGIC)
+    try:
+        while pos < len(data):
+            kind = data[pos:pos + 1]
+            pos += 1
+            if kind == b'N':
+                name_id, length = NAME.unpack_from(data, pos)
+                pos += NAME.size
+                names[name_id] = data[pos:pos + length].decode()
+                pos += length
+            elif kind == b'S':
+                daemon, start, end, count = SAMPLE.unpack_from(data, pos)
+                pos += SAMPLE.size
+                values = {}
+                for _ in range(count):
+                    key, value = VALUE.unpack_from(data, pos)
+                    pos += VALUE.size
+                    values[names[key]] = value
+                series.setdefault(names[daemon], []).append((start, end, values))
+            else:
+                raise ValueError('%s: bad record at offset %d' % (path, pos - 1))
+    except struct.error:
+        # the last record of a killed sampler may be cut short
+        pass
+    return series
+
+
+class PerfCounters(object):
+    """
+    The perf counter time series of the files of one run (one per OSD node),
+    queried by counter name: 'osd.op_latency' (the mean latency of every
+    interval), 'osd.op_w' (per second), 'bluestore.commit_lat' or a pattern
+    like 'AsyncMessenger::Worker-*.msgr_send_bytes' which adds up the
+    counters it matches.
+    """
+    def __init__(self, paths):
+        self.series = {}
+        for path in paths:
+            self.series.update(load(path))
+
+    def daemons(self):
+        return sorted(self.series, key=lambda d: [int(p) if p.isdigit() else p for p in re.split(r'(\d+)', d)])
+
+    def counters(self):
+        names = set()
+        for samples in self.series.values():
+            for _, _, values in samples:
+                names.update(values)
+        return sorted(set(re.sub(r'\.(sum|avgcount)$', '', name) for name in names))
+
+    def is_average(self, counter):
+        return any(_select(values, counter + '.avgcount')
+                   for samples in self.series.values() for _, _, values in samples)
+
+    def intervals(self, counter, daemon):
+        """ [(start, end, total, count)] of one daemon, count is None but for an average """
+        average = self.is_average(counter)
+        result = []
+        for start, end, values in self.series.get(daemon, []):
+            if average:
+                result.append((start, end, _select(values, counter + '.sum'), _select(values, counter + '.avgcount')))
+            else:
+                result.append((start, end, _select(values, counter), None))
+        return result
+
+    def series_of(self, counter, daemon, rate=True):
+        """
+        [(start, end, value)] of the counter of one daemon: the mean of a
+        long running average over the interval, the per second rate of a
+        counter, or its delta when rate is False
+        """
+        return [(start, end, _value(start, end, total, count, rate))
+                for start, end, total, count in self.intervals(counter, daemon)]
+
+    def aligned(self, counter, start, offsets, daemon=None, rate=True):
+        """
+        The value of the counter at each of the offsets (seconds) from
+        start (seconds since the epoch), e.g. the time axis of a fio log
+        with start the job_start of fio, added up over the daemons (the
+        averages weighted by their counts). Offsets no daemon recorded are
+        None.
+        """
+        daemons = [daemon] if daemon else self.daemons()
+        average = self.is_average(counter)
+        columns = []
+        for name in daemons:
+            intervals = self.intervals(counter, name)
+            column = []
+            i = 0
+            for offset in offsets:
+                t = start + offset
+                while i < len(intervals) and intervals[i][1] < t:
+                    i += 1
+                column.append(intervals[i] if i < len(intervals) and intervals[i][0] <= t else None)
+            columns.append(column)
+        values = []
+        for row in zip(*columns) if columns else [[] for _ in offsets]:
+            row = [interval for interval in row if interval]
+            if not row:
+                values.append(None)
+            elif average:
+                count = sum(interval[3] for interval in row)
+                values.append(sum(interval[2] for interval in row) / count if count else 0.0)
+            else:
+                values.append(sum(_value(*interval, rate=rate) for interval in row))
+        return values
+
+
+def _select(values, counter):
+    """ The value of the counter, or the sum of the ones matching a pattern """
+    if not any(c in counter for c in '*?['):
+        return values.get(counter, 0.0)
+    return sum(value for name, value in values.items() if fnmatch.fnmatchcase(name, counter))
+
+
+def _value(start, end, total, count, rate=True):
+    if count is not None:
+        return total / count if count else 0.0
+    if rate and end > start:
+        return total / (end - start)
+    return total
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -35,12 +35,13 @@ and the details for read operations
 """
 
 import json
+from itertools import chain
 from logging import Logger, getLogger
 from pathlib import Path
-from typing import Generator, Optional
+from typing import Iterator, Optional
 
 from common import pdsh  # make_remote_dir  # pyright: ignore[reportUnknownVariableType]
-from post_processing.formatter.test_run_result import TestRunResult
+from post_processing.formatter.test_run_result import AGGREGATED_OUTPUT_PART, TestRunResult
 from post_processing.types import (
     COMMON_FORMAT_FILE_DATA_TYPE,
     INTERNAL_FORMATTED_OUTPUT_TYPE,
@@ -75,7 +76,7 @@ class CommonOutputFormatter:
         # to specify a single run? How full do these get?
 
         self._path: Path
-        self._file_list: Generator[Path, None, None]
+        self._file_list: Iterator[Path]
 
     def convert_all_files(self) -> None:
         """
@@ -134,7 +135,12 @@ class CommonOutputFormatter:
         self._path = Path(self._directory)
         # this gives a generator where each contained object is a Path of format:
         # <self._directory>/results/<iteration>/<run_id>/json_output.<vol_id>.<hostname>
-        self._file_list = self._path.glob(f"**/{self._filename_root}.?")
+        # or, for the output of a fio client driving the fio servers of the clients:
+        # <self._directory>/results/<iteration>/<run_id>/json_output.clients.<hostname>
+        self._file_list = chain(
+            self._path.glob(f"**/{self._filename_root}.?"),
+            self._path.glob(f"**/{self._filename_root}.{AGGREGATED_OUTPUT_PART}.*"),
+        )
 
     def _find_all_testrun_ids(self) -> None:
         """
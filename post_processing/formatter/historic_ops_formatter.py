@@ -0,0 +1,334 @@
+"""
+This file contains the code to convert the historic ops dumped from the OSDs
+at the end of a test run (historic_ops.out on every OSD node, see
+Ceph.dump_historic_ops) into per-stage latency distributions, so a report
+can show where the tail latency of a run comes from.
+
+The dumps are read with a streaming parser one op at a time, so files of
+tens of MB are never held in memory as a whole. The timeline of every op is
+rebuilt from its events and cut into stages, each ending at one of the
+MILESTONES and starting at the previous milestone the op reached (or when
+it was initiated).
+
+The output is a JSON file per test run of the format:
+{
+    unit: "ms"
+    stages: [<stage>, ...]
+    files: [<historic_ops file>, ...]
+    number_of_ops: <value>
+    osds: {
+        <osd>: {
+            <op type>: {
+                count: <value>
+                total: <distribution>
+                stages: {<stage>: <distribution>, ...}
+                tail: {<stage>: <mean over the slowest 1% of the ops>, ...}
+            }
+        }
+    }
+    all: {<op type>: ... }           the same, over all the OSDs
+}
+
+where a distribution is {count, mean, min, p50, p90, p99, p999, max}.
+"""
+
+import json
+import re
+from array import array
+from datetime import datetime
+from logging import Logger, getLogger
+from pathlib import Path
+from typing import Any, Generator, Optional, TextIO, Union
+
+log: Logger = getLogger("cbt")
+
+# The events ending the stages of an op, in the order an op goes through them
+MILESTONES: list[str] = ["queued_for_pg", "reached_pg", "started", "sub_op_committed", "commit_sent", "done"]
+
+PERCENTILES: list[tuple[str, float]] = [("p50", 50), ("p90", 90), ("p99", 99), ("p999", 99.9)]
+
+DISTRIBUTION_TYPE = dict[str, Union[int, float]]
+OP_TYPE_DATA_TYPE = dict[str, Any]
+
+OPS_ARRAY = re.compile(r'"ops"\s*:\s*\[')
+DOCUMENT_START = re.compile(r"^[#{]", re.M)
+OP_KIND = re.compile(r"^(\w+)\(")
+OP_NAMES = re.compile(r"\[([^\]]*)\]")
+ASOK_OSD = re.compile(r"(osd\.\d+)\.asok")
+
+READ_SIZE: int = 1 << 20
+
+
+def parse_event_time(value: str) -> float:
+    """
+    Seconds since the epoch of an event time, e.g. 2024-05-01T10:00:00.123456+0000
+    """
+    return datetime.strptime(value[:26].replace("T", " "), "%Y-%m-%d %H:%M:%S.%f").timestamp()
+
+
+def get_op_type(description: str) -> str:
+    """
+    The kind of message of an op with the names of its operations, e.g.
+    osd_op:set-alloc-hint+write or osd_repop
+    """
+    match = OP_KIND.match(description)
+    kind: str = match.group(1) if match else "unknown"
+    names = OP_NAMES.search(description)
+    if kind != "osd_op" or not names:
+        return kind
+    operations: list[str] = []
+    for operation in names.group(1).split(","):
+        name: str = operation.strip().split(" ")[0]
+        if name and name not in operations:
+            operations.append(name)
+    return f"{kind}:{'+'.join(operations)}"
+
+
+def get_events(op: dict[str, Any]) -> list[dict[str, Any]]:
+    type_data: Union[dict[str, Any], list[Any]] = op.get("type_data", {})
+    if isinstance(type_data, dict):
+        events: list[dict[str, Any]] = type_data.get("events", [])
+        return events
+    # older releases dump type_data as a list: flag point, client info, events
+    for entry in type_data:
+        if isinstance(entry, dict) and "events" in entry:
+            return list(entry["events"])
+    return []
+
+
+def get_stages(op: dict[str, Any]) -> tuple[float, dict[str, float]]:
+    """
+    The total latency of an op and the latency of each of the stages it went
+    through, in ms
+    """
+    times: dict[str, float] = {}
+    for event in get_events(op):
+        name: str = event.get("event", "")
+        if name not in times and "time" in event:
+            times[name] = parse_event_time(event["time"])
+    stages: dict[str, float] = {}
+    start: Optional[float] = times.get("initiated")
+    for milestone in MILESTONES:
+        if milestone in times:
+            if start is not None:
+                stages[milestone] = (times[milestone] - start) * 1000
+            start = times[milestone]
+    if "duration" in op:
+        total: float = float(op["duration"]) * 1000
+    elif times:
+        total = (max(times.values()) - min(times.values())) * 1000
+    else:
+        total = 0.0
+    return total, stages
+
+
+def read_historic_ops(file: TextIO, default_osd: str = "unknown") -> Generator[tuple[str, dict[str, Any]], None, None]:
+    """
+    Yields (osd, op) for every op of the dump_historic_ops documents of a
+    file, one op at a time. A "# <admin socket>" line before a document names
+    its OSD.
+    """
+    decoder = json.JSONDecoder()
+    buffer: str = ""
+    position: int = 0
+    eof: bool = False
+    osd: str = default_osd
+    in_ops: bool = False
+
+    while True:
+        if position > READ_SIZE:
+            buffer = buffer[position:]
+            position = 0
+        # make sure there is something to look at
+        while not eof and len(buffer) - position < READ_SIZE:
+            data: str = file.read(READ_SIZE)
+            if not data:
+                eof = True
+            buffer += data
+        if not in_ops:
+            match = DOCUMENT_START.search(buffer, position)
+            if not match:
+                if eof:
+                    return
+                position = len(buffer)
+                continue
+            position = match.start()
+            if buffer[position] == "#":
+                end: int = buffer.find("\n", position)
+                end = len(buffer) if end < 0 else end
+                osd_match = ASOK_OSD.search(buffer, position, end)
+                osd = osd_match.group(1) if osd_match else buffer[position + 1 : end].strip()
+                position = end
+                continue
+            ops = OPS_ARRAY.search(buffer, position)
+            marker: int = buffer.find("\n#", position)
+            if ops and 0 <= marker < ops.start():
+                # a document without ops, e.g. an error from a dead OSD
+                position = marker + 1
+                continue
+            if not ops:
+                if eof:
+                    return
+                data = file.read(READ_SIZE)
+                eof = not data
+                buffer += data
+                continue
+            position = ops.end()
+            in_ops = True
+            continue
+        # inside the ops array: skip the separators, decode the next op
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+        if position >= len(buffer):
+            if eof:
+                return
+            continue
+        if buffer[position] == "]":
+            in_ops = False
+            position += 1
+            continue
+        try:
+            op, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                log.warning("Truncated historic ops after %s", osd)
+                return
+            # the op is longer than what has been read so far
+            data = file.read(READ_SIZE)
+            eof = not data
+            buffer += data
+            continue
+        yield osd, op
+
+
+def get_distribution(values: array) -> DISTRIBUTION_TYPE:
+    """
+    The count, mean, extremes and percentiles (nearest rank) of a column of latencies
+    """
+    ordered: list[float] = sorted(values)
+    count: int = len(ordered)
+    distribution: DISTRIBUTION_TYPE = {"count": count}
+    if not count:
+        return distribution
+    distribution["mean"] = sum(ordered) / count
+    distribution["min"] = ordered[0]
+    for name, percentile in PERCENTILES:
+        distribution[name] = ordered[min(count - 1, max(0, int(-(-percentile * count // 100)) - 1))]
+    distribution["max"] = ordered[-1]
+    return distribution
+
+
+class OpColumns:
+    """
+    The latencies of the ops of one type, a column per stage, the stages an
+    op did not go through are NaN
+    """
+
+    def __init__(self) -> None:
+        self.total: array = array("d")
+        self.stages: dict[str, array] = {milestone: array("d") for milestone in MILESTONES}
+
+    def add(self, total: float, stages: dict[str, float]) -> None:
+        self.total.append(total)
+        for milestone in MILESTONES:
+            self.stages[milestone].append(stages.get(milestone, float("nan")))
+
+    def extend(self, other: "OpColumns") -> None:
+        self.total.extend(other.total)
+        for milestone in MILESTONES:
+            self.stages[milestone].extend(other.stages[milestone])
+
+    def get(self) -> OP_TYPE_DATA_TYPE:
+        total: DISTRIBUTION_TYPE = get_distribution(self.total)
+        stages: dict[str, DISTRIBUTION_TYPE] = {}
+        tail: dict[str, float] = {}
+        # the slowest 1% of the ops, at least one
+        slowest: list[int] = sorted(range(len(self.total)), key=lambda i: self.total[i], reverse=True)
+        slowest = slowest[: -(-len(slowest) // 100)]
+        for milestone in MILESTONES:
+            column: array = array("d", [value for value in self.stages[milestone] if value == value])
+            if not column:
+                continue
+            stages[milestone] = get_distribution(column)
+            tail_values: list[float] = [
+                self.stages[milestone][i] for i in slowest if self.stages[milestone][i] == self.stages[milestone][i]
+            ]
+            if tail_values:
+                tail[milestone] = sum(tail_values) / len(tail_values)
+        return {"count": len(self.total), "total": total, "stages": stages, "tail": tail}
+
+
+class HistoricOpsFormatter:
+    """
+    Converts the historic_ops.out files of the test runs of an archive
+    directory into the latency breakdown of each run
+    """
+
+    DEFAULT_OUTPUT_FILE_PART: str = "historic_ops.out"
+
+    def __init__(self, archive_directory: str, filename_root: Optional[str] = None) -> None:
+        self._directory: str = archive_directory
+        self._filename_root: str = filename_root if filename_root else self.DEFAULT_OUTPUT_FILE_PART
+        # {test run directory: {osd: {op type: columns}}}
+        self._runs: dict[Path, dict[str, dict[str, OpColumns]]] = {}
+        self._files: dict[Path, list[str]] = {}
+
+    def convert_all_files(self) -> None:
+        """
+        Read every historic ops file in the archive directory
+        """
+        for file_path in sorted(Path(self._directory).glob(f"**/{self._filename_root}*")):
+            if file_path.is_file():
+                self.convert_file(file_path)
+
+    def convert_file(self, file_path: Path) -> None:
+        log.debug("Reading historic ops from %s", file_path)
+        osds: dict[str, dict[str, OpColumns]] = self._runs.setdefault(file_path.parent, {})
+        self._files.setdefault(file_path.parent, []).append(str(file_path))
+        # a dump without an OSD marker is only known by the node it came from
+        host: str = file_path.name[len(self._filename_root) :].lstrip(".") or "unknown"
+        with open(file_path, "r", encoding="utf8", errors="replace") as file:
+            for osd, op in read_historic_ops(file, default_osd=host):
+                total, stages = get_stages(op)
+                op_type: str = get_op_type(op.get("description", ""))
+                osds.setdefault(osd, {}).setdefault(op_type, OpColumns()).add(total, stages)
+
+    def get(self, run_directory: Path) -> dict[str, Any]:
+        """
+        The latency breakdown of one test run
+        """
+        osds: dict[str, dict[str, OpColumns]] = self._runs.get(run_directory, {})
+        all_osds: dict[str, OpColumns] = {}
+        output_osds: dict[str, dict[str, OP_TYPE_DATA_TYPE]] = {}
+        number_of_ops: int = 0
+        for osd, op_types in sorted(osds.items()):
+            output_osds[osd] = {}
+            for op_type, columns in sorted(op_types.items()):
+                output_osds[osd][op_type] = columns.get()
+                all_osds.setdefault(op_type, OpColumns()).extend(columns)
+                number_of_ops += len(columns.total)
+        return {
+            "unit": "ms",
+            "stages": MILESTONES,
+            "files": self._files.get(run_directory, []),
+            "number_of_ops": number_of_ops,
+            "osds": output_osds,
+            "all": {op_type: columns.get() for op_type, columns in sorted(all_osds.items())},
+        }
+
+    def write_output_file(self) -> None:
+        """
+        Write the breakdown of each test run to visualisation/historic_ops/ in
+        the archive directory, named after the path of the run
+        """
+        destination_directory: Path = Path(self._directory) / "visualisation" / "historic_ops"
+        destination_directory.mkdir(parents=True, exist_ok=True)
+        for run_directory in sorted(self._runs):
+            try:
+                name: str = "_".join(run_directory.relative_to(self._directory).parts) or "historic_ops"
+            except ValueError:
+                name = run_directory.name
+            destination_filename: Path = destination_directory / f"{name}.json"
+            log.info("Writing historic ops breakdown to destination file %s", destination_filename)
+            with open(destination_filename, "w", encoding="utf8") as output:
+                json.dump(self.get(run_directory), output, indent=4, sort_keys=True)
@@ -17,6 +17,11 @@ from post_processing.types import (
 
 log: Logger = getLogger("cbt")
 
+# The name of the sum of all the clients in the output of a fio client
+ALL_CLIENTS: str = "All clients"
+# The part of the file name of the output of a fio client
+AGGREGATED_OUTPUT_PART: str = "clients"
+
 
 class TestRunResult:
     def __init__(self, archive_directory: str, test_run_id: str, file_name_root: str) -> None:
@@ -86,12 +91,12 @@ class TestRunResult:
 
         with open(str(file_path), "r", encoding="utf8") as file:
             data: dict[str, Any] = json.load(file)
-            iodepth: str = self._get_iodepth(
-                f"{data['global options']['iodepth']}", f"{data['global options']['write_iops_log']}"
-            )
-            blocksize: str = f"{data['global options']['bs']}"
-            operation: str = f"{data['global options']['rw']}"
-            global_details: IODEPTH_DETAILS_TYPE = self._get_global_options(data["global options"])
+            jobs: JOBS_DATA_TYPE = self._get_jobs(data)
+            options: dict[str, str] = self._get_options(data)
+            iodepth: str = self._get_iodepth(f"{options['iodepth']}", f"{options['write_iops_log']}")
+            blocksize: str = f"{options['bs']}"
+            operation: str = f"{options['rw']}"
+            global_details: IODEPTH_DETAILS_TYPE = self._get_global_options(options)
             blocksize_details: INTERNAL_BLOCKSIZE_DATA_TYPE = {blocksize: {}}
             iodepth_details: dict[str, IODEPTH_DETAILS_TYPE] = {iodepth: global_details}
 
@@ -106,11 +111,11 @@ class TestRunResult:
                         # we already have data here, so use it
                         io_details = self._sum_io_details(
                             self._processed_data[operation][blocksize][iodepth],
-                            self._get_io_details(all_jobs=data["jobs"]),
+                            self._get_io_details(all_jobs=jobs),
                         )
 
             if io_details == {}:
-                io_details = self._get_io_details(all_jobs=data["jobs"])
+                io_details = self._get_io_details(all_jobs=jobs)
 
             iodepth_details[iodepth].update(io_details)
             blocksize_details[blocksize].update(iodepth_details)
@@ -123,6 +128,39 @@ class TestRunResult:
             else:
                 self._processed_data.update({operation: blocksize_details})
 
+    def _get_jobs(self, data: dict[str, Any]) -> JOBS_DATA_TYPE:
+        """
+        The jobs of a fio output. The output of a fio client driving the fio
+        servers of several clients has the jobs of every client in
+        client_stats followed by their sum, the "All clients" entry, which
+        is all we need
+        """
+        if "client_stats" not in data:
+            jobs: JOBS_DATA_TYPE = data["jobs"]
+            return jobs
+
+        all_clients: JOBS_DATA_TYPE = [job for job in data["client_stats"] if job["jobname"] == ALL_CLIENTS]
+        if all_clients:
+            return all_clients
+
+        client_jobs: JOBS_DATA_TYPE = data["client_stats"]
+        return client_jobs
+
+    def _get_options(self, data: dict[str, Any]) -> dict[str, str]:
+        """
+        The options of a fio output. The options in the sections of a job
+        file are only in the job options of each job, so add those of the
+        first job to the global options
+        """
+        options: dict[str, str] = dict(data["global options"])
+        all_jobs: JOBS_DATA_TYPE = data.get("client_stats", data.get("jobs", []))
+        jobs: JOBS_DATA_TYPE = [job for job in all_jobs if job["jobname"] != ALL_CLIENTS]
+        if jobs and isinstance(jobs[0].get("job options"), dict):
+            for name, value in jobs[0]["job options"].items():  # type: ignore[union-attr]
+                options.setdefault(name, f"{value}")
+
+        return options
+
     def _get_global_options(self, fio_global_options: dict[str, str]) -> dict[str, str]:
         """
         read the data from the 'global options' section of the fio output
@@ -182,6 +220,14 @@ class TestRunResult:
         # We need to use a list here as we can possibly iterate over the file
         # list multiple times, and a Generator object only allows iterating
         # once
+        # The output of a fio client already sums all the clients, so it
+        # replaces the output of every volume when there is one
+        aggregated_files: list[Path] = list(
+            self._archive_path.glob(f"**/{testrun_id}/{file_name_root}.{AGGREGATED_OUTPUT_PART}.*")
+        )
+        if aggregated_files:
+            return aggregated_files
+
         return list(self._archive_path.glob(f"**/{testrun_id}/{file_name_root}.?"))
 
     def _file_is_empty(self, file_path: Path) -> bool:
@@ -14,6 +14,15 @@ client_endpoints = {}
 benchmarks = {}
 monitoring_profiles = {}
 
+# Resolved topology: host_info() results per host and getnodes() node-set
+# strings per role combination. Both are only valid for the cluster section
+# they were computed from, see invalidate_topology().
+_topology_owner = None
+_host_infos = {}
+_node_sets = {}
+
+ROLES = ('head', 'clients', 'osds', 'mons', 'rgws', 'mdss', 'mgrs')
+
 
 def _handle_monitoring_legacy():
     """
@@ -85,8 +94,36 @@ def initialize(ctx):
     except IOError as e:
         shutdown('Was not able to access conf file: %s' % cluster['conf_file'])
 
+    # resolve every host once, up front
+    invalidate_topology()
+    getnodes(*ROLES)
+
+
+def invalidate_topology():
+    """
+    Drop the cached host resolutions and node sets, they are rebuilt on the
+    next call. Needed after changing the role lists of the cluster section in
+    place, replacing the section altogether is detected.
+    """
+    global _topology_owner
+    _topology_owner = cluster
+    _host_infos.clear()
+    _node_sets.clear()
+
+
+def _check_topology():
+    if _topology_owner is not cluster:
+        invalidate_topology()
+
 
 def host_info(host):
+    _check_topology()
+    if host not in _host_infos:
+        _host_infos[host] = _resolve_host(host)
+    return dict(_host_infos[host])
+
+
+def _resolve_host(host):
     ret = {}
     user = cluster.get('user')
 
@@ -108,6 +145,13 @@ def host_info(host):
 
 
 def getnodes(*nodelists):
+    _check_topology()
+    if nodelists not in _node_sets:
+        _node_sets[nodelists] = _getnodes(nodelists)
+    return _node_sets[nodelists]
+
+
+def _getnodes(nodelists):
     nodes = []
 
     for nodelist in nodelists:
@@ -162,3 +206,4 @@ def mock_initialize(config_file="tools/invariant.yaml"):
     # Set some defaults required
     cluster['tmp_dir'] = '/tmp/cbt.XYZ'
     cluster['osd_ra'] = '0'
+    invalidate_topology()
@@ -0,0 +1,153 @@
+""" Unit tests for the remote agent """
+
+import os
+import subprocess
+import tempfile
+import time
+import unittest
+import agent
+import common
+import settings
+
+
+class TestAgent(unittest.TestCase):
+    """ Sanity tests for agent.py, using an agent started on the local host """
+    @classmethod
+    def setUpClass(cls):
+        command, source = agent.bootstrap_command()
+        cls.agent = agent.RemoteAgent('localhost', ['sh', '-c', command], source)
+        cls.agent.handshake()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.agent.close()
+
+    def test_handshake(self):
+        """ The agent announces itself """
+        self.assertTrue(self.agent.alive())
+        self.assertIsNotNone(self.agent.pid)
+
+    def test_run(self):
+        """ Can run a shell command """
+        result = self.agent.call('run', cmd='echo hello; exit 2')
+        self.assertEqual(result['rc'], 2)
+        self.assertEqual(result['stdout'], 'hello\n')
+
+    def test_files(self):
+        """ mkdir, append, stat, read and tail """
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'a', 'b')
+            self.agent.call('mkdir', path=path)
+            self.assertTrue(os.path.isdir(path))
+            fname = os.path.join(path, 'log')
+            self.assertFalse(self.agent.call('stat', path=fname)['exists'])
+            self.agent.call('append', path=fname, data='one\n')
+            self.agent.call('append', path=fname, data='two\n')
+            self.assertEqual(self.agent.call('stat', path=fname)['size'], 8)
+            self.assertEqual(self.agent.call('read', path=fname)['data'], 'one\ntwo\n')
+            tail = self.agent.call('tail', path=fname, offset=4)
+            self.assertEqual(tail, {'data': 'two\n', 'offset': 8})
+
+    def test_list(self):
+        """ Files are listed by name or relative path pattern, binary data is safe in base64 """
+        with tempfile.TemporaryDirectory() as tmp:
+            os.mkdir(os.path.join(tmp, 'collectl'))
+            for name in ('output.0', 'other', 'collectl/x.raw.gz'):
+                with open(os.path.join(tmp, name), 'wb') as fd:
+                    fd.write(b'\x1f\x8b\xff')
+            files = self.agent.call('list', root=tmp, patterns=['output.*', 'collectl/*'])['files']
+            self.assertEqual(sorted((name, size) for name, size, _ in files),
+                             [('collectl/x.raw.gz', 3), ('output.0', 3)])
+            tail = self.agent.call('tail', path=os.path.join(tmp, 'other'), offset=1, b64=True)
+            self.assertEqual(tail, {'data': 'i/8=', 'offset': 3})
+
+    def test_error(self):
+        """ A failing operation raises, the agent keeps serving """
+        self.assertRaises(agent.AgentError, self.agent.call, 'read', path='/nonexistent/file')
+        self.assertRaises(agent.AgentError, self.agent.call, 'no_such_op')
+        self.assertEqual(self.agent.call('run', cmd='true')['rc'], 0)
+
+    def test_kill(self):
+        """ Can kill processes by command line pattern """
+        duration = str(1000 + os.getpid())
+        proc = subprocess.Popen(['sleep', duration])
+        # Popen can return before the child has exec'ed sleep
+        for _ in range(100):
+            with open('/proc/%d/cmdline' % proc.pid, 'rb') as f:
+                if f.read().startswith(b'sleep'):
+                    break
+            time.sleep(0.01)
+        try:
+            result = self.agent.call('kill', name='^sleep %s$' % duration, signal='TERM', full=True)
+            self.assertEqual(result['killed'], [proc.pid])
+            self.assertEqual(proc.wait(5), -15)
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+
+    def test_call_many(self):
+        """ The same request can be pipelined to several agents """
+        results = agent.call_many([('a', self.agent)], 'run', cmd='echo $((1+1))')
+        self.assertEqual(results['a']['stdout'], '2\n')
+
+
+class TestCommonAgents(unittest.TestCase):
+    """ The common helpers use the agents once they are started """
+    def tearDown(self):
+        common.stop_agents()
+
+    def test_remote_helpers(self):
+        """ remote_mkdir and remote_append go through the local agent """
+        common.start_agents('localhost')
+        self.assertIsNotNone(common.get_agents('localhost'))
+        self.assertIsNone(common.get_agents('localhost,otherhost'))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'x')
+            common.remote_mkdir('localhost', path)
+            common.remote_append('localhost', os.path.join(path, 'log'), 'line\n')
+            with open(os.path.join(path, 'log'), encoding='UTF-8') as fd:
+                self.assertEqual(fd.read(), 'line\n')
+
+
+class TestResultStreamer(unittest.TestCase):
+    """ Result files are shipped while they are written """
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.saved = (settings.common, settings.cluster)
+        settings.common = {}
+        settings.cluster = {'clients': ['localhost']}
+        self.remote = os.path.join(self.tmp.name, 'run')
+        self.local = os.path.join(self.tmp.name, 'archive')
+        os.makedirs(os.path.join(self.remote, 'collectl'))
+
+    def tearDown(self):
+        settings.common, settings.cluster = self.saved
+        self.tmp.cleanup()
+
+    def test_streamer(self):
+        """ Appended data is shipped incrementally into the sync_files() layout """
+        out = os.path.join(self.remote, 'output.0')
+        raw = os.path.join(self.remote, 'collectl', 'host.raw.gz')
+        with open(out, 'w', encoding='UTF-8') as fd:
+            fd.write('first\n')
+        streamer = common.ResultStreamer(self.remote, self.local, interval=0.05)
+        streamer.start()
+        try:
+            time.sleep(0.2)
+            with open(os.path.join(self.local, 'output.0.localhost'), encoding='UTF-8') as fd:
+                self.assertEqual(fd.read(), 'first\n')
+            with open(out, 'a', encoding='UTF-8') as fd:
+                fd.write('second\n')
+            with open(raw, 'wb') as fd:
+                fd.write(bytes(range(256)))
+        finally:
+            streamer.stop()
+        with open(os.path.join(self.local, 'output.0.localhost'), encoding='UTF-8') as fd:
+            self.assertEqual(fd.read(), 'first\nsecond\n')
+        with open(os.path.join(self.local, 'collectl.localhost', 'host.raw.gz'), 'rb') as fd:
+            self.assertEqual(fd.read(), bytes(range(256)))
+        self.assertEqual(streamer.shipped, 13 + 256)
+
+
+if __name__ == '__main__':
+    unittest.main()
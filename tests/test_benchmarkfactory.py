@@ -2,6 +2,7 @@
 
 import unittest
 import benchmarkfactory
+import settings
 from log_support import setup_loggers
 
 
@@ -47,6 +48,51 @@ class TestBenchmarkFactory(unittest.TestCase):
         self.assertEqual(len(cfgs), 1)
         self.assertEqual(cfgs[0], config)
 
+    def test_permutations_constraints(self):
+        """ Combinations failing a constraint or matching an exclusion are left out """
+        config = {"mode": ["read", "write"], "iodepth": [1, 8, 32], "numjobs": [1, 4],
+                  "constraints": ["(<= (* iodepth numjobs) 32)"],
+                  "exclude": [{"mode": "write", "numjobs": 4}]}
+        cfgs = list(benchmarkfactory.all_configs(config))
+        self.assertEqual(sorted((cfg['mode'], cfg['iodepth'], cfg['numjobs']) for cfg in cfgs),
+                         [('read', 1, 1), ('read', 1, 4), ('read', 8, 1), ('read', 8, 4), ('read', 32, 1),
+                          ('write', 1, 1), ('write', 8, 1), ('write', 32, 1)])
+        for cfg in cfgs:
+            self.assertNotIn('constraints', cfg)
+            self.assertNotIn('exclude', cfg)
+
+    def test_permutations_lazy(self):
+        """ The first combination comes without going through the others """
+        config = {"p%d" % i: list(range(10)) for i in range(12)}
+        config["constraints"] = "(> p11 0)"
+        cfg = next(benchmarkfactory.all_configs(config))
+        self.assertEqual((cfg["p0"], cfg["p11"]), (0, 1))
+
+    def test_constraints_strings(self):
+        """ Constraints compare the settings to quoted strings """
+        config = {"mode": ["randread", "randwrite"], "iodepth": [1, 64],
+                  "constraints": ["(or (!= mode \"randread\") (< iodepth 8))", "(!= mode 'read')"]}
+        cfgs = list(benchmarkfactory.all_configs(config))
+        self.assertEqual(sorted((cfg['mode'], cfg['iodepth']) for cfg in cfgs),
+                         [('randread', 1), ('randwrite', 1), ('randwrite', 64)])
+
+    def test_get_all(self):
+        """ Configs hashing to the same results dir are run once, and built again at every pass """
+        saved = (settings.cluster, settings.benchmarks)
+        settings.cluster = {'tmp_dir': '/tmp/cbt'}
+        settings.benchmarks = {'nullbench': {'x': [1, 1, 2], 'acceptable': {}}}
+        try:
+            sweep = benchmarkfactory.get_all('/tmp', None, 0)
+            first = list(sweep)
+            dirs = [b.archive_dir for b in first]
+            self.assertEqual(len(dirs), 2)
+            self.assertEqual(len(set(dirs)), 2)
+            second = list(sweep)
+            self.assertEqual([b.archive_dir for b in second], dirs)
+            self.assertFalse(set(map(id, first)) & set(map(id, second)))
+        finally:
+            settings.cluster, settings.benchmarks = saved
+
 if __name__ == '__main__':
     setup_loggers(log_fname='/tmp/cbt-utest.log')
     unittest.main()
@@ -0,0 +1,458 @@
+""" Unit tests for the Ceph cluster class, against the fake cluster transport """
+
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+import common
+import settings
+from cluster import config_snapshot
+from cluster.ceph import Ceph, OsdSpec, RecoveryTestThreadBlocking, rbd_features
+from cluster.health import ClusterStatus, pending_autoscale, unscrubbed_pgs
+from cluster.prefill import Prefill
+from cluster.recovery import RecoveryRecorder, analyze
+
+
+class TestMakeOsds(unittest.TestCase):
+    """ OSD provisioning """
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.saved = (settings.common, settings.cluster)
+        settings.common = {'transport': 'fake', 'fake_root': os.path.join(self.tmp.name, 'hosts')}
+        settings.cluster = {'user': 'cbt', 'head': '127.1.0.1', 'osds': ['127.1.0.1', '127.1.0.2', '127.1.0.3'],
+                            'osds_per_node': 2, 'archive_dir': os.path.join(self.tmp.name, 'archive'),
+                            'tmp_dir': '/tmp/cbt', 'clusterid': 'ceph', 'use_existing': False,
+                            'osd_online_rate': 1000, 'osd_parallel_creates': 4}
+        self.cluster = Ceph.mockinit(settings.cluster)
+
+    def tearDown(self):
+        if self.cluster.health_watcher:
+            self.cluster.health_watcher.stop()
+        settings.common, settings.cluster = self.saved
+        self.tmp.cleanup()
+
+    def test_make_osds(self):
+        """ Every OSD is created once, started and timed stage by stage """
+        self.cluster.make_osds()
+        with open(os.path.join(self.tmp.name, 'archive', 'results', 'osd_timings.json'), encoding='UTF-8') as fd:
+            timings = json.load(fd)
+        self.assertEqual(sorted(t['osd'] for t in timings), list(range(6)))
+        self.assertEqual([t['host'] for t in timings if t['osd'] in (2, 3)], ['127.1.0.2'] * 2)
+        for stage in ('prepare', 'auth', 'crush', 'mkfs', 'start', 'up_in'):
+            self.assertTrue(all(t[stage] >= 0 for t in timings), stage)
+        osdmap = os.path.join(self.tmp.name, 'hosts', '.osdmap')
+        self.assertEqual(len([name for name in os.listdir(osdmap) if name.endswith('.up')]), 6)
+        keyring = os.path.join(self.tmp.name, 'hosts', '127.1.0.3', 'tmp', 'cbt', 'ceph', 'osd.5')
+        self.assertTrue(os.path.isdir(keyring))
+
+    def test_allocate_osd_ids(self):
+        """ The id is the last line of the output, an OSD without one is an error """
+        osds = [OsdSpec(n, '127.1.0.1', n, 'uuid-%d' % n, '/mnt/osd-device-%d-data' % n, None) for n in range(2)]
+
+        def run(batch, outputs):
+            batch.results = [{'127.1.0.1': output} for output in outputs]
+        with unittest.mock.patch.object(common.Batch, 'run', autospec=True,
+                                        side_effect=lambda batch: run(batch, [(0, 'warning\n7\n'), (0, '3\n')])):
+            self.cluster.allocate_osd_ids(osds)
+        self.assertEqual([osd.osdnum for osd in osds], [7, 3])
+        with unittest.mock.patch.object(common.Batch, 'run', autospec=True,
+                                        side_effect=lambda batch: run(batch, [(0, '4\n'), (22, 'Error EINVAL\n')])):
+            self.assertRaisesRegex(Exception, 'uuid-1.*rc=22', self.cluster.allocate_osd_ids, osds)
+
+    def test_reset(self):
+        """ A cluster built from the same definition is reset, a changed one is not """
+        settings.cluster.update({'clients': ['127.1.0.1'], 'health_poll_interval': 0.05})
+        self.cluster.make_osds()
+        self.cluster.save_cluster_state()
+        self.cluster.mkpool('rbd', 'default', 'rbd')
+        self.assertTrue(self.cluster.reset())
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, 'hosts', '.pools', 'rbd')))
+        self.assertEqual(len(self.cluster.osds), 6)
+
+        self.cluster.config['osds_per_node'] = 3
+        self.assertFalse(self.cluster.reset())
+
+
+def make_status(states, pools=None, health='HEALTH_OK', checks=None, **pgmap):
+    pgmap['num_pgs'] = sum(states.values())
+    pgmap['pgs_by_state'] = [{'state_name': state, 'count': count} for state, count in states.items()]
+    if pools is None:
+        pools = [{'pool_name': 'rbd', 'pg_num': pgmap['num_pgs'], 'pg_placement_num': pgmap['num_pgs']}]
+    return ClusterStatus({'health': {'status': health, 'checks': checks or {}}, 'pgmap': pgmap}, pools, time.time())
+
+
+class TestClusterStatus(unittest.TestCase):
+    """ The predicates the health checks wait on """
+    check_list = ["degraded", "peering", "recovery_wait", "stuck", "inactive", "unclean", "recovery", "stale"]
+
+    def test_settled(self):
+        """ PGs being created or missing from the pgmap are not healthy """
+        self.assertTrue(make_status({'active+clean': 64}).healthy(self.check_list))
+        self.assertFalse(make_status({'active+clean': 60, 'creating': 4}).healthy(self.check_list))
+        pools = [{'pool_name': 'rbd', 'pg_num': 128}]
+        self.assertFalse(make_status({'active+clean': 64}, pools).settled())
+
+    def test_healthy(self):
+        """ Warnings unrelated to the PGs do not count """
+        checks = {'PG_DEGRADED': {'summary': {'message': 'Degraded data redundancy: 3 pgs degraded'}}}
+        self.assertFalse(make_status({'active+clean': 61, 'active+degraded': 3}, health='HEALTH_WARN',
+                                     checks=checks).healthy(self.check_list))
+        checks = {'POOL_NO_REDUNDANCY': {'summary': {'message': '1 pool(s) have no replicas configured'}}}
+        self.assertTrue(make_status({'active+clean': 64}, health='HEALTH_WARN', checks=checks).healthy(self.check_list))
+
+    def test_scrub_and_autoscale_status(self):
+        """ PGs with a zero scrub stamp and pools the autoscaler would resize """
+        pgs = [{'pgid': '1.0', 'last_scrub_stamp': '2024-05-01T10:00:00.000000+0000',
+                'last_deep_scrub_stamp': '0.000000'},
+               {'pgid': '1.1', 'last_scrub_stamp': '2024-05-01T10:00:00.000000+0000',
+                'last_deep_scrub_stamp': '2024-05-01T10:00:00.000000+0000'},
+               {'pgid': '1.2', 'last_scrub_stamp': '1970-01-01T00:00:00.000000+0000',
+                'last_deep_scrub_stamp': '1970-01-01T00:00:00.000000+0000'}]
+        self.assertEqual(unscrubbed_pgs('127.1.0.1: %s\n' % json.dumps({'pg_ready': True, 'pg_stats': pgs})), 2)
+        self.assertEqual(unscrubbed_pgs('127.1.0.1: %s\n' % json.dumps(pgs[1:2])), 0)
+        status = [{'pool_name': 'rbd', 'would_adjust': True}, {'pool_name': 'kept', 'would_adjust': False}]
+        self.assertEqual(pending_autoscale('127.1.0.1: %s\n' % json.dumps(status)), ['rbd'])
+        self.assertEqual(pending_autoscale(''), [])
+
+    def test_backfill_and_autoscale(self):
+        """ Misplaced objects, backfilling PGs and PG count targets """
+        self.assertTrue(make_status({'active+clean': 64}, misplaced_objects=10).backfilling())
+        self.assertTrue(make_status({'active+clean': 60, 'active+remapped+backfilling': 4}).backfilling())
+        self.assertFalse(make_status({'active+clean': 64}, misplaced_objects=0).backfilling())
+        pools = [{'pool_name': 'rbd', 'pg_num': 64, 'pg_num_target': 256}]
+        self.assertTrue(make_status({'active+clean': 64}, pools).autoscaling())
+        self.assertFalse(make_status({'active+clean': 64}).autoscaling())
+
+
+class TestHealthWatcher(unittest.TestCase):
+    """ Waiting on the cluster status of the fake cluster """
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.saved = (settings.common, settings.cluster)
+        settings.common = {'transport': 'fake', 'fake_root': os.path.join(self.tmp.name, 'hosts')}
+        settings.cluster = {'user': 'cbt', 'head': '127.1.0.1', 'osds': ['127.1.0.1'], 'clients': ['127.1.0.1'],
+                            'tmp_dir': '/tmp/cbt', 'clusterid': 'ceph', 'use_existing': False,
+                            'health_poll_interval': 0.05, 'health_poll_max_interval': 0.2}
+        self.cluster = Ceph.mockinit(settings.cluster)
+
+    def tearDown(self):
+        if self.cluster.health_watcher:
+            self.cluster.health_watcher.stop()
+        settings.common, settings.cluster = self.saved
+        self.tmp.cleanup()
+
+    def test_check_health(self):
+        """ A healthy cluster is reported at the first poll """
+        common.pdsh('127.1.0.1', 'ceph osd pool create rbd 64 64').communicate()
+        start = time.time()
+        self.assertEqual(self.cluster.check_health(), 0)
+        self.assertEqual(self.cluster.check_pg_autoscaler(10), 0)
+        self.assertLess(time.time() - start, 5)
+        self.assertLessEqual(self.cluster.health_watcher.polls, 3)
+
+    def test_recovery_stats_log(self):
+        """ The object counts seen while healing and the time to heal go to recovery_stats.log """
+        thread = RecoveryTestThreadBlocking({'run_dir': '/tmp/cbt', 'osds': [0]}, self.cluster, None,
+                                            threading.Event(), threading.Event())
+        thread.recorder = unittest.mock.Mock()
+        thread.state = 'osdout'
+        with unittest.mock.patch.object(thread, 'reacted', return_value=True):
+            thread.osdout()
+        self.assertEqual(thread.state, 'osdin')
+        with open(os.path.join(self.tmp.name, 'hosts', '127.1.0.1', 'tmp', 'cbt', 'recovery_stats.log')) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], 'Time, Num Deg Objs, Total Deg Objs')
+        self.assertTrue(lines[-1].startswith('Time: '))
+        float(lines[-1].split()[1])
+
+    def test_pending_autoscale(self):
+        """ A pool the autoscaler is about to resize keeps the check waiting """
+        common.pdsh('127.1.0.1', 'ceph osd pool create rbd 64 64').communicate()
+        watcher = self.cluster.get_health_watcher()
+        pending = '127.1.0.1: [{"pool_name": "rbd", "would_adjust": true}]\n'
+        with unittest.mock.patch.object(watcher, 'query', return_value=pending):
+            self.assertEqual(self.cluster.check_pg_autoscaler(0.5), 1)
+        with unittest.mock.patch.object(watcher, 'query', side_effect=[pending, '']) as query:
+            self.assertEqual(self.cluster.check_pg_autoscaler(1.5), 0)
+        self.assertEqual(query.call_count, 2)
+
+    def test_recovery_health_tries(self):
+        """ The recovery test gives the OSDs going out maxhealthtries health waits to show """
+        self.cluster.health_wait = 0.2
+        thread = RecoveryTestThreadBlocking({'run_dir': '/tmp/cbt', 'osds': [0]}, self.cluster, None,
+                                            threading.Event(), threading.Event())
+        thread.recorder = unittest.mock.Mock()
+        thread.maxhealthtries = 2
+        thread.state = 'osdout'
+        start = time.time()
+        for _ in range(2):
+            thread.osdout()
+            self.assertEqual(thread.state, 'osdout')
+        self.assertGreaterEqual(time.time() - start, 2 * self.cluster.health_wait)
+        thread.osdout()
+        self.assertEqual(thread.state, 'osdin')
+        with open(os.path.join(self.tmp.name, 'hosts', '127.1.0.1', 'tmp', 'cbt', 'recovery.log')) as f:
+            log = f.read()
+        self.assertEqual(log.count('Cluster never went unhealthy.'), 1)
+        self.assertNotIn('ret:', log)
+
+    def test_wait_for(self):
+        """ Waiters are woken up by a change, or time out """
+        watcher = self.cluster.get_health_watcher()
+        pools = lambda status: len(status.pools) == 1
+        self.assertIsNone(watcher.wait_for(pools, timeout=0.3))
+        timer = threading.Timer(0.3, lambda: common.pdsh('127.1.0.1', 'ceph osd pool create rbd 8').communicate())
+        timer.start()
+        status = watcher.wait_for(pools, timeout=10)
+        timer.join()
+        self.assertEqual(status.pools[0]['pool_name'], 'rbd')
+        self.assertEqual(status.pgmap['num_pgs'], 8)
+
+
+class TestMkpools(unittest.TestCase):
+    """ Pools made from their profiles in bulk, and reused """
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.saved = (settings.common, settings.cluster)
+        settings.common = {'transport': 'fake', 'fake_root': os.path.join(self.tmp.name, 'hosts')}
+        settings.cluster = {'user': 'cbt', 'head': '127.1.0.1', 'osds': ['127.1.0.1'], 'clients': ['127.1.0.1'],
+                            'tmp_dir': '/tmp/cbt', 'clusterid': 'ceph', 'use_existing': False,
+                            'health_poll_interval': 0.05, 'health_poll_max_interval': 0.2,
+                            'pool_profiles': {'rbd': {'pg_size': 16, 'pgp_size': 16, 'replication': 2},
+                                              'kept': {'pg_size': 8, 'pgp_size': 8, 'replication': 3, 'reuse': True}}}
+        self.cluster = Ceph.mockinit(settings.cluster)
+
+    def tearDown(self):
+        if self.cluster.health_watcher:
+            self.cluster.health_watcher.stop()
+        settings.common, settings.cluster = self.saved
+        self.tmp.cleanup()
+
+    def pool(self, name):
+        with open(os.path.join(self.tmp.name, 'hosts', '.pools', name)) as f:
+            return json.load(f)
+
+    def test_mkpools(self):
+        """ Every option of the profile is applied and the pool is tagged with its spec """
+        self.cluster.mkpools([('rbd-a', 'rbd', 'rbd'), ('rbd-b', 'rbd', 'rbd')])
+        for name in ('rbd-a', 'rbd-b'):
+            pool = self.pool(name)
+            self.assertEqual((pool['pg_num'], pool['size'], pool['min_size']), (16, 2, 1))
+            self.assertEqual(pool['application_metadata']['rbd']['cbt_spec'],
+                             self.cluster.pool_spec(name, 'rbd', 'rbd').digest())
+
+    def test_reuse(self):
+        """ A pool made from the same profile is kept, a changed profile remakes it """
+        self.cluster.mkpools([('kept', 'kept', 'rbd'), ('other', 'rbd', 'rbd')])
+        pool_id = self.pool('kept')['pool']
+        self.cluster.rmpool('kept', 'kept')
+        self.cluster.mkpool('kept', 'kept', 'rbd')
+        self.assertEqual(self.pool('kept')['pool'], pool_id)
+
+        self.cluster.config['pool_profiles']['kept']['pg_size'] = 32
+        self.cluster.rmpool('kept', 'kept')
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, 'hosts', '.pools', 'kept')))
+        self.cluster.mkpool('kept', 'kept', 'rbd')
+        self.assertEqual(self.pool('kept')['pg_num'], 32)
+
+    def test_remove_pools(self):
+        """ Resetting the cluster keeps the pools of a profile with reuse set """
+        self.cluster.config['pool_profiles']['tiered'] = {'pg_size': 8, 'pgp_size': 8, 'cache_profile': 'rbd'}
+        self.cluster.mkpools([('kept', 'kept', 'rbd'), ('other', 'tiered', 'rbd')])
+        pools = os.path.join(self.tmp.name, 'hosts', '.pools')
+        self.assertEqual(sorted(os.listdir(pools)), ['kept', 'other', 'other-cache'])
+        self.cluster.remove_pools()
+        self.assertEqual(os.listdir(pools), ['kept'])
+
+
+class TestPrefill(unittest.TestCase):
+    """ Pool prefills spread over the clients """
+    def test_plan(self):
+        """ The target is split between the processes, each with its own run name """
+        prefill = Prefill('rados', 'ceph.conf', 'rbd', 4096, objects=10, nodes='a,cbt@b', procs=2)
+        plan = prefill.plan()
+        self.assertEqual([objects for _, _, objects in plan], [3, 3, 2, 2])
+        self.assertEqual(len(set(run_name for _, run_name, _ in plan)), 4)
+        self.assertEqual(plan[1][:2], ('cbt@b', 'cbt-prefill-b-0'))
+        self.assertEqual(Prefill('rados', 'ceph.conf', 'rbd', 0, total_bytes=(10 << 22) + 1, nodes='a').objects, 11)
+        self.assertEqual(len(Prefill('rados', 'ceph.conf', 'rbd', 4096, objects=1, nodes='a,b').plan()), 1)
+
+    def test_prefill_pool(self):
+        """ Every client writes its share and the progress adds up to the target """
+        tmp = tempfile.TemporaryDirectory()
+        saved = (settings.common, settings.cluster)
+        settings.common = {'transport': 'fake', 'fake_root': os.path.join(tmp.name, 'hosts')}
+        settings.cluster = {'user': 'cbt', 'head': '127.1.0.1', 'osds': ['127.1.0.1'],
+                            'clients': ['127.1.0.2', '127.1.0.3', '127.1.0.4'], 'tmp_dir': '/tmp/cbt',
+                            'clusterid': 'ceph', 'use_existing': False, 'prefill_procs_per_node': 2}
+        try:
+            cluster = Ceph.mockinit(settings.cluster)
+            self.assertEqual(cluster.prefill_pool('rbd', 4096, objects=1000), 1000)
+            self.assertEqual(sorted(os.listdir(os.path.join(tmp.name, 'hosts'))), ['127.1.0.2', '127.1.0.3', '127.1.0.4'])
+        finally:
+            settings.common, settings.cluster = saved
+            tmp.cleanup()
+
+
+class TestMkimages(unittest.TestCase):
+    """ RBD images created in parallel """
+    def test_rbd_features(self):
+        """ Features needing a disabled one are disabled too """
+        self.assertEqual(rbd_features('deep-flatten,fast-diff,object-map'), ['layering', 'exclusive-lock'])
+        self.assertEqual(rbd_features('exclusive-lock'), ['layering', 'deep-flatten'])
+        self.assertEqual(rbd_features('layering,exclusive-lock,deep-flatten'), [])
+        self.assertEqual(rbd_features('striping', '7'), ['layering', 'exclusive-lock'])
+        self.assertEqual(rbd_features('deep-flatten', 'layering, deep-flatten'), ['layering'])
+
+    def test_mkimages(self):
+        """ Every image is made once, from the head and the clients, with its features """
+        tmp = tempfile.TemporaryDirectory()
+        saved = (settings.common, settings.cluster)
+        settings.common = {'transport': 'fake', 'fake_root': os.path.join(tmp.name, 'hosts')}
+        settings.cluster = {'user': 'cbt', 'head': '127.1.0.1', 'osds': ['127.1.0.1'],
+                            'clients': ['127.1.0.2', '127.1.0.3'], 'tmp_dir': '/tmp/cbt', 'clusterid': 'ceph',
+                            'use_existing': False, 'image_create_nodes': ['head', 'clients'],
+                            'image_create_parallel': 2}
+        try:
+            cluster = Ceph.mockinit(settings.cluster)
+            images = [('img-%d' % i, 1024, 'rbd', None, 22) for i in range(7)]
+            cluster.mkimages(images, 'deep-flatten,fast-diff,object-map')
+            path = os.path.join(tmp.name, 'hosts', '.rbd', 'rbd')
+            self.assertEqual(sorted(os.listdir(path)), ['img-%d' % i for i in range(7)])
+            with open(os.path.join(path, 'img-6')) as f:
+                self.assertEqual(json.load(f)['features'], ['layering', 'exclusive-lock'])
+            self.assertEqual(sorted(os.listdir(os.path.join(tmp.name, 'hosts'))),
+                             ['.rbd', '127.1.0.1', '127.1.0.2', '127.1.0.3'])
+            # an rbd that creates nothing
+            cluster.rbd_cmd = 'true'
+            self.assertRaisesRegex(Exception, '1 rbd images were not created: rbd/lost',
+                                   cluster.mkimages, [('lost', 1024, 'rbd', None, 22)])
+        finally:
+            settings.common, settings.cluster = saved
+            tmp.cleanup()
+
+    def test_mkimages_features(self):
+        """ Images get no feature when all are disabled, the defaults come from the conf """
+        tmp = tempfile.TemporaryDirectory()
+        saved = (settings.common, settings.cluster)
+        conf_file = os.path.join(tmp.name, 'ceph.conf')
+        with open(conf_file, 'w') as f:
+            f.write('[global]\nrbd default features = 61\n[client]\nrbd_default_features = 5 ; layering, exclusive-lock\n')
+        settings.common = {'transport': 'fake', 'fake_root': os.path.join(tmp.name, 'hosts')}
+        settings.cluster = {'user': 'cbt', 'head': '127.1.0.1', 'osds': ['127.1.0.1'], 'tmp_dir': '/tmp/cbt',
+                            'clusterid': 'ceph', 'use_existing': False, 'conf_file': conf_file}
+        try:
+            cluster = Ceph.mockinit(settings.cluster)
+            cluster.mkimages([('none', 1024, 'rbd', None, 22)], 'layering,exclusive-lock,deep-flatten')
+            cluster.mkimages([('conf', 1024, 'rbd', None, 22)], 'deep-flatten')
+            path = os.path.join(tmp.name, 'hosts', '.rbd', 'rbd')
+            for name, features in (('none', []), ('conf', ['layering', 'exclusive-lock'])):
+                with open(os.path.join(path, name)) as f:
+                    self.assertEqual(json.load(f)['features'], features)
+        finally:
+            settings.common, settings.cluster = saved
+            tmp.cleanup()
+
+
+class TestConfigSnapshot(unittest.TestCase):
+    """ Config of every daemon, deduplicated, and its drift """
+    def test_snapshot(self):
+        """ Identical configs are kept once, divergent settings and changes since a snapshot show """
+        tmp = tempfile.TemporaryDirectory()
+        saved = (settings.common, settings.cluster)
+        root = os.path.join(tmp.name, 'hosts')
+        settings.common = {'transport': 'fake', 'fake_root': root}
+        settings.cluster = {'user': 'cbt', 'head': '127.1.0.1', 'osds': ['127.1.0.1', '127.1.0.2'],
+                            'mons': {'127.1.0.1': {'a': '127.1.0.1:6789'}}, 'tmp_dir': '/tmp/cbt',
+                            'clusterid': 'ceph', 'use_existing': False}
+        try:
+            cluster = Ceph.mockinit(settings.cluster)
+            os.makedirs(os.path.join(root, '127.1.0.1', 'var', 'run', 'ceph'))
+            os.makedirs(os.path.join(root, '127.1.0.2', 'var', 'run', 'ceph'))
+            for host, daemon in (('127.1.0.1', 'mon.a'), ('127.1.0.1', 'osd.0'), ('127.1.0.2', 'osd.1')):
+                open(os.path.join(root, host, 'var', 'run', 'ceph', 'ceph-%s.asok' % daemon), 'w').close()
+            os.makedirs(os.path.join(root, '.config'))
+            with open(os.path.join(root, '.config', 'osd.1'), 'w') as f:
+                json.dump({'osd_op_num_shards': '16'}, f)
+            common.make_remote_dir('/tmp/cbt/run')
+
+            previous = cluster.snapshot_config('/tmp/cbt/run')
+            self.assertEqual(sorted(previous.daemons), ['mon.a', 'osd.0', 'osd.1'])
+            self.assertEqual(len(previous.configs), 2)
+            self.assertEqual(previous.daemons['osd.1']['host'], '127.1.0.2')
+            self.assertEqual(previous.divergent(), {'osd': {'osd_op_num_shards': {'"8"': ['osd.0'], '"16"': ['osd.1']}}})
+            saved_snapshot = config_snapshot.load(os.path.join(root, '127.1.0.1', 'tmp', 'cbt', 'run', 'ceph_config.json'))
+            self.assertEqual(saved_snapshot.to_dict(), previous.to_dict())
+
+            with open(os.path.join(root, '.config', 'osd.1'), 'w') as f:
+                json.dump({'osd_op_num_shards': '8', 'osd_memory_target': '8589934592'}, f)
+            snapshot = cluster.snapshot_config('/tmp/cbt/run')
+            self.assertEqual(snapshot.diff(previous), {'osd.1': {'osd_memory_target': ['4294967296', '8589934592'],
+                                                                 'osd_op_num_shards': ['16', '8']}})
+        finally:
+            settings.common, settings.cluster = saved
+            tmp.cleanup()
+
+
+class TestRecoveryRecorder(unittest.TestCase):
+    """ Recovery time series """
+    def test_analyze(self):
+        """ Time to heal and to backfill, throughput and client impact from the samples """
+        recorder = RecoveryRecorder(None)
+        recorder.start_time = 1000.0
+        recorder.mark('osds_out', 1001.0)
+        samples = [(0, 0, 0, 0, 100), (1, 0, 0, 0, 100), (2, 50, 0, 10e6, 50), (3, 20, 0, 30e6, 50),
+                   (4, 0, 0, 0, 100), (5, 0, 40, 20e6, 50), (6, 0, 0, 0, 100)]
+        for t, degraded, misplaced, rate, ops in samples:
+            row = {'time': t, 'degraded_objects': degraded, 'misplaced_objects': misplaced,
+                   'recovering_bytes_per_sec': rate, 'write_op_per_sec': ops}
+            if misplaced:
+                row['pool.rbd.misplaced_objects'] = misplaced
+            recorder.append(row)
+        recorder.mark('osds_in', 1004.5)
+        data = recorder.to_dict()
+        self.assertEqual(data['columns']['pool.rbd.misplaced_objects'], [None] * 5 + [40, None])
+        result = analyze(data)
+        self.assertEqual(result['time_to_heal'], 3)
+        self.assertEqual(result['time_to_backfill'], 1.5)
+        self.assertEqual(result['recovery']['peak_bytes_per_sec'], 30e6)
+        self.assertEqual(result['recovery']['mean_bytes_per_sec'], 20e6)
+        self.assertEqual(result['client']['window'], [2, 5])
+        self.assertEqual(result['client']['ops_outside'], 100)
+        self.assertAlmostEqual(result['client']['impact'], 0.5)
+        self.assertEqual(result['pools']['rbd'], {'peak_degraded': 0, 'peak_misplaced': 40, 'clean_at': 6})
+
+    def test_record_and_save(self):
+        """ The health watcher feeds the recorder, the samples are saved on the head """
+        tmp = tempfile.TemporaryDirectory()
+        saved = (settings.common, settings.cluster)
+        settings.common = {'transport': 'fake', 'fake_root': os.path.join(tmp.name, 'hosts')}
+        settings.cluster = {'user': 'cbt', 'head': '127.1.0.1', 'osds': ['127.1.0.1'], 'clients': ['127.1.0.1'],
+                            'tmp_dir': '/tmp/cbt', 'clusterid': 'ceph', 'use_existing': False}
+        cluster = Ceph.mockinit(settings.cluster)
+        try:
+            common.pdsh('127.1.0.1', 'ceph osd pool create rbd 8').communicate()
+            recorder = RecoveryRecorder(cluster.get_health_watcher(), 0.05)
+            recorder.start()
+            recorder.mark('osds_out')
+            deadline = time.time() + 10
+            while len(recorder.to_dict()['columns']['time']) < 3 and time.time() < deadline:
+                time.sleep(0.05)
+            result = recorder.finish('127.1.0.1', '/tmp/cbt/recovery_timeseries.0.json')
+            self.assertGreaterEqual(result['samples'], 3)
+            self.assertIsNone(result['time_to_heal'])
+            with open(os.path.join(tmp.name, 'hosts', '127.1.0.1', 'tmp', 'cbt', 'recovery_timeseries.0.json')) as f:
+                data = json.load(f)
+            self.assertEqual(data['events'][0][1], 'osds_out')
+            self.assertEqual(data['columns']['degraded_objects'][0], 0)
+        finally:
+            cluster.health_watcher.stop()
+            settings.common, settings.cluster = saved
+            tmp.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,17 @@
 """ Unit tests for the Common class """
 
+import json
 import uuid
 import shutil
 import warnings
 import os
 import tempfile
+import threading
+import time
 import unittest
 import unittest.mock
 import common
+import settings
 
 VAR_NAME = "CBT_TEST_NODES"
 MSG = f"No test VM provided. Set {VAR_NAME} env var"
@@ -22,6 +26,24 @@ def iter_nodes(nodes):
         yield node
 
 
+FAKE_SSH = """#!/bin/sh
+# stand-in for ssh: drop the options and the host, run the command locally
+while [ $# -gt 0 ]; do
+    case "$1" in -o) shift 2;; -*) shift;; *) break;; esac
+done
+shift
+exec sh -c "$*"
+"""
+
+FAKE_SCP = """#!/bin/sh
+# stand-in for scp: drop the options and the host part of the paths
+while [ $# -gt 0 ]; do
+    case "$1" in -o) shift 2;; -*) shift;; *) break;; esac
+done
+exec sh -c "cp -r ${1#*:} ${2#*:}"
+"""
+
+
 class TestCommon(unittest.TestCase):
     """ Sanity tests for common.py """
     def test_mkdirp(self):
@@ -92,3 +114,379 @@ class TestCommon(unittest.TestCase):
                 except OSError:
                     pass
             common.pdsh(nodes, "rm " + fname).communicate()
+
+
+class TestSshMuxTransport(unittest.TestCase):
+    """ Sanity tests for the ssh multiplexing transport, using stand-ins for ssh/scp """
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.saved_common = settings.common
+        fake_ssh = os.path.join(self.tmp.name, 'ssh')
+        fake_scp = os.path.join(self.tmp.name, 'scp')
+        for fname, contents in ((fake_ssh, FAKE_SSH), (fake_scp, FAKE_SCP)):
+            with open(fname, 'w', encoding='UTF-8') as fd:
+                fd.write(contents)
+            os.chmod(fname, 0o755)
+        settings.common = {'transport': 'ssh', 'ssh_cmd': fake_ssh, 'scp_cmd': fake_scp,
+                           'ssh_control_dir': os.path.join(self.tmp.name, 'ctl')}
+
+    def tearDown(self):
+        settings.common = self.saved_common
+        common.get_transport()
+        self.tmp.cleanup()
+
+    def test_get_transport(self):
+        """ The transport is selected from the common section """
+        self.assertIsInstance(common.get_transport(), common.SshMuxTransport)
+        settings.common = {}
+        self.assertIsInstance(common.get_transport(), common.PdshTransport)
+        settings.common = {'transport': 'carrier-pigeon'}
+        self.assertRaises(ValueError, common.get_transport)
+        settings.common = {}
+
+    def test_close_transport(self):
+        """ Rebuilding the transport registers nothing more to close at exit """
+        with unittest.mock.patch('atexit.register') as register:
+            transport = common.get_transport()
+            settings.common = dict(settings.common)
+            self.assertIsNot(common.get_transport(), transport)
+        register.assert_not_called()
+        with unittest.mock.patch.object(common.get_transport(), 'close') as close:
+            common.close_transport()
+        close.assert_called_once_with()
+        self.assertIsNone(common.SINGLETON_TRANSPORT)
+
+    def test_pdsh_prefixes_hosts(self):
+        """ Output lines are prefixed per host like pdsh does """
+        proc = common.get_transport().pdsh('nodea,user@nodeb', 'echo hello')
+        out, _err = proc.communicate()
+        self.assertIn('nodea: hello\n', out)
+        self.assertIn('nodeb: hello\n', out)
+        self.assertEqual(proc.myrtncode, 0)
+
+    def test_pdsh_error(self):
+        """ A failure on one host is reported """
+        proc = common.get_transport().pdsh('nodea,nodeb', 'exit 3', continue_if_error=False)
+        self.assertRaises(Exception, proc.communicate)
+        self.assertEqual(proc.myrtncode, 3)
+
+    def test_rpdcp_suffixes_hosts(self):
+        """ Copied back files get the host name appended like rpdcp does """
+        remote = os.path.join(self.tmp.name, 'remote')
+        local = os.path.join(self.tmp.name, 'local')
+        common.mkdir_p(remote)
+        common.mkdir_p(local)
+        with open(os.path.join(remote, 'output.0'), 'w', encoding='UTF-8') as fd:
+            fd.write('data')
+        common.get_transport().rpdcp('nodea,nodeb', '-r', '%s/*' % remote, local).communicate()
+        self.assertEqual(sorted(os.listdir(local)), ['output.0.nodea', 'output.0.nodeb'])
+
+    def test_batch_per_host(self):
+        """ A batch reports the status and output of every command on every host """
+        with common.Batch('nodea,nodeb') as batch:
+            batch.add('echo one')
+            batch.add('echo two; exit 2')
+        for host in ('nodea', 'nodeb'):
+            self.assertEqual(batch.results[0][host], (0, 'one\n'))
+            self.assertEqual(batch.results[1][host], (2, 'two\n'))
+        self.assertEqual(len(batch.failed()), 2)
+
+
+class TestBatch(unittest.TestCase):
+    """ Tests for common.Batch on the local node """
+    def test_batch(self):
+        """ Commands run in order and keep their own output and status """
+        with common.Batch('localhost') as batch:
+            batch.add('echo first')
+            batch.add(['echo', 'second', '>&2', ';', 'false'])
+            batch.add('echo third')
+        self.assertEqual([r['localhost'] for r in batch.results],
+                         [(0, 'first\n'), (1, 'second\n'), (0, 'third\n')])
+
+    def test_batch_unterminated_output(self):
+        """ Output without a final newline keeps the status of its command """
+        with common.Batch('localhost', continue_if_error=False) as batch:
+            batch.add('printf abc')
+            batch.add('true')
+        self.assertEqual([r['localhost'] for r in batch.results], [(0, 'abc'), (0, '')])
+
+    def test_batch_bash(self):
+        """ Commands run under bash on every transport """
+        with common.Batch('localhost') as batch:
+            batch.add('echo {a,b}; [[ -n x ]] && echo yes')
+        self.assertEqual(batch.results[0]['localhost'], (0, 'a b\nyes\n'))
+        self.assertEqual(common.command_class(batch.script()), 'batch')
+
+    def test_batch_stops_on_error(self):
+        """ A failing command added with continue_if_error=False stops the batch """
+        batch = common.Batch('localhost')
+        batch.add('exit 4', continue_if_error=False)
+        batch.add('echo unreachable')
+        self.assertRaises(Exception, batch.run)
+        self.assertEqual(batch.results[0]['localhost'], (4, ''))
+        self.assertEqual(batch.results[1]['localhost'], (None, ''))
+
+
+FAKE_PDSH = """#!/bin/sh
+# stand-in for pdsh: node b fails, as reported by pdsh on stderr
+echo "nodea: line from a"
+echo "nodeb: line from b"
+echo "pdsh@head: nodeb: ssh exited with exit code 3" >&2
+exit 1
+"""
+
+
+class TestRun(unittest.TestCase):
+    """ Tests for the asyncio execution engine """
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.saved_common = settings.common
+
+    def tearDown(self):
+        settings.common = self.saved_common
+        common.get_transport()
+        self.tmp.cleanup()
+
+    def test_run_streams_lines(self):
+        """ Lines are handed over per host and per stream as they come """
+        lines = []
+        results = common.asyncio.run(common.run('localhost', 'echo out; echo err >&2; exit 5',
+                                                on_line=lambda *line: lines.append(line)))
+        self.assertEqual(sorted(lines), [('localhost', 'stderr', 'err'), ('localhost', 'stdout', 'out')])
+        self.assertEqual(results['localhost'].rc, 5)
+        self.assertEqual(results['localhost'].output(), ('out\n', 'err\n'))
+
+    def test_run_error(self):
+        """ A failure raises unless continue_if_error """
+        self.assertRaises(Exception, common.run_all, 'localhost', ['false'], continue_if_error=False)
+
+    def test_run_timeout(self):
+        """ The command is terminated when the timeout expires """
+        marker = os.path.join(self.tmp.name, 'marker')
+        self.assertRaises(common.asyncio.TimeoutError, common.run_all,
+                          'localhost', ['sleep 0.5; touch %s' % marker], timeout=0.2)
+        time.sleep(0.6)
+        self.assertFalse(os.path.exists(marker))
+
+    def test_run_pdsh_output(self):
+        """ pdsh output is split per host, with the failed hosts reported """
+        fake_pdsh = os.path.join(self.tmp.name, 'pdsh')
+        with open(fake_pdsh, 'w', encoding='UTF-8') as fd:
+            fd.write(FAKE_PDSH)
+        os.chmod(fake_pdsh, 0o755)
+        settings.common = {'pdsh_cmd': fake_pdsh}
+        results = common.run_all('nodea,nodeb', ['true'])[0]
+        self.assertEqual((results['nodea'].rc, results['nodea'].output()), (0, ('line from a\n', '')))
+        self.assertEqual((results['nodeb'].rc, results['nodeb'].output()), (3, ('line from b\n', '')))
+
+    def test_run_concurrency(self):
+        """ The hosts are run at most concurrency at a time """
+        fake_ssh = os.path.join(self.tmp.name, 'ssh')
+        with open(fake_ssh, 'w', encoding='UTF-8') as fd:
+            fd.write(FAKE_SSH)
+        os.chmod(fake_ssh, 0o755)
+        settings.common = {'transport': 'ssh', 'ssh_cmd': fake_ssh,
+                           'ssh_control_dir': os.path.join(self.tmp.name, 'ctl')}
+        running = os.path.join(self.tmp.name, 'running')
+        os.mkdir(running)
+        cmd = 'touch {0}/$$; ls {0} | wc -l; sleep 0.2; rm {0}/$$'.format(running)
+        results = common.run_all('nodea,nodeb,nodec,noded', [cmd], concurrency=2)[0]
+        self.assertEqual(sorted(results), ['nodea', 'nodeb', 'nodec', 'noded'])
+        self.assertTrue(all(int(r.output()[0]) <= 2 for r in results.values()))
+
+
+class TestNodeFile(unittest.TestCase):
+    """ Node lists read from files """
+    def test_nodefile(self):
+        """ A node file is read again once modified """
+        with tempfile.NamedTemporaryFile('w', encoding='UTF-8') as nodefile:
+            nodefile.write('nodea\nnodeb\n')
+            nodefile.flush()
+            self.assertEqual(common.expanded_node_list('head,^%s' % nodefile.name), ['head', 'nodea', 'nodeb'])
+            nodefile.write('nodec\n')
+            nodefile.flush()
+            os.utime(nodefile.name, ns=(0, os.stat(nodefile.name).st_mtime_ns + 1))
+            self.assertEqual(common.expanded_node_list('^%s' % nodefile.name), ['nodea', 'nodeb', 'nodec'])
+
+
+class TestFqdnMap(unittest.TestCase):
+    """ The fqdns are gathered once per cluster session """
+    def setUp(self):
+        self.saved_cluster = settings.cluster
+        settings.cluster = {'head': 'localhost', 'clients': ['nodea', 'user@nodeb']}
+
+    def tearDown(self):
+        settings.cluster = self.saved_cluster
+
+    def test_fqdn_map(self):
+        """ One sweep for all the remote nodes, none for the local one """
+        out = ('nodea: nodea.example.com nodea\n'
+               'nodeb: nodeb.example.com nodeb\n', '')
+        with unittest.mock.patch('socket.gethostbyname', return_value='127.0.0.1'), \
+                unittest.mock.patch('common.pdsh') as pdsh:
+            pdsh.return_value.communicate.return_value = out
+            self.assertEqual(sorted(common.get_fqdn_list('clients')), ['nodea.example.com', 'nodeb.example.com'])
+            self.assertEqual(common.get_fqdn_map('clients')['user@nodeb'],
+                             {'fqdn': 'nodeb.example.com', 'short': 'nodeb'})
+            self.assertEqual(list(common.get_fqdn_map('head')), ['localhost'])
+            self.assertEqual(pdsh.call_count, 1)
+            self.assertEqual(sorted(pdsh.call_args[0][0].split(',')), ['nodea', 'user@nodeb'])
+            common.get_fqdn_map(refresh=True)
+            self.assertEqual(pdsh.call_count, 2)
+
+
+class TestTrace(unittest.TestCase):
+    """ Remote calls are recorded in the trace file """
+    def test_command_class(self):
+        """ Commands are reduced to their executable and ceph subcommand """
+        self.assertEqual(common.command_class('sudo ceph -c /tmp/ceph.conf osd pool set rbd size 3'),
+                         'ceph osd pool set')
+        self.assertEqual(common.command_class('sudo sh -c "ulimit -c unlimited && exec ceph-osd -i 0"'),
+                         'ceph-osd')
+        self.assertEqual(common.command_class(['cd', '/tmp', ';', 'LC_ALL=C', 'fio', '--output=x']), 'fio')
+
+    def test_trace(self):
+        """ Every call gets a record tagged with the current phase """
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'trace.jsonl')
+            common.start_trace(path)
+            try:
+                with common.trace_phase('outer'):
+                    common.pdsh('localhost', 'echo hello').communicate()
+                    with common.trace_phase('inner'):
+                        common.run_all('localhost', ['exit 3'])
+            finally:
+                common.stop_trace()
+            with open(path, encoding='UTF-8') as f:
+                records = [json.loads(line) for line in f]
+        self.assertEqual([(r['k'], r['c'], r['rc'], r['p']) for r in records],
+                         [('pdsh', 'echo', 0, 'outer'), ('run', 'exit', 3, 'outer/inner')])
+        self.assertGreaterEqual(records[0]['t1'], records[0]['t0'])
+        self.assertEqual(records[0]['b'], len('hello\n'))
+
+    def test_restart_trace(self):
+        """ Starting a trace again registers nothing more to run at exit """
+        with tempfile.TemporaryDirectory() as tmp, unittest.mock.patch('atexit.register') as register:
+            for _ in range(2):
+                common.start_trace(os.path.join(tmp, 'trace.jsonl'))
+            common.stop_trace()
+        register.assert_not_called()
+        self.assertIsNone(common.TRACE)
+
+    def test_trace_phases_per_thread(self):
+        """ Threads nest their own phases, or inherit the ones they were created in """
+        barrier = threading.Barrier(2)
+        seen = {}
+
+        def phase(name):
+            with common.trace_phase(name):
+                # both threads are in their phase from here on
+                barrier.wait()
+                if name == 'b':
+                    barrier.wait()
+                seen[name] = list(common.trace_phases())
+                if name == 'a':
+                    barrier.wait()
+            seen[name + ' after'] = list(common.trace_phases())
+
+        def inherited(phases):
+            common.inherit_phases(phases)
+            seen['inherited'] = list(common.trace_phases())
+
+        with common.trace_phase('main'):
+            threads = [threading.Thread(target=phase, args=(name,)) for name in ('a', 'b')]
+            threads.append(threading.Thread(target=inherited, args=(list(common.trace_phases()),)))
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(common.trace_phases(), ['main'])
+        self.assertEqual(seen, {'a': ['a'], 'b': ['b'], 'a after': [], 'b after': [], 'inherited': ['main']})
+
+
+FAKE_SUDO = """#!/bin/sh
+exec "$@"
+"""
+
+
+class TestSyncFiles(unittest.TestCase):
+    """ Result collection through compressed tar streams """
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.saved = (settings.common, settings.cluster, os.environ['PATH'])
+        bindir = os.path.join(self.tmp.name, 'bin')
+        os.mkdir(bindir)
+        for name, contents in (('sudo', FAKE_SUDO), ('ssh', FAKE_SSH)):
+            with open(os.path.join(bindir, name), 'w', encoding='UTF-8') as fd:
+                fd.write(contents)
+            os.chmod(os.path.join(bindir, name), 0o755)
+        os.environ['PATH'] = '%s:%s' % (bindir, os.environ['PATH'])
+        settings.common = {'transport': 'ssh', 'sync': 'tar', 'ssh_cmd': os.path.join(bindir, 'ssh'),
+                           'ssh_control_dir': os.path.join(self.tmp.name, 'ctl')}
+        self.remote = os.path.join(self.tmp.name, 'run')
+        self.local = os.path.join(self.tmp.name, 'archive')
+        os.makedirs(os.path.join(self.remote, 'logs'))
+        for name in ('output.0', 'logs/osd.0.log'):
+            with open(os.path.join(self.remote, name), 'w', encoding='UTF-8') as fd:
+                fd.write('data of %s\n' % name)
+
+    def tearDown(self):
+        settings.common, settings.cluster, os.environ['PATH'] = self.saved
+        common.get_transport()
+        self.tmp.cleanup()
+
+    def test_sync_files(self):
+        """ Entries get the host name appended, unchanged files are skipped """
+        settings.cluster = {'clients': ['nodea', 'nodeb']}
+        with unittest.mock.patch('socket.gethostbyname', return_value='127.0.0.1'):
+            common.sync_files('%s/*' % self.remote, self.local)
+            self.assertEqual(sorted(os.listdir(self.local)),
+                             ['.sync_manifest.json', 'logs.nodea', 'logs.nodeb', 'output.0.nodea', 'output.0.nodeb'])
+            with open(os.path.join(self.local, 'logs.nodeb', 'osd.0.log'), encoding='UTF-8') as fd:
+                self.assertEqual(fd.read(), 'data of logs/osd.0.log\n')
+
+            # only the modified file is copied again
+            os.unlink(os.path.join(self.local, 'logs.nodea', 'osd.0.log'))
+            with open(os.path.join(self.remote, 'output.0'), 'a', encoding='UTF-8') as fd:
+                fd.write('more\n')
+            common.sync_files('%s/*' % self.remote, self.local)
+            self.assertEqual(os.listdir(os.path.join(self.local, 'logs.nodea')), [])
+            with open(os.path.join(self.local, 'output.0.nodea'), encoding='UTF-8') as fd:
+                self.assertEqual(fd.read(), 'data of output.0\nmore\n')
+
+    def test_sync_files_tar_error(self):
+        """ A failing tar is not hidden by the compression """
+        settings.cluster = {'clients': ['nodea']}
+        tar = os.path.join(self.tmp.name, 'bin', 'tar')
+        with open(tar, 'w', encoding='UTF-8') as fd:
+            fd.write('#!/bin/sh\n%s "$@"\nexit 2\n' % shutil.which('tar', path=self.saved[2]))
+        os.chmod(tar, 0o755)
+        with unittest.mock.patch('socket.gethostbyname', return_value='127.0.0.1'):
+            self.assertRaisesRegex(Exception, 'tar exited with 2', common.sync_files, '%s/*' % self.remote, self.local)
+
+    def test_sync_files_parallel(self):
+        """ No more than sync_parallel nodes are synced at a time """
+        settings.cluster = {'clients': ['nodea', 'nodeb', 'nodec', 'noded']}
+        settings.common['sync_parallel'] = 2
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def sync(thread):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.1)
+            with lock:
+                running[0] -= 1
+        with unittest.mock.patch('socket.gethostbyname', return_value='127.0.0.1'), \
+                unittest.mock.patch.object(common.SyncThread, 'sync', autospec=True, side_effect=sync) as mocked:
+            common.sync_files('%s/*' % self.remote, self.local)
+        self.assertEqual(mocked.call_count, 4)
+        self.assertEqual(running, [0, 2])
+
+    def test_sync_files_local(self):
+        """ The local node is synced without compression as well """
+        settings.cluster = {'clients': ['localhost']}
+        settings.common = {'sync': 'tar', 'sync_compression': 'none'}
+        common.sync_files(self.remote, self.local)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.local, 'run.localhost'))), ['logs', 'output.0'])
@@ -3,7 +3,7 @@ Unit tests for the CommonOutputFormatter class
 """
 
 import unittest
-from typing import Dict, List, Union
+from typing import Any, Dict, List, Union
 
 from post_processing.formatter.common_output_formatter import CommonOutputFormatter
 from post_processing.formatter.test_run_result import TestRunResult
@@ -165,3 +165,23 @@ class TestCommonOutputFormatter(unittest.TestCase):
 
         for key in expected_output.keys():
             self.assertEqual(expected_output[key], output[key])
+
+    def test_client_stats_parsing(self) -> None:
+        """
+        Make sure only the sum of all the clients is used from the output of
+        a fio client, with the options of the job file sections
+        """
+        client_jobs: List[Dict[str, Any]] = [
+            {"jobname": "volume", "hostname": host, "job options": {"iodepth": "8"}, "read": self.read_data}
+            for host in ("client1", "client2")
+        ]
+        all_clients: Dict[str, Any] = {"jobname": "All clients", "read": self.read_data, "write": self.write_data}
+        data: Dict[str, Any] = {"global options": self.global_options_data, "client_stats": client_jobs + [all_clients]}
+
+        jobs = self.test_run_results._get_jobs(data)  # pyright: ignore[reportPrivateUsage]
+        self.assertEqual(jobs, [all_clients])
+
+        options = self.test_run_results._get_options(  # pyright: ignore[reportPrivateUsage]
+            {"global options": {"rw": "read"}, "client_stats": client_jobs + [all_clients]}
+        )
+        self.assertEqual(options, {"rw": "read", "iodepth": "8"})
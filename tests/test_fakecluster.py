@@ -0,0 +1,126 @@
+""" Unit tests for the fake cluster transport """
+
+import json
+import os
+import tempfile
+import unittest
+import common
+import fakecluster
+import settings
+
+NODES = '127.1.0.1,127.1.0.2,127.1.0.3'
+
+
+class TestFakeShell(unittest.TestCase):
+    """ The shell interpreter of fakecluster.py, without going through cbt """
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cluster = fakecluster.FakeCluster(self.tmp.name)
+
+    def tearDown(self):
+        self.cluster.close()
+        self.tmp.cleanup()
+
+    def run_cmd(self, command, stdin=b''):
+        _, rc, out, err = self.cluster.run('cbt@127.1.0.1', command, stdin)
+        return rc, out.decode(), err.decode()
+
+    def test_shell(self):
+        """ Lists, redirections, substitutions, conditionals and pipes """
+        rc, out, _ = self.run_cmd('mkdir -p /tmp/x && echo "a b" > /tmp/x/f; echo c >> /tmp/x/f; '
+                                  'if [ -f /tmp/x/f ]; then cat /tmp/x/f | wc -l; fi; '
+                                  'echo $(hostname -s)-$((1+2)) `basename /tmp/x/f`; false || exit 4')
+        self.assertEqual(rc, 4)
+        self.assertEqual(out, '2\n127.1.0.1-3 f\n')
+        with open(os.path.join(self.tmp.name, '127.1.0.1', 'tmp', 'x', 'f'), encoding='UTF-8') as fd:
+            self.assertEqual(fd.read(), 'a b\nc\n')
+
+    def test_errors(self):
+        """ Stderr redirection, syntax errors and unknown commands """
+        rc, out, err = self.run_cmd('cat /nonexistent 2>&1; sh -c "if true"; echo $?')
+        self.assertEqual(rc, 0)
+        self.assertIn('/nonexistent', out)
+        self.assertTrue(out.endswith('2\n'))
+        rc, _, _ = self.run_cmd('some_tool --flag')
+        self.assertEqual(rc, 0)
+        self.assertIn('some_tool --flag', self.cluster.unhandled)
+
+    def test_fio(self):
+        """ fio output carries the json the benchmarks parse and the log files """
+        rc, _, _ = self.run_cmd('sudo /usr/bin/fio --ioengine=rbd --rw=randwrite --bs=4096B --iodepth=16 '
+                                '--numjobs=2 --runtime=30 --output-format=json,normal '
+                                '--write_iops_log=/tmp/out.0 --name=job-0 > /tmp/output.0')
+        self.assertEqual(rc, 0)
+        root = os.path.join(self.tmp.name, '127.1.0.1', 'tmp')
+        with open(os.path.join(root, 'output.0'), encoding='UTF-8') as fd:
+            lines = fd.read().split('\n')
+        self.assertTrue(lines[0].startswith('Starting'))
+        data = json.loads('\n'.join(lines[1:lines.index('')]))
+        self.assertEqual(data['global options']['iodepth'], '16')
+        self.assertEqual(len(data['jobs']), 2)
+        self.assertGreater(data['jobs'][0]['write']['iops'], 0)
+        self.assertTrue(os.path.exists(os.path.join(root, 'out.0_iops.1.log')))
+
+    def test_rados_bench(self):
+        """ The rados bench summary has one key per line """
+        rc, out, _ = self.run_cmd('rados -p pool bench 10 write -b 4096 --concurrent-ios 16 --no-cleanup')
+        self.assertEqual(rc, 0)
+        summary = out[out.index('Total time run'):].strip().split('\n')
+        result = dict(line.split(':') for line in summary)
+        self.assertIn('Average IOPS', result)
+
+    def test_fixtures(self):
+        """ User fixtures are matched before the builtins """
+        fixtures = os.path.join(self.tmp.name, 'fixtures.yaml')
+        with open(fixtures, 'w', encoding='UTF-8') as fd:
+            fd.write("fixtures:\n"
+                     "  - match: '^ceph health'\n"
+                     "    stdout: \"HEALTH_WARN on {host}\\n\"\n"
+                     "    rc: 1\n"
+                     "    latency: 2.5\n")
+        cluster = fakecluster.FakeCluster(self.tmp.name, fixtures)
+        host, rc, out, _ = cluster.run('127.1.0.2', 'sudo ceph health', b'')
+        self.assertEqual((rc, out), (1, b'HEALTH_WARN on 127.1.0.2\n'))
+        self.assertEqual(host.delay, 2.5)
+
+
+class TestFakeTransport(unittest.TestCase):
+    """ The common helpers against simulated nodes """
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.saved = (settings.common, settings.cluster)
+        settings.common = {'transport': 'fake', 'fake_root': os.path.join(self.tmp.name, 'hosts')}
+        settings.cluster = {'user': 'cbt', 'clients': NODES.split(',')}
+
+    def tearDown(self):
+        settings.common, settings.cluster = self.saved
+        self.tmp.cleanup()
+
+    def test_pdsh(self):
+        """ Output is prefixed per host and failures are reported the pdsh way """
+        out, _ = common.pdsh(NODES, 'echo hi; [ $(hostname -s) != 127.1.0.2 ]', continue_if_error=True).communicate()
+        self.assertEqual(sorted(out.splitlines()), ['127.1.0.%d: hi' % i for i in range(1, 4)])
+        proc = common.pdsh(NODES, 'exit 3', continue_if_error=False)
+        self.assertRaises(Exception, proc.communicate)
+        self.assertEqual(proc.myrtncode, 3)
+
+    def test_batch(self):
+        """ Batches are demultiplexed per host and command """
+        with common.Batch(NODES) as batch:
+            batch.add('echo one; exit 3')
+            batch.add('sudo ceph health')
+        self.assertEqual(batch.results[0]['127.1.0.1'], (3, 'one\n'))
+        self.assertEqual(batch.results[1]['127.1.0.3'], (0, 'HEALTH_OK\n'))
+
+    def test_sync_files(self):
+        """ Result files are collected from every node """
+        common.pdsh(NODES, 'mkdir -p /tmp/cbt && hostname -s > /tmp/cbt/output.0').communicate()
+        archive = os.path.join(self.tmp.name, 'archive')
+        common.sync_files('/tmp/cbt/*', archive)
+        for node in NODES.split(','):
+            with open(os.path.join(archive, 'output.0.%s' % node), encoding='UTF-8') as fd:
+                self.assertEqual(fd.read(), '%s\n' % node)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+""" Unit tests for running the fio processes of a client from a job file """
+
+import json
+import os
+import tempfile
+import unittest
+import unittest.mock
+import common
+import settings
+from benchmark import fio_jobfile
+from benchmark.librbdfio import LibrbdFio
+from cluster.ceph import Ceph
+
+
+class TestJobFile(unittest.TestCase):
+    """ Command lines to job file and back """
+    def test_make_job_file(self):
+        """ Shared options go global, the rest to the sections of each process """
+        text, options = fio_jobfile.make_job_file([
+            ('0', ' --rw=write --output-format=json --iodepth=4 --time_based --name=a --name=b --size=1M'),
+            ('1', ' --rw=write --output-format=json --iodepth=8 --time_based --name=a')])
+        self.assertEqual(options, ' --output-format=json')
+        self.assertEqual(text.split('\n\n'), [
+            '[global]\nrw=write\ntime_based',
+            '[a]\ndescription=0\niodepth=4',
+            '[b]\ndescription=0\niodepth=4\nsize=1M',
+            '[a]\ndescription=1\niodepth=8\n'])
+        with self.assertRaises(ValueError):
+            fio_jobfile.make_job_file([('0', ' --size 1M')])
+
+    def test_split_report(self):
+        """ The jobs go to the report of the process of their section """
+        jobs = [{'jobname': 'a', 'job options': {'description': label, 'iodepth': label}} for label in ('0', '1', '0')]
+        reports = fio_jobfile.split_report({'fio version': 'fio-3.35', 'global options': {'bs': '4k'}, 'jobs': jobs})
+        self.assertEqual(sorted(reports), ['0', '1'])
+        self.assertEqual(len(reports['0']['jobs']), 2)
+        self.assertEqual(reports['1']['fio version'], 'fio-3.35')
+        self.assertEqual(reports['1']['global options'], {'bs': '4k', 'iodepth': '1'})
+
+    def test_split_client_report(self):
+        """ The jobs of every client go to the report of their process, the sum is left out """
+        jobs = [{'jobname': 'a', 'hostname': host, 'job options': {'description': label}}
+                for host, label in (('h1', '0'), ('h1', '1'), ('h2', '0'))]
+        jobs.append({'jobname': 'All clients', 'hostname': '', 'job options': {}})
+        reports = fio_jobfile.split_client_report({'global options': {}, 'client_stats': jobs})
+        self.assertEqual(sorted(reports), [('h1', '0'), ('h1', '1'), ('h2', '0')])
+        self.assertNotIn('client_stats', reports[('h2', '0')])
+        self.assertEqual(reports[('h2', '0')]['jobs'], jobs[2:3])
+
+
+class TestLibrbdFioJobFile(unittest.TestCase):
+    """ librbdfio with job_file against the fake cluster """
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.saved = (settings.common, settings.cluster)
+        settings.common = {'transport': 'fake', 'sync': 'tar', 'fake_root': os.path.join(self.tmp.name, 'hosts')}
+        settings.cluster = {'user': 'cbt', 'head': '127.1.0.1', 'osds': ['127.1.0.1'], 'mons': ['127.1.0.1'],
+                            'clients': ['127.1.0.2', '127.1.0.3'], 'osds_per_node': 1, 'tmp_dir': '/tmp/cbt',
+                            'archive_dir': os.path.join(self.tmp.name, 'archive'), 'clusterid': 'ceph'}
+        self.cluster = Ceph.mockinit(settings.cluster)
+
+    def tearDown(self):
+        settings.common, settings.cluster = self.saved
+        self.tmp.cleanup()
+
+    def test_run_workloads(self):
+        """ Every volume gets its json output back from the output of the client """
+        config = {'iteration': 0, 'osd_ra': 4096, 'op_size': 4096, 'volumes_per_client': 2, 'job_file': True,
+                  'total_iodepth': 25,
+                  'workloads': {'qd': {'mode': 'randwrite', 'numjobs': [1], 'total_iodepth': [25], 'monitor': False,
+                                       'volumes_per_client': 2, 'sla': {'latency_ms': 100, 'time': 10, 'ramp': 0}}}}
+        benchmark = LibrbdFio(os.path.join(self.tmp.name, 'archive'), self.cluster, config)
+        benchmark.run_workloads()
+        probe_dir = os.path.join(benchmark.out_dir, 'randwrite_4096', 'iodepth-025', 'numjobs-001')
+        for host in ('127.1.0.2', '127.1.0.3'):
+            self.assertTrue(os.path.exists(os.path.join(probe_dir, 'output.all.%s' % host)))
+            for volume, iodepth in ((0, '13'), (1, '12')):
+                with open(os.path.join(probe_dir, 'json_output.%d.%s' % (volume, host))) as fd:
+                    jobs = json.load(fd)['jobs']
+                self.assertEqual(len(jobs), 1)
+                self.assertEqual(jobs[0]['job options']['iodepth'], iodepth)
+                self.assertTrue(jobs[0]['job options']['rbdname'].endswith('-%d' % volume))
+                self.assertNotIn('`', jobs[0]['job options']['rbdname'])
+
+    def test_run_archive(self):
+        """ Every workload lands in its own directory of the archive, and only there """
+        config = {'iteration': 0, 'osd_ra': 4096, 'op_size': 4096, 'volumes_per_client': 1, 'job_file': True,
+                  'time': 1, 'workloads': {'a': {'mode': 'randwrite', 'numjobs': [1], 'iodepth': [4, 8],
+                                                 'monitor': False}}}
+        benchmark = LibrbdFio(os.path.join(self.tmp.name, 'archive'), self.cluster, config)
+        benchmark.run()
+        self.assertFalse([f for f in os.listdir(benchmark.out_dir) if f.startswith(('output.', 'json_output.'))])
+        for iodepth in ('004', '008'):
+            workload_dir = os.path.join(benchmark.out_dir, 'randwrite_4096', 'iodepth-%s' % iodepth, 'numjobs-001')
+            for host in ('127.1.0.2', '127.1.0.3'):
+                self.assertTrue(os.path.exists(os.path.join(workload_dir, 'json_output.0.%s' % host)))
+
+    def test_missing_fqdn(self):
+        """ A client without a known fqdn fails the job files instead of running without one """
+        fqdns = {'cbt@127.1.0.2': {'fqdn': '127.1.0.2', 'short': '127'}}
+        with unittest.mock.patch.object(common, 'get_fqdn_map', return_value=fqdns):
+            self.assertRaisesRegex(Exception, 'No fqdn for the clients cbt@127.1.0.3',
+                                   fio_jobfile.write_job_files, [('0', ' --rw=write')], '/tmp/cbt/fio.job')
+
+    def test_client_server(self):
+        """ The fio client on the head reports every client and their sum """
+        config = {'iteration': 0, 'osd_ra': 4096, 'op_size': 4096, 'volumes_per_client': 2, 'client_server': True,
+                  'workloads': {'qd': {'mode': 'randread', 'numjobs': [1], 'iodepth': [8], 'monitor': False,
+                                       'volumes_per_client': 2, 'sla': {'latency_ms': 100, 'time': 10, 'ramp': 0}}}}
+        benchmark = LibrbdFio(os.path.join(self.tmp.name, 'archive'), self.cluster, config)
+        benchmark.run_workloads()
+        probe_dir = os.path.join(benchmark.out_dir, 'randread_4096', 'iodepth-008', 'numjobs-001')
+        self.assertFalse([f for f in os.listdir(probe_dir) if f.startswith('output.all.')])
+        with open(os.path.join(probe_dir, 'json_output.clients.127.1.0.1')) as fd:
+            stats = json.load(fd)['client_stats']
+        self.assertEqual([job['jobname'] for job in stats].count('All clients'), 1)
+        self.assertEqual(len(stats), 5)
+        for host in ('127.1.0.2', '127.1.0.3'):
+            for volume in (0, 1):
+                with open(os.path.join(probe_dir, 'json_output.%d.%s' % (volume, host))) as fd:
+                    report = json.load(fd)
+                self.assertEqual([job['hostname'] for job in report['jobs']], [host])
+                self.assertEqual(report['global options']['rw'], 'randread')
+
+
+if __name__ == '__main__':
+    unittest.main()
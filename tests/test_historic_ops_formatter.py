@@ -0,0 +1,106 @@
+"""
+Unit tests for the HistoricOpsFormatter class
+"""
+
+import io
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from typing import Any
+
+from post_processing.formatter import historic_ops_formatter
+from post_processing.formatter.historic_ops_formatter import HistoricOpsFormatter, get_op_type, read_historic_ops
+
+
+def make_op(number: int, stage_us: list[int], description: str = "") -> dict[str, Any]:
+    """
+    An op of dump_historic_ops going through the milestones after the given
+    microseconds each
+    """
+    events: list[dict[str, str]] = [{"event": "initiated", "time": "2024-05-01T10:00:00.000000+0000"}]
+    elapsed: int = 0
+    for milestone, us in zip(historic_ops_formatter.MILESTONES, stage_us):
+        elapsed += us
+        events.append({"event": milestone, "time": f"2024-05-01T10:00:00.{elapsed:06d}+0000"})
+        if milestone == "started":
+            events.append({"event": "waiting for subops from 1,2", "time": f"2024-05-01T10:00:00.{elapsed:06d}+0000"})
+    return {
+        "description": description
+        or f"osd_op(client.4156.0:{number} 1.0 1:abc:::obj:head [set-alloc-hint object_size 4194304,write 0~4096] snapc 0=[] ondisk+write e20)",
+        "initiated_at": "2024-05-01T10:00:00.000000+0000",
+        "age": 1.0,
+        "duration": elapsed / 1e6,
+        "type_data": {"flag_point": "commit sent; apply or cleanup", "events": events},
+    }
+
+
+def dump(ops: list[dict[str, Any]]) -> str:
+    return json.dumps({"size": 20, "duration": 600, "ops": ops}, indent=4) + "\n"
+
+
+class TestHistoricOpsFormatter(unittest.TestCase):
+    """
+    Tests of the historic ops parser and latency breakdown
+    """
+
+    def test_op_type(self) -> None:
+        self.assertEqual(get_op_type(make_op(1, [])["description"]), "osd_op:set-alloc-hint+write")
+        self.assertEqual(get_op_type("osd_repop(client.4156.0:1 1.0 e20/18)"), "osd_repop")
+
+    def test_streaming(self) -> None:
+        """
+        Ops longer than a read are put together, the markers name the OSDs
+        """
+        saved: int = historic_ops_formatter.READ_SIZE
+        historic_ops_formatter.READ_SIZE = 64
+        try:
+            text: str = (
+                "# /var/run/ceph/ceph-osd.3.asok\n"
+                + dump([make_op(i, [10, 20, 30, 40, 50, 60]) for i in range(5)])
+                + "# /var/run/ceph/ceph-osd.7.asok\n"
+                + '{\n    "error": "(111) Connection refused"\n}\n'
+                + "# /var/run/ceph/ceph-osd.9.asok\n"
+                + dump([make_op(i, [10]) for i in range(2)])
+            )
+            ops = list(read_historic_ops(io.StringIO(text)))
+        finally:
+            historic_ops_formatter.READ_SIZE = saved
+        self.assertEqual([osd for osd, _ in ops], ["osd.3"] * 5 + ["osd.9"] * 2)
+        self.assertEqual(ops[4][1]["description"], make_op(4, [])["description"])
+
+    def test_breakdown(self) -> None:
+        """
+        Every stage gets its distribution and the tail shows the slow stage
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            run: Path = Path(tmp) / "results" / "00000000" / "id-1"
+            run.mkdir(parents=True)
+            ops: list[dict[str, Any]] = [make_op(i, [100, 10, 10, 1000, 10, 10]) for i in range(99)]
+            # the slowest op waited for its PG
+            ops.append(make_op(99, [100, 50000, 10, 1000, 10, 10]))
+            with open(run / "historic_ops.out.host1", "w") as f:
+                f.write("# /var/run/ceph/ceph-osd.0.asok\n" + dump(ops[:50]))
+                f.write("# /var/run/ceph/ceph-osd.1.asok\n" + dump(ops[50:]))
+
+            formatter: HistoricOpsFormatter = HistoricOpsFormatter(tmp)
+            formatter.convert_all_files()
+            formatter.write_output_file()
+            with open(os.path.join(tmp, "visualisation", "historic_ops", "results_00000000_id-1.json")) as f:
+                result: dict[str, Any] = json.load(f)
+
+        self.assertEqual(result["number_of_ops"], 100)
+        self.assertEqual(sorted(result["osds"]), ["osd.0", "osd.1"])
+        write: dict[str, Any] = result["all"]["osd_op:set-alloc-hint+write"]
+        self.assertEqual(write["count"], 100)
+        self.assertAlmostEqual(write["stages"]["sub_op_committed"]["p50"], 1.0, places=3)
+        self.assertAlmostEqual(write["stages"]["reached_pg"]["p50"], 0.01, places=3)
+        self.assertAlmostEqual(write["stages"]["reached_pg"]["max"], 50.0, places=3)
+        self.assertAlmostEqual(write["total"]["max"], 51.13, places=3)
+        self.assertAlmostEqual(write["tail"]["reached_pg"], 50.0, places=3)
+        self.assertEqual(result["osds"]["osd.1"]["osd_op:set-alloc-hint+write"]["count"], 50)
+
+
+if __name__ == "__main__":
+    unittest.main()
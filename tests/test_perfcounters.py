@@ -0,0 +1,95 @@
+""" Unit tests for the OSD perf counter sampler and reader """
+
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import perfcounters
+
+# answers "perf schema" and "perf dump" for an admin socket, the counters
+# moving by the number of dumps so far
+FAKE_CEPH = r'''
+import json, os, sys
+asok, command = sys.argv[2], sys.argv[3:]
+if command == ['perf', 'schema']:
+    print(json.dumps({'osd': {'op_w': {'type': 10}, 'op_latency': {'type': 5}, 'numpg': {'type': 2}}}))
+    sys.exit(0)
+state = asok + '.dumps'
+n = int(open(state).read()) + 1 if os.path.exists(state) else 0
+open(state, 'w').write(str(n))
+print(json.dumps({'osd': {'op_w': 100 * n, 'op_latency': {'avgcount': 100 * n, 'sum': 0.5 * n},
+                          'numpg': 32, 'op_r_latency_in_bytes_histogram': {'axes': []}}}))
+'''
+
+
+class TestPerfCounters(unittest.TestCase):
+    """ Sanity tests for perfcounters.py """
+    def test_deltas(self):
+        """ Counters and averages move by their deltas, gauges are kept as they are """
+        schema = {'osd': {'op_w': {'type': 10}, 'numpg': {'type': 2}}}
+        first = perfcounters.flatten({'osd': {'op_w': 10, 'numpg': 32, 'op_latency': {'avgcount': 4, 'sum': 1.0}}}, schema)
+        second = perfcounters.flatten({'osd': {'op_w': 25, 'numpg': 32, 'op_latency': {'avgcount': 4, 'sum': 1.0}}}, schema)
+        self.assertEqual(perfcounters.deltas(first, second), {'osd.op_w': 15, 'osd.numpg': 32})
+        # a restarted daemon counts from zero again
+        self.assertEqual(perfcounters.deltas(second, first)['osd.op_w'], 10)
+
+    def test_sampler(self):
+        """ The sampler records every OSD of the node until it is interrupted """
+        with tempfile.TemporaryDirectory() as tmp:
+            fake_ceph = os.path.join(tmp, 'ceph.py')
+            with open(fake_ceph, 'w') as f:
+                f.write(FAKE_CEPH)
+            for osd in (0, 1):
+                open(os.path.join(tmp, 'ceph-osd.%d.asok' % osd), 'w').close()
+            out = os.path.join(tmp, 'perf_counters.bin')
+            proc = subprocess.Popen([sys.executable, perfcounters.__file__, '--out', out, '--interval', '0.1',
+                                     '--ceph-cmd', '%s %s' % (sys.executable, fake_ceph),
+                                     '--asok-glob', os.path.join(tmp, 'ceph-osd.*.asok')])
+            deadline = time.time() + 30
+            while time.time() < deadline:
+                if os.path.exists(out) and len(perfcounters.load(out).get('osd.1', [])) >= 3:
+                    break
+                time.sleep(0.1)
+            proc.send_signal(signal.SIGINT)
+            self.assertEqual(proc.wait(timeout=30), 0)
+
+            counters = perfcounters.PerfCounters([out])
+            self.assertEqual(counters.daemons(), ['osd.0', 'osd.1'])
+            self.assertEqual(counters.counters(), ['osd.numpg', 'osd.op_latency', 'osd.op_w'])
+            for start, end, value in counters.series_of('osd.op_latency', 'osd.0'):
+                self.assertAlmostEqual(value, 0.005)
+            for start, end, value in counters.series_of('osd.op_w', 'osd.1', rate=False):
+                self.assertEqual(value, 100)
+            self.assertEqual(set(value for _, _, value in counters.series_of('osd.numpg', 'osd.0', rate=False)), {32})
+            start = counters.series_of('osd.numpg', 'osd.1')[0][0]
+            self.assertEqual(counters.aligned('osd.numpg', start, [0.01], rate=False), [64])
+
+    def test_aligned(self):
+        """ Queries line up with an external time axis and add up over the daemons """
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for osd in (0, 1):
+                paths.append(os.path.join(tmp, 'perf_counters.bin.%d' % osd))
+                with open(paths[-1], 'wb') as f:
+                    writer = perfcounters.Writer(f)
+                    for second in range(10):
+                        writer.write('osd.%d' % osd, 1000.0 + second, 1001.0 + second + 0.01 * osd,
+                                     {'osd.op_w': 10.0 * (osd + 1),
+                                      'AsyncMessenger::Worker-%d.msgr_send_bytes' % osd: 4096.0,
+                                      'bluestore.commit_lat.sum': 0.1 * (osd + 1),
+                                      'bluestore.commit_lat.avgcount': 10.0})
+            counters = perfcounters.PerfCounters(paths)
+            self.assertEqual(counters.aligned('osd.op_w', 1000.0, [-1, 0.5, 5.5, 20], rate=False), [None, 30.0, 30.0, None])
+            self.assertAlmostEqual(counters.aligned('bluestore.commit_lat', 1000.0, [3.5])[0], 0.015)
+            self.assertEqual(counters.aligned('AsyncMessenger::Worker-*.msgr_send_bytes', 1000.0, [2.5], 'osd.1', rate=False), [4096.0])
+            with open(paths[0], 'ab') as f:
+                f.write(b'S\x00')
+            self.assertEqual(len(perfcounters.load(paths[0])['osd.0']), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
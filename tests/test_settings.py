@@ -0,0 +1,42 @@
+""" Unit tests for the settings module """
+
+import unittest
+import unittest.mock
+import settings
+
+
+class TestTopologyCache(unittest.TestCase):
+    """ Host resolution and node sets are computed once per cluster section """
+    def setUp(self):
+        self.saved_cluster = settings.cluster
+        settings.cluster = {'user': 'cbt', 'head': '127.0.0.1', 'clients': ['127.0.0.2', 'root@127.0.0.3']}
+
+    def tearDown(self):
+        settings.cluster = self.saved_cluster
+
+    def test_getnodes(self):
+        """ Node sets are built like before """
+        self.assertEqual(sorted(settings.getnodes('head', 'clients').split(',')),
+                         ['cbt@127.0.0.1', 'cbt@127.0.0.2', 'root@127.0.0.3'])
+        self.assertEqual(settings.host_info('root@127.0.0.3'),
+                         {'user': 'root', 'host': '127.0.0.3', 'addr': '127.0.0.3'})
+
+    def test_resolved_once(self):
+        """ Hosts are resolved on the first call only """
+        with unittest.mock.patch('socket.gethostbyname', return_value='127.0.0.1') as resolve:
+            first = settings.getnodes('head', 'clients')
+            self.assertEqual(resolve.call_count, 3)
+            self.assertEqual(settings.getnodes('head', 'clients'), first)
+            settings.getnodes('clients')
+            settings.host_info('127.0.0.2')
+            self.assertEqual(resolve.call_count, 3)
+
+    def test_invalidate(self):
+        """ Replacing the cluster section or invalidating rebuilds the cache """
+        self.assertEqual(settings.getnodes('head'), 'cbt@127.0.0.1')
+        settings.cluster = {'head': '127.0.0.4'}
+        self.assertEqual(settings.getnodes('head'), '127.0.0.4')
+        settings.cluster['head'] = '127.0.0.5'
+        self.assertEqual(settings.getnodes('head'), '127.0.0.4')
+        settings.invalidate_topology()
+        self.assertEqual(settings.getnodes('head'), '127.0.0.5')
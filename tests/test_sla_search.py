@@ -0,0 +1,91 @@
+""" Unit tests for the SLA driven queue depth search of librbdfio workloads """
+
+import json
+import os
+import tempfile
+import unittest
+import settings
+from benchmark.librbdfio import LibrbdFio, SlaSearch
+from cluster.ceph import Ceph
+
+
+def model(numjobs, iodepth):
+    """ A device saturating at 160k iops, 0.1ms per op unloaded, p99 three times the mean """
+    queue = numjobs * iodepth
+    latency = 0.1 * (1 + queue / 16.0)
+    return queue / latency * 1000, latency * 3
+
+
+class TestSlaSearch(unittest.TestCase):
+    """ The search over numjobs and iodepth """
+    def test_bisection(self):
+        """ The iodepth is doubled until the target is missed then bisected """
+        search = SlaSearch(model, 1.5, [1], [1, 256])
+        best = search.run()
+        self.assertEqual([p['iodepth'] for p in search.probes], [1, 2, 4, 8, 16, 32, 64, 128, 96, 80, 72])
+        self.assertEqual(best['iodepth'], 64)
+        self.assertEqual([p['sla'] for p in search.probes], [True] * 7 + [False] * 4)
+
+    def test_knee(self):
+        """ Deeper queues adding too few iops end the search """
+        search = SlaSearch(model, 100, [1, 2, 4], [1, 1024], min_gain=0.25)
+        best = search.run()
+        self.assertEqual([p['iodepth'] for p in search.probes if p['numjobs'] == 1], [1, 2, 4, 8, 16, 32, 64])
+        # more jobs only move along the same curve
+        self.assertEqual(sorted(set(p['numjobs'] for p in search.probes)), [1, 2])
+        self.assertEqual((best['numjobs'], best['iodepth']), (1, 64))
+
+    def test_unreachable(self):
+        """ No probe within the target """
+        search = SlaSearch(model, 0.1, [1, 8], [4, 64])
+        self.assertIsNone(search.run())
+        self.assertEqual(len(search.probes), 1)
+
+
+class TestLibrbdFioSlaSearch(unittest.TestCase):
+    """ SLA workloads against the fake cluster """
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.saved = (settings.common, settings.cluster)
+        settings.common = {'transport': 'fake', 'sync': 'tar', 'fake_root': os.path.join(self.tmp.name, 'hosts')}
+        settings.cluster = {'user': 'cbt', 'head': '127.1.0.1', 'osds': ['127.1.0.1'], 'mons': ['127.1.0.1'],
+                            'clients': ['127.1.0.2', '127.1.0.3'], 'osds_per_node': 1, 'tmp_dir': '/tmp/cbt',
+                            'archive_dir': os.path.join(self.tmp.name, 'archive'), 'clusterid': 'ceph'}
+        self.cluster = Ceph.mockinit(settings.cluster)
+
+    def tearDown(self):
+        settings.common, settings.cluster = self.saved
+        self.tmp.cleanup()
+
+    def test_run_workloads(self):
+        """ The probes are short fio runs whose json results drive the search """
+        config = {'iteration': 0, 'osd_ra': 4096, 'time': 300, 'op_size': 4096, 'volumes_per_client': 2,
+                  'workloads': {'qd': {'mode': 'randwrite', 'numjobs': [1], 'iodepth': [16, 128], 'monitor': False,
+                                       'sla': {'latency_ms': 1, 'time': 10, 'ramp': 0}}}}
+        benchmark = LibrbdFio(os.path.join(self.tmp.name, 'archive'), self.cluster, config)
+        benchmark.run_workloads()
+        with open(os.path.join(benchmark.out_dir, 'randwrite_4096', 'sla_search.json')) as fd:
+            result = json.load(fd)
+        self.assertEqual(result['percentile'], 99)
+        best = result['best']
+        self.assertTrue(best['sla'])
+        self.assertLessEqual(best['latency_ms'], 1)
+        self.assertTrue(any(not p['sla'] for p in result['probes']))
+        self.assertLess(len(result['probes']), 8)
+        probe_dir = os.path.join(benchmark.out_dir, 'randwrite_4096', 'iodepth-%03d' % best['iodepth'], 'numjobs-001')
+        self.assertEqual(len([f for f in os.listdir(probe_dir) if f.startswith('json_output.')]), 4)
+        self.assertEqual(benchmark.time, 300)
+
+    def test_global_op_size(self):
+        """ A workload without its own op_size is summarized under the global one """
+        workload = {'mode': 'randread', 'numjobs': 1, 'iodepth': [8], 'monitor': False,
+                    'sla': {'latency_ms': 100, 'time': 10, 'ramp': 0}}
+        config = {'iteration': 0, 'osd_ra': 4096, 'op_size': 8192, 'volumes_per_client': 1,
+                  'workloads': {'qd': workload}}
+        benchmark = LibrbdFio(os.path.join(self.tmp.name, 'archive'), self.cluster, config)
+        benchmark.run_sla_search('qd', workload, 'iodepth', False)
+        self.assertTrue(os.path.exists(os.path.join(benchmark.out_dir, 'randread_8192', 'sla_search.json')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+""" Unit tests for the steady state detection of the fio benchmarks """
+
+import json
+import os
+import tempfile
+import time
+import unittest
+import settings
+from benchmark import steadystate
+
+
+def report(timestamp_ms, total_ios):
+    """ A fio status report of two jobs """
+    jobs = [{'jobname': 'job', 'read': {'total_ios': 0, 'io_kbytes': 0},
+             'write': {'total_ios': total_ios // 2, 'io_kbytes': total_ios * 2}} for _ in range(2)]
+    return json.dumps({'fio version': 'fio-3.35', 'timestamp_ms': timestamp_ms, 'jobs': jobs}, indent=2) + '\n'
+
+
+def output(rates, interval_ms=1000):
+    """ The output of fio with a status report after each interval done at the rates """
+    text = 'Starting 2 processes\n'
+    total = 0
+    text += report(0, 0)
+    for i, rate in enumerate(rates, 1):
+        total += int(rate * interval_ms / 1000)
+        text += report(i * interval_ms, total)
+    return text
+
+
+class TestSteadyState(unittest.TestCase):
+    """ The criteria and the series they are checked on """
+    config = dict(steadystate.DEFAULTS, window=10, interval=1)
+
+    def test_check(self):
+        """ Both the slope and the deviation have to be within bounds """
+        self.assertIsNone(steadystate.check([1000] * 9, self.config))
+        self.assertTrue(steadystate.check([500] * 5 + [1000] * 10, self.config)['steady'])
+        rising = steadystate.check([1000 + 5 * i for i in range(10)], self.config)
+        self.assertAlmostEqual(rising['slope'], 5 * 100 / 1022.5)
+        self.assertFalse(rising['steady'])
+        noisy = steadystate.check([1000, 1300] * 5, self.config)
+        self.assertEqual(noisy['slope'], steadystate.check([1300, 1000] * 5, self.config)['slope'])
+        self.assertFalse(noisy['steady'])
+
+    def test_series(self):
+        """ Reports split across reads are put together, the outputs summed """
+        series = steadystate.Series('iops')
+        text = output([100, 200, 300])
+        for i in range(0, len(text), 7):
+            series.feed('a', text[i:i + 7])
+        series.feed('b', output([1000, 1000]))
+        self.assertEqual(series.values(), [1100, 1200])
+        bw = steadystate.Series('bw')
+        bw.feed('a', output([100]))
+        self.assertEqual(bw.values(), [400])
+
+    def test_strip(self):
+        """ Only the final report is left """
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'output.0.host1')
+            with open(path, 'w', encoding='UTF-8') as fd:
+                fd.write(output([100, 200]) + '\njob: (groupid=0, jobs=1): err= 0\n')
+            steadystate.strip_status_reports(tmp)
+            with open(path, encoding='UTF-8') as fd:
+                lines = fd.read().split('\n')
+        self.assertEqual(lines[0], 'Starting 2 processes')
+        self.assertEqual(json.loads('\n'.join(lines[1:lines.index('')]))['timestamp_ms'], 2000)
+
+
+class TestSteadyStateController(unittest.TestCase):
+    """ The controller tails the outputs of the clients while fio runs """
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.saved = (settings.common, settings.cluster)
+        settings.common = {}
+        settings.cluster = {'clients': ['localhost']}
+        self.remote = os.path.join(self.tmp.name, 'run')
+        self.local = os.path.join(self.tmp.name, 'archive')
+        os.makedirs(self.remote)
+
+    def tearDown(self):
+        settings.common, settings.cluster = self.saved
+        self.tmp.cleanup()
+
+    def test_terminate(self):
+        """ The test is ended once steady and the verdict recorded """
+        stopped = os.path.join(self.tmp.name, 'stopped')
+        with open(os.path.join(self.remote, 'output.0'), 'w', encoding='UTF-8') as fd:
+            fd.write(output([100, 500, 1000], 50))
+        config = steadystate.get_config({'window': 0.5, 'interval': 0.05})
+        with steadystate.watch(config, self.remote, self.local, stop_command='touch %s' % stopped) as controller:
+            time.sleep(0.2)
+            self.assertIsNone(controller.reached)
+            with open(os.path.join(self.remote, 'output.0'), 'a', encoding='UTF-8') as fd:
+                fd.write(output([100, 500] + [1000] * 10, 50)[len(output([100, 500, 1000], 50)):])
+            controller.join(5)
+        self.assertTrue(os.path.exists(stopped))
+        with open(os.path.join(self.local, 'steady_state.json'), encoding='UTF-8') as fd:
+            result = json.load(fd)
+        self.assertTrue(result['steady_state'])
+        self.assertTrue(result['terminated'])
+        self.assertEqual(result['iops'][-10:], [1000] * 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+"""
+Usage:
+        config_diff.py [--all] <ceph_config.json> [<previous ceph_config.json>]
+
+Flags the configuration drift in the daemon config snapshots saved with every
+run (ceph_config.json, see cluster/config_snapshot.py):
+
+  - the settings that differ between the daemons of a type (OSDs, mons, mgrs)
+    within the run
+  - with a previous snapshot, the settings changed since then, grouped by the
+    daemons they changed on
+
+The settings expected to differ per daemon (name, paths, addresses) are left
+out. A directory argument is searched for a ceph_config.json* file. --all
+lists the daemons of a divergent value even when there are many of them.
+The exit status is 1 when drift was found.
+
+Examples:
+            PYTHONPATH=. tools/config_diff.py results/00000000/id-1/ceph_config.json.osd1
+
+            PYTHONPATH=. tools/config_diff.py /tmp/archive/results/00000000/id-1 /tmp/archive.old/results/00000000/id-1
+"""
+
+import glob
+import os
+import sys
+from argparse import ArgumentParser, Namespace
+from typing import Dict, List
+
+from cluster.config_snapshot import ConfigSnapshot, load
+
+
+def find_snapshot(path: str) -> str:
+    if os.path.isdir(path):
+        found = sorted(glob.glob(os.path.join(path, "ceph_config.json*")))
+        if not found:
+            sys.exit(f"no ceph_config.json in {path}")
+        return found[0]
+    return path
+
+
+def daemon_list(daemons: List[str], show_all: bool) -> str:
+    if show_all or len(daemons) <= 6:
+        return ",".join(daemons)
+    return f"{','.join(daemons[:5])},... ({len(daemons)} daemons)"
+
+
+def report_divergent(snapshot: ConfigSnapshot, show_all: bool) -> int:
+    divergent = snapshot.divergent()
+    for daemon_type, keys in sorted(divergent.items()):
+        print(f"{len(keys)} {daemon_type} settings differ between daemons:")
+        for key, values in keys.items():
+            print(f"  {key}")
+            for value, daemons in sorted(values.items(), key=lambda v: -len(v[1])):
+                print(f"      {value:<30} {daemon_list(daemons, show_all)}")
+    return len(divergent)
+
+
+def report_drift(snapshot: ConfigSnapshot, previous: ConfigSnapshot, show_all: bool) -> int:
+    # the same change on several daemons is listed once
+    changes: Dict[str, Dict[str, List[str]]] = {}
+    for daemon, keys in snapshot.diff(previous).items():
+        for key, (old, new) in keys.items():
+            changes.setdefault(key, {}).setdefault(f"{old} -> {new}", []).append(daemon)
+    if changes:
+        print(f"{len(changes)} settings changed since the previous run:")
+        for key, values in sorted(changes.items()):
+            for change, daemons in sorted(values.items()):
+                print(f"  {key:<40} {change:<40} {daemon_list(daemons, show_all)}")
+    added = sorted(set(snapshot.daemons) - set(previous.daemons))
+    removed = sorted(set(previous.daemons) - set(snapshot.daemons))
+    if added:
+        print(f"new daemons: {daemon_list(added, show_all)}")
+    if removed:
+        print(f"daemons gone: {daemon_list(removed, show_all)}")
+    return len(changes)
+
+
+def main() -> int:
+    parser = ArgumentParser(description="Flag configuration drift between cbt daemon config snapshots")
+    parser.add_argument("--all", action="store_true", help="list every daemon of a divergent value")
+    parser.add_argument("snapshot", help="ceph_config.json of the run, or its directory")
+    parser.add_argument("previous", nargs="?", help="ceph_config.json of a previous run, or its directory")
+    args: Namespace = parser.parse_args()
+
+    snapshot = load(find_snapshot(args.snapshot))
+    print(f"{len(snapshot.daemons)} daemons, {len(snapshot.configs)} distinct configs")
+    drift = report_divergent(snapshot, args.all)
+    if args.previous:
+        drift += report_drift(snapshot, load(find_snapshot(args.previous)), args.all)
+    return 1 if drift else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
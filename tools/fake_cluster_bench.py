@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+"""
+Usage:
+        fake_cluster_bench.py [--nodes=<n,...>] [--benchmark=<name>] [--latency=<s>]
+                              [--fixtures=<file>] [--workdir=<dir>] [--keep]
+
+Runs cbt.py end to end against fake clusters of increasing size (the 'fake'
+transport, see fakecluster.py: every node is simulated on the local host and
+the ceph/rados/rbd/fio commands are answered by fixtures) and reports, per
+cluster size:
+
+  - wall:     wall time of the whole cbt.py run
+  - remote:   time during which at least one remote call was in flight,
+              from the remote call trace
+  - own:      wall - remote, the time cbt spends on its own (scheduling,
+              parsing, fixed sleeps of the benchmark code)
+  - calls:    number of remote calls
+  - rss:      peak resident memory of the cbt.py process
+  - post:     time taken by the common output formatter over the archive
+  - results:  number of json result files written by the benchmark
+
+A third of the nodes are OSDs (the first three being the monitors), the
+others are clients. The librbdfio benchmark keeps a fixed 5s pause in run();
+radosbench pauses 60s for idle monitoring in initialize() which dominates its
+wall time.
+
+Examples:
+            PYTHONPATH=. tools/fake_cluster_bench.py
+
+            PYTHONPATH=. tools/fake_cluster_bench.py --nodes=10,100 --latency=0.05 --keep
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import yaml
+
+from post_processing.formatter.common_output_formatter import CommonOutputFormatter
+
+CBT_DIR: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# cbt.main() in a child process which reports its own peak memory
+CHILD: str = (
+    "import json, resource, sys\n"
+    "import cbt\n"
+    "rc = cbt.main(['cbt.py'] + sys.argv[2:])\n"
+    "with open(sys.argv[1], 'w') as f:\n"
+    "    json.dump({'rc': rc, 'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}, f)\n"
+    "sys.exit(rc)\n"
+)
+
+BENCHMARKS: Dict[str, Dict[str, Any]] = {
+    "librbdfio": {
+        "time": 60,
+        "vol_size": 1024,
+        "mode": "randwrite",
+        "op_size": 4096,
+        "iodepth": 16,
+        "volumes_per_client": 1,
+        "idle_monitor_sleep": 0,
+        "wait_pgautoscaler_timeout": 0,
+    },
+    "radosbench": {
+        "time": 60,
+        "op_size": 4194304,
+        "concurrent_ops": 16,
+        "concurrent_procs": 1,
+    },
+}
+
+
+def addresses(nodes: int) -> List[str]:
+    """
+    Loopback addresses resolve without a name server and are not taken for
+    the local host by cbt
+    """
+    return ["127.%d.%d.%d" % (1 + (i >> 16 & 255), i >> 8 & 255, i & 255) for i in range(1, nodes + 1)]
+
+
+def make_plan(nodes: int, benchmark: str, workdir: str, latency: float, fixtures: str) -> Dict[str, Any]:
+    hosts: List[str] = addresses(max(nodes, 2))
+    osds: int = max(nodes // 3, 1)
+    common: Dict[str, Any] = {
+        "transport": "fake",
+        "fake_root": os.path.join(workdir, "hosts"),
+        "fake_latency": latency,
+        "sync": "tar",
+    }
+    if fixtures:
+        common["fake_fixtures"] = os.path.abspath(fixtures)
+    return {
+        "common": common,
+        "cluster": {
+            "user": "cbt",
+            "head": hosts[0],
+            "mons": hosts[:min(osds, 3)],
+            "mgrs": hosts[:1],
+            "osds": hosts[:osds],
+            "clients": hosts[osds:],
+            "use_existing": True,
+            "iterations": 1,
+            "health_wait": 0,
+            "tmp_dir": "/tmp/cbt",
+            "osds_per_node": 1,
+        },
+        "monitoring_profiles": {"collectl": {}},
+        "benchmarks": {benchmark: dict(BENCHMARKS[benchmark])},
+    }
+
+
+def remote_time(trace: str) -> Tuple[float, int]:
+    """
+    Time covered by at least one remote call and number of calls
+    """
+    intervals: List[Tuple[float, float]] = []
+    if os.path.exists(trace):
+        with open(trace) as f:
+            intervals = [(r["t0"], r["t1"]) for r in map(json.loads, f) if r]
+    total: float = 0.0
+    end: float = float("-inf")
+    for t0, t1 in sorted(intervals):
+        if t1 > end:
+            total += t1 - max(t0, end)
+            end = t1
+    return total, len(intervals)
+
+
+def run_once(nodes: int, args: Namespace) -> Dict[str, Any]:
+    workdir: str = os.path.join(args.workdir, "nodes-%d" % nodes)
+    shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(workdir)
+    archive: str = os.path.join(workdir, "archive")
+    conf: str = os.path.join(workdir, "ceph.conf")
+    plan_file: str = os.path.join(workdir, "plan.yaml")
+    usage_file: str = os.path.join(workdir, "usage.json")
+    with open(conf, "w") as f:
+        f.write("[global]\n")
+    with open(plan_file, "w") as f:
+        yaml.dump(make_plan(nodes, args.benchmark, workdir, args.latency, args.fixtures), f)
+
+    start: float = time.perf_counter()
+    with open(os.path.join(workdir, "cbt.log"), "w") as log:
+        proc = subprocess.run([sys.executable, "-c", CHILD, usage_file, "-a", archive, "-c", conf, plan_file],
+                              cwd=CBT_DIR, stdout=log, stderr=subprocess.STDOUT)
+    wall: float = time.perf_counter() - start
+    usage: Dict[str, Any] = {"rc": proc.returncode, "maxrss_kb": 0}
+    if os.path.exists(usage_file):
+        with open(usage_file) as f:
+            usage = json.load(f)
+
+    remote, calls = remote_time(os.path.join(archive, "results", "remote_calls.jsonl"))
+
+    start = time.perf_counter()
+    formatter: CommonOutputFormatter = CommonOutputFormatter(os.path.join(archive, "results"), "json_output*")
+    formatter.convert_all_files()
+    formatter.write_output_file()
+    post: float = time.perf_counter() - start
+    results: int = sum(1 for _ in Path(archive, "results").glob("**/json_output.*"))
+
+    if not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {"nodes": nodes, "rc": usage["rc"], "wall": wall, "remote": remote, "calls": calls,
+            "rss_mb": usage["maxrss_kb"] / 1024.0, "post": post, "results": results}
+
+
+def main() -> int:
+    parser: ArgumentParser = ArgumentParser(description="Benchmark cbt end to end against fake clusters")
+    parser.add_argument("--nodes", type=str, default="10,100,1000", help="Comma separated cluster sizes")
+    parser.add_argument("--benchmark", type=str, default="librbdfio", choices=sorted(BENCHMARKS), help="Benchmark run")
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated seconds per remote command")
+    parser.add_argument("--fixtures", type=str, default="", help="YAML fixtures file for fakecluster.py")
+    parser.add_argument("--workdir", type=str, default="", help="Where the fake nodes and archives go")
+    parser.add_argument("--keep", action="store_true", help="Keep the fake nodes, archives and cbt logs")
+    args: Namespace = parser.parse_args()
+    if not args.workdir:
+        args.workdir = tempfile.mkdtemp(prefix="cbt-fake-bench.")
+
+    print(f"{'nodes':>6} {'rc':>3} {'wall(s)':>9} {'remote(s)':>10} {'own(s)':>8} {'calls':>6} "
+          f"{'rss(MB)':>8} {'post(s)':>8} {'results':>8}")
+    failed: bool = False
+    for nodes in [int(n) for n in args.nodes.split(",")]:
+        r: Dict[str, Any] = run_once(nodes, args)
+        failed = failed or r["rc"] != 0
+        print(f"{r['nodes']:>6} {r['rc']:>3} {r['wall']:>9.2f} {r['remote']:>10.2f} {r['wall'] - r['remote']:>8.2f} "
+              f"{r['calls']:>6} {r['rss_mb']:>8.1f} {r['post']:>8.3f} {r['results']:>8}", flush=True)
+    if args.keep:
+        print(f"Work directory: {args.workdir}")
+    else:
+        shutil.rmtree(args.workdir, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    exit(main())
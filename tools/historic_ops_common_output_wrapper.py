@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+"""
+Usage:
+        historic_ops_common_output_wrapper.py --archive=<archive_dir>
+                                              --results_file_root=<file_root>
+
+Input:
+        --archive               [Required]  The achive directory that contains the
+                                    historic ops dumped at the end of each test run
+
+        --results_file_root     [Optional]  The base name of the historic ops files
+                                    Default: "historic_ops.out"
+
+Output:
+        One file per test run in <archive_dir>/visualisation/historic_ops/ with
+        the latency distribution of every stage of the ops, per OSD and per op
+        type, and the stages the slowest 1% of the ops spent their time in.
+
+Examples:
+            PYTHONPATH=. historic_ops_common_output_wrapper.py --archive="/tmp/ch_cbt_run"
+"""
+
+from argparse import ArgumentParser, Namespace
+from logging import Logger, getLogger
+
+from post_processing.formatter.historic_ops_formatter import HistoricOpsFormatter
+
+log: Logger = getLogger()
+
+
+def main() -> int:
+    """
+    Main routine for the script
+    """
+
+    result: int = 0
+
+    parser: ArgumentParser = ArgumentParser(description="Parse cbt historic ops into per stage latencies")
+    parser.add_argument("--archive", type=str, required=True, help="The archive directory used for the CBT results")
+    parser.add_argument(
+        "--results_file_root",
+        type=str,
+        required=False,
+        default=HistoricOpsFormatter.DEFAULT_OUTPUT_FILE_PART,
+        help="The filename root of the historic ops files",
+    )
+
+    args: Namespace = parser.parse_args()
+
+    formatter: HistoricOpsFormatter = HistoricOpsFormatter(
+        archive_directory=args.archive, filename_root=args.results_file_root
+    )
+
+    try:
+        formatter.convert_all_files()
+        formatter.write_output_file()
+    except Exception as e:
+        log.error(
+            "Encountered an error parsing historic ops in directory %s with name %s"
+            % (args.archive, args.results_file_root)
+        )
+        log.exception(e)
+        result = 1
+
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+"""
+Usage:
+        perf_counter_report.py [--counter=<name>]... [--step=<s>] [--fio-json=<file>] <perf_counters.bin>...
+
+Reports on the OSD perf counters recorded by the perfcounters monitoring
+profile (see perfcounters.py), one row per --step seconds (the sampling
+interval at its middle) and one column per counter, added up over the OSDs of
+all the given files. Averages such as osd.op_latency are the mean latency of
+the interval, the other counters a per second rate. A counter may be a
+pattern, e.g. 'AsyncMessenger::Worker-*.msgr_send_bytes'.
+
+With --fio-json the rows follow the time axis of that fio run (from the
+job_start of its first job, as in the fio logs) instead of the recording.
+Without any --counter the available counters are listed.
+
+Examples:
+            PYTHONPATH=. tools/perf_counter_report.py results/00000000/id-1/perfcounters.*/perf_counters.bin
+
+            PYTHONPATH=. tools/perf_counter_report.py --counter=osd.op_latency --counter=bluestore.commit_lat \\
+                --fio-json=results/00000000/id-1/json_output.0.client1 results/00000000/id-1/perfcounters.*/perf_counters.bin
+"""
+
+import json
+from argparse import ArgumentParser, Namespace
+from typing import List, Optional, Tuple
+
+from perfcounters import PerfCounters
+
+
+def recording_axis(counters: PerfCounters) -> Tuple[float, float]:
+    """
+    The start and the length of the recording, in seconds
+    """
+    times = [(start, end) for samples in counters.series.values() for start, end, _ in samples]
+    if not times:
+        return 0.0, 0.0
+    start = min(t[0] for t in times)
+    return start, max(t[1] for t in times) - start
+
+
+def fio_axis(path: str) -> Tuple[float, float]:
+    """
+    The job_start (in seconds) and the runtime of the first job of a fio json output
+    """
+    with open(path) as f:
+        text = f.read()
+    # fio may print notices before the json document
+    job = json.loads(text[text.index("{"):])["jobs"][0]
+    return job["job_start"] / 1000.0, job["job_runtime"] / 1000.0
+
+
+def fmt(value: Optional[float]) -> str:
+    if value is None:
+        return f"{'-':>16}"
+    return f"{value:>16.6g}"
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Report on OSD perf counters recorded by cbt")
+    parser.add_argument("--counter", action="append", default=[], help="counter or pattern, repeatable")
+    parser.add_argument("--step", type=float, default=1.0, help="seconds per row (default 1)")
+    parser.add_argument("--fio-json", help="fio json output giving the time axis")
+    parser.add_argument("files", nargs="+", help="perf_counters.bin files")
+    args: Namespace = parser.parse_args()
+
+    counters = PerfCounters(args.files)
+    if not args.counter:
+        print(f"{len(counters.daemons())} daemons: {' '.join(counters.daemons())}")
+        for name in counters.counters():
+            print(f"  {name}")
+        return
+
+    start, length = fio_axis(args.fio_json) if args.fio_json else recording_axis(counters)
+    offsets: List[float] = []
+    offset = args.step / 2
+    while offset < length:
+        offsets.append(offset)
+        offset += args.step
+    columns = [counters.aligned(name, start, offsets) for name in args.counter]
+    print(f"{'time':>8} " + " ".join(f"{name[-16:]:>16}" for name in args.counter))
+    for i, offset in enumerate(offsets):
+        print(f"{offset:>7.1f}s " + " ".join(fmt(column[i]) for column in columns))
+
+
+if __name__ == "__main__":
+    main()
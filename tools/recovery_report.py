@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+"""
+Usage:
+        recovery_report.py [--points=<n>] <recovery_timeseries.json>...
+
+Reports on the recovery time series recorded by the recovery test threads in
+<run_dir>/recovery_timeseries.<cycle>.json (see cluster/recovery.py):
+
+  - time to heal (OSDs out until nothing is degraded) and time to backfill
+    (OSDs in until nothing is misplaced)
+  - mean and peak recovery throughput, and the throughput curve downsampled
+    to --points rows
+  - the window in which recovery was active and the client op/s inside it
+    against outside of it
+  - per pool: peak degraded and misplaced objects and when it was clean
+
+Examples:
+            PYTHONPATH=. tools/recovery_report.py /tmp/archive/results/000/id-1/recovery_timeseries.0.json
+
+            PYTHONPATH=. tools/recovery_report.py --points=40 results/*/*/recovery_timeseries.*.json
+"""
+
+from argparse import ArgumentParser, Namespace
+from typing import Any, Dict, List, Optional
+
+from cluster.recovery import analyze, load
+
+
+def seconds(value: Optional[float]) -> str:
+    return "n/a" if value is None else f"{value:.1f}s"
+
+
+def rate(value: Optional[float], scale: float = 1e6, unit: str = "MB/s") -> str:
+    return "n/a" if value is None else f"{value / scale:.1f} {unit}"
+
+
+def downsample(curve: List[List[float]], points: int) -> List[List[float]]:
+    """
+    Averages consecutive rows of the curve down to at most points rows
+    """
+    if len(curve) <= points:
+        return curve
+    step = len(curve) / points
+    rows: List[List[float]] = []
+    for i in range(points):
+        chunk = curve[int(i * step):int((i + 1) * step)]
+        rows.append([sum(column) / len(chunk) for column in zip(*chunk)])
+    return rows
+
+
+def report(path: str, result: Dict[str, Any], points: int) -> None:
+    print(f"{path}: {result['samples']} samples over {seconds(result['duration'])}")
+    print(f"  time to heal:     {seconds(result['time_to_heal'])}")
+    print(f"  time to backfill: {seconds(result['time_to_backfill'])}")
+    recovery = result["recovery"]
+    print(f"  recovery:         {rate(recovery['mean_bytes_per_sec'])} mean, "
+          f"{rate(recovery['peak_bytes_per_sec'])} peak, "
+          f"{rate(recovery['mean_objects_per_sec'], 1, 'objects/s')} mean")
+    client = result["client"]
+    if client["window"]:
+        impact = "n/a" if client["impact"] is None else f"{100 * client['impact']:.1f}%"
+        ops_during = "n/a" if client["ops_during"] is None else f"{client['ops_during']:.0f}"
+        ops_outside = "n/a" if client["ops_outside"] is None else f"{client['ops_outside']:.0f}"
+        print(f"  client impact:    {client['window'][0]:.1f}s-{client['window'][1]:.1f}s, "
+              f"{ops_during} op/s during against {ops_outside} op/s outside ({impact} lost)")
+    if result["pools"]:
+        print(f"  {'pool':<20} {'peak degraded':>14} {'peak misplaced':>15} {'clean at':>9}")
+        for pool, stats in sorted(result["pools"].items()):
+            print(f"  {pool:<20} {stats['peak_degraded']:>14} {stats['peak_misplaced']:>15} "
+                  f"{seconds(stats['clean_at']):>9}")
+    curve = downsample(recovery["curve"], points)
+    if curve:
+        print(f"  {'time':>8} {'MB/s':>10} {'objects/s':>10}")
+        for t, bytes_per_sec, objects_per_sec in curve:
+            print(f"  {t:>7.1f}s {bytes_per_sec / 1e6:>10.1f} {objects_per_sec:>10.1f}")
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Report on recovery time series recorded by cbt")
+    parser.add_argument("--points", type=int, default=20, help="rows of the throughput curve (default 20)")
+    parser.add_argument("files", nargs="+", help="recovery_timeseries.<cycle>.json files")
+    args: Namespace = parser.parse_args()
+    for path in args.files:
+        report(path, analyze(load(path)), args.points)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+"""
+Usage:
+        topology_cache_bench.py [--hosts=<n>] [--calls=<n>] [--resolve-delay-ms=<ms>]
+
+Measures the cost of a settings.getnodes() call on a generated inventory,
+with the topology cache cleared before every call (the behaviour before the
+cache existed: every host resolved on every call) and with the cache warm.
+
+The inventory is made of IP addresses so that no name server is needed;
+--resolve-delay-ms adds a fixed latency to every socket.gethostbyname() call
+to stand in for a real resolver.
+
+Examples:
+            PYTHONPATH=. tools/topology_cache_bench.py --hosts=500
+
+            PYTHONPATH=. tools/topology_cache_bench.py --hosts=500 --resolve-delay-ms=0.5 --calls=20
+"""
+
+import socket
+import time
+from argparse import ArgumentParser, Namespace
+from typing import Callable
+
+import settings
+
+
+def make_inventory(hosts: int) -> dict:
+    """
+    A cluster section with hosts spread over the roles, 2/3 of them clients
+    """
+    addrs: list[str] = ["10.%d.%d.%d" % (i >> 16 & 255, i >> 8 & 255, i & 255) for i in range(1, hosts + 1)]
+    osds: int = max(hosts // 3 - 4, 1)
+    return {
+        "user": "cbt",
+        "head": addrs[0],
+        "mons": addrs[1:4],
+        "mgrs": addrs[1:2],
+        "osds": addrs[4:4 + osds],
+        "clients": addrs[4 + osds:],
+    }
+
+
+def time_calls(calls: int, before_call: Callable[[], None]) -> float:
+    """
+    Mean duration in seconds of a getnodes() call over every role
+    """
+    total: float = 0.0
+    for _ in range(calls):
+        before_call()
+        start: float = time.perf_counter()
+        settings.getnodes("head", "clients", "osds", "mons", "rgws", "mdss", "mgrs")
+        total += time.perf_counter() - start
+    return total / calls
+
+
+def main() -> int:
+    parser: ArgumentParser = ArgumentParser(description="Measure the settings.getnodes() cost with and without the topology cache")
+    parser.add_argument("--hosts", type=int, default=500, help="Number of hosts in the inventory")
+    parser.add_argument("--calls", type=int, default=100, help="Number of getnodes() calls to average")
+    parser.add_argument("--resolve-delay-ms", type=float, default=0.0, help="Simulated resolver latency per lookup")
+    args: Namespace = parser.parse_args()
+
+    if args.resolve_delay_ms:
+        gethostbyname = socket.gethostbyname
+
+        def slow_gethostbyname(host: str) -> str:
+            time.sleep(args.resolve_delay_ms / 1000.0)
+            return gethostbyname(host)
+
+        socket.gethostbyname = slow_gethostbyname
+
+    settings.cluster = make_inventory(args.hosts)
+    uncached: float = time_calls(args.calls, settings.invalidate_topology)
+    settings.getnodes("head", "clients", "osds", "mons", "rgws", "mdss", "mgrs")
+    cached: float = time_calls(args.calls, lambda: None)
+
+    print(f"{'hosts':>6} {'calls':>6} {'uncached(us)':>14} {'cached(us)':>12} {'speedup':>10}")
+    print(f"{args.hosts:>6} {args.calls:>6} {uncached * 1e6:>14.1f} {cached * 1e6:>12.3f} {uncached / cached:>9.0f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
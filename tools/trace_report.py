@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+"""
+Usage:
+        trace_report.py [--top=<n>] [--depth=<n>] [--width=<n>] [--phase=<prefix>] <trace>
+
+Reports on the remote call trace written by cbt in
+<archive_dir>/results/remote_calls.jsonl (one JSON object per remote call, see
+common.trace_call()):
+
+  - a timeline with one row per phase of the run: '#' while at least one
+    remote call of the phase is in flight, '-' while the phase is running
+    without any remote call
+  - per phase: number of calls, time spent in remote calls (overlapping calls
+    counted once) against the duration of the phase
+  - the command patterns taking the most time and the most frequent ones
+
+Phases are nested (e.g. LibrbdFio.run/Ceph.mkpool), --depth groups them by
+their first levels.
+
+Examples:
+            trace_report.py /tmp/archive/results/remote_calls.jsonl
+
+            trace_report.py --depth=1 --top=20 --phase=Ceph.initialize remote_calls.jsonl
+"""
+
+import json
+from argparse import ArgumentParser, Namespace
+from typing import Any, Dict, List, Tuple
+
+Record = Dict[str, Any]
+
+
+def load(path: str) -> List[Record]:
+    records: List[Record] = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    records.sort(key=lambda r: r["t0"])
+    return records
+
+
+def phase_of(record: Record, depth: int) -> str:
+    return "/".join(record["p"].split("/")[:depth]) or "(none)"
+
+
+def busy_time(intervals: List[Tuple[float, float]]) -> float:
+    """
+    Length of the union of the intervals
+    """
+    total: float = 0.0
+    end: float = float("-inf")
+    for t0, t1 in sorted(intervals):
+        if t1 > end:
+            total += t1 - max(t0, end)
+            end = t1
+    return total
+
+
+def timeline(records: List[Record], depth: int, width: int) -> List[str]:
+    start: float = min(r["t0"] for r in records)
+    span: float = max(max(r["t1"] for r in records) - start, 1e-6)
+    rows: Dict[str, List[str]] = {}
+    for r in records:
+        row = rows.setdefault(phase_of(r, depth), [" "] * width)
+        first = int((r["t0"] - start) / span * (width - 1))
+        last = int((r["t1"] - start) / span * (width - 1))
+        for i in range(first, last + 1):
+            row[i] = "#"
+    lines: List[str] = []
+    label_width: int = min(max(len(p) for p in rows), 40)
+    end_label: str = f"{span:.1f}s"
+    lines.append(f"{'':<{label_width}} |0s{end_label:>{width - 2}}|")
+    for phase, row in rows.items():
+        used = [i for i, c in enumerate(row) if c == "#"]
+        for i in range(used[0], used[-1] + 1):
+            if row[i] == " ":
+                row[i] = "-"
+        lines.append(f"{phase[-label_width:]:<{label_width}} |{''.join(row)}|")
+    return lines
+
+
+def phase_table(records: List[Record], depth: int) -> List[str]:
+    phases: Dict[str, List[Record]] = {}
+    for r in records:
+        phases.setdefault(phase_of(r, depth), []).append(r)
+    lines: List[str] = [f"{'phase':<50} {'calls':>6} {'remote(s)':>10} {'phase(s)':>10} {'remote%':>8} {'bytes':>10}"]
+    for phase, recs in phases.items():
+        remote: float = busy_time([(r["t0"], r["t1"]) for r in recs])
+        duration: float = max(r["t1"] for r in recs) - min(r["t0"] for r in recs)
+        nbytes: int = sum(r["b"] for r in recs)
+        share: float = 100.0 * remote / duration if duration else 100.0
+        lines.append(f"{phase[-50:]:<50} {len(recs):>6} {remote:>10.2f} {duration:>10.2f} {share:>7.1f}% {nbytes:>10}")
+    return lines
+
+
+def pattern_tables(records: List[Record], top: int) -> List[str]:
+    patterns: Dict[str, List[float]] = {}
+    failures: Dict[str, int] = {}
+    for r in records:
+        key = f"{r['k']}: {r['c']}"
+        patterns.setdefault(key, []).append(r["t1"] - r["t0"])
+        if r["rc"] not in (0, None):
+            failures[key] = failures.get(key, 0) + 1
+    header: str = f"{'pattern':<50} {'calls':>6} {'total(s)':>9} {'mean(s)':>8} {'max(s)':>8} {'failed':>7}"
+
+    def row(key: str) -> str:
+        durations = patterns[key]
+        return (f"{key[:50]:<50} {len(durations):>6} {sum(durations):>9.2f} "
+                f"{sum(durations) / len(durations):>8.3f} {max(durations):>8.2f} {failures.get(key, 0):>7}")
+
+    lines: List[str] = [f"Slowest patterns (total time), top {top}:", header]
+    lines += [row(k) for k in sorted(patterns, key=lambda k: -sum(patterns[k]))[:top]]
+    lines += ["", f"Most frequent patterns, top {top}:", header]
+    lines += [row(k) for k in sorted(patterns, key=lambda k: -len(patterns[k]))[:top]]
+    return lines
+
+
+def main() -> int:
+    parser: ArgumentParser = ArgumentParser(description="Report on the cbt remote call trace")
+    parser.add_argument("trace", type=str, help="remote_calls.jsonl trace file")
+    parser.add_argument("--top", type=int, default=10, help="Number of patterns listed")
+    parser.add_argument("--depth", type=int, default=2, help="Number of phase levels kept")
+    parser.add_argument("--width", type=int, default=80, help="Width of the timeline")
+    parser.add_argument("--phase", type=str, default="", help="Only report the phases starting with this prefix")
+    args: Namespace = parser.parse_args()
+
+    records: List[Record] = [r for r in load(args.trace) if r["p"].startswith(args.phase)]
+    if not records:
+        print("No remote calls recorded")
+        return 1
+
+    print("\n".join(timeline(records, args.depth, args.width)))
+    print()
+    print("\n".join(phase_table(records, args.depth)))
+    print()
+    print("\n".join(pattern_tables(records, args.top)))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
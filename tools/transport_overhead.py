@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+"""
+Usage:
+        transport_overhead.py [--nodes=<nodes>] [--calls=<n>] [--command=<cmd>]
+                              [--transports=pdsh,ssh]
+
+Measures the per-call overhead of the remote execution transports used by
+common.pdsh(). Every transport runs the same trivial command the requested
+number of times against the same node list and the mean/min/max wall-clock
+time per call is reported. The default node list is localhost, which stands
+in for a remote node: the call goes through a real ssh session to the local
+sshd, so only the connection setup and process spawn costs are measured.
+
+Examples:
+            transport_overhead.py --calls=100
+
+            transport_overhead.py --nodes=osd1,osd2,osd3 --transports=ssh
+"""
+
+import shutil
+import time
+from argparse import ArgumentParser, Namespace
+
+import common
+
+
+def time_calls(transport, nodes: str, command: str, calls: int) -> list[float]:
+    """
+    Run the command through the transport and return the duration of each call
+    """
+    durations: list[float] = []
+    for _ in range(calls):
+        start: float = time.monotonic()
+        transport.pdsh(nodes, command, continue_if_error=False).communicate()
+        durations.append(time.monotonic() - start)
+    return durations
+
+
+def main() -> int:
+    parser: ArgumentParser = ArgumentParser(description="Measure the per-call overhead of the cbt transports")
+    parser.add_argument("--nodes", type=str, default="localhost", help="Comma separated list of nodes")
+    parser.add_argument("--calls", type=int, default=50, help="Number of calls per transport")
+    parser.add_argument("--command", type=str, default="true", help="Command run on the nodes")
+    parser.add_argument("--transports", type=str, default="pdsh,ssh", help="Transports to compare")
+    args: Namespace = parser.parse_args()
+
+    print(f"{'transport':<10} {'calls':>6} {'first(ms)':>10} {'mean(ms)':>10} {'min(ms)':>10} {'max(ms)':>10}")
+    for name in args.transports.split(","):
+        transport = common.TRANSPORTS[name]({})
+        if name == "pdsh" and shutil.which(transport.pdsh_cmd) is None:
+            print(f"{name:<10} skipped, {transport.pdsh_cmd} is not installed")
+            continue
+        try:
+            durations: list[float] = time_calls(transport, args.nodes, args.command, args.calls)
+        finally:
+            transport.close()
+        # the first call of a multiplexing transport includes the master setup
+        steady: list[float] = durations[1:] or durations
+        print(
+            f"{name:<10} {len(durations):>6} {durations[0] * 1000:>10.1f} "
+            f"{sum(steady) / len(steady) * 1000:>10.1f} {min(steady) * 1000:>10.1f} {max(steady) * 1000:>10.1f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())